@@ -2,30 +2,78 @@ import os
 import uuid
 import json
 import time
+import hashlib
+import shutil
+import tempfile
 import xml.etree.ElementTree as ET
-import requests
 import re
 from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import random
-import google.generativeai as genai
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 import asyncio
 import traceback
 import aiohttp
+from cliente_nvd import ClienteNVD, ErrorNVD, NVD_API_BASE_URL
+from cache_nvd import CacheNVD
+from espejo_nvd import EspejoNVD
+from indice_cpe import IndiceCPE, parsear_purl, ALIAS_PRODUCTOS_CPE
+from versiones import CachePredicados, esquema_para_purl, version_valida
+from trabajos import GestorTrabajos
+from bucle_async import BucleAsync
+from lector_json import LectorJSONIncremental
+from lector_xml import LectorXMLIncremental
+from grafo_dependencias import GrafoDependencias, SIN_PROFUNDIDAD
+from registros import Registro, Componente, Vulnerabilidad, a_json
+from conversaciones import AlmacenMemoria, AlmacenSQLite, ContextoSBOM
+from prompts import ConstructorPrompt, Seccion, estimar_tokens
+from cache_respuestas import CacheRespuestas
+from llm import ClienteLLM, crear_proveedor
 
 # ✅ CARGAR CONFIGURACIÓN
 load_dotenv()
 
-app = Flask(__name__)
+# 🔁 EVENT LOOP COMPARTIDO (NVD, API de proyectos y Gemini asíncronos sin asyncio.run por petición)
+bucle_async = BucleAsync()
+
+class ProveedorJSON(DefaultJSONProvider):
+    """jsonify convierte los registros compactos (Componente, Vulnerabilidad) a dict al responder"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Registro):
+            return o.a_dict()
+        return DefaultJSONProvider.default(o)
+
+class FlaskAsync(Flask):
+    """Ejecuta las vistas `async def` en el bucle compartido en lugar de crear un loop por petición"""
+    json_provider_class = ProveedorJSON
+
+    def async_to_sync(self, func):
+        return lambda *args, **kwargs: bucle_async.ejecutar(func(*args, **kwargs))
+
+app = FlaskAsync(__name__)
 
 # ✅ CONFIGURACIÓN BÁSICA (mismo código anterior)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "chat-secret-key")
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("CHAT_MAX_CONTENT_MB", "16")) * 1024 * 1024
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# Las subidas se procesan en memoria; solo se guarda una copia en disco si se pide expresamente
+app.config['GUARDAR_SUBIDAS'] = os.getenv("CHAT_GUARDAR_SUBIDAS", "false").lower() in ('1', 'true', 'si', 'sí')
+
+# Los JSON a partir de este tamaño se recorren componente a componente sin construir el árbol completo
+app.config['JSON_INCREMENTAL_BYTES'] = int(os.getenv("CHAT_JSON_INCREMENTAL_BYTES", str(2 * 1024 * 1024)))
+# Las subidas de los trabajos en segundo plano se copian (por bloques) a un temporal que pasa
+# a disco a partir de este tamaño: el trabajo sigue después de que la petición cierre su stream
+app.config['SUBIDAS_EN_MEMORIA_BYTES'] = int(os.getenv("CHAT_SUBIDAS_EN_MEMORIA_BYTES", str(1024 * 1024)))
+
+# Presupuesto de tokens de entrada de cada prompt: el contexto se elige por relevancia hasta llenarlo
+app.config['PROMPT_MAX_TOKENS'] = int(os.getenv("CHAT_PROMPT_MAX_TOKENS", "6000"))
+app.config['PROMPT_SBOM_MAX_TOKENS'] = int(os.getenv("CHAT_PROMPT_SBOM_MAX_TOKENS", "8000"))
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
@@ -40,27 +88,119 @@ CORS(app,
 )
 
 # ✅ CONFIGURACIÓN AI
+# LLM_PROVEEDOR: 'gemini' o 'simulado' (determinista y sin red: pruebas de carga y CI sin gastar cuota)
+# LLM_MODELO_SBOM permite usar otro modelo (p. ej. más barato o más rápido) para el análisis de subidas
+LLM_PROVEEDOR = os.getenv("LLM_PROVEEDOR", "gemini").lower()
+
+def crear_cliente_llm(modelo):
+    if LLM_PROVEEDOR == 'simulado':
+        proveedor = crear_proveedor('simulado', latencia=float(os.getenv("LLM_SIMULADO_LATENCIA", "0")))
+    else:
+        proveedor = crear_proveedor(LLM_PROVEEDOR, api_key=os.getenv("api_key"), modelo=modelo)
+    return ClienteLLM(
+        proveedor,
+        timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+        reintentos=int(os.getenv("LLM_REINTENTOS", "2")),
+        max_concurrentes=int(os.getenv("LLM_MAX_CONCURRENTES", "8")),
+        # Subidas simultáneas del mismo BOM (mismo prompt) comparten una sola llamada al modelo
+        coalescer=os.getenv("LLM_COALESCER", "true").lower() in ('1', 'true', 'si', 'sí')
+    )
+
 try:
-    genai.configure(api_key=os.getenv("api_key"))
-    model = genai.GenerativeModel("gemini-2.0-flash")
-    print("✅ Gemini AI configurado correctamente")
+    LLM_MODELO = os.getenv("LLM_MODELO", "gemini-2.0-flash")
+    cliente_llm = crear_cliente_llm(LLM_MODELO)
+    LLM_MODELO_SBOM = os.getenv("LLM_MODELO_SBOM", LLM_MODELO)
+    cliente_llm_sbom = cliente_llm if LLM_MODELO_SBOM == LLM_MODELO else crear_cliente_llm(LLM_MODELO_SBOM)
+    print(f"✅ LLM configurado correctamente: {cliente_llm.nombre}")
 except Exception as e:
-    print(f"⚠️ Error configurando Gemini AI: {e}")
-    model = None
-
-# 🧠 HISTORIAL DE CONVERSACIONES POR USUARIO
-historial_conversaciones = {}
+    print(f"⚠️ Error configurando el LLM: {e}")
+    cliente_llm = cliente_llm_sbom = None
+
+# 🧠 HISTORIAL DE CONVERSACIONES POR USUARIO (mensajes en buffer circular + último contexto SBOM aparte)
+# CHAT_ALMACEN: 'memoria' (por proceso) o 'sqlite' (persistente y compartido entre workers/contenedores)
+CHAT_ALMACEN = os.getenv("CHAT_ALMACEN", "memoria").lower()
+limites_historial = {
+    'max_mensajes': int(os.getenv("CHAT_HISTORIAL_MAX_MENSAJES", "40")),
+    'ttl': int(os.getenv("CHAT_HISTORIAL_TTL", str(7 * 24 * 3600))),
+    'max_caracteres': int(os.getenv("CHAT_HISTORIAL_MAX_CARACTERES", "200000"))
+}
+if CHAT_ALMACEN == 'sqlite':
+    historial_conversaciones = AlmacenSQLite(
+        os.getenv("CHAT_ALMACEN_DB", os.path.join("cache", "conversaciones.db")),
+        max_bytes_contexto=int(os.getenv("CHAT_ALMACEN_MAX_BYTES_CONTEXTO", str(8 * 1024 * 1024))),
+        **limites_historial
+    )
+    print(f"🗄️ Historial de conversaciones en SQLite: {historial_conversaciones.ruta}")
+else:
+    historial_conversaciones = AlmacenMemoria(**limites_historial)
+
+# 📬 TRABAJOS DE ANÁLISIS EN SEGUNDO PLANO (la subida responde con un id y el pipeline sigue aparte)
+gestor_trabajos = GestorTrabajos(
+    max_workers=int(os.getenv("CHAT_TRABAJOS_WORKERS", "2")),
+    ttl=int(os.getenv("CHAT_TRABAJOS_TTL", "3600"))
+)
 
 # 📁 EXTENSIONES DE ARCHIVO PERMITIDAS PARA SBOM
 ALLOWED_EXTENSIONS = {'json', 'xml', 'yaml', 'yml', 'spdx', 'txt'}
 
 # 🔒 CONFIGURACIÓN NVD API
-NVD_API_BASE_URL = "https://services.nvd.nist.gov/rest/json/cves/2.0"
 NVD_API_KEY = os.getenv("NVD_API_KEY")  # Opcional pero recomendado para rate limits mejores
 
-# 🗂️ CACHE PARA CONSULTAS NVD (evitar consultas repetitivas)
-nvd_cache = {}
-cache_expiry = {}
+# 🔌 CLIENTE NVD COMPARTIDO (una sesión con conexiones keep-alive para todo el proceso)
+# La cuota del limitador de tasa se elige según haya o no NVD_API_KEY
+cliente_nvd = ClienteNVD(
+    NVD_API_BASE_URL,
+    api_key=NVD_API_KEY,
+    limite_conexiones=int(os.getenv("NVD_MAX_CONEXIONES", "10"))
+)
+bucle_async.al_cerrar(cliente_nvd.cerrar)
+
+# ⚡ CONSULTAS NVD CONCURRENTES (número máximo de componentes consultados a la vez)
+NVD_CONCURRENCIA = int(os.getenv("NVD_CONCURRENCIA", "5"))
+
+# ⏱️ PRESUPUESTO DE TIEMPO DEL ENRIQUECIMIENTO (segundos; al agotarse solo se usa la cache)
+NVD_PRESUPUESTO_SEGUNDOS = float(os.getenv("NVD_PRESUPUESTO_SEGUNDOS", "120"))
+
+# 🕸️ CON GRAFO DE DEPENDENCIAS: no consultar los paquetes que ningún componente de primer nivel alcanza
+NVD_OMITIR_NO_ALCANZABLES = os.getenv("NVD_OMITIR_NO_ALCANZABLES", "false").lower() in ('1', 'true', 'si', 'sí')
+
+# 🪞 FUENTE DE DATOS NVD: 'api' (consultas en vivo) o 'espejo' (copia local, sin red)
+NVD_FUENTE = os.getenv("NVD_FUENTE", "api").lower()
+espejo_nvd = None
+if NVD_FUENTE == 'espejo':
+    espejo_nvd = EspejoNVD(os.getenv("NVD_ESPEJO_DB", os.path.join("cache", "espejo_nvd.db")))
+    print(f"🪞 Usando espejo local de NVD ({len(espejo_nvd)} CVEs)")
+
+# 📚 ÍNDICE LOCAL DEL DICCIONARIO CPE (resolución componente → vendor:producto)
+indice_cpe = IndiceCPE()
+if os.getenv("NVD_CPE_DICCIONARIO"):
+    try:
+        indice_cpe.cargar_diccionario(os.getenv("NVD_CPE_DICCIONARIO"))
+    except Exception as e:
+        print(f"⚠️ Error cargando diccionario CPE: {e}")
+elif espejo_nvd is not None:
+    indice_cpe.cargar_pares(espejo_nvd.pares_vendor_producto())
+    print(f"📚 Índice CPE construido desde el espejo: {len(indice_cpe)} productos")
+
+# 🔢 PREDICADOS DE APLICABILIDAD PRECOMPILADOS POR CVE (rangos de versiones cpeMatch)
+predicados_cve = CachePredicados()
+
+# 🗂️ CACHE PERSISTENTE PARA CONSULTAS NVD (compartida entre reinicios y workers)
+nvd_cache = CacheNVD(
+    os.getenv("NVD_CACHE_DB", os.path.join("cache", "nvd_cache.db")),
+    ttl=int(os.getenv("NVD_CACHE_TTL", 24 * 3600)),
+    max_entradas=int(os.getenv("NVD_CACHE_MAX_ENTRADAS", "20000")),
+    max_entradas_memoria=int(os.getenv("NVD_CACHE_MAX_ENTRADAS_MEMORIA", "2000"))
+)
+
+# 💬 CACHE DE RESPUESTAS: PREGUNTAS REPETIDAS SOBRE EL MISMO ANÁLISIS SBOM (Y CRITERIOS) NO VUELVEN A GEMINI
+# Solo coincidencias exactas salvo que CHAT_CACHE_RESPUESTAS_SIMILITUD (p. ej. 0.9) active el nivel por similitud
+app.config['CACHE_RESPUESTAS'] = os.getenv("CHAT_CACHE_RESPUESTAS", "true").lower() in ('1', 'true', 'si', 'sí')
+cache_respuestas = CacheRespuestas(
+    ttl=int(os.getenv("CHAT_CACHE_RESPUESTAS_TTL", "3600")),
+    max_entradas=int(os.getenv("CHAT_CACHE_RESPUESTAS_MAX_ENTRADAS", "1000")),
+    umbral_similitud=float(os.getenv("CHAT_CACHE_RESPUESTAS_SIMILITUD", "0"))
+)
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -71,95 +211,148 @@ def obtener_usuario_id(request):
     user_id = request.cookies.get('username', 'anonymous')
     return user_id
 
-def formatear_historial_para_ai(historial, es_pregunta_sbom=False, mensaje_usuario=""):
-    """Convierte el historial en un formato optimizado según el tipo de pregunta"""
-    if not historial:
+def prioridad_vulnerabilidad(vuln):
+    """Importancia propia (0..1) de una vulnerabilidad al elegir qué entra en el prompt: su score CVSS"""
+    return min(float(vuln.get('score_cvss', 0) or 0), 10.0) / 10
+
+def huella_criterios(criterios):
+    """Hash estable de los criterios de solucionabilidad (clave de las secciones de prompt guardadas)"""
+    return hashlib.sha1(json.dumps(criterios or {}, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def huella_contexto_respuesta(proyecto_id, contexto_proyecto, criterios):
+    """
+    Hash de lo que, aparte del análisis SBOM, entra en el prompt de una respuesta cacheable: el
+    proyecto activo, su contexto tal como se le pasa al modelo y los criterios. Sin él, un usuario
+    con otro proyecto (o sin proyecto) recibiría la respuesta generada con el proyecto de otro
+    """
+    datos = [str(proyecto_id) if proyecto_id else None, contexto_proyecto, huella_criterios(criterios)]
+    return hashlib.sha1(json.dumps(datos).encode('utf-8')).hexdigest()
+
+def secciones_prompt_sbom(sbom_context, criterios=None):
+    """
+    Secciones del contexto de chat que solo dependen del análisis SBOM: resúmenes, distribución por
+    severidad, la lista de vulnerabilidades (con sus términos ya extraídos) y los datos del proyecto.
+    Se generan una vez por análisis y se guardan en el contexto; solo se regeneran si cambian los
+    criterios del proyecto, que deciden la prioridad de cada vulnerabilidad
+    """
+    if criterios is None:
+        criterios = sbom_context.criterios_solucionabilidad
+    return sbom_context.secciones_prompt(huella_criterios(criterios),
+                                         lambda: generar_secciones_prompt_sbom(sbom_context, criterios))
+
+def generar_secciones_prompt_sbom(sbom_context, criterios):
+    """Genera las secciones de secciones_prompt_sbom (solo al crearlas o si cambian los criterios)"""
+    print(f"🧩 Generando secciones de prompt para {sbom_context.filename}")
+    cabecera = [
+        f"- **Archivo:** {sbom_context.filename}",
+        f"- **Formato:** {sbom_context.sbom_data.get('formato', 'Desconocido')}",
+        f"- **Componentes totales:** {sbom_context.sbom_data.get('resumen', {}).get('total_componentes', 0)}",
+        f"- **Vulnerabilidades encontradas:** {sbom_context.resumen_vulnerabilidades['total']}"
+    ]
+    
+    # Para preguntas no relacionadas con SBOM, solo incluir resumen básico
+    lineas = [f"\n🔍 **CONTEXTO REDUCIDO DEL ÚLTIMO ANÁLISIS SBOM:**"] + cabecera
+    
+    # Solo distribución por severidad, no lista completa
+    if sbom_context.resumen_vulnerabilidades['por_severidad']:
+        lineas.append(f"- **Distribución por severidad:**")
+        for sev, count in sbom_context.resumen_vulnerabilidades['por_severidad'].items():
+            emoji = {'CRITICAL': '🔴', 'HIGH': '🟠', 'MEDIUM': '🟡', 'LOW': '🟢', 'UNKNOWN': '⚪'}.get(sev, '⚪')
+            lineas.append(f"  {emoji} {sev}: {count}")
+    
+    lineas.append(f"- **Fecha de análisis:** {sbom_context.timestamp}\n")
+    lineas.append("**📋 NOTA:** Tienes disponible un análisis SBOM completo. Si el usuario pregunta específicamente sobre vulnerabilidades, menciona que puedes proporcionar detalles específicos.\n")
+    secciones = {
+        'reducido': Seccion.texto_fijo(*lineas),
+        'completo': Seccion.texto_fijo(f"\n🔍 **CONTEXTO COMPLETO DEL ÚLTIMO ANÁLISIS SBOM:**", *cabecera),
+        'vulnerabilidades': None
+    }
+    
+    # ✅ CON CRITERIOS, LAS VULNERABILIDADES COMPITEN POR LA PRIORIDAD DEL PROYECTO; SIN ELLOS, POR SCORE CVSS
+    vulnerabilidades_nvd = sbom_context.sbom_data.get('vulnerabilidades_nvd', [])
+    if vulnerabilidades_nvd:
+        seccion = Seccion(
+            "\n**📋 VULNERABILIDADES PRINCIPALES (mostrando {incluidos} de {total}):**",
+            pie_omitidos="\n**... y {omitidos} vulnerabilidades adicionales disponibles para consulta específica.**",
+            numeracion="{i}. "
+        )
+        for vuln in vulnerabilidades_nvd:
+            comp = vuln.get('componente_afectado', {})
+            if criterios:
+                prioridad = calcular_solucionabilidad_personalizada(vuln, criterios)['prioridad_personalizada'] / 100
+            else:
+                prioridad = prioridad_vulnerabilidad(vuln)
+            seccion.agregar(
+                f"**{vuln.get('cve_id', 'N/A')}** - Severidad: {vuln.get('severidad', 'UNKNOWN')} "
+                f"(Score: {vuln.get('score_cvss', 0)}) - Componente: {comp.get('nombre', 'Unknown')}",
+                prioridad
+            )
+        secciones['vulnerabilidades'] = seccion
+    
+    # Incluir criterios y proyecto info
+    seccion = Seccion()
+    if sbom_context.proyecto_nombre:
+        seccion.agregar(f"- **Proyecto analizado:** {sbom_context.proyecto_nombre}", 1.0)
+    
+    if criterios:
+        seccion.agregar(f"- **Criterios aplicados:** Severidad {criterios.get('peso_severidad', 70)}% / Solucionabilidad {criterios.get('peso_solucionabilidad', 30)}%", 1.0)
+    secciones['proyecto'] = seccion
+    return secciones
+
+def formatear_historial_para_ai(conversacion, es_pregunta_sbom=False, mensaje_usuario="", presupuesto_tokens=None,
+                                criterios_proyecto=None, incluir_conversacion=True):
+    """
+    Convierte el historial (Conversacion) en un formato optimizado según el tipo de pregunta.
+    Las vulnerabilidades, los datos del proyecto y los mensajes anteriores compiten por el
+    presupuesto de tokens según su relevancia para el mensaje del usuario. Las secciones del
+    análisis SBOM salen ya generadas del contexto (criterios_proyecto: los actuales del proyecto,
+    si han cambiado desde el análisis). Con incluir_conversacion=False solo entra el análisis
+    """
+    if conversacion is None or (not conversacion.mensajes and conversacion.contexto_sbom is None):
         return "No hay conversación previa.\n"
     
-    contexto = "Contexto de la conversación:\n"
-    sbom_context = None
-    conversacion_normal = []
+    if presupuesto_tokens is None:
+        presupuesto_tokens = app.config['PROMPT_MAX_TOKENS']
+    constructor = ConstructorPrompt(presupuesto_tokens, mensaje_usuario)
+    constructor.fijo("Contexto de la conversación:")
     
-    # ✅ SEPARAR CONTEXTO SBOM DE CONVERSACIÓN NORMAL
-    for entrada in historial:
-        if entrada.startswith("CONTEXTO_SBOM:"):
-            try:
-                sbom_data_str = entrada.replace("CONTEXTO_SBOM: ", "")
-                sbom_context = json.loads(sbom_data_str)
-                print(f"✅ Contexto SBOM encontrado: {sbom_context['filename']}")
-            except Exception as e:
-                print(f"⚠️ Error parseando contexto SBOM: {e}")
-        else:
-            conversacion_normal.append(entrada)
+    # ✅ EL CONTEXTO SBOM SE GUARDA APARTE Y YA PARSEADO: NO HAY QUE BUSCARLO NI DECODIFICARLO
+    sbom_context = conversacion.contexto_sbom
+    conversacion_normal = list(conversacion.mensajes)
+    if sbom_context:
+        print(f"✅ Contexto SBOM encontrado: {sbom_context.filename}")
+        secciones = secciones_prompt_sbom(sbom_context, criterios_proyecto)
     
     # ✅ LÓGICA OPTIMIZADA: CONTEXTO MÍNIMO PARA PREGUNTAS SIMPLES
     if not es_pregunta_sbom and sbom_context:
-        # Para preguntas no relacionadas con SBOM, solo incluir resumen básico
-        contexto += f"\n🔍 **CONTEXTO REDUCIDO DEL ÚLTIMO ANÁLISIS SBOM:**\n"
-        contexto += f"- **Archivo:** {sbom_context['filename']}\n"
-        contexto += f"- **Formato:** {sbom_context['sbom_data'].get('formato', 'Desconocido')}\n"
-        contexto += f"- **Componentes totales:** {sbom_context['sbom_data'].get('resumen', {}).get('total_componentes', 0)}\n"
-        contexto += f"- **Vulnerabilidades encontradas:** {sbom_context['resumen_vulnerabilidades']['total']}\n"
-        
-        # Solo distribución por severidad, no lista completa
-        if sbom_context['resumen_vulnerabilidades']['por_severidad']:
-            contexto += f"- **Distribución por severidad:**\n"
-            for sev, count in sbom_context['resumen_vulnerabilidades']['por_severidad'].items():
-                emoji = {'CRITICAL': '🔴', 'HIGH': '🟠', 'MEDIUM': '🟡', 'LOW': '🟢', 'UNKNOWN': '⚪'}.get(sev, '⚪')
-                contexto += f"  {emoji} {sev}: {count}\n"
-        
-        contexto += f"- **Fecha de análisis:** {sbom_context['timestamp']}\n\n"
-        contexto += "**📋 NOTA:** Tienes disponible un análisis SBOM completo. Si el usuario pregunta específicamente sobre vulnerabilidades, menciona que puedes proporcionar detalles específicos.\n\n"
+        constructor.agregar(secciones['reducido'])
         
     elif es_pregunta_sbom and sbom_context:
         # Para preguntas sobre SBOM, incluir contexto completo
-        contexto += f"\n🔍 **CONTEXTO COMPLETO DEL ÚLTIMO ANÁLISIS SBOM:**\n"
-        contexto += f"- **Archivo:** {sbom_context['filename']}\n"
-        contexto += f"- **Formato:** {sbom_context['sbom_data'].get('formato', 'Desconocido')}\n"
-        contexto += f"- **Componentes totales:** {sbom_context['sbom_data'].get('resumen', {}).get('total_componentes', 0)}\n"
-        contexto += f"- **Vulnerabilidades encontradas:** {sbom_context['resumen_vulnerabilidades']['total']}\n"
-        
-        # ✅ INCLUIR LISTA COMPLETA SOLO SI ES NECESARIO
-        vulnerabilidades_nvd = sbom_context['sbom_data'].get('vulnerabilidades_nvd', [])
-        if vulnerabilidades_nvd:
-            # Limitar vulnerabilidades mostradas para evitar contexto excesivo
-            max_vulns_mostrar = 20  # Solo mostrar las primeras 20
-            contexto += f"\n**📋 VULNERABILIDADES PRINCIPALES (mostrando {min(len(vulnerabilidades_nvd), max_vulns_mostrar)} de {len(vulnerabilidades_nvd)}):**\n"
-            
-            for i, vuln in enumerate(vulnerabilidades_nvd[:max_vulns_mostrar], 1):
-                cve_id = vuln.get('cve_id', 'N/A')
-                severidad = vuln.get('severidad', 'UNKNOWN')
-                score = vuln.get('score_cvss', 0)
-                comp = vuln.get('componente_afectado', {})
-                comp_nombre = comp.get('nombre', 'Unknown')
-                
-                contexto += f"**{i}. {cve_id}** - Severidad: {severidad} (Score: {score}) - Componente: {comp_nombre}\n"
-            
-            if len(vulnerabilidades_nvd) > max_vulns_mostrar:
-                contexto += f"\n**... y {len(vulnerabilidades_nvd) - max_vulns_mostrar} vulnerabilidades adicionales disponibles para consulta específica.**\n"
-        
-        # Incluir criterios y proyecto info
-        if sbom_context.get('proyecto_nombre'):
-            contexto += f"- **Proyecto analizado:** {sbom_context['proyecto_nombre']}\n"
-        
-        if sbom_context.get('criterios_solucionabilidad'):
-            criterios = sbom_context['criterios_solucionabilidad']
-            contexto += f"- **Criterios aplicados:** Severidad {criterios.get('peso_severidad', 70)}% / Solucionabilidad {criterios.get('peso_solucionabilidad', 30)}%\n"
-    
-    # ✅ INCLUIR CONVERSACIÓN NORMAL (últimos 10 intercambios para preguntas simples, 15 para SBOM)
-    limite_conversacion = 15 if es_pregunta_sbom else 10
-    contexto += "**CONVERSACIÓN RECIENTE:**\n"
-    for entrada in conversacion_normal[-limite_conversacion:]:
-        contexto += f"{entrada}\n"
-    
-    contexto += "\n**INSTRUCCIONES:**\n"
+        # ✅ LAS VULNERABILIDADES ENTRAN POR PRIORIDAD Y POR COINCIDENCIA CON LA PREGUNTA (CVE, COMPONENTE...)
+        constructor.agregar(secciones['completo'])
+        if secciones['vulnerabilidades']:
+            constructor.agregar(secciones['vulnerabilidades'])
+        constructor.agregar(secciones['proyecto'])
+    
+    # ✅ CONVERSACIÓN RECIENTE: LOS MENSAJES MÁS NUEVOS PESAN MÁS, PERO UNO ANTIGUO RELEVANTE TAMBIÉN ENTRA
+    # Ningún mensaje suelto (p. ej. un análisis SBOM largo) puede llevarse más de un cuarto del presupuesto
+    if incluir_conversacion:
+        seccion = constructor.seccion("**CONVERSACIÓN RECIENTE:**", siempre=True)
+        for i, entrada in enumerate(conversacion_normal):
+            seccion.agregar(entrada, 0.9 ** (len(conversacion_normal) - 1 - i), max_tokens=presupuesto_tokens // 4)
+    
+    lineas = ["\n**INSTRUCCIONES:**"]
     if es_pregunta_sbom:
-        contexto += "- El usuario está preguntando sobre el SBOM. Usa la información específica proporcionada.\n"
-        contexto += "- Si necesitas detalles de vulnerabilidades no mostradas, menciona que puedes proporcionarlos.\n"
+        lineas.append("- El usuario está preguntando sobre el SBOM. Usa la información específica proporcionada.")
+        lineas.append("- Si necesitas detalles de vulnerabilidades no mostradas, menciona que puedes proporcionarlos.")
     else:
-        contexto += "- Esta es una consulta general. Responde de forma natural y concisa.\n"
-        contexto += "- Si el usuario pregunta sobre vulnerabilidades, puedes mencionar que hay un análisis SBOM disponible.\n"
+        lineas.append("- Esta es una consulta general. Responde de forma natural y concisa.")
+        lineas.append("- Si el usuario pregunta sobre vulnerabilidades, puedes mencionar que hay un análisis SBOM disponible.")
+    constructor.fijo(*lineas)
     
+    contexto = constructor.construir() + "\n"
+    print(f"✂️ Contexto: ~{constructor.tokens_estimados} de {presupuesto_tokens} tokens ({constructor.omitidos} fragmentos omitidos)")
     return contexto
 
 def es_pregunta_relacionada_sbom(mensaje):
@@ -187,14 +380,6 @@ def es_pregunta_relacionada_sbom(mensaje):
     # Si contiene palabras relacionadas con SBOM, sí es sobre SBOM
     return any(palabra in mensaje_lower for palabra in palabras_sbom_directas)
 
-def limpiar_cache_expirado():
-    """Limpia entradas de cache que han expirado"""
-    now = datetime.now()
-    expired_keys = [key for key, expiry in cache_expiry.items() if now > expiry]
-    for key in expired_keys:
-        nvd_cache.pop(key, None)
-        cache_expiry.pop(key, None)
-
 def normalizar_nombre_componente(nombre):
     """Normaliza el nombre del componente para búsqueda en NVD"""
     # Convertir a minúsculas
@@ -214,115 +399,182 @@ def normalizar_nombre_componente(nombre):
     
     return nombre
 
-def extraer_cpes_de_componente(componente):
-    """Extrae posibles CPEs de un componente"""
-    cpes = []
-    
-    nombre = componente.get('nombre', '').lower()
-    version = componente.get('version', '')
-    
-    # Si hay PURL, intentar extraer información
-    purl = componente.get('purl', '')
+def clave_cache_componente(componente):
+    """Clave de cache normalizada: nombre normalizado + versión"""
+    nombre = normalizar_nombre_componente(componente.get('nombre', ''))
+    version = str(componente.get('version', '')).strip().lower()
+    return f"{nombre}:{version}"
+
+def clave_paquete(componente):
+    """
+    Identidad de un paquete para deduplicar componentes repetidos en el SBOM:
+    el purl normalizado (sin calificadores ni subpath) o, si no hay purl, nombre@versión
+    """
+    version = str(componente.get('version', '')).strip()
+    purl = parsear_purl(componente.get('purl', ''))
     if purl:
-        # Ejemplo: pkg:npm/lodash@4.17.20
-        purl_match = re.match(r'pkg:([^/]+)/([^@]+)@?([^?]*)', purl)
-        if purl_match:
-            ecosystem, name, ver = purl_match.groups()
-            nombre = name.lower()
-            if ver:
-                version = ver
-    
-    # Generar posibles CPEs
-    nombre_normalizado = normalizar_nombre_componente(nombre)
-    
-    # CPE básico
-    if version:
-        cpes.append(f"cpe:2.3:a:*:{nombre_normalizado}:{version}:*:*:*:*:*:*:*")
-        cpes.append(f"cpe:2.3:a:{nombre_normalizado}:{nombre_normalizado}:{version}:*:*:*:*:*:*:*")
-    
-    return cpes
+        tipo, namespace, nombre, version_purl = purl
+        return f"pkg:{tipo}/{namespace + '/' if namespace else ''}{nombre}@{version_purl or version}"
+    return f"{normalizar_nombre_componente(componente.get('nombre', ''))}@{version.lower()}"
+
+def agrupar_componentes(componentes):
+    """Agrupa los componentes por clave_paquete conservando el orden de primera aparición"""
+    grupos = {}
+    for componente in componentes:
+        grupos.setdefault(clave_paquete(componente), []).append(componente)
+    return list(grupos.values())
+
+def repartir_vulnerabilidades(vulnerabilidades, grupo):
+    """
+    Vulnerabilidades de un paquete consultado una sola vez, repetidas para cada aparición del
+    grupo con su propio componente afectado (la primera aparición usa los registros originales)
+    """
+    resultado = list(vulnerabilidades)
+    for componente in grupo[1:]:
+        afectado = {'nombre': componente.get('nombre', ''), 'version': componente.get('version', '')}
+        for vuln in vulnerabilidades:
+            copia = type(vuln).desde_dict(vuln.a_dict()) if isinstance(vuln, Registro) else dict(vuln)
+            copia['componente_afectado'] = afectado
+            resultado.append(copia)
+    return resultado
+
+def variantes_producto_cpe(nombre):
+    """
+    Posibles nombres de producto CPE para un componente (p. ej. 'spring-core' -> 'spring_core'),
+    más su alias conocido si lo tiene (log4j-core -> log4j, ver ALIAS_PRODUCTOS_CPE)
+    """
+    base = normalizar_nombre_componente(nombre).split('/')[-1]
+    variantes = {base, base.replace(' ', '_'), base.replace('-', '_'), base.replace('.', '_'),
+                 base.replace(' ', '-'), re.sub(r'[\s\-\.]+', '_', base)}
+    alias = ALIAS_PRODUCTOS_CPE.get(re.sub(r'[\s_]+', '-', base))
+    if alias:
+        variantes.add(alias)
+    return {v for v in variantes if v}
+
+def construir_vulnerabilidad(cve_data, componente):
+    """Convierte un CVE de NVD (formato 2.0) en el registro de vulnerabilidad que usa el chat"""
+    return Vulnerabilidad(
+        cve_id=cve_data.get('id', 'CVE-UNKNOWN'),
+        descripcion=extraer_descripcion_cve(cve_data),
+        severidad=extraer_severidad_cve(cve_data),
+        score_cvss=extraer_score_cvss(cve_data),
+        vector_cvss=extraer_vector_cvss(cve_data),
+        fecha_publicacion=extraer_fecha_publicacion(cve_data),
+        referencias=extraer_referencias_cve(cve_data),
+        productos_afectados=extraer_productos_afectados(cve_data),
+        componente_afectado={
+            'nombre': componente.get('nombre', ''),
+            'version': componente.get('version', '')
+        },
+        cvss=cve_data.get('metrics', {})  # ✅ NUEVA ESTRUCTURA PARA MÉTRICAS
+    )
+
+def buscar_vulnerabilidades_espejo(componente):
+    """Busca vulnerabilidades de un componente en el espejo local de NVD (sin red)"""
+    candidatos = indice_cpe.resolver(componente)
+    if candidatos:
+        cves = espejo_nvd.buscar_por_productos({c.producto for c in candidatos}, {c.vendor for c in candidatos})
+    else:
+        cves = espejo_nvd.buscar_por_productos(variantes_producto_cpe(componente.get('nombre', '')))
+    vulnerabilidades = [construir_vulnerabilidad(cve_data, componente)
+                        for cve_data in cves if es_vulnerabilidad_relevante(cve_data, componente, candidatos)]
+    print(f"🪞 Espejo NVD: {len(vulnerabilidades)} vulnerabilidades relevantes para {componente.get('nombre', '')}")
+    return vulnerabilidades
+
+async def consultar_cves_nvd(params, max_retries=3):
+    """
+    Consulta la API de CVEs con reintentos y devuelve la lista de objetos 'cve'.
+    Lanza ErrorNVD si no se obtiene respuesta válida: una lista vacía significa
+    "sin vulnerabilidades" y se cachea, un fallo no
+    """
+    ultimo_error = None
+    for intento in range(max_retries):
+        try:
+            status, data, _ = await cliente_nvd.consultar(params)
+            if status == 200:
+                # ✅ ACCEDER AL OBJETO CVE DENTRO DE VULNERABILITIES
+                cves = [vuln_item.get('cve', {}) for vuln_item in data.get('vulnerabilities', [])]
+                print(f"📊 Encontradas {len(cves)} vulnerabilidades potenciales")
+                return cves
+                
+            elif status == 429:  # Rate limit
+                # El limitador compartido ya se ha pausado según Retry-After
+                print(f"⏳ Rate limit alcanzado, reintentando tras la pausa indicada por NVD...")
+                ultimo_error = "rate limit (429)"
+            else:
+                print(f"❌ Error en NVD API: {status}")
+                raise ErrorNVD(f"NVD respondió {status}")
+                
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            print(f"⏰ Timeout o error de red en intento {intento + 1}: {type(e).__name__}")
+            ultimo_error = type(e).__name__
+            if intento < max_retries - 1:
+                await asyncio.sleep(1)
+    raise ErrorNVD(f"sin respuesta de NVD tras {max_retries} intentos: {ultimo_error}")
+
+def obtener_vulnerabilidades_cache(componente):
+    """Vulnerabilidades del componente si ya están en cache (o en el espejo local), None si no"""
+    if espejo_nvd is not None:
+        return buscar_vulnerabilidades_espejo(componente)
+    vulnerabilidades = nvd_cache.obtener(clave_cache_componente(componente))
+    if vulnerabilidades is None:
+        return None
+    # Registros nuevos en cada lectura: el enriquecimiento añade claves a cada vulnerabilidad
+    return [Vulnerabilidad.desde_dict(vuln) for vuln in vulnerabilidades]
 
 async def buscar_vulnerabilidades_nvd(componente, max_retries=3):
-    """Busca vulnerabilidades para un componente en NVD"""
-    limpiar_cache_expirado()
+    """
+    Busca vulnerabilidades para un componente en NVD (API o espejo local según NVD_FUENTE).
+    Si el diccionario CPE resuelve el componente se consulta por virtualMatchString,
+    y si no, por palabra clave
+    """
+    if espejo_nvd is not None:
+        # Consulta SQLite síncrona: fuera del event loop
+        return await asyncio.get_running_loop().run_in_executor(None, buscar_vulnerabilidades_espejo, componente)
     
     nombre = componente.get('nombre', '')
-    version = componente.get('version', '')
     
     # Crear clave de cache
-    cache_key = f"{nombre}:{version}"
+    cache_key = clave_cache_componente(componente)
     
     # Verificar cache
-    if cache_key in nvd_cache:
+    vulnerabilidades_cache = obtener_vulnerabilidades_cache(componente)
+    if vulnerabilidades_cache is not None:
         print(f"📋 Usando cache para {cache_key}")
-        return nvd_cache[cache_key]
-    
-    vulnerabilidades = []
+        return vulnerabilidades_cache
     
     try:
-        # Normalizar nombre para búsqueda
-        keyword = normalizar_nombre_componente(nombre)
-        
-        # ✅ NUEVA URL DE LA API V2.0
-        url = f"{NVD_API_BASE_URL}?keywordSearch={keyword}"
-        
-        headers = {}
-        if NVD_API_KEY:
-            headers['apiKey'] = NVD_API_KEY
-        
-        print(f"🔍 Consultando NVD para: {keyword}")
-        
-        for intento in range(max_retries):
+        # ✅ PARÁMETROS DE LA API V2.0
+        candidatos = indice_cpe.resolver(componente)
+        if candidatos:
+            consultas = [{'virtualMatchString': candidato.match_string} for candidato in candidatos]
+            print(f"🎯 CPE resueltos para {nombre}: {', '.join(c.match_string for c in candidatos)}")
+        else:
+            # Normalizar nombre para búsqueda
+            keyword = normalizar_nombre_componente(nombre)
+            consultas = [{'keywordSearch': keyword}]
+            print(f"🔍 Consultando NVD para: {keyword}")
+        
+        cves = {}
+        fallos = 0
+        for params in consultas:
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, headers=headers, timeout=10) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            
-                            # ✅ NUEVA ESTRUCTURA DE RESPUESTA
-                            if 'vulnerabilities' in data:
-                                print(f"📊 Encontradas {len(data['vulnerabilities'])} vulnerabilidades potenciales")
-                                
-                                for vuln_item in data['vulnerabilities']:
-                                    # ✅ ACCEDER AL OBJETO CVE DENTRO DE VULNERABILITIES
-                                    cve_data = vuln_item.get('cve', {})
-                                    
-                                    if es_vulnerabilidad_relevante(cve_data, componente):
-                                        vulnerabilidad = {
-                                            'cve_id': cve_data.get('id', 'CVE-UNKNOWN'),
-                                            'descripcion': extraer_descripcion_cve(cve_data),
-                                            'severidad': extraer_severidad_cve(cve_data),
-                                            'score_cvss': extraer_score_cvss(cve_data),
-                                            'vector_cvss': extraer_vector_cvss(cve_data),
-                                            'fecha_publicacion': extraer_fecha_publicacion(cve_data),
-                                            'referencias': extraer_referencias_cve(cve_data),
-                                            'productos_afectados': extraer_productos_afectados(cve_data),
-                                            'componente_afectado': {
-                                                'nombre': nombre,
-                                                'version': version
-                                            },
-                                            'cvss': cve_data.get('metrics', {})  # ✅ NUEVA ESTRUCTURA PARA MÉTRICAS
-                                        }
-                                        vulnerabilidades.append(vulnerabilidad)
-                            
-                            break  # Éxito, salir del bucle de reintentos
-                            
-                        elif response.status == 429:  # Rate limit
-                            wait_time = 2 ** intento
-                            print(f"⏳ Rate limit alcanzado, esperando {wait_time}s...")
-                            await asyncio.sleep(wait_time)
-                        else:
-                            print(f"❌ Error en NVD API: {response.status}")
-                            break
-                            
-            except asyncio.TimeoutError:
-                print(f"⏰ Timeout en intento {intento + 1}")
-                if intento < max_retries - 1:
-                    await asyncio.sleep(1)
-        
-        # Guardar en cache
-        nvd_cache[cache_key] = vulnerabilidades
-        cache_expiry[cache_key] = datetime.now() + timedelta(hours=24)
+                for cve_data in await consultar_cves_nvd(params, max_retries):
+                    cves.setdefault(cve_data.get('id'), cve_data)
+            except ErrorNVD as e:
+                print(f"⚠️ Consulta NVD fallida para {nombre} ({params}): {e}")
+                fallos += 1
+        
+        vulnerabilidades = [construir_vulnerabilidad(cve_data, componente)
+                            for cve_data in cves.values()
+                            if es_vulnerabilidad_relevante(cve_data, componente, candidatos)]
+        
+        # Guardar en cache solo si todas las consultas han respondido: un fallo o un resultado
+        # parcial quedaría compartido como "sin vulnerabilidades" durante todo el TTL
+        if fallos:
+            print(f"🚫 No se cachea {cache_key}: {fallos}/{len(consultas)} consultas fallidas")
+        else:
+            nvd_cache.guardar(cache_key, [vuln.a_dict() for vuln in vulnerabilidades])
         
         print(f"✅ Encontradas {len(vulnerabilidades)} vulnerabilidades relevantes para {nombre}")
         return vulnerabilidades
@@ -331,28 +583,42 @@ async def buscar_vulnerabilidades_nvd(componente, max_retries=3):
         print(f"❌ Error consultando NVD para {nombre}: {e}")
         return []
 
-def es_vulnerabilidad_relevante(cve_data, componente):
-    """Determina si una vulnerabilidad es relevante para el componente"""
+def es_vulnerabilidad_relevante(cve_data, componente, candidatos=None):
+    """
+    Determina si una vulnerabilidad es relevante para el componente.
+    Si el CVE tiene configuraciones CPE para el producto, se evalúan sus rangos de versiones
+    (versionStart*/versionEnd*) con el esquema del ecosistema; la descripción solo se usa
+    para CVEs que NVD aún no ha analizado (sin configuraciones)
+    """
     nombre_componente = componente.get('nombre', '').lower()
     version_componente = componente.get('version', '')
+    purl = componente.get('purl', '')
     
-    # Buscar en descripciones
-    descripcion = extraer_descripcion_cve(cve_data).lower()
-    if nombre_componente in descripcion:
-        return True
+    purl_info = parsear_purl(purl)
+    if purl_info and purl_info[3] and not version_valida(version_componente):
+        version_componente = purl_info[3]
+    esquema = esquema_para_purl(purl)
     
-    # Buscar en CPEs configuradas
-    try:
-        configurations = cve_data.get('configurations', {}).get('nodes', [])
-        for node in configurations:
-            cpe_matches = node.get('cpeMatch', [])
-            for cpe_match in cpe_matches:
-                cpe_name = cpe_match.get('criteria', '').lower()
-                if nombre_componente in cpe_name:
-                    return True
-    except:
-        pass
+    predicado = predicados_cve.obtener(cve_data)
     
+    # Productos CPE del componente: resueltos por el diccionario o variantes del nombre
+    if candidatos:
+        resultado = predicado.evaluar({c.producto for c in candidatos}, version_componente, esquema,
+                                      {c.vendor for c in candidatos})
+    else:
+        # Solo el producto exacto o su alias conocido: con un prefijo del nombre, jquery-ui
+        # se compararía con los rangos de versiones de jquery
+        resultado = predicado.evaluar(variantes_producto_cpe(nombre_componente), version_componente, esquema)
+    
+    if resultado is not None:
+        return resultado
+    
+    # Sin configuraciones CPE (pendiente de análisis en NVD): buscar en descripciones
+    if not predicado.rangos:
+        descripcion = extraer_descripcion_cve(cve_data).lower()
+        return bool(nombre_componente) and nombre_componente in descripcion
+    
+    # El CVE tiene configuraciones pero ninguna para este producto
     return False
 
 def extraer_descripcion_cve(cve_data):
@@ -507,24 +773,86 @@ def extraer_productos_afectados(cve_data):
     except:
         return []
 
+def decodificar_texto(contenido):
+    """Decodifica bytes como UTF-8 y, si no es válido, como latin-1"""
+    if isinstance(contenido, str):
+        return contenido
+    try:
+        return contenido.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return contenido.decode('latin-1')
+
+def tamano_fuente(fuente):
+    """Tamaño en bytes de unos bytes o de un fichero binario con seek (sin leerlo)"""
+    if isinstance(fuente, (bytes, bytearray)):
+        return len(fuente)
+    posicion = fuente.tell()
+    fuente.seek(0, os.SEEK_END)
+    tamano = fuente.tell() - posicion
+    fuente.seek(posicion)
+    return tamano
+
+def parsear_sbom(contenido, filename):
+    """
+    Parsea el documento una sola vez según su extensión y devuelve (tipo, documento):
+    ('json', dict), ('json_flujo', (cabecera, resultado)), ('xml', (lector, resultado)),
+    ('yaml', objeto) o ('texto', str). `contenido` son bytes o un fichero binario (p. ej. el
+    stream de la subida): los JSON grandes y los XML se recorren desde él por bloques, sin
+    cargarlo entero; el resto se lee completo
+    """
+    extension = filename.rsplit('.', 1)[1].lower()
+    
+    if extension == 'json' and tamano_fuente(contenido) >= app.config['JSON_INCREMENTAL_BYTES']:
+        return 'json_flujo', leer_sbom_json_incremental(contenido)
+    if extension in ['xml', 'spdx']:
+        return 'xml', leer_sbom_xml(contenido)
+    if not isinstance(contenido, (bytes, bytearray)):
+        contenido = contenido.read()
+    
+    if extension == 'json':
+        try:
+            return 'json', json.loads(contenido)
+        except UnicodeDecodeError:
+            return 'json', json.loads(decodificar_texto(contenido))
+    elif extension in ['yaml', 'yml']:
+        import yaml
+        return 'yaml', yaml.safe_load(contenido)
+    else:
+        return 'texto', decodificar_texto(contenido)
+
+def validar_documento_sbom(tipo, documento):
+    """Valida un documento ya parseado por parsear_sbom"""
+    if tipo == 'json':
+        return validar_sbom_json(documento)
+    elif tipo == 'json_flujo':
+        return validar_sbom_json(documento[0])
+    elif tipo == 'xml':
+        return validar_sbom_xml_lector(documento[0])
+    elif tipo == 'yaml':
+        return validar_sbom_yaml(documento)
+    else:
+        return validar_sbom_texto(documento)
+
+def procesar_documento_sbom(tipo, documento):
+    """Extrae componentes y resumen de un documento ya parseado por parsear_sbom"""
+    if tipo == 'json':
+        return procesar_sbom_json_datos(documento)
+    elif tipo == 'json_flujo':
+        return documento[1]
+    elif tipo == 'xml':
+        return documento[1]
+    elif tipo == 'yaml':
+        return procesar_sbom_yaml_datos(documento)
+    else:
+        return procesar_sbom_texto(documento)
+
 def procesar_archivo_sbom(file_path, filename):
     """
     Procesa diferentes formatos de SBOM y extrae información relevante
     """
     try:
-        extension = filename.rsplit('.', 1)[1].lower()
-        
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        if extension == 'json':
-            return procesar_sbom_json(content)
-        elif extension in ['xml', 'spdx']:
-            return procesar_sbom_xml(content)
-        elif extension in ['yaml', 'yml']:
-            return procesar_sbom_yaml(content)
-        else:
-            return procesar_sbom_texto(content)
+        with open(file_path, 'rb') as f:
+            return procesar_documento_sbom(*parsear_sbom(f, filename))
             
     except Exception as e:
         return f"Error procesando archivo SBOM: {str(e)}"
@@ -532,26 +860,97 @@ def procesar_archivo_sbom(file_path, filename):
 def procesar_sbom_json(content):
     """Procesa SBOM en formato JSON (CycloneDX, SPDX-JSON)"""
     try:
-        data = json.loads(content)
-        
-        # Detectar formato
-        if 'bomFormat' in data and data['bomFormat'] == 'CycloneDX':
-            return procesar_cyclonedx(data)
-        elif 'spdxVersion' in data:
-            return procesar_spdx_json(data)
-        else:
-            return procesar_sbom_generico(data)
-            
+        return procesar_sbom_json_datos(json.loads(content))
     except json.JSONDecodeError as e:
         return f"Error parseando JSON: {str(e)}"
 
+def procesar_sbom_json_datos(data):
+    """Procesa un SBOM JSON ya parseado"""
+    # Detectar formato
+    if 'bomFormat' in data and data['bomFormat'] == 'CycloneDX':
+        return procesar_cyclonedx(data)
+    elif 'spdxVersion' in data:
+        return procesar_spdx_json(data)
+    else:
+        return procesar_sbom_generico(data)
+
 def procesar_cyclonedx(data):
     """Procesa SBOM en formato CycloneDX con consulta a NVD"""
+    componentes = [componente_cyclonedx(c) for componente in data.get('components') or []
+                   for c in aplanar_componentes_cyclonedx(componente)]
+    vulnerabilidades = [vulnerabilidad_cyclonedx(v) for v in data.get('vulnerabilities') or []]
+    grafo = GrafoDependencias.desde_cyclonedx(data.get('dependencies'), raiz=referencia_raiz_cyclonedx(data))
+    return resultado_cyclonedx(data, componentes, vulnerabilidades, grafo)
+
+def referencia_raiz_cyclonedx(data):
+    """bom-ref del componente principal (metadata.component), raíz del grafo de dependencias"""
+    return ((data.get('metadata') or {}).get('component') or {}).get('bom-ref')
+
+def aplanar_componentes_cyclonedx(component):
+    """
+    El componente y sus subcomponentes (components anidados) a cualquier profundidad, cada uno
+    después de sus anidados: el mismo orden en que los entrega el lector XML al cerrarse
+    """
+    for anidado in component.get('components') or []:
+        yield from aplanar_componentes_cyclonedx(anidado)
+    yield component
+
+def componente_cyclonedx(component):
+    """Extrae la información relevante de un componente CycloneDX"""
+    # Extraer licencias
+    licencias = []
+    if 'licenses' in component:
+        for license_info in component['licenses']:
+            if 'license' in license_info:
+                if 'name' in license_info['license']:
+                    licencias.append(license_info['license']['name'])
+                elif 'id' in license_info['license']:
+                    licencias.append(license_info['license']['id'])
+    
+    return Componente(
+        nombre=component.get('name', 'No especificado'),
+        version=component.get('version', 'No especificada'),
+        tipo=component.get('type', 'library'),
+        purl=component.get('purl', ''),
+        bom_ref=component.get('bom-ref', ''),
+        licencias=licencias
+    )
+
+def vulnerabilidad_cyclonedx(vuln):
+    """Extrae una vulnerabilidad declarada en el propio SBOM CycloneDX"""
+    vuln_info = {
+        'id': vuln.get('id', 'No especificado'),
+        'descripcion': vuln.get('description', 'No disponible'),
+        'severidad': '',
+        'componentes_afectados': []
+    }
+    
+    # Extraer severidad
+    if 'ratings' in vuln:
+        for rating in vuln['ratings']:
+            if 'severity' in rating:
+                vuln_info['severidad'] = rating['severity']
+                break
+    
+    # Componentes afectados
+    if 'affects' in vuln:
+        for affect in vuln['affects']:
+            if 'ref' in affect:
+                vuln_info['componentes_afectados'].append(affect['ref'])
+    
+    return vuln_info
+
+def resultado_cyclonedx(data, componentes, vulnerabilidades, grafo=None):
+    """
+    Compone el resultado CycloneDX a partir de los componentes y vulnerabilidades ya extraídos.
+    El grafo de dependencias viaja en la clave interna '_grafo', que analizar_sbom retira
+    antes de serializar nada
+    """
     resultado = {
         'formato': 'CycloneDX',
         'version': data.get('specVersion', 'No especificada'),
-        'componentes': [],
-        'vulnerabilidades': [],
+        'componentes': componentes,
+        'vulnerabilidades': vulnerabilidades,
         'vulnerabilidades_nvd': [],  # ✅ NUEVO: Vulnerabilidades de NVD
         'resumen': {}
     }
@@ -565,53 +964,6 @@ def procesar_cyclonedx(data):
             'tipo': main_component.get('type', 'No especificado')
         }
     
-    # Procesar componentes
-    if 'components' in data:
-        for component in data['components']:
-            comp_info = {
-                'nombre': component.get('name', 'No especificado'),
-                'version': component.get('version', 'No especificada'),
-                'tipo': component.get('type', 'library'),
-                'purl': component.get('purl', ''),
-                'licencias': []
-            }
-            
-            # Extraer licencias
-            if 'licenses' in component:
-                for license_info in component['licenses']:
-                    if 'license' in license_info:
-                        if 'name' in license_info['license']:
-                            comp_info['licencias'].append(license_info['license']['name'])
-                        elif 'id' in license_info['license']:
-                            comp_info['licencias'].append(license_info['license']['id'])
-            
-            resultado['componentes'].append(comp_info)
-    
-    # Procesar vulnerabilidades existentes en el SBOM
-    if 'vulnerabilities' in data:
-        for vuln in data['vulnerabilities']:
-            vuln_info = {
-                'id': vuln.get('id', 'No especificado'),
-                'descripcion': vuln.get('description', 'No disponible'),
-                'severidad': '',
-                'componentes_afectados': []
-            }
-            
-            # Extraer severidad
-            if 'ratings' in vuln:
-                for rating in vuln['ratings']:
-                    if 'severity' in rating:
-                        vuln_info['severidad'] = rating['severity']
-                        break
-            
-            # Componentes afectados
-            if 'affects' in vuln:
-                for affect in vuln['affects']:
-                    if 'ref' in affect:
-                        vuln_info['componentes_afectados'].append(affect['ref'])
-            
-            resultado['vulnerabilidades'].append(vuln_info)
-    
     # Generar resumen
     resultado['resumen'] = {
         'total_componentes': len(resultado['componentes']),
@@ -620,36 +972,41 @@ def procesar_cyclonedx(data):
         'licencias_unicas': list(set([lic for comp in resultado['componentes'] for lic in comp['licencias']]))
     }
     
+    if grafo is not None and grafo.num_aristas:
+        resultado['_grafo'] = grafo
+    
     return resultado
 
 def procesar_spdx_json(data):
     """Procesa SBOM en formato SPDX JSON"""
+    return resultado_spdx(data, [componente_spdx(p) for p in data.get('packages') or []])
+
+def componente_spdx(package):
+    """Extrae la información relevante de un paquete SPDX"""
+    # Extraer información de licencias
+    licencias = []
+    if 'licenseConcluded' in package:
+        licencias.append(package['licenseConcluded'])
+    if 'licenseDeclared' in package:
+        licencias.append(package['licenseDeclared'])
+    
+    return Componente(
+        nombre=package.get('name', 'No especificado'),
+        version=package.get('versionInfo', 'No especificada'),
+        spdx_id=package.get('SPDXID', ''),
+        download_location=package.get('downloadLocation', ''),
+        licencias=licencias
+    )
+
+def resultado_spdx(data, componentes):
+    """Compone el resultado SPDX a partir de los paquetes ya extraídos"""
     resultado = {
         'formato': 'SPDX',
         'version': data.get('spdxVersion', 'No especificada'),
-        'componentes': [],
+        'componentes': componentes,
         'resumen': {}
     }
     
-    # Procesar paquetes
-    if 'packages' in data:
-        for package in data['packages']:
-            comp_info = {
-                'nombre': package.get('name', 'No especificado'),
-                'version': package.get('versionInfo', 'No especificada'),
-                'spdx_id': package.get('SPDXID', ''),
-                'download_location': package.get('downloadLocation', ''),
-                'licencias': []
-            }
-            
-            # Extraer información de licencias
-            if 'licenseConcluded' in package:
-                comp_info['licencias'].append(package['licenseConcluded'])
-            if 'licenseDeclared' in package:
-                comp_info['licencias'].append(package['licenseDeclared'])
-            
-            resultado['componentes'].append(comp_info)
-    
     resultado['resumen'] = {
         'total_componentes': len(resultado['componentes']),
         'licencias_unicas': list(set([lic for comp in resultado['componentes'] for lic in comp['licencias'] if lic != 'NOASSERTION']))
@@ -657,101 +1014,184 @@ def procesar_spdx_json(data):
     
     return resultado
 
+def leer_sbom_json_incremental(contenido):
+    """
+    Recorre un SBOM JSON grande (bytes o fichero binario) elemento a elemento con
+    LectorJSONIncremental: cada componente (con sus anidados), paquete o vulnerabilidad se reduce
+    a su registro compacto nada más leerlo, sin construir el árbol completo del documento. Devuelve (cabecera, resultado): la cabecera contiene los valores
+    pequeños de primer nivel (bomFormat, specVersion, metadata...) y sirve para validar
+    """
+    extractores = {
+        'components': lambda component: [componente_cyclonedx(c) for c in aplanar_componentes_cyclonedx(component)],
+        'packages': lambda package: [componente_spdx(package)],
+        'vulnerabilities': lambda vuln: [vulnerabilidad_cyclonedx(vuln)]
+    }
+    grafo = GrafoDependencias()
+    lector = LectorJSONIncremental(contenido, claves_incrementales=list(extractores) + ['dependencies'])
+    registros = {clave: [] for clave in extractores}
+    valores = {}
+    for clave, valor in lector:
+        if clave in extractores:
+            registros[clave].extend(extractores[clave](valor))
+        elif clave == 'dependencies':
+            grafo.agregar_dependencia(valor.get('ref'), valor.get('dependsOn') or [])
+        else:
+            valores[clave] = valor
+    
+    # Los arrays recorridos quedan marcados en la cabecera (en su orden) sin su contenido
+    cabecera = {clave: valores.get(clave) for clave in lector.claves}
+    
+    if cabecera.get('bomFormat') == 'CycloneDX':
+        if referencia_raiz_cyclonedx(cabecera):
+            grafo.establecer_raiz(referencia_raiz_cyclonedx(cabecera))
+        resultado = resultado_cyclonedx(cabecera, registros['components'], registros['vulnerabilities'], grafo)
+    elif 'spdxVersion' in cabecera:
+        resultado = resultado_spdx(cabecera, registros['packages'])
+    else:
+        resultado = procesar_sbom_generico(cabecera)
+    
+    print(f"📦 JSON leído de forma incremental: {len(registros['components']) + len(registros['packages'])} componentes")
+    return cabecera, resultado
+
 def procesar_sbom_xml(content):
     """Procesa SBOM en formato XML"""
     try:
-        root = ET.fromstring(content)
-        
-        # Detectar si es SPDX XML o CycloneDX XML
-        if 'spdx' in root.tag.lower():
-            return procesar_spdx_xml(root)
-        elif 'bom' in root.tag.lower():
-            return procesar_cyclonedx_xml(root)
-        else:
-            return {"formato": "XML genérico", "contenido": "Formato XML no reconocido"}
-            
+        return leer_sbom_xml(content)[1]
     except ET.ParseError as e:
         return f"Error parseando XML: {str(e)}"
 
-def procesar_spdx_xml(root):
-    """Procesa SPDX en formato XML (stub básico)"""
+def leer_sbom_xml(contenido):
+    """
+    Recorre un SBOM XML en una sola pasada con iterparse (LectorXMLIncremental): el formato y la
+    versión del esquema CycloneDX 1.x / SPDX se detectan en la raíz y cada componente se reduce a
+    su registro compacto al cerrarse. Devuelve (lector, resultado); el lector sirve para validar
+    """
+    lector = LectorXMLIncremental(contenido, elementos=('component', 'Package', 'dependency'))
+    componentes = []
+    componente_principal = None
+    grafo = GrafoDependencias()
+    for nombre, ruta, elem in lector:
+        if lector.formato == 'SPDX' and nombre == 'Package':
+            componentes.append(componente_spdx_xml(elem, lector.espacio))
+        elif lector.formato == 'CycloneDX' and nombre == 'component':
+            # bom/components/... (incluidos los anidados), no metadata/tools/components
+            if ruta[1:2] == ('components',):
+                componentes.append(componente_cyclonedx_xml(elem, lector.espacio))
+            elif ruta[1:] == ('metadata',):
+                componente_principal = componente_cyclonedx_xml(elem, lector.espacio)
+        elif lector.formato == 'CycloneDX' and nombre == 'dependency' and ruta[1:] == ('dependencies',):
+            # <dependency ref="a"><dependency ref="b"/></dependency>
+            grafo.agregar_dependencia(elem.get('ref'), [hijo.get('ref') for hijo in elem.findall(etiqueta_xml(lector.espacio, 'dependency'))])
+    
+    if lector.formato == 'SPDX':
+        resultado = resultado_spdx_xml(componentes)
+    elif lector.formato == 'CycloneDX':
+        if componente_principal and componente_principal['bom_ref']:
+            grafo.establecer_raiz(componente_principal['bom_ref'])
+        resultado = resultado_cyclonedx_xml(lector.version_esquema, componentes, componente_principal, grafo)
+    else:
+        resultado = {"formato": "XML genérico", "contenido": "Formato XML no reconocido"}
+    return lector, resultado
+
+def etiqueta_xml(espacio, nombre):
+    return f'{{{espacio}}}{nombre}' if espacio else nombre
+
+def componente_spdx_xml(package, espacio):
+    """Extrae la información relevante de un Package SPDX XML"""
+    licencias = []
+    license_concluded = package.findtext(etiqueta_xml(espacio, 'licenseConcluded'))
+    if license_concluded:
+        licencias.append(license_concluded)
+    license_declared = package.findtext(etiqueta_xml(espacio, 'licenseDeclared'))
+    if license_declared:
+        licencias.append(license_declared)
+    return Componente(
+        nombre=package.findtext(etiqueta_xml(espacio, 'name'), default='No especificado'),
+        version=package.findtext(etiqueta_xml(espacio, 'versionInfo'), default='No especificada'),
+        spdx_id=package.findtext(etiqueta_xml(espacio, 'SPDXID'), default=''),
+        licencias=licencias
+    )
+
+def resultado_spdx_xml(componentes):
     resultado = {
         'formato': 'SPDX XML',
-        'componentes': [],
+        'componentes': componentes,
         'resumen': {}
     }
-    # Buscar paquetes/componentes SPDX
-    for package in root.findall('.//{*}Package'):
-        name = package.findtext('{*}name', default='No especificado')
-        version = package.findtext('{*}versionInfo', default='No especificada')
-        spdx_id = package.findtext('{*}SPDXID', default='')
-        licencias = []
-        license_concluded = package.findtext('{*}licenseConcluded')
-        if license_concluded:
-            licencias.append(license_concluded)
-        license_declared = package.findtext('{*}licenseDeclared')
-        if license_declared:
-            licencias.append(license_declared)
-        resultado['componentes'].append({
-            'nombre': name,
-            'version': version,
-            'spdx_id': spdx_id,
-            'licencias': licencias
-        })
     resultado['resumen'] = {
         'total_componentes': len(resultado['componentes']),
         'licencias_unicas': list(set([lic for comp in resultado['componentes'] for lic in comp['licencias'] if lic != 'NOASSERTION']))
     }
     return resultado
 
-def procesar_cyclonedx_xml(root):
-    """Procesa CycloneDX en formato XML"""
+def componente_cyclonedx_xml(component, espacio):
+    """Extrae la información de un <component> CycloneDX (name/version/purl son elementos hijos)"""
+    # Extraer licencias (<licenses><license><id|name>)
+    licencias = []
+    licenses = component.find(etiqueta_xml(espacio, 'licenses'))
+    if licenses is not None:
+        for license_info in licenses.iter(etiqueta_xml(espacio, 'license')):
+            nombre_licencia = (license_info.findtext(etiqueta_xml(espacio, 'name'))
+                               or license_info.findtext(etiqueta_xml(espacio, 'id')))
+            if nombre_licencia:
+                licencias.append(nombre_licencia)
+    
+    return Componente(
+        nombre=component.findtext(etiqueta_xml(espacio, 'name'), default='No especificado'),
+        version=component.findtext(etiqueta_xml(espacio, 'version'), default='No especificada'),
+        tipo=component.get('type', 'library'),
+        purl=component.findtext(etiqueta_xml(espacio, 'purl'), default=''),
+        bom_ref=component.get('bom-ref', ''),
+        licencias=licencias
+    )
+
+def resultado_cyclonedx_xml(version_esquema, componentes, componente_principal=None, grafo=None):
     resultado = {
         'formato': 'CycloneDX XML',
-        'componentes': [],
+        'version': version_esquema or 'No especificada',
+        'componentes': componentes,
         'resumen': {}
     }
     
-    # Buscar componentes
-    components_elem = root.find('.//{http://cyclonedx.org/schema/bom/1.4}components')
-    if components_elem is not None:
-        for component in components_elem.findall('.//{http://cyclonedx.org/schema/bom/1.4}component'):
-            name = component.get('name', 'No especificado')
-            version = component.get('version', 'No especificada')
-            comp_type = component.get('type', 'library')
-            
-            resultado['componentes'].append({
-                'nombre': name,
-                'version': version,
-                'tipo': comp_type
-            })
+    if componente_principal:
+        resultado['componente_principal'] = {
+            'nombre': componente_principal['nombre'],
+            'version': componente_principal['version'],
+            'tipo': componente_principal['tipo']
+        }
     
     resultado['resumen'] = {
-        'total_componentes': len(resultado['componentes'])
+        'total_componentes': len(resultado['componentes']),
+        'tipos_componentes': list(set([comp['tipo'] for comp in resultado['componentes']])),
+        'licencias_unicas': list(set([lic for comp in resultado['componentes'] for lic in comp['licencias']]))
     }
     
+    if grafo is not None and grafo.num_aristas:
+        resultado['_grafo'] = grafo
+    
     return resultado
 
 def procesar_sbom_yaml(content):
     """Procesa SBOM en formato YAML"""
     try:
         import yaml
-        data = yaml.safe_load(content)
-        
-        # Si es YAML, probablemente sea similar al JSON
-        if isinstance(data, dict):
-            if 'bomFormat' in data and data['bomFormat'] == 'CycloneDX':
-                return procesar_cyclonedx(data)
-            elif 'spdxVersion' in data:
-                return procesar_spdx_json(data)
-            else:
-                return procesar_sbom_generico(data)
-        else:
-            return {"formato": "YAML", "error": "Formato YAML no reconocido"}
-            
+        return procesar_sbom_yaml_datos(yaml.safe_load(content))
     except Exception as e:
         return f"Error procesando YAML: {str(e)}"
 
+def procesar_sbom_yaml_datos(data):
+    """Procesa un SBOM YAML ya parseado"""
+    # Si es YAML, probablemente sea similar al JSON
+    if isinstance(data, dict):
+        if 'bomFormat' in data and data['bomFormat'] == 'CycloneDX':
+            return procesar_cyclonedx(data)
+        elif 'spdxVersion' in data:
+            return procesar_spdx_json(data)
+        else:
+            return procesar_sbom_generico(data)
+    else:
+        return {"formato": "YAML", "error": "Formato YAML no reconocido"}
+
 def procesar_sbom_texto(content):
     """Procesa archivos SBOM en formato texto plano"""
     return {
@@ -825,8 +1265,135 @@ def calcular_grado_severidad_combinado(vulnerabilidades_nvd):
         'detalles_grados': detalles_grados
     }
 
-async def enriquecer_sbom_con_nvd(sbom_data, limite_vulnerabilidades=10, max_severidad_permitida='MEDIUM', max_grado_combinado=50):
-    """Enriquece el SBOM con vulnerabilidades de NVD aplicando filtros del proyecto"""
+def prioridad_componente(componente):
+    """
+    Clave de orden para consultar NVD: primero los componentes con versión concreta y purl
+    (los únicos cuyos rangos de versiones se pueden evaluar) y los que el diccionario CPE resuelve
+    """
+    purl = componente.get('purl', '')
+    version = componente.get('version', '')
+    con_version = version_valida(version) or bool(parsear_purl(purl) and parsear_purl(purl)[3])
+    resuelto = bool(indice_cpe.resolver(componente, max_candidatos=1)) if len(indice_cpe) else False
+    return (not con_version, not purl, not resuelto)
+
+def profundidad_grupo(grafo, grupo):
+    """
+    Menor profundidad en el grafo de dependencias entre las apariciones de un paquete:
+    SIN_PROFUNDIDAD si ninguna es alcanzable y None si ninguna aparece en el grafo
+    """
+    profundidades = [grafo.profundidad(c.get('bom_ref')) for c in grupo if c.get('bom_ref')]
+    profundidades = [p for p in profundidades if p is not None]
+    if not profundidades:
+        return None
+    alcanzables = [p for p in profundidades if p != SIN_PROFUNDIDAD]
+    return min(alcanzables) if alcanzables else SIN_PROFUNDIDAD
+
+def introducido_por_grupo(grafo, grupo, nombres, maximo=5):
+    """Componentes de primer nivel (nombre@versión) que arrastran alguna aparición del paquete"""
+    introducido_por = []
+    for componente in grupo:
+        for referencia in grafo.introducido_por(componente.get('bom_ref'), maximo=maximo):
+            nombre = nombres.get(referencia, referencia)
+            if nombre not in introducido_por:
+                introducido_por.append(nombre)
+    return introducido_por[:maximo]
+
+async def consultar_componentes_nvd(componentes, concurrencia=None, presupuesto=None, progreso=None, profundidades=None):
+    """
+    Consulta NVD para varios componentes limitando la concurrencia y el tiempo total.
+    Los aciertos de cache se resuelven primero sin red; el resto se consulta por orden de
+    prioridad hasta agotar `presupuesto` segundos (por defecto NVD_PRESUPUESTO_SEGUNDOS).
+    Con `profundidades` (una por componente, ver profundidad_grupo) van primero los alcanzables
+    desde el componente principal, de menor a mayor profundidad, y al final los no alcanzables.
+    Devuelve los resultados en el mismo orden que los componentes: la lista de vulnerabilidades,
+    la excepción producida o None si el componente quedó sin consultar.
+    `progreso(procesados, total)` se llama cada vez que termina un componente
+    """
+    concurrencia = max(1, concurrencia or NVD_CONCURRENCIA)
+    presupuesto = NVD_PRESUPUESTO_SEGUNDOS if presupuesto is None else presupuesto
+    total = len(componentes)
+    resultados = [None] * total
+    procesados = 0
+    
+    def notificar():
+        if progreso is not None:
+            try:
+                progreso(procesados, total)
+            except Exception as e:
+                print(f"⚠️ Error notificando progreso: {e}")
+    
+    # 1. Aciertos de cache: no consumen cuota de NVD ni presupuesto de red.
+    # Son consultas SQLite síncronas (cache o espejo): se hacen en un hilo del executor
+    # para no bloquear el event loop compartido con el resto de peticiones
+    def resolver_desde_cache():
+        pendientes = []
+        for indice, componente in enumerate(componentes):
+            try:
+                vulns_cache = obtener_vulnerabilidades_cache(componente)
+            except Exception as e:
+                vulns_cache = e
+            if vulns_cache is None:
+                pendientes.append(indice)
+            else:
+                resultados[indice] = vulns_cache
+        return pendientes
+    
+    pendientes = await asyncio.get_running_loop().run_in_executor(None, resolver_desde_cache)
+    procesados = total - len(pendientes)
+    if procesados:
+        print(f"📋 {procesados}/{total} componentes resueltos desde cache")
+        notificar()
+    
+    # 2. Fallos de cache por orden de prioridad, repartidos entre `concurrencia` workers
+    def orden(indice):
+        clave = prioridad_componente(componentes[indice])
+        if profundidades is None:
+            return clave
+        profundidad = profundidades[indice]
+        if profundidad is None:
+            return (1, 0) + clave
+        if profundidad == SIN_PROFUNDIDAD:
+            return (2, 0) + clave
+        return (0, profundidad) + clave
+    
+    pendientes.sort(key=orden)
+    cola = iter(pendientes)
+    
+    async def worker():
+        nonlocal procesados
+        for indice in cola:
+            try:
+                resultados[indice] = await buscar_vulnerabilidades_nvd(componentes[indice])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                resultados[indice] = e
+            procesados += 1
+            notificar()
+    
+    if pendientes:
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(worker() for _ in range(min(concurrencia, len(pendientes))))),
+                timeout=presupuesto
+            )
+        except asyncio.TimeoutError:
+            sin_consultar = sum(1 for indice in pendientes if resultados[indice] is None)
+            print(f"⏱️ Presupuesto de {presupuesto:.0f}s agotado: {sin_consultar} componentes sin consultar")
+    
+    return resultados
+
+async def enriquecer_sbom_con_nvd(sbom_data, limite_vulnerabilidades=10, max_severidad_permitida='MEDIUM', max_grado_combinado=50,
+                                  concurrencia=None, presupuesto=None, progreso=None, grafo=None):
+    """
+    Enriquece el SBOM con vulnerabilidades de NVD aplicando filtros del proyecto.
+    Se analizan todos los componentes: las consultas se lanzan en paralelo (hasta `concurrencia`,
+    por defecto NVD_CONCURRENCIA) dentro de un presupuesto de tiempo, y si se agota solo quedan
+    fuera los componentes de menor prioridad, que se informan en la cobertura del análisis.
+    Con `grafo` (GrafoDependencias) se priorizan los paquetes alcanzables, se pueden omitir los
+    no alcanzables (NVD_OMITIR_NO_ALCANZABLES) y cada vulnerabilidad indica qué componentes de
+    primer nivel la introducen
+    """
     if not isinstance(sbom_data, dict) or 'componentes' not in sbom_data:
         print("⚠️ SBOM data no válido para enriquecimiento NVD")
         return sbom_data
@@ -854,19 +1421,66 @@ async def enriquecer_sbom_con_nvd(sbom_data, limite_vulnerabilidades=10, max_sev
     max_nivel_permitido = severidad_niveles.get(max_severidad_permitida, 2)
     print(f"🔍 Nivel máximo de severidad permitido: {max_severidad_permitida} (nivel {max_nivel_permitido})")
 
-    # Analizar solo los primeros X componentes para evitar timeouts
-    componentes_a_analizar = sbom_data['componentes'][:15]
-    
-    for componente in componentes_a_analizar:
-        componentes_analizados += 1
-        print(f"🔍 Analizando componente {componentes_analizados}/15: {componente.get('nombre', 'Unknown')}")
+    componentes_a_analizar = sbom_data['componentes']
+    componentes_omitidos = []
+    
+    # ✅ DEDUPLICAR: una consulta por paquete único, el resultado vale para todas sus apariciones
+    grupos = agrupar_componentes(componentes_a_analizar)
+    paquetes_unicos = [grupo[0] for grupo in grupos]
+    print(f"🧬 {len(componentes_a_analizar)} componentes → {len(paquetes_unicos)} paquetes únicos")
+    
+    # ✅ GRAFO DE DEPENDENCIAS: profundidad de cada paquete desde el componente principal
+    profundidades = None
+    omitir = set()
+    componentes_no_alcanzables = []
+    if grafo is not None:
+        profundidades = [profundidad_grupo(grafo, grupo) for grupo in grupos]
+        nombres_por_referencia = {c['bom_ref']: f"{c.get('nombre', 'Unknown')}@{c.get('version', '')}"
+                                  for c in componentes_a_analizar if c.get('bom_ref')}
+        if NVD_OMITIR_NO_ALCANZABLES:
+            omitir = {indice for indice, profundidad in enumerate(profundidades) if profundidad == SIN_PROFUNDIDAD}
+        print(f"🕸️ Grafo de dependencias: {len(grafo)} nodos, {grafo.num_aristas} aristas"
+              + (f", {len(omitir)} paquetes no alcanzables omitidos" if omitir else ""))
+    
+    indices_consulta = [indice for indice in range(len(grupos)) if indice not in omitir]
+    print(f"⚡ Consultando {len(indices_consulta)} paquetes (concurrencia: {max(1, concurrencia or NVD_CONCURRENCIA)})")
+    resultados_consulta = await consultar_componentes_nvd(
+        [paquetes_unicos[indice] for indice in indices_consulta], concurrencia, presupuesto, progreso,
+        profundidades=[profundidades[indice] for indice in indices_consulta] if profundidades is not None else None
+    )
+    resultados_nvd = [None] * len(grupos)
+    for indice, resultado_consulta in zip(indices_consulta, resultados_consulta):
+        resultados_nvd[indice] = resultado_consulta
+    
+    for indice, (grupo, vulns_componente) in enumerate(zip(grupos, resultados_nvd)):
+        componente = grupo[0]
+        ocurrencias = len(grupo)
+        if indice in omitir:
+            componentes_no_alcanzables.extend(f"{c.get('nombre', 'Unknown')}@{c.get('version', '')}" for c in grupo)
+            continue
+        if vulns_componente is None:
+            # Sin consultar: el presupuesto de tiempo se agotó antes de llegar a este componente
+            componentes_omitidos.extend(f"{c.get('nombre', 'Unknown')}@{c.get('version', '')}" for c in grupo)
+            continue
+        
+        componentes_analizados += ocurrencias
+        print(f"🔍 Analizando componente {componentes_analizados}/{len(componentes_a_analizar)}: {componente.get('nombre', 'Unknown')}"
+              + (f" (x{ocurrencias})" if ocurrencias > 1 else ""))
         
         try:
-            vulns_componente = await buscar_vulnerabilidades_nvd(componente)
+            if isinstance(vulns_componente, Exception):
+                raise vulns_componente
             
             if vulns_componente:
-                # ✅ CONTAR TODAS LAS VULNERABILIDADES BRUTAS
-                total_vulnerabilidades_brutas += len(vulns_componente)
+                # Qué componentes de primer nivel arrastran este paquete
+                if grafo is not None and profundidades[indice] is not None:
+                    introducido_por = introducido_por_grupo(grafo, grupo, nombres_por_referencia)
+                    for vuln in vulns_componente:
+                        vuln['profundidad_dependencia'] = profundidades[indice]
+                        vuln['introducido_por'] = introducido_por
+                
+                # ✅ CONTAR TODAS LAS VULNERABILIDADES BRUTAS (UNA POR CADA APARICIÓN DEL PAQUETE)
+                total_vulnerabilidades_brutas += len(vulns_componente) * ocurrencias
                 print(f"   📊 Encontradas {len(vulns_componente)} vulnerabilidades brutas")
                 
                 # ✅ APLICAR SOLO FILTRO DE SEVERIDAD (NO LÍMITE DE CANTIDAD)
@@ -887,12 +1501,13 @@ async def enriquecer_sbom_con_nvd(sbom_data, limite_vulnerabilidades=10, max_sev
                 print(f"   ✅ Después del filtro de severidad: {len(vulns_filtradas)} vulnerabilidades válidas")
                 print(f"   ❌ Excluidas por severidad: {len(vulns_excluidas_componente)} vulnerabilidades")
                 
+                # ✅ EL RESULTADO SE REPARTE A CADA APARICIÓN: LOS TOTALES Y EL VEREDICTO NO CAMBIAN AL DEDUPLICAR
                 if vulns_filtradas:
-                    componentes_con_vulns += 1
-                    vulnerabilidades_nvd.extend(vulns_filtradas)
+                    componentes_con_vulns += ocurrencias
+                    vulnerabilidades_nvd.extend(repartir_vulnerabilidades(vulns_filtradas, grupo))
                     
                 # ✅ SIEMPRE AÑADIR LAS EXCLUIDAS AL TOTAL
-                vulnerabilidades_excluidas.extend(vulns_excluidas_componente)
+                vulnerabilidades_excluidas.extend(repartir_vulnerabilidades(vulns_excluidas_componente, grupo))
                     
             else:
                 print(f"   ✅ Sin vulnerabilidades conocidas en NVD")
@@ -943,9 +1558,20 @@ async def enriquecer_sbom_con_nvd(sbom_data, limite_vulnerabilidades=10, max_sev
         sev = vuln.get('severidad', 'UNKNOWN')
         severidades_excluidas_count[sev] = severidades_excluidas_count.get(sev, 0) + 1
     
+    total_componentes = len(componentes_a_analizar)
+    
+    if grafo is not None:
+        sbom_data['resumen']['grafo_dependencias'] = grafo.resumen()
+    
     # ✅ ACTUALIZAR RESUMEN CON GRADO COMBINADO
     sbom_data['resumen']['nvd_analysis'] = {
         'componentes_analizados': componentes_analizados,
+        'componentes_totales': total_componentes,
+        'componentes_unicos': len(paquetes_unicos),
+        'cobertura_porcentaje': round(componentes_analizados / total_componentes * 100, 1) if total_componentes else 100.0,
+        'presupuesto_agotado': bool(componentes_omitidos),
+        'componentes_omitidos': componentes_omitidos,
+        'componentes_no_alcanzables': componentes_no_alcanzables,
         'componentes_vulnerables': componentes_con_vulns,
         'vulnerabilidades_encontradas': len(vulnerabilidades_nvd),
         'total_vulnerabilidades_nvd': len(vulnerabilidades_nvd),
@@ -967,7 +1593,9 @@ async def enriquecer_sbom_con_nvd(sbom_data, limite_vulnerabilidades=10, max_sev
     }
     
     print(f"✅ Análisis NVD completado:")
-    print(f"   - Componentes analizados: {componentes_analizados}")
+    print(f"   - Componentes analizados: {componentes_analizados}/{total_componentes}")
+    if componentes_omitidos:
+        print(f"   - ⏱️ Componentes omitidos por presupuesto de tiempo: {len(componentes_omitidos)}")
     print(f"   - Componentes con vulnerabilidades: {componentes_con_vulns}")
     print(f"   - Vulnerabilidades que pasan filtro de severidad: {len(vulnerabilidades_nvd)}")
     print(f"   - Vulnerabilidades excluidas por severidad: {len(vulnerabilidades_excluidas)}")
@@ -983,7 +1611,7 @@ async def enriquecer_sbom_con_nvd(sbom_data, limite_vulnerabilidades=10, max_sev
     
     return sbom_data
 
-def generar_prompt_sbom(sbom_data, mensaje_usuario, criterios_proyecto=None):
+def generar_prompt_sbom(sbom_data, mensaje_usuario, criterios_proyecto=None, presupuesto_tokens=None):
     """
     Genera un prompt específico para análisis de SBOM con datos de NVD
     Usa criterios personalizados si están disponibles
@@ -991,43 +1619,55 @@ def generar_prompt_sbom(sbom_data, mensaje_usuario, criterios_proyecto=None):
     
     # ✅ SI HAY CRITERIOS DEL PROYECTO, USAR LA FUNCIÓN PERSONALIZADA
     if criterios_proyecto:
-        return generar_prompt_sbom_con_criterios(sbom_data, mensaje_usuario, criterios_proyecto)
+        return generar_prompt_sbom_con_criterios(sbom_data, mensaje_usuario, criterios_proyecto, presupuesto_tokens)
     
     # ✅ CÓDIGO ORIGINAL PARA CUANDO NO HAY CRITERIOS ESPECÍFICOS
-    prompt_parts = []
+    if presupuesto_tokens is None:
+        presupuesto_tokens = app.config['PROMPT_SBOM_MAX_TOKENS']
+    constructor = ConstructorPrompt(presupuesto_tokens, mensaje_usuario)
     
     # Introducción
-    prompt_parts.append("Como experto en ciberseguridad y análisis de SBOM, he recibido un archivo SBOM para análisis.")
-    prompt_parts.append("He consultado la National Vulnerability Database (NVD) para obtener información actualizada sobre vulnerabilidades.")
-    prompt_parts.append("")
+    constructor.fijo(
+        "Como experto en ciberseguridad y análisis de SBOM, he recibido un archivo SBOM para análisis.",
+        "He consultado la National Vulnerability Database (NVD) para obtener información actualizada sobre vulnerabilidades.",
+        ""
+    )
     
     # Información básica del SBOM
     formato = sbom_data.get('formato', 'No especificado')
     total_componentes = sbom_data.get('resumen', {}).get('total_componentes', 'No disponible')
     
-    prompt_parts.append("INFORMACIÓN DEL SBOM:")
-    prompt_parts.append(f"- Formato: {formato}")
-    prompt_parts.append(f"- Total de componentes: {total_componentes}")
-    prompt_parts.append("")
+    constructor.fijo(
+        "INFORMACIÓN DEL SBOM:",
+        f"- Formato: {formato}",
+        f"- Total de componentes: {total_componentes}",
+        ""
+    )
     
     # Componente principal (si existe)
     if 'componente_principal' in sbom_data:
         comp = sbom_data['componente_principal']
-        prompt_parts.append("COMPONENTE PRINCIPAL:")
-        prompt_parts.append(f"- Nombre: {comp.get('nombre', 'No especificado')}")
-        prompt_parts.append(f"- Versión: {comp.get('version', 'No especificada')}")
-        prompt_parts.append(f"- Tipo: {comp.get('tipo', 'No especificado')}")
-        prompt_parts.append("")
+        constructor.fijo(
+            "COMPONENTE PRINCIPAL:",
+            f"- Nombre: {comp.get('nombre', 'No especificado')}",
+            f"- Versión: {comp.get('version', 'No especificada')}",
+            f"- Tipo: {comp.get('tipo', 'No especificado')}",
+            ""
+        )
     
     # ✅ VULNERABILIDADES DE NVD
     if sbom_data.get('vulnerabilidades_nvd'):
         vulnerabilidades_nvd = sbom_data['vulnerabilidades_nvd']
         nvd_analysis = sbom_data.get('resumen', {}).get('nvd_analysis', {})
         
-        prompt_parts.append("ANÁLISIS DE VULNERABILIDADES (NATIONAL VULNERABILITY DATABASE):")
-        prompt_parts.append(f"- Componentes analizados: {nvd_analysis.get('componentes_analizados', 0)}")
-        prompt_parts.append(f"- Componentes con vulnerabilidades: {nvd_analysis.get('componentes_con_vulnerabilidades', 0)}")
-        prompt_parts.append(f"- Total vulnerabilidades encontradas: {len(vulnerabilidades_nvd)}")
+        lineas = [
+            "ANÁLISIS DE VULNERABILIDADES (NATIONAL VULNERABILITY DATABASE):",
+            f"- Componentes analizados: {nvd_analysis.get('componentes_analizados', 0)}"
+        ]
+        if nvd_analysis.get('presupuesto_agotado'):
+            lineas.append(f"- Cobertura: {nvd_analysis.get('cobertura_porcentaje', 0)}% de {nvd_analysis.get('componentes_totales', 0)} componentes (análisis parcial por tiempo)")
+        lineas.append(f"- Componentes con vulnerabilidades: {nvd_analysis.get('componentes_con_vulnerabilidades', 0)}")
+        lineas.append(f"- Total vulnerabilidades encontradas: {len(vulnerabilidades_nvd)}")
         
         # Agrupar por severidad
         severidades = {}
@@ -1037,277 +1677,297 @@ def generar_prompt_sbom(sbom_data, mensaje_usuario, criterios_proyecto=None):
                 severidades[sev] = 0
             severidades[sev] += 1
         
-        prompt_parts.append("- Distribución por severidad:")
+        lineas.append("- Distribución por severidad:")
         for sev, count in sorted(severidades.items(), key=lambda x: {'CRITICAL': 4, 'HIGH': 3, 'MEDIUM': 2, 'LOW': 1, 'UNKNOWN': 0}.get(x[0], 0), reverse=True):
-            prompt_parts.append(f"  * {sev}: {count}")
-        
-        # ✅ MOSTRAR MÁS VULNERABILIDADES (era 5, ahora 15)
-        vulns_criticas = sorted(vulnerabilidades_nvd, 
-                               key=lambda x: x.get('score_cvss', 0), 
-                               reverse=True)[:15]  # ✅ AUMENTADO A 15
-        
-        if vulns_criticas:
-            prompt_parts.append("")
-            prompt_parts.append("VULNERABILIDADES MÁS CRÍTICAS:")
-            for i, vuln in enumerate(vulns_criticas, 1):
-                comp = vuln.get('componente_afectado', {})
-                prompt_parts.append(f"{i}. **{vuln.get('cve_id', 'CVE-Unknown')}** en *{comp.get('nombre', 'Unknown')}* {comp.get('version', '')}")
-                prompt_parts.append(f"   - Severidad: **{vuln.get('severidad', 'UNKNOWN')}** (Score CVSS: {vuln.get('score_cvss', 0)})")
-                prompt_parts.append(f"   - Descripción: {vuln.get('descripcion', 'Sin descripción')[:150]}...")
-                prompt_parts.append("")  # Línea en blanco para separar
-        
-        # ✅ AÑADIR RESUMEN ADICIONAL SI HAY MUCHAS VULNERABILIDADES
-        if len(vulnerabilidades_nvd) > 15:
-            prompt_parts.append(f"**NOTA IMPORTANTE:** Se han encontrado {len(vulnerabilidades_nvd)} vulnerabilidades en total.")
-            prompt_parts.append(f"Las {len(vulns_criticas)} vulnerabilidades mostradas arriba son las de mayor score CVSS.")
-            prompt_parts.append("En tu análisis, menciona que hay vulnerabilidades adicionales y recomienda revisar el reporte completo.")
-            prompt_parts.append("")
-        
-        prompt_parts.append("")
+            lineas.append(f"  * {sev}: {count}")
+        constructor.fijo(*lineas)
+        
+        # ✅ LAS VULNERABILIDADES MOSTRADAS LAS DECIDE EL PRESUPUESTO (POR SCORE CVSS Y RELEVANCIA)
+        seccion = constructor.seccion(
+            "\nVULNERABILIDADES MÁS CRÍTICAS:",
+            pie_omitidos=(f"**NOTA IMPORTANTE:** Se han encontrado {len(vulnerabilidades_nvd)} vulnerabilidades en total.\n"
+                          "Las {incluidos} vulnerabilidades mostradas arriba son las de mayor score CVSS.\n"
+                          "En tu análisis, menciona que hay vulnerabilidades adicionales y recomienda revisar el reporte completo.\n"),
+            numeracion="{i}. "
+        )
+        for vuln in sorted(vulnerabilidades_nvd, key=lambda x: x.get('score_cvss', 0), reverse=True):
+            comp = vuln.get('componente_afectado', {})
+            lineas = [
+                f"**{vuln.get('cve_id', 'CVE-Unknown')}** en *{comp.get('nombre', 'Unknown')}* {comp.get('version', '')}",
+                f"   - Severidad: **{vuln.get('severidad', 'UNKNOWN')}** (Score CVSS: {vuln.get('score_cvss', 0)})"
+            ]
+            if vuln.get('introducido_por'):
+                lineas.append(f"   - Introducida por: {', '.join(vuln['introducido_por'])} (profundidad {vuln.get('profundidad_dependencia')})")
+            lineas.append(f"   - Descripción: {vuln.get('descripcion', 'Sin descripción')[:150]}...")
+            lineas.append("")  # Línea en blanco para separar
+            seccion.agregar("\n".join(lineas), prioridad_vulnerabilidad(vuln))
+        
+        constructor.fijo("")
     
     # Vulnerabilidades originales del SBOM (si existen)
     if sbom_data.get('vulnerabilidades'):
         vulnerabilidades = sbom_data['vulnerabilidades']
-        prompt_parts.append(f"VULNERABILIDADES EN EL SBOM ORIGINAL: {len(vulnerabilidades)}")
-        
-        for vuln in vulnerabilidades[:3]:  # Mostrar solo las primeras 3
-            vuln_id = vuln.get('id', 'Sin ID')
-            severidad = vuln.get('severidad', 'Sin severidad')
-            prompt_parts.append(f"- {vuln_id}: {severidad}")
-        
-        prompt_parts.append("")
+        seccion = constructor.seccion(f"VULNERABILIDADES EN EL SBOM ORIGINAL: {len(vulnerabilidades)}", siempre=True)
+        for vuln in vulnerabilidades:
+            seccion.agregar(f"- {vuln.get('id', 'Sin ID')}: {vuln.get('severidad', 'Sin severidad')}", 0.2)
+        constructor.fijo("")
     
     # Licencias (si existen)
     resumen = sbom_data.get('resumen', {})
     if resumen.get('licencias_unicas'):
-        licencias_todas = resumen['licencias_unicas']
-        licencias_mostrar = licencias_todas[:8]  # Primeras 8 licencias
-        
-        prompt_parts.append(f"LICENCIAS DETECTADAS ({len(licencias_mostrar)} de {len(licencias_todas)}):")
-        prompt_parts.append(", ".join(licencias_mostrar))
-        prompt_parts.append("")
+        seccion = constructor.seccion("LICENCIAS DETECTADAS ({incluidos} de {total}):", separador=", ")
+        for licencia in resumen['licencias_unicas']:
+            seccion.agregar(licencia, 0.1)
+        constructor.fijo("")
     
     # Consulta del usuario
-    prompt_parts.append(f"CONSULTA DEL USUARIO: {mensaje_usuario}")
-    prompt_parts.append("")
+    constructor.fijo(f"CONSULTA DEL USUARIO: {mensaje_usuario}", "")
     
     # Instrucciones específicas
-    prompt_parts.append("INSTRUCCIONES PARA EL ANÁLISIS:")
-    prompt_parts.append("1. Proporciona un análisis detallado de seguridad basado en el SBOM y las vulnerabilidades encontradas en NVD")
-    prompt_parts.append("2. Prioriza las vulnerabilidades críticas y de alta severidad")
-    prompt_parts.append("3. Sugiere acciones específicas de mitigación para cada vulnerabilidad crítica")
-    prompt_parts.append("4. Evalúa el riesgo general del proyecto basado en los hallazgos")
-    prompt_parts.append("5. Identifica patrones de riesgo en las dependencias")
-    prompt_parts.append("")
+    constructor.fijo(
+        "INSTRUCCIONES PARA EL ANÁLISIS:",
+        "1. Proporciona un análisis detallado de seguridad basado en el SBOM y las vulnerabilidades encontradas en NVD",
+        "2. Prioriza las vulnerabilidades críticas y de alta severidad",
+        "3. Sugiere acciones específicas de mitigación para cada vulnerabilidad crítica",
+        "4. Evalúa el riesgo general del proyecto basado en los hallazgos",
+        "5. Identifica patrones de riesgo en las dependencias",
+        ""
+    )
     
     # Formato de respuesta
-    prompt_parts.append("FORMATO DE RESPUESTA:")
-    prompt_parts.append("- Usa **negrita** para CVEs y puntos críticos")
-    prompt_parts.append("- Usa *cursiva* para severidades y nombres de componentes")
-    prompt_parts.append("- Organiza en secciones: Resumen Ejecutivo, Vulnerabilidades Críticas, Recomendaciones")
-    prompt_parts.append("- Incluye `código` para nombres técnicos de componentes")
-    prompt_parts.append("- Usa ### para separar secciones importantes")
-    
-    prompt_completo = "\n".join(prompt_parts)
+    constructor.fijo(
+        "FORMATO DE RESPUESTA:",
+        "- Usa **negrita** para CVEs y puntos críticos",
+        "- Usa *cursiva* para severidades y nombres de componentes",
+        "- Organiza en secciones: Resumen Ejecutivo, Vulnerabilidades Críticas, Recomendaciones",
+        "- Incluye `código` para nombres técnicos de componentes",
+        "- Usa ### para separar secciones importantes"
+    )
+    
+    prompt_completo = constructor.construir()
+    print(f"✂️ Prompt SBOM: ~{constructor.tokens_estimados} de {presupuesto_tokens} tokens ({constructor.omitidos} fragmentos omitidos)")
     return prompt_completo
 
-def generar_prompt_sbom_con_criterios(sbom_data, mensaje_usuario, criterios_proyecto):
+def generar_prompt_sbom_con_criterios(sbom_data, mensaje_usuario, criterios_proyecto, presupuesto_tokens=None):
     """
     Genera prompt incluyendo los criterios de solucionabilidad del proyecto específico
     """
     
-    prompt_parts = []
+    if presupuesto_tokens is None:
+        presupuesto_tokens = app.config['PROMPT_SBOM_MAX_TOKENS']
+    constructor = ConstructorPrompt(presupuesto_tokens, mensaje_usuario)
     
     # ✅ CONTEXTO DE CRITERIOS DE SOLUCIONABILIDAD DEL PROYECTO
-    prompt_parts.append("CRITERIOS DE SOLUCIONABILIDAD DEL PROYECTO:")
-    prompt_parts.append(f"- **Peso dado a severidad:** {criterios_proyecto.get('peso_severidad', 70)}%")
-    prompt_parts.append(f"- **Peso dado a solucionabilidad:** {criterios_proyecto.get('peso_solucionabilidad', 30)}%")
-    prompt_parts.append(f"- **Umbral 'fácil de resolver':** ≥{criterios_proyecto.get('umbral_solucionabilidad_facil', 75)} puntos")
-    prompt_parts.append(f"- **Umbral 'dificultad media':** ≥{criterios_proyecto.get('umbral_solucionabilidad_media', 50)} puntos")
-    prompt_parts.append("")
+    constructor.fijo(
+        "CRITERIOS DE SOLUCIONABILIDAD DEL PROYECTO:",
+        f"- **Peso dado a severidad:** {criterios_proyecto.get('peso_severidad', 70)}%",
+        f"- **Peso dado a solucionabilidad:** {criterios_proyecto.get('peso_solucionabilidad', 30)}%",
+        f"- **Umbral 'fácil de resolver':** ≥{criterios_proyecto.get('umbral_solucionabilidad_facil', 75)} puntos",
+        f"- **Umbral 'dificultad media':** ≥{criterios_proyecto.get('umbral_solucionabilidad_media', 50)} puntos",
+        ""
+    )
     
     # ✅ PRIORIDADES ESPECÍFICAS DEL PROYECTO
-    prompt_parts.append("PRIORIDADES ESPECÍFICAS CONFIGURADAS PARA ESTE PROYECTO:")
+    lineas = ["PRIORIDADES ESPECÍFICAS CONFIGURADAS PARA ESTE PROYECTO:"]
     if criterios_proyecto.get('priori_vectores_red', True):
-        prompt_parts.append("✅ **ALTA PRIORIDAD:** Vulnerabilidades de vector de red (acceso remoto)")
+        lineas.append("✅ **ALTA PRIORIDAD:** Vulnerabilidades de vector de red (acceso remoto)")
     if criterios_proyecto.get('priori_sin_parches', True):
-        prompt_parts.append("✅ **ALTA PRIORIDAD:** Vulnerabilidades sin parches oficiales disponibles")
+        lineas.append("✅ **ALTA PRIORIDAD:** Vulnerabilidades sin parches oficiales disponibles")
     if criterios_proyecto.get('priori_exploit_publico', True):
-        prompt_parts.append("✅ **ALTA PRIORIDAD:** Vulnerabilidades con exploits públicos disponibles")
+        lineas.append("✅ **ALTA PRIORIDAD:** Vulnerabilidades con exploits públicos disponibles")
     if criterios_proyecto.get('incluir_temporal_fixes', True):
-        prompt_parts.append("✅ **INCLUIR:** Vulnerabilidades con soluciones temporales como solucionables")
+        lineas.append("✅ **INCLUIR:** Vulnerabilidades con soluciones temporales como solucionables")
     if criterios_proyecto.get('excluir_privilegios_altos', False):
-        prompt_parts.append("⚠️ **MENOR PRIORIDAD:** Vulnerabilidades que requieren privilegios administrativos")
-    prompt_parts.append("")
+        lineas.append("⚠️ **MENOR PRIORIDAD:** Vulnerabilidades que requieren privilegios administrativos")
+    lineas.append("")
     
     # ✅ INSTRUCCIONES ESPECÍFICAS BASADAS EN CRITERIOS
-    prompt_parts.append("INSTRUCCIONES DE ANÁLISIS BASADAS EN LOS CRITERIOS DEL PROYECTO:")
+    lineas.append("INSTRUCCIONES DE ANÁLISIS BASADAS EN LOS CRITERIOS DEL PROYECTO:")
     
     peso_severidad = criterios_proyecto.get('peso_severidad', 70)
     peso_solucionabilidad = criterios_proyecto.get('peso_solucionabilidad', 30)
     
     if peso_severidad > peso_solucionabilidad:
-        prompt_parts.append("- **Este proyecto PRIORIZA LA SEVERIDAD** sobre la facilidad de solución")
-        prompt_parts.append("- Enfócate en vulnerabilidades críticas y de alta severidad, independientemente de qué tan difíciles sean de resolver")
-        prompt_parts.append("- Menciona primero las vulnerabilidades más peligrosas, aunque sean complejas de solucionar")
+        lineas.append("- **Este proyecto PRIORIZA LA SEVERIDAD** sobre la facilidad de solución")
+        lineas.append("- Enfócate en vulnerabilidades críticas y de alta severidad, independientemente de qué tan difíciles sean de resolver")
+        lineas.append("- Menciona primero las vulnerabilidades más peligrosas, aunque sean complejas de solucionar")
     else:
-        prompt_parts.append("- **Este proyecto PRIORIZA LA SOLUCIONABILIDAD** sobre la severidad pura")
-        prompt_parts.append("- Enfócate en vulnerabilidades que sean más fáciles de resolver, incluso si son de severidad media")
-        prompt_parts.append("- Sugiere comenzar por las vulnerabilidades más sencillas de resolver para obtener resultados rápidos")
+        lineas.append("- **Este proyecto PRIORIZA LA SOLUCIONABILIDAD** sobre la severidad pura")
+        lineas.append("- Enfócate en vulnerabilidades que sean más fáciles de resolver, incluso si son de severidad media")
+        lineas.append("- Sugiere comenzar por las vulnerabilidades más sencillas de resolver para obtener resultados rápidos")
     
     umbral_facil = criterios_proyecto.get('umbral_solucionabilidad_facil', 75)
     umbral_medio = criterios_proyecto.get('umbral_solucionabilidad_media', 50)
     
-    prompt_parts.append(f"- Clasifica como **'FÁCIL DE RESOLVER'** las vulnerabilidades con ≥{umbral_facil} puntos de solucionabilidad")
-    prompt_parts.append(f"- Clasifica como **'DIFICULTAD MEDIA'** las vulnerabilidades entre {umbral_medio}-{umbral_facil-1} puntos")
-    prompt_parts.append(f"- Clasifica como **'DIFÍCIL DE RESOLVER'** las vulnerabilidades con <{umbral_medio} puntos")
-    prompt_parts.append("")
+    lineas.append(f"- Clasifica como **'FÁCIL DE RESOLVER'** las vulnerabilidades con ≥{umbral_facil} puntos de solucionabilidad")
+    lineas.append(f"- Clasifica como **'DIFICULTAD MEDIA'** las vulnerabilidades entre {umbral_medio}-{umbral_facil-1} puntos")
+    lineas.append(f"- Clasifica como **'DIFÍCIL DE RESOLVER'** las vulnerabilidades con <{umbral_medio} puntos")
+    lineas.append("")
     
     # ✅ FÓRMULA DE PRIORIZACIÓN PERSONALIZADA
-    prompt_parts.append("FÓRMULA DE PRIORIZACIÓN DEL PROYECTO:")
-    prompt_parts.append(f"**Prioridad Final = ({peso_severidad}% × Severidad) + ({peso_solucionabilidad}% × Solucionabilidad)**")
-    prompt_parts.append("- Usa esta fórmula para determinar qué vulnerabilidades mencionar primero")
-    prompt_parts.append("- Las vulnerabilidades con mayor prioridad final deben aparecer al inicio de tu análisis")
-    prompt_parts.append("")
+    lineas.append("FÓRMULA DE PRIORIZACIÓN DEL PROYECTO:")
+    lineas.append(f"**Prioridad Final = ({peso_severidad}% × Severidad) + ({peso_solucionabilidad}% × Solucionabilidad)**")
+    lineas.append("- Usa esta fórmula para determinar qué vulnerabilidades mencionar primero")
+    lineas.append("- Las vulnerabilidades con mayor prioridad final deben aparecer al inicio de tu análisis")
+    lineas.append("")
+    constructor.fijo(*lineas)
     
     # ✅ INFORMACIÓN BÁSICA DEL SBOM (reutilizar código existente)
     formato = sbom_data.get('formato', 'No especificado')
     total_componentes = sbom_data.get('resumen', {}).get('total_componentes', 'No disponible')
     
-    prompt_parts.append("INFORMACIÓN DEL SBOM:")
-    prompt_parts.append(f"- Formato: {formato}")
-    prompt_parts.append(f"- Total de componentes: {total_componentes}")
-    prompt_parts.append("")
+    constructor.fijo(
+        "INFORMACIÓN DEL SBOM:",
+        f"- Formato: {formato}",
+        f"- Total de componentes: {total_componentes}",
+        ""
+    )
     
     # ✅ COMPONENTE PRINCIPAL (si existe)
     if 'componente_principal' in sbom_data:
         comp = sbom_data['componente_principal']
-        prompt_parts.append("COMPONENTE PRINCIPAL:")
-        prompt_parts.append(f"- Nombre: {comp.get('nombre', 'No especificado')}")
-        prompt_parts.append(f"- Versión: {comp.get('version', 'No especificada')}")
-        prompt_parts.append(f"- Tipo: {comp.get('tipo', 'No especificado')}")
-        prompt_parts.append("")
+        constructor.fijo(
+            "COMPONENTE PRINCIPAL:",
+            f"- Nombre: {comp.get('nombre', 'No especificado')}",
+            f"- Versión: {comp.get('version', 'No especificada')}",
+            f"- Tipo: {comp.get('tipo', 'No especificado')}",
+            ""
+        )
     
     # ✅ VULNERABILIDADES DE NVD CON ANÁLISIS PERSONALIZADO
     if sbom_data.get('vulnerabilidades_nvd'):
         vulnerabilidades_nvd = sbom_data['vulnerabilidades_nvd']
         nvd_analysis = sbom_data.get('resumen', {}).get('nvd_analysis', {})
         
-        prompt_parts.append("ANÁLISIS DE VULNERABILIDADES (NATIONAL VULNERABILITY DATABASE):")
-        prompt_parts.append(f"- Componentes analizados: {nvd_analysis.get('componentes_analizados', 0)}")
-        prompt_parts.append(f"- Componentes con vulnerabilidades: {nvd_analysis.get('componentes_vulnerables', 0)}")
-        prompt_parts.append(f"- Total vulnerabilidades encontradas: {len(vulnerabilidades_nvd)}")
+        lineas = [
+            "ANÁLISIS DE VULNERABILIDADES (NATIONAL VULNERABILITY DATABASE):",
+            f"- Componentes analizados: {nvd_analysis.get('componentes_analizados', 0)}"
+        ]
+        if nvd_analysis.get('presupuesto_agotado'):
+            lineas.append(f"- Cobertura: {nvd_analysis.get('cobertura_porcentaje', 0)}% de {nvd_analysis.get('componentes_totales', 0)} componentes (análisis parcial por tiempo)")
+        lineas.append(f"- Componentes con vulnerabilidades: {nvd_analysis.get('componentes_vulnerables', 0)}")
+        lineas.append(f"- Total vulnerabilidades encontradas: {len(vulnerabilidades_nvd)}")
+        constructor.fijo(*lineas)
         
         # ✅ ANÁLISIS DE SOLUCIONABILIDAD PERSONALIZADO
         if any(vuln.get('solucionabilidad_personalizada') for vuln in vulnerabilidades_nvd):
-            prompt_parts.append("\n**ANÁLISIS DE SOLUCIONABILIDAD PERSONALIZADO APLICADO:**")
-            
             # Contar por nivel de solucionabilidad personalizado
             facil = sum(1 for v in vulnerabilidades_nvd if v.get('solucionabilidad_personalizada', {}).get('nivel') == 'FÁCIL')
             moderada = sum(1 for v in vulnerabilidades_nvd if v.get('solucionabilidad_personalizada', {}).get('nivel') == 'MODERADA')
             dificil = sum(1 for v in vulnerabilidades_nvd if v.get('solucionabilidad_personalizada', {}).get('nivel') in ['DIFÍCIL', 'MUY_DIFÍCIL'])
             
-            prompt_parts.append(f"- 🟢 **Fácil de resolver:** {facil} vulnerabilidades")
-            prompt_parts.append(f"- 🟡 **Dificultad media:** {moderada} vulnerabilidades")
-            prompt_parts.append(f"- 🔴 **Difícil de resolver:** {dificil} vulnerabilidades")
+            constructor.fijo(
+                "\n**ANÁLISIS DE SOLUCIONABILIDAD PERSONALIZADO APLICADO:**",
+                f"- 🟢 **Fácil de resolver:** {facil} vulnerabilidades",
+                f"- 🟡 **Dificultad media:** {moderada} vulnerabilidades",
+                f"- 🔴 **Difícil de resolver:** {dificil} vulnerabilidades"
+            )
             
-            # ✅ TOP VULNERABILIDADES SEGÚN PRIORIDAD PERSONALIZADA (AUMENTADO A 10)
+            # ✅ TOP VULNERABILIDADES SEGÚN PRIORIDAD PERSONALIZADA: TANTAS COMO QUEPAN EN EL PRESUPUESTO
+            # Cada CVE tiene una sola clave: si no entra en el top puede aparecer como ejemplo (más corto)
             vulns_priorizadas = sorted(
                 [v for v in vulnerabilidades_nvd if v.get('solucionabilidad_personalizada')],
                 key=lambda x: x.get('solucionabilidad_personalizada', {}).get('prioridad_personalizada', 0),
                 reverse=True
-            )[:10]  # ✅ AUMENTADO A 10
+            )
             
-            if vulns_priorizadas:
-                prompt_parts.append(f"\n**TOP 10 VULNERABILIDADES SEGÚN TUS CRITERIOS:**")
-                for i, vuln in enumerate(vulns_priorizadas, 1):
-                    cve_id = vuln.get('cve_id', 'N/A')
-                    severidad = vuln.get('severidad', 'UNKNOWN')
-                    solucionabilidad = vuln.get('solucionabilidad_personalizada', {})
-                    nivel_sol = solucionabilidad.get('nivel', 'UNKNOWN')
-                    prioridad = solucionabilidad.get('prioridad_personalizada', 0)
-                    puntos_sol = solucionabilidad.get('puntos_solucionabilidad', 0)
-                    comp = vuln.get('componente_afectado', {})
-                    
-                    prompt_parts.append(f"  {i}. **{cve_id}** en *{comp.get('nombre', 'Unknown')}* {comp.get('version', '')}")
-                    prompt_parts.append(f"     - Severidad: **{severidad}** | Solucionabilidad: **{nivel_sol}** ({puntos_sol} pts) | Prioridad: **{prioridad:.1f}**")
-                    prompt_parts.append(f"     - Descripción: {vuln.get('descripcion', 'Sin descripción')[:100]}...")
-                    
-                    # ✅ AGREGAR RAZONES DE SOLUCIONABILIDAD
-                    razones = solucionabilidad.get('razones_solucionabilidad', [])
-                    if razones:
-                        prompt_parts.append(f"     - **Factores:** {', '.join(razones[:3])}")  # Primeras 3 razones
-            
-            # ✅ EJEMPLOS ESPECÍFICOS DE VULNERABILIDADES FÁCILES
-            vulns_faciles = [v for v in vulnerabilidades_nvd 
-                           if v.get('solucionabilidad_personalizada', {}).get('nivel') == 'FÁCIL']
-            
-            if vulns_faciles and len(vulns_faciles) > len([v for v in vulns_priorizadas if v.get('solucionabilidad_personalizada', {}).get('nivel') == 'FÁCIL']):
-                prompt_parts.append(f"\n**EJEMPLOS ADICIONALES DE VULNERABILIDADES FÁCILES DE RESOLVER:**")
+            seccion = constructor.seccion(
+                "\n**TOP {incluidos} VULNERABILIDADES SEGÚN TUS CRITERIOS:**",
+                pie_omitidos=("\n**VULNERABILIDADES ADICIONALES:** Se encontraron {omitidos} vulnerabilidades adicionales.\n"
+                              "En tu análisis, menciona que hay más vulnerabilidades y explica cómo están priorizadas según los criterios del proyecto."),
+                numeracion="  {i}. ",
+                total=len(vulnerabilidades_nvd)
+            )
+            for vuln in vulns_priorizadas:
+                cve_id = vuln.get('cve_id', 'N/A')
+                severidad = vuln.get('severidad', 'UNKNOWN')
+                solucionabilidad = vuln.get('solucionabilidad_personalizada', {})
+                nivel_sol = solucionabilidad.get('nivel', 'UNKNOWN')
+                prioridad = solucionabilidad.get('prioridad_personalizada', 0)
+                puntos_sol = solucionabilidad.get('puntos_solucionabilidad', 0)
+                comp = vuln.get('componente_afectado', {})
                 
-                # Obtener vulnerabilidades fáciles que no están en el top 10
-                faciles_extra = [v for v in vulns_faciles if v not in vulns_priorizadas][:5]
+                lineas = [
+                    f"**{cve_id}** en *{comp.get('nombre', 'Unknown')}* {comp.get('version', '')}",
+                    f"     - Severidad: **{severidad}** | Solucionabilidad: **{nivel_sol}** ({puntos_sol} pts) | Prioridad: **{prioridad:.1f}**"
+                ]
+                if vuln.get('introducido_por'):
+                    lineas.append(f"     - Introducida por: {', '.join(vuln['introducido_por'])} (profundidad {vuln.get('profundidad_dependencia')})")
+                lineas.append(f"     - Descripción: {vuln.get('descripcion', 'Sin descripción')[:100]}...")
                 
-                for i, vuln in enumerate(faciles_extra, 1):
-                    cve_id = vuln.get('cve_id', 'N/A')
-                    severidad = vuln.get('severidad', 'UNKNOWN')
-                    solucionabilidad = vuln.get('solucionabilidad_personalizada', {})
-                    puntos_sol = solucionabilidad.get('puntos_solucionabilidad', 0)
-                    comp = vuln.get('componente_afectado', {})
-                    razones = solucionabilidad.get('razones_solucionabilidad', [])
-                    
-                    prompt_parts.append(f"  {i}. **{cve_id}** en *{comp.get('nombre', 'Unknown')}* {comp.get('version', '')}")
-                    prompt_parts.append(f"     - Severidad: **{severidad}** | Solucionabilidad: **{puntos_sol} puntos** (FÁCIL)")
-                    prompt_parts.append(f"     - **Por qué es fácil:** {', '.join(razones[:2]) if razones else 'Múltiples factores positivos'}")
-                    prompt_parts.append(f"     - Descripción: {vuln.get('descripcion', 'Sin descripción')[:80]}...")
+                # ✅ AGREGAR RAZONES DE SOLUCIONABILIDAD
+                razones = solucionabilidad.get('razones_solucionabilidad', [])
+                if razones:
+                    lineas.append(f"     - **Factores:** {', '.join(razones[:3])}")  # Primeras 3 razones
+                seccion.agregar("\n".join(lineas), prioridad / 100, clave=cve_id)
             
-            # ✅ EJEMPLOS DE VULNERABILIDADES DE DIFICULTAD MEDIA
-            vulns_medias = [v for v in vulnerabilidades_nvd 
-                          if v.get('solucionabilidad_personalizada', {}).get('nivel') == 'MODERADA']
+            # ✅ EJEMPLOS ESPECÍFICOS DE VULNERABILIDADES FÁCILES (las que no han entrado en el top)
+            seccion = constructor.seccion("\n**EJEMPLOS ADICIONALES DE VULNERABILIDADES FÁCILES DE RESOLVER:**",
+                                          numeracion="  {i}. ")
+            for vuln in vulns_priorizadas:
+                solucionabilidad = vuln.get('solucionabilidad_personalizada', {})
+                if solucionabilidad.get('nivel') != 'FÁCIL':
+                    continue
+                cve_id = vuln.get('cve_id', 'N/A')
+                puntos_sol = solucionabilidad.get('puntos_solucionabilidad', 0)
+                comp = vuln.get('componente_afectado', {})
+                razones = solucionabilidad.get('razones_solucionabilidad', [])
+                
+                seccion.agregar("\n".join([
+                    f"**{cve_id}** en *{comp.get('nombre', 'Unknown')}* {comp.get('version', '')}",
+                    f"     - Severidad: **{vuln.get('severidad', 'UNKNOWN')}** | Solucionabilidad: **{puntos_sol} puntos** (FÁCIL)",
+                    f"     - **Por qué es fácil:** {', '.join(razones[:2]) if razones else 'Múltiples factores positivos'}",
+                    f"     - Descripción: {vuln.get('descripcion', 'Sin descripción')[:80]}..."
+                ]), solucionabilidad.get('prioridad_personalizada', 0) / 200, clave=cve_id)
             
-            if vulns_medias:
-                prompt_parts.append(f"\n**EJEMPLOS DE VULNERABILIDADES DE DIFICULTAD MEDIA ({len(vulns_medias)} total):**")
+            # ✅ EJEMPLOS DE VULNERABILIDADES DE DIFICULTAD MEDIA
+            vulns_medias = [v for v in vulns_priorizadas
+                            if v.get('solucionabilidad_personalizada', {}).get('nivel') == 'MODERADA']
+            seccion = constructor.seccion(f"\n**EJEMPLOS DE VULNERABILIDADES DE DIFICULTAD MEDIA ({len(vulns_medias)} total):**",
+                                          numeracion="  {i}. ")
+            for vuln in vulns_medias:
+                cve_id = vuln.get('cve_id', 'N/A')
+                solucionabilidad = vuln.get('solucionabilidad_personalizada', {})
+                puntos_sol = solucionabilidad.get('puntos_solucionabilidad', 0)
+                comp = vuln.get('componente_afectado', {})
+                razones = solucionabilidad.get('razones_solucionabilidad', [])
                 
-                for i, vuln in enumerate(vulns_medias[:3], 1):  # Solo 3 ejemplos
-                    cve_id = vuln.get('cve_id', 'N/A')
-                    severidad = vuln.get('severidad', 'UNKNOWN')
-                    solucionabilidad = vuln.get('solucionabilidad_personalizada', {})
-                    puntos_sol = solucionabilidad.get('puntos_solucionabilidad', 0)
-                    comp = vuln.get('componente_afectado', {})
-                    razones = solucionabilidad.get('razones_solucionabilidad', [])
-                    
-                    prompt_parts.append(f"  {i}. **{cve_id}** en *{comp.get('nombre', 'Unknown')}* {comp.get('version', '')}")
-                    prompt_parts.append(f"     - Severidad: **{severidad}** | Solucionabilidad: **{puntos_sol} puntos** (MEDIA)")
-                    prompt_parts.append(f"     - Factores: {', '.join(razones[:2]) if razones else 'Complejidad moderada'}")
+                seccion.agregar("\n".join([
+                    f"**{cve_id}** en *{comp.get('nombre', 'Unknown')}* {comp.get('version', '')}",
+                    f"     - Severidad: **{vuln.get('severidad', 'UNKNOWN')}** | Solucionabilidad: **{puntos_sol} puntos** (MEDIA)",
+                    f"     - Factores: {', '.join(razones[:2]) if razones else 'Complejidad moderada'}"
+                ]), solucionabilidad.get('prioridad_personalizada', 0) / 250, clave=cve_id)
+        else:
+            # ✅ SIN SOLUCIONABILIDAD PERSONALIZADA NO SE LISTA NINGUNA: AVISAR DEL TOTAL
+            constructor.fijo(
+                f"\n**VULNERABILIDADES ADICIONALES:** Se encontraron {len(vulnerabilidades_nvd)} vulnerabilidades adicionales.",
+                "En tu análisis, menciona que hay más vulnerabilidades y explica cómo están priorizadas según los criterios del proyecto."
+            )
         
         # ✅ AÑADIR INFORMACIÓN DE GRADO COMBINADO
-        nvd_analysis = sbom_data.get('resumen', {}).get('nvd_analysis', {})
         analisis_grado = nvd_analysis.get('analisis_grado_combinado')
         
         if analisis_grado:
-            prompt_parts.append(f"\n**📊 ANÁLISIS DE GRADO DE SEVERIDAD COMBINADO:**")
-            prompt_parts.append(f"- Grado total acumulado: **{analisis_grado['total_grado_combinado']}** puntos")
-            prompt_parts.append(f"- Límite máximo permitido: **{analisis_grado['max_grado_permitido']}** puntos")
-            prompt_parts.append(f"- Promedio por vulnerabilidad: **{analisis_grado['promedio_grado']}** puntos")
+            lineas = [
+                f"\n**📊 ANÁLISIS DE GRADO DE SEVERIDAD COMBINADO:**",
+                f"- Grado total acumulado: **{analisis_grado['total_grado_combinado']}** puntos",
+                f"- Límite máximo permitido: **{analisis_grado['max_grado_permitido']}** puntos",
+                f"- Promedio por vulnerabilidad: **{analisis_grado['promedio_grado']}** puntos"
+            ]
             
             if analisis_grado.get('excede_limite_grado'):
-                prompt_parts.append(f"- ⚠️ **EXCEDE EL LÍMITE** por {analisis_grado['diferencia_grado']} puntos ({analisis_grado['porcentaje_usado_grado']}%)")
+                lineas.append(f"- ⚠️ **EXCEDE EL LÍMITE** por {analisis_grado['diferencia_grado']} puntos ({analisis_grado['porcentaje_usado_grado']}%)")
             else:
-                prompt_parts.append(f"- ✅ **DENTRO DEL LÍMITE** ({analisis_grado['porcentaje_usado_grado']}% del máximo usado)")
+                lineas.append(f"- ✅ **DENTRO DEL LÍMITE** ({analisis_grado['porcentaje_usado_grado']}% del máximo usado)")
+            constructor.fijo(*lineas)
             
             # Mostrar distribución de grados
             if analisis_grado.get('detalles_grados'):
-                prompt_parts.append(f"\n**Distribución de grados individuales (primeros 5):**")
-                for i, detalle in enumerate(analisis_grado['detalles_grados'][:5], 1):
-                    prompt_parts.append(f"  {i}. **{detalle['cve_id']}** en *{detalle['componente']}*: {detalle['grado_severidad']}/10 ({detalle['severidad']})")
-
-        # ✅ AÑADIR INFORMACIÓN SOBRE VULNERABILIDADES ADICIONALES
-        total_vulns = len(vulnerabilidades_nvd)
-        vulns_mostradas = len(vulns_priorizadas) if 'vulns_priorizadas' in locals() else 0
-        
-        if total_vulns > vulns_mostradas:
-            prompt_parts.append(f"\n**VULNERABILIDADES ADICIONALES:** Se encontraron {total_vulns - vulns_mostradas} vulnerabilidades adicionales.")
-            prompt_parts.append("En tu análisis, menciona que hay más vulnerabilidades y explica cómo están priorizadas según los criterios del proyecto.")
+                seccion = constructor.seccion("\n**Distribución de grados individuales (mostrando {incluidos} de {total}):**",
+                                              numeracion="  {i}. ")
+                for detalle in analisis_grado['detalles_grados']:
+                    seccion.agregar(f"**{detalle['cve_id']}** en *{detalle['componente']}*: {detalle['grado_severidad']}/10 ({detalle['severidad']})",
+                                    float(detalle['grado_severidad'] or 0) / 40)
         
         # ✅ DISTRIBUCIÓN POR SEVERIDAD (código existente)
         severidades = {}
@@ -1315,40 +1975,44 @@ def generar_prompt_sbom_con_criterios(sbom_data, mensaje_usuario, criterios_proy
             sev = vuln.get('severidad', 'UNKNOWN')
             severidades[sev] = severidades.get(sev, 0) + 1
         
-        prompt_parts.append("\n- **Distribución por severidad:**")
+        lineas = ["\n- **Distribución por severidad:**"]
         for sev, count in sorted(severidades.items(), key=lambda x: {'CRITICAL': 4, 'HIGH': 3, 'MEDIUM': 2, 'LOW': 1, 'UNKNOWN': 0}.get(x[0], 0), reverse=True):
             emoji = {'CRITICAL': '🔴', 'HIGH': '🟠', 'MEDIUM': '🟡', 'LOW': '🟢', 'UNKNOWN': '⚪'}.get(sev, '⚪')
-            prompt_parts.append(f"  {emoji} {sev}: {count} vulnerabilidades")
-        
-        prompt_parts.append("")
+            lineas.append(f"  {emoji} {sev}: {count} vulnerabilidades")
+        lineas.append("")
+        constructor.fijo(*lineas)
     
     # ✅ CONSULTA DEL USUARIO
-    prompt_parts.append(f"CONSULTA DEL USUARIO: {mensaje_usuario}")
-    prompt_parts.append("")
+    constructor.fijo(f"CONSULTA DEL USUARIO: {mensaje_usuario}", "")
     
     # ✅ ACTUALIZAR INSTRUCCIONES FINALES
-    prompt_parts.append("INSTRUCCIONES FINALES PARA EL ANÁLISIS:")
-    prompt_parts.append("1. **RESPETA LOS CRITERIOS DE SOLUCIONABILIDAD** configurados para este proyecto específico")
-    prompt_parts.append("2. **EVALÚA EL GRADO DE SEVERIDAD COMBINADO** y menciona si excede los límites del proyecto")
-    prompt_parts.append("3. **ORDENA LAS VULNERABILIDADES** según la prioridad calculada con la fórmula del proyecto")
-    prompt_parts.append("4. **MENCIONA CLARAMENTE** si el proyecto cumple con los 3 criterios: cantidad, severidad máxima y grado combinado")
-    prompt_parts.append("5. **DA RECOMENDACIONES ESPECÍFICAS** basadas en los umbrales y prioridades del proyecto")
-    prompt_parts.append("6. **PROPORCIONA EJEMPLOS ESPECÍFICOS** de las vulnerabilidades mencionadas arriba cuando sea relevante")
-    prompt_parts.append("7. **SI HAY MUCHAS VULNERABILIDADES**, proporciona un resumen con las más críticas y menciona el total")
-    prompt_parts.append("8. **CUANDO EL USUARIO PREGUNTE POR VULNERABILIDADES ESPECÍFICAS**, usa la información detallada proporcionada")
-    prompt_parts.append("")
+    constructor.fijo(
+        "INSTRUCCIONES FINALES PARA EL ANÁLISIS:",
+        "1. **RESPETA LOS CRITERIOS DE SOLUCIONABILIDAD** configurados para este proyecto específico",
+        "2. **EVALÚA EL GRADO DE SEVERIDAD COMBINADO** y menciona si excede los límites del proyecto",
+        "3. **ORDENA LAS VULNERABILIDADES** según la prioridad calculada con la fórmula del proyecto",
+        "4. **MENCIONA CLARAMENTE** si el proyecto cumple con los 3 criterios: cantidad, severidad máxima y grado combinado",
+        "5. **DA RECOMENDACIONES ESPECÍFICAS** basadas en los umbrales y prioridades del proyecto",
+        "6. **PROPORCIONA EJEMPLOS ESPECÍFICOS** de las vulnerabilidades mencionadas arriba cuando sea relevante",
+        "7. **SI HAY MUCHAS VULNERABILIDADES**, proporciona un resumen con las más críticas y menciona el total",
+        "8. **CUANDO EL USUARIO PREGUNTE POR VULNERABILIDADES ESPECÍFICAS**, usa la información detallada proporcionada",
+        ""
+    )
     
     # ✅ FORMATO DE RESPUESTA
-    prompt_parts.append("FORMATO DE RESPUESTA:")
-    prompt_parts.append("- Comienza mencionando que has aplicado los criterios específicos del proyecto")
-    prompt_parts.append("- Usa **negrita** para CVEs y puntos críticos")
-    prompt_parts.append("- Usa *cursiva* para severidades y nombres de componentes")
-    prompt_parts.append("- Organiza en secciones: Resumen Ejecutivo, Vulnerabilidades Prioritarias, Recomendaciones Específicas")
-    prompt_parts.append("- Incluye `código` para nombres técnicos de componentes")
-    prompt_parts.append("- Menciona explícitamente qué criterios de solucionabilidad has aplicado")
-    prompt_parts.append("- **PROPORCIONA EJEMPLOS CONCRETOS** cuando el usuario solicite vulnerabilidades específicas")
-    
-    prompt_completo = "\n".join(prompt_parts)
+    constructor.fijo(
+        "FORMATO DE RESPUESTA:",
+        "- Comienza mencionando que has aplicado los criterios específicos del proyecto",
+        "- Usa **negrita** para CVEs y puntos críticos",
+        "- Usa *cursiva* para severidades y nombres de componentes",
+        "- Organiza en secciones: Resumen Ejecutivo, Vulnerabilidades Prioritarias, Recomendaciones Específicas",
+        "- Incluye `código` para nombres técnicos de componentes",
+        "- Menciona explícitamente qué criterios de solucionabilidad has aplicado",
+        "- **PROPORCIONA EJEMPLOS CONCRETOS** cuando el usuario solicite vulnerabilidades específicas"
+    )
+    
+    prompt_completo = constructor.construir()
+    print(f"✂️ Prompt SBOM con criterios: ~{constructor.tokens_estimados} de {presupuesto_tokens} tokens ({constructor.omitidos} fragmentos omitidos)")
     return prompt_completo
 
 def validar_contenido_sbom(content, filename):
@@ -1356,21 +2020,7 @@ def validar_contenido_sbom(content, filename):
     Valida si el contenido es realmente un SBOM antes de procesarlo
     """
     try:
-        extension = filename.rsplit('.', 1)[1].lower()
-        
-        if extension == 'json':
-            data = json.loads(content)
-            return validar_sbom_json(data)
-        elif extension in ['xml', 'spdx']:
-            return validar_sbom_xml(content)
-        elif extension in ['yaml', 'yml']:
-            import yaml
-            data = yaml.safe_load(content)
-            return validar_sbom_yaml(data)
-        else:
-            # Para archivos de texto, verificar palabras clave
-            return validar_sbom_texto(content)
-            
+        return validar_documento_sbom(*parsear_sbom(content, filename))
     except Exception as e:
         return False, f"Error validando archivo: {str(e)}"
 
@@ -1401,36 +2051,35 @@ def validar_sbom_json(data):
 def validar_sbom_xml(content):
     """Valida si un XML es un SBOM válido"""
     try:
-        root = ET.fromstring(content)
-        
-        # Verificar CycloneDX XML
-        if 'cyclonedx.org' in str(root.tag) or 'bom' in root.tag.lower():
-            return True, "SBOM CycloneDX XML válido detectado"
-        
-        # Verificar SPDX XML
-        if 'spdx' in root.tag.lower() or any('spdx' in elem.tag.lower() for elem in root.iter()):
-            return True, "SBOM SPDX XML válido detectado"
-        
-        # Verificar elementos típicos de SBOM
-        sbom_elements = ['component', 'package', 'dependency', 'vulnerability', 'license']
-        found_elements = []
-        
-        for elem in root.iter():
-            tag_lower = elem.tag.lower()
-            for sbom_elem in sbom_elements:
-                if sbom_elem in tag_lower:
-                    found_elements.append(sbom_elem)
-        
-        if len(set(found_elements)) >= 2:
-            return True, f"SBOM XML genérico detectado (contiene: {', '.join(set(found_elements))})"
-        
-        return False, "El archivo XML no parece ser un SBOM válido"
-        
+        return validar_sbom_xml_lector(leer_sbom_xml(content)[0])
     except ET.ParseError as e:
         return False, f"Error parseando XML: {str(e)}"
 
-def validar_sbom_yaml(data):
-    """Valida si un YAML es un SBOM válido"""
+def validar_sbom_xml_lector(lector):
+    """Valida un XML ya recorrido con LectorXMLIncremental (raíz y etiquetas distintas vistas)"""
+    raiz = lector.raiz or ''
+    # Verificar CycloneDX XML
+    if 'cyclonedx.org' in raiz or 'bom' in raiz.lower():
+        return True, "SBOM CycloneDX XML válido detectado"
+    
+    # Las palabras clave se buscan sobre las etiquetas distintas, no sobre cada elemento
+    etiquetas = [etiqueta.lower() for etiqueta in lector.etiquetas]
+    
+    # Verificar SPDX XML
+    if any('spdx' in etiqueta for etiqueta in etiquetas):
+        return True, "SBOM SPDX XML válido detectado"
+    
+    # Verificar elementos típicos de SBOM
+    sbom_elements = ['component', 'package', 'dependency', 'vulnerability', 'license']
+    found_elements = set(sbom_elem for sbom_elem in sbom_elements if any(sbom_elem in etiqueta for etiqueta in etiquetas))
+    
+    if len(found_elements) >= 2:
+        return True, f"SBOM XML genérico detectado (contiene: {', '.join(found_elements)})"
+    
+    return False, "El archivo XML no parece ser un SBOM válido"
+
+def validar_sbom_yaml(data):
+    """Valida si un YAML es un SBOM válido"""
     if isinstance(data, dict):
         # Verificar CycloneDX YAML
         if 'bomFormat' in data and data['bomFormat'] == 'CycloneDX':
@@ -1626,181 +2275,224 @@ def calcular_solucionabilidad_personalizada(vuln_data, criterios_proyecto):
         'puntos_severidad': puntos_severidad
     }
 
-@app.route('/chat/upload-sbom', methods=['POST'])
-def upload_sbom():
-    try:
-        print("🚀 Iniciando procesamiento de SBOM...")
-        
-        # ✅ VALIDAR ARCHIVO
-        if 'file' not in request.files:
-            return jsonify({"error": "No se proporcionó archivo"}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({"error": "Nombre de archivo vacío"}), 400
-        
-        if not allowed_file(file.filename):
-            return jsonify({"error": "Tipo de archivo no permitido"}), 400
-        
-        # ✅ OBTENER USUARIO ID
-        user_id = obtener_usuario_id(request)
-        
-        # ✅ OBTENER PARÁMETROS ADICIONALES (incluir el nuevo)
-        proyecto_id = request.form.get('proyecto_id')
-        limite_vulnerabilidades = request.form.get('limite_vulnerabilidades', 10)
-        max_severidad = request.form.get('max_severidad', 'MEDIUM')
-        max_grado_combinado = request.form.get('max_grado_combinado', 50)  # ✅ NUEVO
-        mensaje_usuario = request.form.get('mensaje', 'Analiza este archivo SBOM')
-        
-        # ✅ OBTENER CRITERIOS DE SOLUCIONABILIDAD DEL PROYECTO
-        criterios_solucionabilidad = {}
-        proyecto_nombre = "Proyecto no especificado"
-        
-        print(f"📁 Archivo recibido: {file.filename}")
-        print(f"🎯 Proyecto ID: {proyecto_id}")
-        print(f"👤 Usuario ID: {user_id}")
-        print(f"📊 Límite vulnerabilidades: {limite_vulnerabilidades}")
-        print(f"🔺 Severidad máxima: {max_severidad}")
-        
-        # ✅ GUARDAR ARCHIVO TEMPORALMENTE
-        filename = secure_filename(file.filename)
+def recibir_archivo_sbom(request, desacoplar=False):
+    """
+    Valida el archivo subido y entrega su stream para que el análisis lo recorra por bloques, sin
+    leerlo entero (solo se guarda copia en UPLOAD_FOLDER si GUARDAR_SUBIDAS está activo).
+    Con desacoplar=True (trabajos en segundo plano, que siguen tras cerrar la petición) el stream
+    se copia antes por bloques a un temporal propio, en memoria o en disco según su tamaño.
+    Devuelve (parametros para analizar_sbom, None) o (None, respuesta de error)
+    """
+    # ✅ VALIDAR ARCHIVO
+    if 'file' not in request.files:
+        return None, (jsonify({"error": "No se proporcionó archivo"}), 400)
+
+    file = request.files['file']
+    if file.filename == '':
+        return None, (jsonify({"error": "Nombre de archivo vacío"}), 400)
+
+    if not allowed_file(file.filename):
+        return None, (jsonify({"error": "Tipo de archivo no permitido"}), 400)
+
+    # ✅ OBTENER USUARIO ID
+    user_id = obtener_usuario_id(request)
+
+    # ✅ OBTENER PARÁMETROS ADICIONALES (incluir el nuevo)
+    parametros = {
+        'user_id': user_id,
+        'proyecto_id': request.form.get('proyecto_id'),
+        'limite_vulnerabilidades': request.form.get('limite_vulnerabilidades', 10),
+        'max_severidad': request.form.get('max_severidad', 'MEDIUM'),
+        'max_grado_combinado': request.form.get('max_grado_combinado', 50),  # ✅ NUEVO
+        'mensaje_usuario': request.form.get('mensaje', 'Analiza este archivo SBOM'),
+        # Las cookies se copian para autenticar la consulta de criterios fuera de la petición
+        'cookies': dict(request.cookies) if request.cookies else {}
+    }
+
+    print(f"📁 Archivo recibido: {file.filename}")
+    print(f"🎯 Proyecto ID: {parametros['proyecto_id']}")
+    print(f"👤 Usuario ID: {user_id}")
+    print(f"📊 Límite vulnerabilidades: {parametros['limite_vulnerabilidades']}")
+    print(f"🔺 Severidad máxima: {parametros['max_severidad']}")
+
+    # ✅ STREAM DE LA SUBIDA (MAX_CONTENT_LENGTH ya limita el tamaño; werkzeug la pasa a disco si es grande)
+    filename = secure_filename(file.filename)
+    contenido = file.stream
+
+    if app.config['GUARDAR_SUBIDAS']:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        unique_filename = f"{timestamp}_{filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        
-        file.save(file_path)
-        print(f"💾 Archivo guardado en: {file_path}")
-        
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{timestamp}_{uuid.uuid4().hex[:8]}_{filename}")
+        with open(file_path, 'wb') as f:
+            shutil.copyfileobj(contenido, f)
+        contenido.seek(0)
+        print(f"💾 Copia del archivo guardada en: {file_path}")
+
+    if desacoplar:
+        copia = tempfile.SpooledTemporaryFile(max_size=app.config['SUBIDAS_EN_MEMORIA_BYTES'])
+        shutil.copyfileobj(contenido, copia)
+        copia.seek(0)
+        contenido = copia
+
+    parametros.update({'contenido': contenido, 'filename': filename})
+    return parametros, None
+
+async def consultar_proyecto_api(proyecto_id, cookies=None):
+    """GET /proyectos/<id> en la API con las cookies del usuario; devuelve (status, datos o None)"""
+    api_host = os.getenv('API_HOST', 'host.docker.internal')
+    api_port = os.getenv('API_PORT', '5001')
+
+    async with aiohttp.ClientSession(cookies=cookies or {}, timeout=aiohttp.ClientTimeout(total=5)) as sesion:
+        async with sesion.get(
+            f"http://{api_host}:{api_port}/proyectos/{proyecto_id}",
+            headers={'Content-Type': 'application/json'}
+        ) as response:
+            datos = await response.json() if response.status == 200 else None
+            return response.status, datos
+
+def criterios_desde_proyecto(proyecto_data):
+    """Criterios de solucionabilidad a partir de los datos del proyecto devueltos por la API"""
+    return {
+        'priori_vectores_red': proyecto_data.get('priori_vectores_red', True),
+        'priori_sin_parches': proyecto_data.get('priori_sin_parches', True),
+        'priori_exploit_publico': proyecto_data.get('priori_exploit_publico', True),
+        'peso_severidad': proyecto_data.get('peso_severidad', 70),
+        'peso_solucionabilidad': proyecto_data.get('peso_solucionabilidad', 30),
+        'umbral_solucionabilidad_facil': proyecto_data.get('umbral_solucionabilidad_facil', 75),
+        'umbral_solucionabilidad_media': proyecto_data.get('umbral_solucionabilidad_media', 50),
+        'incluir_temporal_fixes': proyecto_data.get('incluir_temporal_fixes', True),
+        'excluir_privilegios_altos': proyecto_data.get('excluir_privilegios_altos', False),
+        'max_grado_combinado': proyecto_data.get('max_grado_severidad_combinado', 50)
+    }
+
+async def obtener_criterios_proyecto(proyecto_id, cookies):
+    """Obtiene de la API el nombre y los criterios de solucionabilidad del proyecto"""
+    criterios_solucionabilidad = {}
+    proyecto_nombre = "Proyecto no especificado"
+
+    try:
+        status, proyecto_data = await consultar_proyecto_api(proyecto_id, cookies)
+
+        if status == 200:
+            proyecto_nombre = proyecto_data.get('nombre', 'Proyecto no especificado')
+            criterios_solucionabilidad = criterios_desde_proyecto(proyecto_data)
+            print(f"🎯 Criterios de solucionabilidad obtenidos: {criterios_solucionabilidad}")
+        else:
+            print(f"⚠️ No se pudieron obtener criterios del proyecto: {status}")
+
+    except Exception as e:
+        print(f"⚠️ Error obteniendo criterios del proyecto: {e}")
+
+    return criterios_solucionabilidad, proyecto_nombre
+
+# 📋 ETAPAS DEL ANÁLISIS DE UN SBOM (se publican en el progreso de los trabajos)
+ETAPAS_ANALISIS_SBOM = ['criterios', 'validacion', 'procesamiento', 'nvd', 'solucionabilidad', 'limites', 'ia']
+
+async def analizar_sbom(contenido, filename, user_id, proyecto_id=None, limite_vulnerabilidades=10, max_severidad='MEDIUM',
+                  max_grado_combinado=50, mensaje_usuario='Analiza este archivo SBOM', cookies=None, trabajo=None):
+    """
+    Pipeline completo de análisis de un SBOM (contenido en bytes o fichero binario): criterios del proyecto,
+    validación, procesamiento, enriquecimiento NVD, solucionabilidad, límites y respuesta de IA.
+    El documento se parsea una única vez y validación y extracción trabajan sobre ese árbol.
+    No depende del contexto de la petición, así que puede ejecutarse en un trabajo en segundo plano
+    (`trabajo` recibe las etapas y el progreso). Las etapas de CPU se delegan a hilos para no
+    bloquear el bucle compartido. Devuelve (datos de respuesta, status HTTP)
+    """
+    def etapa(nombre):
+        if trabajo is not None:
+            trabajo.iniciar_etapa(nombre)
+
+    try:
         # ✅ OBTENER CRITERIOS DE SOLUCIONABILIDAD DEL PROYECTO
+        etapa('criterios')
         criterios_solucionabilidad = {}
         proyecto_nombre = "Proyecto no especificado"
-        
+
         if proyecto_id:
-            try:
-                api_host = os.getenv('API_HOST', 'host.docker.internal')
-                api_port = os.getenv('API_PORT', '5001')
-                
-                # Obtener cookies para autenticación
-                cookies = {}
-                if hasattr(request, 'cookies') and request.cookies:
-                    for name, value in request.cookies.items():
-                        cookies[name] = value
-                
-                criterios_response = requests.get(
-                    f"http://{api_host}:{api_port}/proyectos/{proyecto_id}",
-                    cookies=cookies,
-                    headers={'Content-Type': 'application/json'},
-                    timeout=5
-                )
-                
-                if criterios_response.status_code == 200:
-                    proyecto_data = criterios_response.json()
-                    proyecto_nombre = proyecto_data.get('nombre', 'Proyecto no especificado')
-                    criterios_solucionabilidad = {
-                        'priori_vectores_red': proyecto_data.get('priori_vectores_red', True),
-                        'priori_sin_parches': proyecto_data.get('priori_sin_parches', True),
-                        'priori_exploit_publico': proyecto_data.get('priori_exploit_publico', True),
-                        'peso_severidad': proyecto_data.get('peso_severidad', 70),
-                        'peso_solucionabilidad': proyecto_data.get('peso_solucionabilidad', 30),
-                        'umbral_solucionabilidad_facil': proyecto_data.get('umbral_solucionabilidad_facil', 75),
-                        'umbral_solucionabilidad_media': proyecto_data.get('umbral_solucionabilidad_media', 50),
-                        'incluir_temporal_fixes': proyecto_data.get('incluir_temporal_fixes', True),
-                        'excluir_privilegios_altos': proyecto_data.get('excluir_privilegios_altos', False),
-                        'max_grado_combinado': proyecto_data.get('max_grado_severidad_combinado', 50)
-                    }
-                    print(f"🎯 Criterios de solucionabilidad obtenidos: {criterios_solucionabilidad}")
-                else:
-                    print(f"⚠️ No se pudieron obtener criterios del proyecto: {criterios_response.status_code}")
-                    
-            except Exception as e:
-                print(f"⚠️ Error obteniendo criterios del proyecto: {e}")
-        
-        # ✅ VALIDAR CONTENIDO DEL SBOM
+            criterios_solucionabilidad, proyecto_nombre = await obtener_criterios_proyecto(proyecto_id, cookies)
+
+        # ✅ PARSEAR UNA SOLA VEZ Y VALIDAR SOBRE EL ÁRBOL
+        etapa('validacion')
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            is_valid, validation_message = validar_contenido_sbom(content, filename)
-            if not is_valid:
-                os.remove(file_path)
-                return jsonify({
-                    "error": f"Archivo no válido: {validation_message}"
-                }), 400
-            
-            print(f"✅ Validación exitosa: {validation_message}")
-            
-        except UnicodeDecodeError:
-            try:
-                with open(file_path, 'r', encoding='latin-1') as f:
-                    content = f.read()
-            except Exception as e:
-                os.remove(file_path)
-                return jsonify({
-                    "error": f"Error de codificación del archivo: {str(e)}"
-                }), 400
-        
-        # ✅ PROCESAR SBOM
+            tipo_documento, documento = await asyncio.to_thread(parsear_sbom, contenido, filename)
+            is_valid, validation_message = validar_documento_sbom(tipo_documento, documento)
+        except Exception as e:
+            is_valid, validation_message = False, f"Error validando archivo: {str(e)}"
+        # El documento ya contiene todo: liberar los bytes o cerrar el fichero
+        if hasattr(contenido, 'close'):
+            contenido.close()
+        contenido = None
+
+        if not is_valid:
+            return {"error": f"Archivo no válido: {validation_message}"}, 400
+
+        print(f"✅ Validación exitosa: {validation_message}")
+
+        # ✅ PROCESAR SBOM (MISMO ÁRBOL)
+        etapa('procesamiento')
         try:
-            sbom_data = procesar_archivo_sbom(file_path, filename)
-            if not sbom_data:
-                os.remove(file_path)
-                return jsonify({"error": "No se pudo procesar el archivo SBOM"}), 400
-            
+            sbom_data = await asyncio.to_thread(procesar_documento_sbom, tipo_documento, documento)
+            documento = None
+            if not sbom_data or isinstance(sbom_data, str):
+                return {"error": sbom_data or "No se pudo procesar el archivo SBOM"}, 400
+            # El grafo de dependencias solo se usa para el enriquecimiento: no se serializa
+            grafo_dependencias = sbom_data.pop('_grafo', None)
+
             print(f"📋 SBOM procesado: {sbom_data.get('formato', 'Desconocido')}")
-            
+
         except Exception as e:
             print(f"❌ Error procesando SBOM: {e}")
-            os.remove(file_path)
-            return jsonify({
-                "error": f"Error procesando SBOM: {str(e)}"
-            }), 500
-        
+            return {"error": f"Error procesando SBOM: {str(e)}"}, 500
+
         # ✅ ENRIQUECER CON DATOS DE NVD (incluir nuevo parámetro)
+        etapa('nvd')
         try:
             print("🔍 Consultando National Vulnerability Database...")
-            sbom_data = asyncio.run(enriquecer_sbom_con_nvd(
-                sbom_data, 
-                int(limite_vulnerabilidades), 
+            sbom_data = await enriquecer_sbom_con_nvd(
+                sbom_data,
+                int(limite_vulnerabilidades),
                 max_severidad,
-                int(criterios_solucionabilidad.get('max_grado_combinado', max_grado_combinado))
-            ))
-            
+                int(criterios_solucionabilidad.get('max_grado_combinado', max_grado_combinado)),
+                progreso=trabajo.actualizar_progreso if trabajo is not None else None,
+                grafo=grafo_dependencias
+            )
+
         except Exception as e:
             print(f"⚠️ Error consultando NVD (continuando sin datos NVD): {e}")
-        
+
         # ✅ APLICAR ANÁLISIS DE SOLUCIONABILIDAD PERSONALIZADA
+        etapa('solucionabilidad')
         analisis_solucionabilidad_personalizado = None
         if criterios_solucionabilidad and isinstance(sbom_data, dict) and 'vulnerabilidades_nvd' in sbom_data:
             try:
                 print("🎯 Aplicando análisis de solucionabilidad personalizada...")
-                
+
                 # Enriquecer cada vulnerabilidad con solucionabilidad personalizada
                 for vuln in sbom_data['vulnerabilidades_nvd']:
                     solucionabilidad_personalizada = calcular_solucionabilidad_personalizada(
                         vuln, criterios_solucionabilidad
                     )
                     vuln['solucionabilidad_personalizada'] = solucionabilidad_personalizada
-                
+
                 # Ordenar vulnerabilidades por prioridad personalizada (mayor prioridad primero)
                 sbom_data['vulnerabilidades_nvd'] = sorted(
                     sbom_data['vulnerabilidades_nvd'],
                     key=lambda x: x.get('solucionabilidad_personalizada', {}).get('prioridad_personalizada', 0),
                     reverse=True
                 )
-                
+
                 # Generar estadísticas de solucionabilidad personalizada
                 total_vulns = len(sbom_data['vulnerabilidades_nvd'])
-                facil = sum(1 for v in sbom_data['vulnerabilidades_nvd'] 
+                facil = sum(1 for v in sbom_data['vulnerabilidades_nvd']
                            if v.get('solucionabilidad_personalizada', {}).get('nivel') == 'FÁCIL')
-                moderada = sum(1 for v in sbom_data['vulnerabilidades_nvd'] 
+                moderada = sum(1 for v in sbom_data['vulnerabilidades_nvd']
                               if v.get('solucionabilidad_personalizada', {}).get('nivel') == 'MODERADA')
-                dificil = sum(1 for v in sbom_data['vulnerabilidades_nvd'] 
+                dificil = sum(1 for v in sbom_data['vulnerabilidades_nvd']
                              if v.get('solucionabilidad_personalizada', {}).get('nivel') in ['DIFÍCIL', 'MUY_DIFÍCIL'])
-                
+
                 # Calcular vulnerabilidades de alta prioridad (top 20% o score > 75)
-                alta_prioridad = sum(1 for v in sbom_data['vulnerabilidades_nvd'] 
+                alta_prioridad = sum(1 for v in sbom_data['vulnerabilidades_nvd']
                                    if v.get('solucionabilidad_personalizada', {}).get('prioridad_personalizada', 0) > 75)
-                
+
                 analisis_solucionabilidad_personalizado = {
                     'peso_severidad': criterios_solucionabilidad.get('peso_severidad', 70),
                     'peso_solucionabilidad': criterios_solucionabilidad.get('peso_solucionabilidad', 30),
@@ -1813,101 +2505,70 @@ def upload_sbom():
                     'alta_prioridad': alta_prioridad,
                     'criterios_aplicados': criterios_solucionabilidad
                 }
-                
+
                 # Añadir al SBOM
                 sbom_data['analisis_solucionabilidad_personalizado'] = analisis_solucionabilidad_personalizado
-                
+
                 print(f"✅ Análisis personalizado completado:")
                 print(f"   - Fácil: {facil}, Media: {moderada}, Difícil: {dificil}")
                 print(f"   - Alta prioridad: {alta_prioridad}")
-                
+
             except Exception as e:
                 print(f"⚠️ Error en análisis de solucionabilidad personalizada: {e}")
-        
+
         # ✅ VERIFICAR LÍMITES DEL PROYECTO CON ANÁLISIS AVANZADO
+        etapa('limites')
         limites_info = None
         if proyecto_id:
             try:
                 vulnerabilidades_encontradas = len(sbom_data.get('vulnerabilidades_nvd', []))
                 limites_info = verificar_limites_proyecto_avanzado(
-                    proyecto_id, 
-                    vulnerabilidades_encontradas, 
+                    proyecto_id,
+                    vulnerabilidades_encontradas,
                     sbom_data.get('vulnerabilidades_nvd', []),
                     limite_vulnerabilidades,
                     max_severidad
                 )
                 print(f"📊 Verificación de límites: {limites_info}")
-                
+
             except Exception as e:
                 print(f"⚠️ Error verificando límites: {e}")
-        
+
         # ✅ GUARDAR SBOM EN EL HISTORIAL DEL USUARIO
         try:
-            if user_id not in historial_conversaciones:
-                historial_conversaciones[user_id] = []
-            
-            # Guardar información del SBOM para contexto futuro
-            sbom_context = {
-                'tipo': 'sbom_analysis',
-                'filename': filename,
-                'proyecto_id': proyecto_id,
-                'proyecto_nombre': proyecto_nombre,
-                'sbom_data': sbom_data,  # ✅ GUARDAR TODO EL SBOM PROCESADO
-                'criterios_solucionabilidad': criterios_solucionabilidad,
-                'timestamp': datetime.now().isoformat(),
-                'resumen_vulnerabilidades': {
-                    'total': len(sbom_data.get('vulnerabilidades_nvd', [])),
-                    'por_severidad': {},
-                    'componentes_analizados': sbom_data.get('resumen', {}).get('nvd_analysis', {}).get('componentes_analizados', 0)
-                }
-            }
-            
-            # Calcular distribución por severidad para resumen
-            if sbom_data.get('vulnerabilidades_nvd'):
-                for vuln in sbom_data['vulnerabilidades_nvd']:
-                    sev = vuln.get('severidad', 'UNKNOWN')
-                    sbom_context['resumen_vulnerabilidades']['por_severidad'][sev] = \
-                        sbom_context['resumen_vulnerabilidades']['por_severidad'].get(sev, 0) + 1
-            
-            # ✅ AGREGAR AL HISTORIAL COMO CONTEXTO ESPECIAL
-            historial_conversaciones[user_id].append(f"CONTEXTO_SBOM: {json.dumps(sbom_context)}")
-            
+            # Guardar todo el SBOM procesado como objeto (sustituye al análisis anterior)
+            historial_conversaciones.guardar_contexto_sbom(user_id, ContextoSBOM(
+                filename, sbom_data, proyecto_id, proyecto_nombre, criterios_solucionabilidad
+            ))
+
             print(f"✅ SBOM guardado en historial para usuario: {user_id}")
-            
+
         except Exception as e:
             print(f"⚠️ Error guardando SBOM en historial: {e}")
-        
+
         # ✅ GENERAR RESPUESTA DE IA CON CRITERIOS PERSONALIZADOS
+        etapa('ia')
         ai_response = "Archivo SBOM procesado correctamente."
-        
-        if model and sbom_data:
+
+        if cliente_llm_sbom and sbom_data:
             try:
                 # Usar prompt personalizado si hay criterios, sino el genérico
                 prompt = generar_prompt_sbom(sbom_data, mensaje_usuario, criterios_solucionabilidad)
-                
+
                 print(f"🧠 Generando respuesta de IA...")
-                response_ia = model.generate_content(prompt)
-                ai_response = response_ia.text
-                
+                ai_response = await cliente_llm_sbom.generar(prompt)
+
                 # ✅ GUARDAR TAMBIÉN LA RESPUESTA DE LA IA EN EL HISTORIAL
-                if user_id in historial_conversaciones:
-                    historial_conversaciones[user_id].append(f"Usuario [SBOM]: {mensaje_usuario}")
-                    historial_conversaciones[user_id].append(f"Bot [Análisis SBOM]: {ai_response}")
-                
+                historial_conversaciones.agregar_mensajes(user_id, f"Usuario [SBOM]: {mensaje_usuario}",
+                                                          f"Bot [Análisis SBOM]: {ai_response}")
+
                 if criterios_solucionabilidad:
                     print(f"✅ IA consciente de criterios de solucionabilidad del proyecto")
-                
+
             except Exception as e:
                 print(f"⚠️ Error generando respuesta de IA: {e}")
                 ai_response = f"Archivo SBOM procesado. Error en IA: {str(e)}"
-        
-        # ✅ LIMPIAR ARCHIVO TEMPORAL
-        try:
-            os.remove(file_path)
-            print(f"🗑️ Archivo temporal eliminado: {file_path}")
-        except Exception as e:
-            print(f"⚠️ Error eliminando archivo temporal: {e}")
-        
+
         # ✅ CONSTRUIR RESPUESTA FINAL
         response_data = {
             "message": ai_response,
@@ -1921,26 +2582,103 @@ def upload_sbom():
             "criterios_aplicados": bool(criterios_solucionabilidad),
             "limites_info": limites_info
         }
-        
+
         print(f"✅ Procesamiento completado exitosamente")
-        return jsonify(response_data), 200
-        
+        return response_data, 200
+
+    except Exception as e:
+        print(f"❌ Error general analizando SBOM: {str(e)}")
+        traceback.print_exc()
+        return {"error": f"Error interno del servidor: {str(e)}"}, 500
+
+@app.route('/chat/upload-sbom', methods=['POST'])
+async def upload_sbom():
+    """Análisis síncrono: la respuesta llega cuando termina todo el pipeline"""
+    try:
+        print("🚀 Iniciando procesamiento de SBOM...")
+
+        parametros, error = recibir_archivo_sbom(request)
+        if error:
+            return error
+
+        response_data, status = await analizar_sbom(**parametros)
+        return jsonify(response_data), status
+
     except Exception as e:
         print(f"❌ Error general en upload_sbom: {str(e)}")
-        import traceback
         traceback.print_exc()
-        
-        # Limpiar archivo si existe
-        try:
-            if 'file_path' in locals() and os.path.exists(file_path):
-                os.remove(file_path)
-        except:
-            pass
-        
         return jsonify({
             "error": f"Error interno del servidor: {str(e)}"
         }), 500
 
+@app.route('/chat/trabajos/sbom', methods=['POST'])
+def crear_trabajo_sbom():
+    """
+    Análisis asíncrono: guarda el archivo, encola el pipeline y responde 202 con el id del trabajo.
+    El estado se consulta en /chat/trabajos/<id> o se sigue en /chat/trabajos/<id>/eventos
+    """
+    try:
+        print("🚀 Encolando análisis de SBOM...")
+
+        parametros, error = recibir_archivo_sbom(request, desacoplar=True)
+        if error:
+            return error
+
+        trabajo = gestor_trabajos.crear(
+            parametros['user_id'],
+            lambda trabajo, **kwargs: bucle_async.ejecutar(analizar_sbom(trabajo=trabajo, **kwargs)),
+            etapas=ETAPAS_ANALISIS_SBOM,
+            **parametros
+        )
+        print(f"📬 Trabajo {trabajo.id} creado para usuario: {parametros['user_id']}")
+
+        response = jsonify({
+            "trabajo_id": trabajo.id,
+            "estado": trabajo.estado,
+            "estado_url": f"/chat/trabajos/{trabajo.id}",
+            "eventos_url": f"/chat/trabajos/{trabajo.id}/eventos"
+        })
+        response.headers['Location'] = f"/chat/trabajos/{trabajo.id}"
+        return response, 202
+
+    except Exception as e:
+        print(f"❌ Error creando trabajo de SBOM: {str(e)}")
+        traceback.print_exc()
+        return jsonify({
+            "error": f"Error interno del servidor: {str(e)}"
+        }), 500
+
+@app.route('/chat/trabajos/<trabajo_id>', methods=['GET'])
+def estado_trabajo(trabajo_id):
+    """Estado, etapa y progreso de un trabajo; incluye el resultado cuando ha terminado"""
+    trabajo = gestor_trabajos.obtener(trabajo_id, obtener_usuario_id(request))
+    if trabajo is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(trabajo.a_dict()), 200
+
+@app.route('/chat/trabajos/<trabajo_id>/eventos', methods=['GET'])
+def eventos_trabajo(trabajo_id):
+    """Server-Sent Events con cada cambio de etapa o progreso hasta que el trabajo termina"""
+    trabajo = gestor_trabajos.obtener(trabajo_id, obtener_usuario_id(request))
+    if trabajo is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+
+    def generar():
+        version = -1
+        while True:
+            actual = trabajo.esperar_cambio(version)
+            if actual == version and not trabajo.terminado:
+                yield ": keepalive\n\n"  # evita que proxies cierren la conexión inactiva
+                continue
+            version = actual
+            evento = 'resultado' if trabajo.terminado else 'progreso'
+            yield evento_sse(evento, trabajo.a_dict())
+            if trabajo.terminado:
+                break
+
+    return Response(generar(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 def verificar_limites_proyecto_avanzado(proyecto_id, vulnerabilidades_encontradas, vulnerabilidades_nvd, limite_configurado, 
                                         max_severidad_configurada, max_grado_combinado=50):
     """
@@ -2040,28 +2778,14 @@ def verificar_limites_proyecto_avanzado(proyecto_id, vulnerabilidades_encontrada
             'error': f'Error inesperado: {str(e)}'
         }
 
-def obtener_info_proyecto(proyecto_id):
+async def obtener_info_proyecto(proyecto_id, cookies=None):
     """Obtiene información COMPLETA del proyecto incluyendo criterios de solucionabilidad"""
     try:
-        api_host = os.getenv('API_HOST', 'host.docker.internal')
-        api_port = os.getenv('API_PORT', '5001')
-
-        print(f"🔍 Consultando información del proyecto {proyecto_id} en {api_host}:{api_port}")
-        
-        cookies = {}
-        if hasattr(request, 'cookies') and request.cookies:
-            for name, value in request.cookies.items():
-                cookies[name] = value
+        print(f"🔍 Consultando información del proyecto {proyecto_id}")
         
-        response = requests.get(
-            f"http://{api_host}:{api_port}/proyectos/{proyecto_id}",
-            cookies=cookies,
-            headers={'Content-Type': 'application/json'},
-            timeout=5
-        )
+        status, proyecto_data = await consultar_proyecto_api(proyecto_id, cookies)
         
-        if response.status_code == 200:
-            proyecto_data = response.json()
+        if status == 200:
             return {
                 'proyecto_encontrado': True,
                 'limite_configurado': proyecto_data.get('max_vulnerabilidades', 10),
@@ -2069,50 +2793,37 @@ def obtener_info_proyecto(proyecto_id):
                 'proyecto_data': proyecto_data  # ✅ INCLUIR DATOS COMPLETOS
             }
         else:
-            return {'proyecto_encontrado': False, 'error': f'Error HTTP {response.status_code}'}
+            return {'proyecto_encontrado': False, 'error': f'Error HTTP {status}'}
             
     except Exception as e:
         return {'proyecto_encontrado': False, 'error': str(e)}
 
-@app.route('/chat/mensajes', methods=['POST'])
-def chat_mensajes():
-    """ Endpoint para enviar mensajes al chat y obtener respuestas de IA con contexto de proyecto """
-    try:
-        data = request.json
-        mensaje = data.get('message', '')
-        proyecto_id = data.get('proyecto_id', '')  
-        proyecto_nombre = data.get('proyecto_nombre', '')  
-        
-        if not mensaje:
-            return jsonify({"error": "Mensaje vacío"}), 400
-        
-        user_id = obtener_usuario_id(request)
-        
-        # ✅ DETECTAR TIPO DE PREGUNTA ANTES DE GENERAR CONTEXTO
-        es_pregunta_sbom = es_pregunta_relacionada_sbom(mensaje)
-        print(f"🔍 Pregunta sobre SBOM detectada: {es_pregunta_sbom}")
-        print(f"📝 Mensaje: '{mensaje}'")
-        
-        # ✅ OBTENER CONTEXTO COMPLETO DEL PROYECTO CON CRITERIOS DE SOLUCIONABILIDAD
-        contexto_proyecto = ""
-        if proyecto_id:
-            try:
-                # Obtener información completa del proyecto
-                proyecto_info = obtener_info_proyecto(proyecto_id)
-                
-                if proyecto_info.get('proyecto_encontrado'):
-                    proyecto_data = proyecto_info.get('proyecto_data', {})
-                    
-                    # ✅ CONTEXTO DE PROYECTO REDUCIDO PARA PREGUNTAS SIMPLES
-                    if not es_pregunta_sbom:
-                        contexto_proyecto = f"""
+async def obtener_contexto_proyecto(proyecto_id, proyecto_nombre, es_pregunta_sbom, cookies=None):
+    """
+    Texto con la configuración del proyecto activo (completo solo para preguntas sobre SBOM) y sus
+    criterios de solucionabilidad actuales (None si no se han podido obtener)
+    """
+    contexto_proyecto = ""
+    criterios = None
+    if proyecto_id:
+        try:
+            # Obtener información completa del proyecto
+            proyecto_info = await obtener_info_proyecto(proyecto_id, cookies)
+
+            if proyecto_info.get('proyecto_encontrado'):
+                proyecto_data = proyecto_info.get('proyecto_data', {})
+                criterios = criterios_desde_proyecto(proyecto_data)
+
+                # ✅ CONTEXTO DE PROYECTO REDUCIDO PARA PREGUNTAS SIMPLES
+                if not es_pregunta_sbom:
+                    contexto_proyecto = f"""
 **PROYECTO ACTIVO: {proyecto_nombre}**
 - Límite de vulnerabilidades: {proyecto_data.get('max_vulnerabilidades', 10)}
 - Severidad máxima: {proyecto_data.get('max_severidad', 'MEDIUM')}
 """
-                    else:
-                        # Contexto completo solo para preguntas sobre SBOM
-                        contexto_proyecto = f"""
+                else:
+                    # Contexto completo solo para preguntas sobre SBOM
+                    contexto_proyecto = f"""
 **CONTEXTO DEL PROYECTO ACTIVO: {proyecto_nombre}**
 
 **Configuración de Seguridad:**
@@ -2135,103 +2846,235 @@ def chat_mensajes():
 **Fórmula de Priorización:**
 Prioridad = ({proyecto_data.get('peso_severidad', 70)}% × Severidad) + ({proyecto_data.get('peso_solucionabilidad', 30)}% × Solucionabilidad Invertida)
 """
-                else:
-                    contexto_proyecto = f"\n**PROYECTO ACTIVO:** {proyecto_nombre}\n"
-                    
-            except Exception as e:
-                print(f"⚠️ Error obteniendo contexto del proyecto: {e}")
+            else:
                 contexto_proyecto = f"\n**PROYECTO ACTIVO:** {proyecto_nombre}\n"
-        
-        # ✅ INICIALIZAR HISTORIAL SI NO EXISTE
-        if user_id not in historial_conversaciones:
-            historial_conversaciones[user_id] = []
-        
-        historial_usuario = historial_conversaciones[user_id]
-        
+
+        except Exception as e:
+            print(f"⚠️ Error obteniendo contexto del proyecto: {e}")
+            contexto_proyecto = f"\n**PROYECTO ACTIVO:** {proyecto_nombre}\n"
+    return contexto_proyecto, criterios
+
+async def preparar_mensaje_chat(user_id, mensaje, proyecto_id, proyecto_nombre, cookies=None, cachear=True):
+    """
+    Construye el prompt de un mensaje de chat con el historial y el contexto del proyecto.
+    Devuelve (prompt_completo, es_pregunta_sbom, contexto_proyecto, contexto_cache); contexto_cache
+    es (huella del análisis, huella del proyecto y sus criterios) si la respuesta se puede cachear, o None.
+    Las respuestas cacheadas se comparten entre usuarios: con cachear=True, las preguntas sobre el
+    SBOM se responden sin la conversación del usuario en el prompt
+    """
+    # ✅ DETECTAR TIPO DE PREGUNTA ANTES DE GENERAR CONTEXTO
+    es_pregunta_sbom = es_pregunta_relacionada_sbom(mensaje)
+    print(f"🔍 Pregunta sobre SBOM detectada: {es_pregunta_sbom}")
+    print(f"📝 Mensaje: '{mensaje}'")
+
+    # ✅ OBTENER CONTEXTO COMPLETO DEL PROYECTO CON CRITERIOS DE SOLUCIONABILIDAD
+    contexto_proyecto, criterios_actuales = await obtener_contexto_proyecto(proyecto_id, proyecto_nombre, es_pregunta_sbom, cookies)
+    conversacion = historial_conversaciones.obtener(user_id)
+
+    cierre = f"\n\n**Usuario:** {mensaje}"
+
+    # ✅ INSTRUCCIONES ESPECÍFICAS SOLO SI ES NECESARIO
+    if es_pregunta_sbom:
+        cierre += "\n\n**INSTRUCCIÓN ESPECIAL:** El usuario está preguntando sobre el SBOM analizado. Usa la información específica proporcionada. Si necesitas detalles de vulnerabilidades específicas que no están en el resumen, menciona que puedes proporcionarlos."
+
+    # ✅ GENERAR CONTEXTO OPTIMIZADO SEGÚN TIPO DE PREGUNTA CON EL PRESUPUESTO QUE DEJAN PROYECTO Y MENSAJE
+    presupuesto_historial = max(0, app.config['PROMPT_MAX_TOKENS'] - estimar_tokens(contexto_proyecto + cierre))
+    # Si el análisis guardado es de este proyecto, sus secciones se priorizan con los criterios vigentes
+    if not (proyecto_id and conversacion is not None and conversacion.contexto_sbom is not None
+            and str(conversacion.contexto_sbom.proyecto_id) == str(proyecto_id)):
+        criterios_actuales = None
+    # ✅ SOLO SE CACHEAN PREGUNTAS SOBRE EL SBOM: DEPENDEN DEL ANÁLISIS, EL PROYECTO Y SUS CRITERIOS.
+    # La conversación privada del usuario no entra en esos prompts: la respuesta la puede recibir otro usuario
+    cacheable = cachear and es_pregunta_sbom and conversacion is not None and conversacion.contexto_sbom is not None
+    contexto_previo = formatear_historial_para_ai(conversacion, es_pregunta_sbom, mensaje, presupuesto_historial,
+                                                  criterios_actuales, incluir_conversacion=not cacheable)
+    
+    contexto_cache = None
+    if cacheable:
+        criterios = criterios_actuales if criterios_actuales is not None else conversacion.contexto_sbom.criterios_solucionabilidad
+        contexto_cache = (conversacion.contexto_sbom.huella(),
+                          huella_contexto_respuesta(proyecto_id, contexto_proyecto, criterios))
+    prompt_completo = contexto_previo + contexto_proyecto + cierre
+
+    print(f"📝 Contexto total: {len(prompt_completo)} caracteres")
+    print(f"🎯 Proyecto activo: {proyecto_nombre if proyecto_nombre else 'Ninguno'}")
+
+    return prompt_completo, es_pregunta_sbom, contexto_proyecto, contexto_cache
+
+def usar_cache_respuestas(request, data):
+    """La cache se puede saltar por petición con {"cache": false} o la cabecera Cache-Control: no-cache"""
+    if not app.config['CACHE_RESPUESTAS'] or data.get('cache', True) is False:
+        return False
+    return 'no-cache' not in request.headers.get('Cache-Control', '').lower()
+
+def registrar_intercambio_chat(user_id, mensaje, response_text, proyecto_id, proyecto_nombre):
+    """
+    Guarda pregunta y respuesta en el historial y devuelve la conversación. El buffer circular
+    conserva los últimos mensajes y el contexto SBOM va aparte, así que no hay que recortar nada
+    """
+    # ✅ GUARDAR EN HISTORIAL CON INFORMACIÓN DEL PROYECTO
+    if proyecto_id:
+        return historial_conversaciones.agregar_mensajes(user_id, f"Usuario [Proyecto: {proyecto_nombre}]: {mensaje}",
+                                                         f"Bot [Con criterios de {proyecto_nombre}]: {response_text}")
+    return historial_conversaciones.agregar_mensajes(user_id, f"Usuario: {mensaje}", f"Bot: {response_text}")
+
+def datos_respuesta_chat(response_text, conversacion, es_pregunta_sbom, contexto_proyecto, prompt_completo,
+                         proyecto_id, proyecto_nombre, respuesta_en_cache=None):
+    """Cuerpo de respuesta de /chat/mensajes (también es el evento final del streaming)"""
+    return {
+        "message": response_text,
+        "respuesta_en_cache": respuesta_en_cache,  # 'exacta', 'similar' o None
+        "contexto_proyecto_aplicado": bool(proyecto_id and "error" not in contexto_proyecto.lower()),
+        "contexto_sbom_disponible": conversacion.contexto_sbom is not None,
+        "es_pregunta_sbom": es_pregunta_sbom,
+        "contexto_optimizado": not es_pregunta_sbom,  # Nuevo campo para debug
+        "caracteres_contexto": len(prompt_completo) if prompt_completo else 0,  # Nuevo campo para debug
+        "proyecto_info": {
+            "id": proyecto_id,
+            "nombre": proyecto_nombre
+        } if proyecto_id else None
+    }
+
+@app.route('/chat/mensajes', methods=['POST'])
+async def chat_mensajes():
+    """ Endpoint para enviar mensajes al chat y obtener respuestas de IA con contexto de proyecto """
+    try:
+        data = request.json
+        mensaje = data.get('message', '')
+        proyecto_id = data.get('proyecto_id', '')
+        proyecto_nombre = data.get('proyecto_nombre', '')
+
+        if not mensaje:
+            return jsonify({"error": "Mensaje vacío"}), 400
+
+        user_id = obtener_usuario_id(request)
+
+        prompt_completo, es_pregunta_sbom, contexto_proyecto, contexto_cache = await preparar_mensaje_chat(
+            user_id, mensaje, proyecto_id, proyecto_nombre, dict(request.cookies), usar_cache_respuestas(request, data)
+        )
+
+        # ✅ PREGUNTA YA RESPONDIDA SOBRE ESTE MISMO ANÁLISIS: SIN LLAMADA A GEMINI
+        en_cache = cache_respuestas.obtener(mensaje, *contexto_cache) if contexto_cache else None
+        respuesta_en_cache = None
+
         # ✅ GENERAR RESPUESTA CON IA USANDO CONTEXTO OPTIMIZADO
-        if model:
+        if en_cache:
+            response_text, respuesta_en_cache = en_cache
+            print(f"⚡ Respuesta servida desde la cache ({respuesta_en_cache})")
+        elif cliente_llm:
             try:
-                # ✅ GENERAR CONTEXTO OPTIMIZADO SEGÚN TIPO DE PREGUNTA
-                contexto_previo = formatear_historial_para_ai(historial_usuario, es_pregunta_sbom, mensaje)
-                prompt_completo = contexto_previo + contexto_proyecto + f"\n\n**Usuario:** {mensaje}"
-                
-                # ✅ INSTRUCCIONES ESPECÍFICAS SOLO SI ES NECESARIO
-                if es_pregunta_sbom:
-                    prompt_completo += "\n\n**INSTRUCCIÓN ESPECIAL:** El usuario está preguntando sobre el SBOM analizado. Usa la información específica proporcionada. Si necesitas detalles de vulnerabilidades específicas que no están en el resumen, menciona que puedes proporcionarlos."
-                
-                print(f"🧠 Enviando mensaje con contexto optimizado a Gemini...")
-                print(f"📝 Contexto total: {len(prompt_completo)} caracteres")
-                print(f"🔍 Pregunta sobre SBOM: {es_pregunta_sbom}")
-                print(f"🎯 Proyecto activo: {proyecto_nombre if proyecto_nombre else 'Ninguno'}")
-                
-                response = model.generate_content(prompt_completo)
-                response_text = response.text
-                
+                print(f"🧠 Enviando mensaje con contexto optimizado a {cliente_llm.nombre}...")
+                response_text = await cliente_llm.generar(prompt_completo)
+                if contexto_cache:
+                    cache_respuestas.guardar(mensaje, *contexto_cache, response_text)
+
             except Exception as e:
-                print(f"❌ Error con Gemini: {e}")
+                print(f"❌ Error con {cliente_llm.nombre}: {e}")
                 response_text = "Lo siento, hubo un error procesando tu mensaje. ¿Podrías reformular tu pregunta?"
         else:
             response_text = "Servidor de AI temporalmente no disponible. Por favor, intenta más tarde."
-        
-        # ✅ GUARDAR EN HISTORIAL CON INFORMACIÓN DEL PROYECTO
-        if proyecto_id:
-            historial_usuario.append(f"Usuario [Proyecto: {proyecto_nombre}]: {mensaje}")
-            historial_usuario.append(f"Bot [Con criterios de {proyecto_nombre}]: {response_text}")
-        else:
-            historial_usuario.append(f"Usuario: {mensaje}")
-            historial_usuario.append(f"Bot: {response_text}")
-        
-        # ✅ MANTENER SOLO LOS ÚLTIMOS 40 INTERCAMBIOS + CONTEXTOS SBOM
-        if len(historial_usuario) > 60:  # Aumentado para dar espacio a contextos SBOM
-            # Preservar contextos SBOM y mantener últimos intercambios
-            contextos_sbom = [entry for entry in historial_usuario if entry.startswith("CONTEXTO_SBOM:")]
-            intercambios_normales = [entry for entry in historial_usuario if not entry.startswith("CONTEXTO_SBOM:")]
-            
-            # Mantener último contexto SBOM + últimos 40 intercambios normales
-            historial_filtrado = []
-            if contextos_sbom:
-                historial_filtrado.append(contextos_sbom[-1])  # Último SBOM
-            historial_filtrado.extend(intercambios_normales[-40:])  # Últimos 40 intercambios
-            
-            historial_conversaciones[user_id] = historial_filtrado
-        
+
+        conversacion = registrar_intercambio_chat(user_id, mensaje, response_text, proyecto_id, proyecto_nombre)
+
         # ✅ RESPUESTA CON INFORMACIÓN ADICIONAL
-        response_data = {
-            "message": response_text,
-            "contexto_proyecto_aplicado": bool(proyecto_id and "error" not in contexto_proyecto.lower()),
-            "contexto_sbom_disponible": any(entry.startswith("CONTEXTO_SBOM:") for entry in historial_usuario),
-            "es_pregunta_sbom": es_pregunta_sbom,
-            "contexto_optimizado": not es_pregunta_sbom,  # Nuevo campo para debug
-            "caracteres_contexto": len(prompt_completo) if 'prompt_completo' in locals() else 0,  # Nuevo campo para debug
-            "proyecto_info": {
-                "id": proyecto_id,
-                "nombre": proyecto_nombre
-            } if proyecto_id else None
-        }
-        
+        response_data = datos_respuesta_chat(response_text, conversacion, es_pregunta_sbom, contexto_proyecto,
+                                             prompt_completo, proyecto_id, proyecto_nombre, respuesta_en_cache)
+
         return jsonify(response_data), 200
-        
+
     except Exception as e:
         print(f"❌ Error general en chat_mensajes: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": "Error interno del servidor"}), 500
 
+def evento_sse(evento, datos):
+    """Formatea un evento Server-Sent Events con datos JSON"""
+    return f"event: {evento}\ndata: {json.dumps(datos, default=a_json)}\n\n"
+
+@app.route('/chat/mensajes/stream', methods=['POST'])
+def chat_mensajes_stream():
+    """
+    Variante de /chat/mensajes que reenvía la respuesta del modelo según se genera (SSE).
+    Emite eventos 'fragmento' con {"texto": ...} y un evento 'fin' con el mismo cuerpo que
+    /chat/mensajes; el intercambio se guarda en el historial cuando termina la generación
+    """
+    try:
+        data = request.json or {}
+        mensaje = data.get('message', '')
+        proyecto_id = data.get('proyecto_id', '')
+        proyecto_nombre = data.get('proyecto_nombre', '')
+
+        if not mensaje:
+            return jsonify({"error": "Mensaje vacío"}), 400
+
+        user_id = obtener_usuario_id(request)
+
+        prompt_completo, es_pregunta_sbom, contexto_proyecto, contexto_cache = bucle_async.ejecutar(preparar_mensaje_chat(
+            user_id, mensaje, proyecto_id, proyecto_nombre, dict(request.cookies), usar_cache_respuestas(request, data)
+        ))
+        en_cache = cache_respuestas.obtener(mensaje, *contexto_cache) if contexto_cache else None
+
+    except Exception as e:
+        print(f"❌ Error general en chat_mensajes_stream: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+    def generar():
+        fragmentos = []
+        respuesta_en_cache = None
+        if en_cache:
+            # ✅ RESPUESTA YA CACHEADA: SE ENVÍA ENTERA EN UN SOLO FRAGMENTO
+            texto, respuesta_en_cache = en_cache
+            print(f"⚡ Respuesta servida desde la cache ({respuesta_en_cache})")
+            fragmentos.append(texto)
+            yield evento_sse('fragmento', {"texto": texto})
+        elif cliente_llm:
+            try:
+                print(f"🧠 Enviando mensaje en streaming a {cliente_llm.nombre}...")
+                for texto in cliente_llm.generar_flujo(prompt_completo):
+                    fragmentos.append(texto)
+                    yield evento_sse('fragmento', {"texto": texto})
+                # Solo se cachea una generación completa
+                if contexto_cache and fragmentos:
+                    cache_respuestas.guardar(mensaje, *contexto_cache, ''.join(fragmentos))
+
+            except Exception as e:
+                print(f"❌ Error con {cliente_llm.nombre}: {e}")
+                if not fragmentos:
+                    fragmentos.append("Lo siento, hubo un error procesando tu mensaje. ¿Podrías reformular tu pregunta?")
+                    yield evento_sse('fragmento', {"texto": fragmentos[-1]})
+        else:
+            fragmentos.append("Servidor de AI temporalmente no disponible. Por favor, intenta más tarde.")
+            yield evento_sse('fragmento', {"texto": fragmentos[-1]})
+
+        response_text = ''.join(fragmentos)
+        conversacion = registrar_intercambio_chat(user_id, mensaje, response_text, proyecto_id, proyecto_nombre)
+        yield evento_sse('fin', datos_respuesta_chat(response_text, conversacion, es_pregunta_sbom,
+                                                     contexto_proyecto, prompt_completo, proyecto_id, proyecto_nombre,
+                                                     respuesta_en_cache))
+
+    return Response(stream_with_context(generar()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/health', methods=['GET'])
 def health_check():
     try:
         total_usuarios = len(historial_conversaciones)
-        total_mensajes = sum(len(hist) for hist in historial_conversaciones.values())
+        total_mensajes = historial_conversaciones.total_mensajes()
         
         return jsonify({
             "status": "ok",
             "service": "chat",
             "port": 5002,
-            "ai_available": model is not None,
+            "ai_available": cliente_llm is not None,
+            "llm": cliente_llm.estadisticas() if cliente_llm else None,
             "cors_configured": True,
             "memoria_activa": True,
             "usuarios_activos": total_usuarios,
             "total_mensajes": total_mensajes,
+            "trabajos_en_memoria": len(gestor_trabajos),
+            "cache_respuestas": cache_respuestas.estadisticas(),
             "sbom_processing": True,
             "formatos_soportados": list(ALLOWED_EXTENSIONS)
         })
@@ -2242,7 +3085,8 @@ def health_check():
 def index():
     return jsonify({
         "message": "Servidor de Chat SVAIA - Con Memoria y Procesamiento SBOM",
-        "endpoints": ["/chat/mensajes", "/chat/upload-sbom", "/health"],
+        "endpoints": ["/chat/mensajes", "/chat/mensajes/stream", "/chat/upload-sbom", "/chat/trabajos/sbom", "/chat/trabajos/<id>",
+                      "/chat/trabajos/<id>/eventos", "/health"],
         "status": "running",
         "version": "5.0",
         "features": ["memoria_conversacion", "contexto_ai", "historial_persistente", "procesamiento_sbom"],
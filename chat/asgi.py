@@ -0,0 +1,172 @@
+"""
+Punto de entrada ASGI del servicio de chat.
+
+Uso:
+    uvicorn asgi:asgi_app --host 0.0.0.0 --port 5000
+
+Flask 2.3 es WSGI: cada petición ocupa un hilo durante toda su duración (incluidas las vistas
+async, que esperan en ese hilo el resultado del bucle compartido de app.bucle_async, y las
+respuestas SSE, que lo ocupan mientras dura el streaming). Los hilos salen de un pool acotado
+de CHAT_ASGI_HILOS; las peticiones que llegan con el pool lleno esperan turno en el event loop
+de uvicorn sin crear hilos nuevos. Las consultas a NVD, a la API de proyectos y al LLM sí se
+multiplexan en el bucle compartido. Si el cliente se desconecta, el streaming se corta en el
+siguiente fragmento y el hilo vuelve al pool. Solo HTTP (no websockets)
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Hilos para atender peticiones: debe cubrir las peticiones simultáneas esperadas, contando
+# los streams SSE abiertos
+ASGI_HILOS = int(os.getenv("CHAT_ASGI_HILOS", "32"))
+
+# Cuerpos de petición de hasta este tamaño se quedan en memoria; los mayores pasan a disco
+ASGI_CUERPO_EN_MEMORIA = int(os.getenv("CHAT_ASGI_CUERPO_EN_MEMORIA_BYTES", str(1024 * 1024)))
+
+
+def construir_environ(scope, cuerpo):
+    """Environ WSGI (PEP 3333) de un scope HTTP de ASGI con el cuerpo ya leído en `cuerpo`"""
+    root_path = scope.get('root_path', '')
+    ruta = scope['path']
+    if root_path and ruta.startswith(root_path):
+        ruta = ruta[len(root_path):]
+    servidor = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': ruta.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': servidor[0],
+        'SERVER_PORT': str(servidor[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': cuerpo,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for nombre, valor in scope.get('headers', []):
+        nombre = nombre.decode('latin-1').upper().replace('-', '_')
+        valor = valor.decode('latin-1')
+        if nombre not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            nombre = f"HTTP_{nombre}"
+        # Cabeceras repetidas: se unen con comas (las cookies con '; ')
+        if nombre in environ:
+            valor = environ[nombre] + ('; ' if nombre == 'HTTP_COOKIE' else ',') + valor
+        environ[nombre] = valor
+    return environ
+
+
+class AplicacionASGI:
+    """
+    Adaptador WSGI → ASGI con un pool de hilos acotado: lee el cuerpo de la petición en el event
+    loop, ejecuta la aplicación WSGI en un hilo del pool y envía cada fragmento de la respuesta
+    en cuanto se genera (el streaming SSE no se acumula)
+    """
+
+    def __init__(self, aplicacion_wsgi, max_hilos=ASGI_HILOS, cuerpo_en_memoria=ASGI_CUERPO_EN_MEMORIA):
+        self.aplicacion_wsgi = aplicacion_wsgi
+        self.max_hilos = max_hilos
+        self.cuerpo_en_memoria = cuerpo_en_memoria
+        self._executor = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._ciclo_de_vida(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Tipo de conexión ASGI no soportado: {scope['type']}")
+
+        cuerpo = await self._leer_cuerpo(receive)
+        if cuerpo is None:
+            return  # el cliente se desconectó antes de terminar de enviar la petición
+        bucle = asyncio.get_running_loop()
+        desconectado = threading.Event()
+        vigilante = asyncio.ensure_future(self._vigilar_desconexion(receive, desconectado))
+        try:
+            await bucle.run_in_executor(self._executor, self._atender, scope, cuerpo, send, bucle, desconectado)
+        finally:
+            vigilante.cancel()
+            cuerpo.close()
+
+    async def _leer_cuerpo(self, receive):
+        cuerpo = tempfile.SpooledTemporaryFile(max_size=self.cuerpo_en_memoria)
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'http.disconnect':
+                cuerpo.close()
+                return None
+            cuerpo.write(mensaje.get('body', b''))
+            if not mensaje.get('more_body', False):
+                cuerpo.seek(0)
+                return cuerpo
+
+    @staticmethod
+    async def _vigilar_desconexion(receive, desconectado):
+        """Tras el cuerpo, el siguiente mensaje de una petición HTTP solo puede ser la desconexión"""
+        mensaje = await receive()
+        if mensaje['type'] == 'http.disconnect':
+            desconectado.set()
+
+    def _atender(self, scope, cuerpo, send, bucle, desconectado):
+        """Ejecuta la aplicación WSGI (en un hilo del pool) y envía la respuesta al event loop"""
+        def enviar(mensaje):
+            asyncio.run_coroutine_threadsafe(send(mensaje), bucle).result()
+
+        respuesta = {'status': None, 'headers': None, 'iniciada': False}
+
+        def iniciar():
+            if not respuesta['iniciada']:
+                respuesta['iniciada'] = True
+                enviar({'type': 'http.response.start', 'status': respuesta['status'], 'headers': respuesta['headers']})
+
+        def escribir(datos):
+            iniciar()
+            enviar({'type': 'http.response.body', 'body': bytes(datos), 'more_body': True})
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and respuesta['iniciada']:
+                raise exc_info[1].with_traceback(exc_info[2])
+            respuesta['status'] = int(status.split(' ', 1)[0])
+            respuesta['headers'] = [(nombre.lower().encode('latin-1'), valor.encode('latin-1'))
+                                    for nombre, valor in headers]
+            return escribir
+
+        iterable = self.aplicacion_wsgi(construir_environ(scope, cuerpo), start_response)
+        try:
+            for fragmento in iterable:
+                if desconectado.is_set():
+                    return
+                if fragmento:
+                    escribir(fragmento)
+            if not desconectado.is_set():
+                iniciar()
+                enviar({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    async def _ciclo_de_vida(self, receive, send):
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensaje['type'] == 'lifespan.shutdown':
+                self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def _crear_aplicacion():
+    from app import app
+    return AplicacionASGI(app)
+
+
+asgi_app = _crear_aplicacion()
@@ -0,0 +1,59 @@
+import asyncio
+import atexit
+import threading
+
+
+class BucleAsync:
+    """
+    Event loop de larga duración en un hilo propio, compartido por todo el proceso.
+    Sustituye a los asyncio.run por petición: las sesiones aiohttp, sus conexiones keep-alive
+    y las tareas en curso sobreviven entre peticiones y se multiplexan en un único bucle.
+    run_coroutine_threadsafe copia el contexto (contextvars) del hilo que llama, por lo que
+    las corrutinas ven el contexto de petición de Flask de quien las lanzó
+    """
+
+    def __init__(self, nombre='bucle-async'):
+        self._loop = asyncio.new_event_loop()
+        self._hilo = threading.Thread(target=self._ejecutar_bucle, name=nombre, daemon=True)
+        self._al_cerrar = []
+        self._hilo.start()
+        atexit.register(self.cerrar)
+
+    def _ejecutar_bucle(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def enviar(self, corrutina):
+        """Programa la corrutina en el bucle y devuelve un concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(corrutina, self._loop)
+
+    def ejecutar(self, corrutina, timeout=None):
+        """Ejecuta la corrutina en el bucle compartido y espera su resultado (desde otro hilo)"""
+        try:
+            en_el_bucle = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            en_el_bucle = False
+        if en_el_bucle:
+            # Esperar aquí bloquearía el propio bucle: desde dentro hay que usar await
+            corrutina.close()
+            raise RuntimeError("BucleAsync.ejecutar no puede llamarse desde el propio bucle")
+        return self.enviar(corrutina).result(timeout)
+
+    def al_cerrar(self, fabrica_corrutina):
+        """Registra una corrutina de limpieza (p. ej. cerrar sesiones) que se ejecuta al cerrar"""
+        self._al_cerrar.append(fabrica_corrutina)
+
+    def cerrar(self):
+        if not self._loop.is_running():
+            return
+        for fabrica in self._al_cerrar:
+            try:
+                self.enviar(fabrica()).result(5)
+            except Exception as e:
+                print(f"⚠️ Error en limpieza del bucle async: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._hilo.join(5)
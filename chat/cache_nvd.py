@@ -0,0 +1,207 @@
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheMemoria:
+    """
+    Cache en memoria con caducidad y límite duro de tamaño.
+    Las caducidades se indexan en un min-heap y se expulsan de forma perezosa, de modo
+    que un acierto es O(1) y las escrituras O(log n) amortizado, sin recorrer toda la cache.
+    El tamaño se limita por número de entradas y por bytes aproximados (LRU)
+    """
+
+    def __init__(self, max_entradas=2000, max_bytes=32 * 1024 * 1024):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()  # clave -> (expira, peso, valor)
+        self._caducidades = []  # heap de (expira, clave)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if entrada[0] <= time.time():
+                self._eliminar(clave)
+                return None
+            self._entradas.move_to_end(clave)
+            return entrada[2]
+
+    def guardar(self, clave, valor, expira, peso):
+        if peso > self.max_bytes:
+            return
+        with self._lock:
+            if clave in self._entradas:
+                self._eliminar(clave)
+            self._entradas[clave] = (expira, peso, valor)
+            self._bytes += peso
+            heapq.heappush(self._caducidades, (expira, clave))
+            self._expulsar_caducadas()
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                self._eliminar(next(iter(self._entradas)))
+            # Compactar el heap si acumula demasiadas referencias obsoletas
+            if len(self._caducidades) > 2 * len(self._entradas) + 64:
+                self._caducidades = [(e[0], c) for c, e in self._entradas.items()]
+                heapq.heapify(self._caducidades)
+
+    def _expulsar_caducadas(self):
+        ahora = time.time()
+        while self._caducidades and self._caducidades[0][0] <= ahora:
+            expira, clave = heapq.heappop(self._caducidades)
+            entrada = self._entradas.get(clave)
+            # Solo si la referencia del heap corresponde a la entrada vigente
+            if entrada is not None and entrada[0] == expira:
+                self._eliminar(clave)
+
+    def _eliminar(self, clave):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is not None:
+            self._bytes -= entrada[1]
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+class CacheNVD:
+    """
+    Cache persistente de consultas NVD sobre SQLite.
+    Las entradas caducan tras `ttl` segundos y, si se supera `max_entradas`, se expulsan
+    las menos usadas recientemente (LRU). El modo WAL y busy_timeout permiten que varios
+    workers de gunicorn compartan el mismo fichero de forma segura.
+    Delante de SQLite hay una CacheMemoria por proceso para que los aciertos frecuentes
+    no paguen la consulta ni la deserialización JSON
+    """
+
+    # Cada cuántas escrituras se purgan caducadas y se aplica el límite de tamaño
+    PURGA_CADA = 50
+    # Los aciertos en memoria actualizan ultimo_acceso en SQLite por lotes: al acumular
+    # ACCESOS_POR_LOTE claves o, como muy tarde, ACCESOS_CADA_SEGUNDOS después del primero
+    ACCESOS_POR_LOTE = 100
+    ACCESOS_CADA_SEGUNDOS = 30
+
+    def __init__(self, ruta, ttl=24 * 3600, max_entradas=20000, max_entradas_memoria=2000,
+                 max_bytes_memoria=32 * 1024 * 1024):
+        self.ruta = ruta
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._memoria = CacheMemoria(max_entradas_memoria, max_bytes_memoria)
+        self._local = threading.local()
+        self._escrituras = 0
+        self._lock = threading.Lock()
+        self._accesos = {}  # clave -> último acierto en memoria aún no volcado a SQLite
+        self._accesos_desde = 0.0
+
+        directorio = os.path.dirname(os.path.abspath(ruta))
+        os.makedirs(directorio, exist_ok=True)
+
+        conexion = self._conexion()
+        conexion.execute("""
+            CREATE TABLE IF NOT EXISTS cache_nvd (
+                clave TEXT PRIMARY KEY,
+                valor TEXT NOT NULL,
+                expira REAL NOT NULL,
+                ultimo_acceso REAL NOT NULL
+            )
+        """)
+        conexion.execute("CREATE INDEX IF NOT EXISTS idx_cache_nvd_acceso ON cache_nvd(ultimo_acceso)")
+        conexion.execute("CREATE INDEX IF NOT EXISTS idx_cache_nvd_expira ON cache_nvd(expira)")
+
+    def _conexion(self):
+        """Una conexión por hilo (sqlite3 no permite compartirlas entre hilos)"""
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            conexion.execute("PRAGMA busy_timeout=30000")
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexion = conexion
+        return conexion
+
+    def obtener(self, clave):
+        """Devuelve el valor guardado o None si no existe o ha caducado"""
+        valor = self._memoria.obtener(clave)
+        if valor is not None:
+            self._anotar_acceso(clave)
+            return valor
+
+        ahora = time.time()
+        conexion = self._conexion()
+        fila = conexion.execute(
+            "SELECT valor, expira FROM cache_nvd WHERE clave = ? AND expira > ?", (clave, ahora)
+        ).fetchone()
+        if fila is None:
+            return None
+        conexion.execute("UPDATE cache_nvd SET ultimo_acceso = ? WHERE clave = ?", (ahora, clave))
+        valor = json.loads(fila[0])
+        self._memoria.guardar(clave, valor, fila[1], len(fila[0]))
+        return valor
+
+    def _anotar_acceso(self, clave):
+        """
+        Apunta un acierto en memoria. Sin esto las claves más leídas, que nunca llegan a
+        SQLite, serían las que el LRU de SQLite ve como más frías y expulsa primero
+        """
+        ahora = time.time()
+        with self._lock:
+            if not self._accesos:
+                self._accesos_desde = ahora
+            self._accesos[clave] = ahora
+            volcar = (len(self._accesos) >= self.ACCESOS_POR_LOTE
+                      or ahora - self._accesos_desde >= self.ACCESOS_CADA_SEGUNDOS)
+        if volcar:
+            self.volcar_accesos()
+
+    def volcar_accesos(self):
+        """Escribe en SQLite los ultimo_acceso pendientes de los aciertos en memoria"""
+        with self._lock:
+            accesos, self._accesos = self._accesos, {}
+        if not accesos:
+            return
+        conexion = self._conexion()
+        conexion.execute("BEGIN")
+        try:
+            conexion.executemany(
+                "UPDATE cache_nvd SET ultimo_acceso = max(ultimo_acceso, ?) WHERE clave = ?",
+                [(instante, clave) for clave, instante in accesos.items()]
+            )
+            conexion.execute("COMMIT")
+        except Exception:
+            conexion.execute("ROLLBACK")
+            raise
+
+    def guardar(self, clave, valor):
+        """Guarda un valor serializable a JSON con el TTL configurado"""
+        ahora = time.time()
+        serializado = json.dumps(valor)
+        self._conexion().execute(
+            "INSERT OR REPLACE INTO cache_nvd (clave, valor, expira, ultimo_acceso) VALUES (?, ?, ?, ?)",
+            (clave, serializado, ahora + self.ttl, ahora)
+        )
+        self._memoria.guardar(clave, valor, ahora + self.ttl, len(serializado))
+        with self._lock:
+            self._escrituras += 1
+            purgar = self._escrituras % self.PURGA_CADA == 0
+        if purgar:
+            self.purgar()
+
+    def purgar(self):
+        """Elimina las entradas caducadas y aplica el límite de tamaño (LRU)"""
+        self.volcar_accesos()
+        conexion = self._conexion()
+        conexion.execute("DELETE FROM cache_nvd WHERE expira <= ?", (time.time(),))
+        conexion.execute("""
+            DELETE FROM cache_nvd WHERE clave IN (
+                SELECT clave FROM cache_nvd ORDER BY ultimo_acceso
+                LIMIT max(0, (SELECT COUNT(*) FROM cache_nvd) - ?)
+            )
+        """, (self.max_entradas,))
+
+    def __len__(self):
+        return self._conexion().execute("SELECT COUNT(*) FROM cache_nvd").fetchone()[0]
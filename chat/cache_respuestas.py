@@ -0,0 +1,160 @@
+import hashlib
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from cache_nvd import CacheMemoria
+
+_NO_ALFANUMERICO = re.compile(r'[^a-z0-9\-\.]+')
+
+# Palabras que no cambian el sentido de la pregunta (artículos, preposiciones, interrogativos...).
+# Las negaciones ('no', 'ni', 'sin', 'nunca', 'not') no están: cambian la respuesta
+_VACIAS = {
+    'el', 'la', 'los', 'las', 'lo', 'un', 'una', 'unos', 'unas', 'de', 'del', 'al', 'a', 'en', 'por', 'para',
+    'con', 'y', 'e', 'o', 'u', 'que', 'cual', 'cuales', 'cuantas', 'cuantos', 'como', 'es', 'son', 'hay',
+    'me', 'mi', 'mis', 'se', 'su', 'sus', 'este', 'esta', 'estos', 'estas', 'ese', 'esa', 'esos', 'esas',
+    'puedes', 'podrias', 'dime', 'dame', 'muestrame', 'favor', 'hola',
+    'the', 'an', 'of', 'in', 'on', 'for', 'to', 'and', 'or', 'what', 'which', 'are', 'is', 'please'
+}
+
+
+def normalizar_pregunta(texto):
+    """Minúsculas, sin tildes, sin signos de puntuación y con los espacios colapsados"""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(_NO_ALFANUMERICO.sub(' ', texto).split()).strip('.-')
+
+
+def palabras_contenido(normalizada):
+    """
+    Palabras con significado de una pregunta normalizada: todo salvo las palabras vacías, así que
+    conserva negaciones, severidades, adjetivos, nombres de componentes e identificadores
+    """
+    return frozenset(palabra.strip('.-') for palabra in normalizada.split()) - _VACIAS - {''}
+
+
+def vector_ngramas(normalizada, dimension=1024):
+    """
+    'Embedding' local sin dependencias: trigramas de caracteres y palabras completas proyectados
+    con hashing a `dimension` posiciones y normalizados (similitud = producto escalar)
+    """
+    vector = {}
+    rasgos = [normalizada[i:i + 3] for i in range(max(1, len(normalizada) - 2))]
+    # Las palabras pesan más que los trigramas: 'criticas' frente a 'bajas' debe separar las preguntas
+    rasgos.extend(f"#{palabra}" for palabra in normalizada.split() for _ in range(3))
+    for rasgo in rasgos:
+        indice = int.from_bytes(hashlib.blake2b(rasgo.encode('utf-8'), digest_size=4).digest(), 'little') % dimension
+        vector[indice] = vector.get(indice, 0.0) + 1.0
+    norma = math.sqrt(sum(peso * peso for peso in vector.values())) or 1.0
+    return {indice: peso / norma for indice, peso in vector.items()}
+
+
+def similitud(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(peso * b.get(indice, 0.0) for indice, peso in a.items())
+
+
+class CacheRespuestas:
+    """
+    Cache de respuestas del modelo a preguntas sobre un mismo análisis SBOM.
+    Nivel exacto: clave = hash de (pregunta normalizada, huella del análisis, huella de los
+    criterios), sobre una CacheMemoria con TTL y LRU. Nivel por similitud (desactivado salvo con
+    umbral > 0): para cada (análisis, criterios) se guardan los vectores de n-gramas de las
+    preguntas respondidas y una pregunta nueva reutiliza la respuesta de la más parecida si supera
+    el umbral y tiene exactamente las mismas palabras de contenido (negaciones, severidades,
+    componentes, CVE, versiones). Los n-gramas solo no bastan: 'criticas' y 'no son criticas',
+    'alta' y 'baja' u 'openssl' y 'openssh' se parecen más del 0.9
+    """
+
+    def __init__(self, ttl=3600, max_entradas=1000, max_bytes=16 * 1024 * 1024, umbral_similitud=0,
+                 max_preguntas_por_analisis=200, max_analisis=256):
+        self.ttl = ttl
+        self.umbral_similitud = umbral_similitud
+        self.max_preguntas_por_analisis = max_preguntas_por_analisis
+        self.max_analisis = max_analisis
+        self._respuestas = CacheMemoria(max_entradas=max_entradas, max_bytes=max_bytes)
+        self._preguntas = OrderedDict()  # (huella_sbom, huella_criterios) -> OrderedDict(clave -> (vector, palabras))
+        self._lock = threading.Lock()
+        self.aciertos_exactos = 0
+        self.aciertos_similares = 0
+        self.fallos = 0
+
+    @staticmethod
+    def clave(normalizada, huella_sbom, huella_criterios):
+        return hashlib.sha256(f"{normalizada}\x00{huella_sbom}\x00{huella_criterios}".encode('utf-8')).hexdigest()
+
+    def obtener(self, pregunta, huella_sbom, huella_criterios):
+        """Devuelve (respuesta, 'exacta' | 'similar') o None"""
+        normalizada = normalizar_pregunta(pregunta)
+        respuesta = self._respuestas.obtener(self.clave(normalizada, huella_sbom, huella_criterios))
+        if respuesta is not None:
+            with self._lock:
+                self.aciertos_exactos += 1
+            return respuesta, 'exacta'
+
+        if self.umbral_similitud:
+            respuesta = self._obtener_similar(normalizada, (huella_sbom, huella_criterios))
+            if respuesta is not None:
+                with self._lock:
+                    self.aciertos_similares += 1
+                return respuesta, 'similar'
+
+        with self._lock:
+            self.fallos += 1
+        return None
+
+    def _obtener_similar(self, normalizada, analisis):
+        vector = vector_ngramas(normalizada)
+        palabras = palabras_contenido(normalizada)
+        with self._lock:
+            preguntas = self._preguntas.get(analisis)
+            if not preguntas:
+                return None
+            candidatas = list(preguntas.items())
+        mejor, mejor_similitud = None, self.umbral_similitud
+        for clave, (vector_guardado, palabras_guardadas) in candidatas:
+            if palabras_guardadas != palabras:
+                continue
+            valor = similitud(vector, vector_guardado)
+            if valor >= mejor_similitud:
+                mejor, mejor_similitud = clave, valor
+        if mejor is None:
+            return None
+        respuesta = self._respuestas.obtener(mejor)
+        if respuesta is None:
+            # Caducada o expulsada del nivel exacto: su vector ya no sirve
+            with self._lock:
+                preguntas.pop(mejor, None)
+        return respuesta
+
+    def guardar(self, pregunta, huella_sbom, huella_criterios, respuesta):
+        normalizada = normalizar_pregunta(pregunta)
+        clave = self.clave(normalizada, huella_sbom, huella_criterios)
+        self._respuestas.guardar(clave, respuesta, time.time() + self.ttl, len(respuesta.encode('utf-8')))
+        if not self.umbral_similitud:
+            return
+        entrada = (vector_ngramas(normalizada), palabras_contenido(normalizada))
+        analisis = (huella_sbom, huella_criterios)
+        with self._lock:
+            preguntas = self._preguntas.get(analisis)
+            if preguntas is None:
+                preguntas = self._preguntas[analisis] = OrderedDict()
+            self._preguntas.move_to_end(analisis)
+            preguntas[clave] = entrada
+            preguntas.move_to_end(clave)
+            while len(preguntas) > self.max_preguntas_por_analisis:
+                preguntas.popitem(last=False)
+            while len(self._preguntas) > self.max_analisis:
+                self._preguntas.popitem(last=False)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'entradas': len(self._respuestas),
+                'aciertos_exactos': self.aciertos_exactos,
+                'aciertos_similares': self.aciertos_similares,
+                'fallos': self.fallos
+            }
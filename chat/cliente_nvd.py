@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import aiohttp
+
+NVD_API_BASE_URL = "https://services.nvd.nist.gov/rest/json/cves/2.0"
+
+# 🚦 CUOTAS PUBLICADAS POR NVD (peticiones por ventana móvil de 30 segundos)
+NVD_PETICIONES_SIN_CLAVE = 5
+NVD_PETICIONES_CON_CLAVE = 50
+NVD_VENTANA_SEGUNDOS = 30
+
+# Pausa por defecto tras un 429 sin cabecera Retry-After (recomendación de NVD: 6s entre peticiones)
+NVD_PAUSA_POR_DEFECTO = 6
+
+
+class ErrorNVD(Exception):
+    """NVD no ha devuelto una respuesta válida (error HTTP, timeout o 429 tras agotar los reintentos)"""
+
+
+class LimitadorTasa:
+    """
+    Token bucket compartido por todas las consultas del proceso.
+    La capacidad y la tasa de recarga se eligen para que capacidad + tasa * ventana
+    no supere nunca la cuota, así ni siquiera una ráfaga inicial excede el límite de NVD.
+    Es seguro entre hilos y no depende de ningún event loop concreto
+    """
+
+    def __init__(self, peticiones, ventana):
+        self.capacidad = max(1, peticiones // 5)
+        self.tasa = max(peticiones - self.capacidad, 1) / ventana
+        self._tokens = float(self.capacidad)
+        self._ultima_recarga = time.monotonic()
+        self._bloqueado_hasta = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def para_nvd(cls, api_key=None):
+        """Crea un limitador con la cuota correspondiente a tener o no API key"""
+        peticiones = NVD_PETICIONES_CON_CLAVE if api_key else NVD_PETICIONES_SIN_CLAVE
+        return cls(peticiones, NVD_VENTANA_SEGUNDOS)
+
+    def _reservar(self):
+        """Reserva un token y devuelve los segundos que hay que esperar para usarlo"""
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultima_recarga) * self.tasa)
+            self._ultima_recarga = ahora
+            # Los tokens pueden quedar en negativo: es la cola de peticiones ya reservadas
+            self._tokens -= 1
+            espera = -self._tokens / self.tasa if self._tokens < 0 else 0.0
+            return max(espera, self._bloqueado_hasta - ahora)
+
+    async def adquirir(self):
+        """Espera hasta que haya un token disponible"""
+        espera = self._reservar()
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+    def pausar(self, segundos):
+        """Bloquea todas las peticiones durante `segundos` (p. ej. tras un Retry-After)"""
+        with self._lock:
+            self._bloqueado_hasta = max(self._bloqueado_hasta, time.monotonic() + segundos)
+            self._tokens = min(self._tokens, 0.0)
+
+
+def segundos_retry_after(headers, por_defecto=NVD_PAUSA_POR_DEFECTO):
+    """Interpreta la cabecera Retry-After (segundos o fecha HTTP)"""
+    valor = headers.get('Retry-After') if headers else None
+    if not valor:
+        return por_defecto
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return por_defecto
+
+
+class ClienteNVD:
+    """
+    Cliente compartido para la API de NVD.
+    Mantiene una única sesión aiohttp con conexiones keep-alive, límite de conexiones
+    y cache DNS, de forma que las consultas reutilizan conexiones TCP/TLS ya abiertas.
+    Todas las peticiones pasan por un LimitadorTasa ajustado a la cuota de NVD
+    """
+
+    def __init__(self, base_url, api_key=None, limite_conexiones=10, ttl_dns=300,
+                 keepalive=60, timeout=10, limitador=None):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.limitador = limitador or LimitadorTasa.para_nvd(api_key)
+        self.limite_conexiones = limite_conexiones
+        self.ttl_dns = ttl_dns
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._sesion = None
+        self._loop = None
+
+    def _crear_sesion(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.limite_conexiones,
+            limit_per_host=self.limite_conexiones,
+            ttl_dns_cache=self.ttl_dns,
+            use_dns_cache=True,
+            keepalive_timeout=self.keepalive
+        )
+        headers = {}
+        if self.api_key:
+            headers['apiKey'] = self.api_key
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+
+    def sesion(self):
+        """Devuelve la sesión activa, creándola si no existe o si cambió el event loop"""
+        loop = asyncio.get_running_loop()
+        if self._sesion is None or self._sesion.closed or self._loop is not loop:
+            self._sesion = self._crear_sesion()
+            self._loop = loop
+        return self._sesion
+
+    async def consultar(self, params):
+        """
+        Realiza una petición GET a la API de CVEs respetando el limitador de tasa.
+        Si NVD responde 429 se pausa el limitador según Retry-After para todo el proceso.
+        Devuelve (status, datos_json o None, headers)
+        """
+        await self.limitador.adquirir()
+        async with self.sesion().get(self.base_url, params=params) as response:
+            datos = None
+            if response.status == 200:
+                datos = await response.json()
+            elif response.status in (429, 503):
+                self.limitador.pausar(segundos_retry_after(response.headers))
+            return response.status, datos, response.headers
+
+    async def cerrar(self):
+        """Cierra la sesión y sus conexiones"""
+        if self._sesion is not None and not self._sesion.closed:
+            await self._sesion.close()
+        self._sesion = None
+        self._loop = None
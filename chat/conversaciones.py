@@ -0,0 +1,403 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from registros import a_json
+
+MAX_MENSAJES = 40
+
+
+class ContextoSBOM:
+    """
+    Último análisis SBOM de un usuario, guardado como objeto (no como JSON) para que cada
+    mensaje de chat lo use directamente sin volver a parsearlo. Las secciones de prompt que
+    se generan a partir de él se guardan junto al objeto (no se persisten)
+    """
+
+    __slots__ = ('filename', 'proyecto_id', 'proyecto_nombre', 'sbom_data', 'criterios_solucionabilidad',
+                 'timestamp', 'resumen_vulnerabilidades', '_secciones_prompt', '_huella')
+
+    tipo = 'sbom_analysis'
+
+    def __init__(self, filename, sbom_data, proyecto_id=None, proyecto_nombre=None, criterios_solucionabilidad=None,
+                 timestamp=None, resumen_vulnerabilidades=None):
+        self.filename = filename
+        self.proyecto_id = proyecto_id
+        self.proyecto_nombre = proyecto_nombre
+        self.sbom_data = sbom_data
+        self.criterios_solucionabilidad = criterios_solucionabilidad or {}
+        self.timestamp = timestamp or datetime.now().isoformat()
+        self.resumen_vulnerabilidades = resumen_vulnerabilidades or self._resumir(sbom_data)
+        self._secciones_prompt = None
+        self._huella = None
+
+    @staticmethod
+    def _resumir(sbom_data):
+        """Total y distribución por severidad de las vulnerabilidades NVD del análisis"""
+        por_severidad = {}
+        for vuln in sbom_data.get('vulnerabilidades_nvd', []):
+            sev = vuln.get('severidad', 'UNKNOWN')
+            por_severidad[sev] = por_severidad.get(sev, 0) + 1
+        return {
+            'total': len(sbom_data.get('vulnerabilidades_nvd', [])),
+            'por_severidad': por_severidad,
+            'componentes_analizados': sbom_data.get('resumen', {}).get('nvd_analysis', {}).get('componentes_analizados', 0)
+        }
+
+    def huella(self):
+        """
+        Hash del resultado del análisis (formato, nº de componentes y vulnerabilidades por
+        componente): dos subidas del mismo SBOM comparten huella aunque las haga otro usuario
+        """
+        if self._huella is None:
+            vulnerabilidades = sorted(
+                (vuln.get('cve_id', ''), vuln.get('componente_afectado', {}).get('nombre', ''),
+                 vuln.get('componente_afectado', {}).get('version', ''))
+                for vuln in self.sbom_data.get('vulnerabilidades_nvd', [])
+            )
+            datos = [self.sbom_data.get('formato'), self.sbom_data.get('resumen', {}).get('total_componentes'), vulnerabilidades]
+            self._huella = hashlib.sha1(json.dumps(datos, default=str).encode('utf-8')).hexdigest()
+        return self._huella
+
+    def secciones_prompt(self, huella, generar):
+        """
+        Secciones de prompt de este análisis: generar() solo se llama la primera vez o cuando
+        cambia la huella (los criterios del proyecto con los que se generaron)
+        """
+        guardadas = self._secciones_prompt
+        if guardadas is None or guardadas[0] != huella:
+            guardadas = self._secciones_prompt = (huella, generar())
+        return guardadas[1]
+
+    def a_dict(self):
+        return {
+            'tipo': self.tipo,
+            'filename': self.filename,
+            'proyecto_id': self.proyecto_id,
+            'proyecto_nombre': self.proyecto_nombre,
+            'sbom_data': self.sbom_data,
+            'criterios_solucionabilidad': self.criterios_solucionabilidad,
+            'timestamp': self.timestamp,
+            'resumen_vulnerabilidades': self.resumen_vulnerabilidades
+        }
+
+    @classmethod
+    def desde_dict(cls, datos):
+        return cls(
+            datos['filename'], datos['sbom_data'], datos.get('proyecto_id'), datos.get('proyecto_nombre'),
+            datos.get('criterios_solucionabilidad'), datos.get('timestamp'), datos.get('resumen_vulnerabilidades')
+        )
+
+
+class Conversacion:
+    """Historial de un usuario: los mensajes en un buffer circular y el contexto SBOM aparte"""
+
+    __slots__ = ('mensajes', 'contexto_sbom', 'actualizado')
+
+    def __init__(self, max_mensajes=MAX_MENSAJES, mensajes=(), contexto_sbom=None, actualizado=None):
+        self.mensajes = deque(mensajes, maxlen=max_mensajes)
+        self.contexto_sbom = contexto_sbom
+        self.actualizado = actualizado or time.time()
+
+    def agregar(self, *entradas):
+        """Añade entradas de texto ('Usuario: ...', 'Bot: ...'); las más antiguas salen solas"""
+        self.mensajes.extend(entradas)
+        self.actualizado = time.time()
+
+    def recortar(self, max_caracteres):
+        """Descarta los mensajes más antiguos hasta que el total quepa en `max_caracteres`"""
+        total = sum(len(entrada) for entrada in self.mensajes)
+        while self.mensajes and total > max_caracteres:
+            total -= len(self.mensajes.popleft())
+
+    def guardar_contexto_sbom(self, contexto):
+        """Sustituye el contexto SBOM: solo el último análisis es relevante para el chat"""
+        self.contexto_sbom = contexto
+        self.actualizado = time.time()
+
+    def copia(self):
+        """Copia con su propio buffer de mensajes (el contexto SBOM se comparte: solo se sustituye)"""
+        return Conversacion(self.mensajes.maxlen, self.mensajes, self.contexto_sbom, self.actualizado)
+
+    def __len__(self):
+        return len(self.mensajes)
+
+
+class AlmacenConversaciones:
+    """
+    Interfaz común de los almacenes de conversaciones. Límites por usuario: `max_mensajes`
+    mensajes y `max_caracteres` caracteres de historial; una conversación sin actividad durante
+    `ttl` segundos caduca entera (mensajes y contexto SBOM)
+    """
+
+    def __init__(self, max_mensajes=MAX_MENSAJES, ttl=7 * 24 * 3600, max_caracteres=200000):
+        self.max_mensajes = max_mensajes
+        self.ttl = ttl
+        self.max_caracteres = max_caracteres
+
+    def obtener(self, usuario_id):
+        """
+        Devuelve una copia de la conversación del usuario (vacía si no existe o ha caducado):
+        modificarla no cambia la guardada, que solo se modifica a través del almacén
+        """
+        raise NotImplementedError
+
+    def agregar_mensajes(self, usuario_id, *entradas):
+        """Añade mensajes aplicando los límites y devuelve una copia de la conversación actualizada"""
+        raise NotImplementedError
+
+    def guardar_contexto_sbom(self, usuario_id, contexto):
+        """Sustituye el contexto SBOM del usuario y devuelve una copia de la conversación actualizada"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def total_mensajes(self):
+        raise NotImplementedError
+
+
+class AlmacenMemoria(AlmacenConversaciones):
+    """
+    Conversaciones en memoria del proceso, ordenadas por actividad (LRU): las caducadas se
+    expulsan desde el principio sin recorrer el resto y, por encima de `max_usuarios`, se
+    descartan las menos recientes. Todas las modificaciones se hacen con el lock tomado y
+    hacia fuera solo salen copias. Se pierden al reiniciar y no se comparten entre workers
+    """
+
+    def __init__(self, max_mensajes=MAX_MENSAJES, ttl=7 * 24 * 3600, max_caracteres=200000, max_usuarios=10000):
+        super().__init__(max_mensajes, ttl, max_caracteres)
+        self.max_usuarios = max_usuarios
+        self._conversaciones = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expulsar_caducadas(self):
+        limite = time.time() - self.ttl
+        while self._conversaciones:
+            usuario_id, conversacion = next(iter(self._conversaciones.items()))
+            if conversacion.actualizado >= limite:
+                break
+            del self._conversaciones[usuario_id]
+
+    def _conversacion(self, usuario_id):
+        """Conversación guardada del usuario, creándola si no existe (con el lock tomado)"""
+        self._expulsar_caducadas()
+        conversacion = self._conversaciones.get(usuario_id)
+        if conversacion is None:
+            conversacion = self._conversaciones[usuario_id] = Conversacion(self.max_mensajes)
+            while len(self._conversaciones) > self.max_usuarios:
+                self._conversaciones.popitem(last=False)
+        else:
+            # Leer también es actividad: el orden del OrderedDict sigue siendo el de `actualizado`
+            conversacion.actualizado = time.time()
+            self._conversaciones.move_to_end(usuario_id)
+        return conversacion
+
+    def obtener(self, usuario_id):
+        with self._lock:
+            return self._conversacion(usuario_id).copia()
+
+    def agregar_mensajes(self, usuario_id, *entradas):
+        with self._lock:
+            conversacion = self._conversacion(usuario_id)
+            conversacion.agregar(*entradas)
+            conversacion.recortar(self.max_caracteres)
+            return conversacion.copia()
+
+    def guardar_contexto_sbom(self, usuario_id, contexto):
+        with self._lock:
+            conversacion = self._conversacion(usuario_id)
+            conversacion.guardar_contexto_sbom(contexto)
+            return conversacion.copia()
+
+    def __len__(self):
+        with self._lock:
+            self._expulsar_caducadas()
+            return len(self._conversaciones)
+
+    def total_mensajes(self):
+        with self._lock:
+            return sum(len(conversacion) for conversacion in self._conversaciones.values())
+
+
+class AlmacenSQLite(AlmacenConversaciones):
+    """
+    Conversaciones persistentes en SQLite, compartidas por todos los workers y contenedores que
+    monten el mismo fichero (WAL + busy_timeout, como la cache de NVD). Sobreviven a reinicios.
+    El contexto SBOM se guarda serializado una sola vez; cada proceso mantiene los últimos
+    contextos ya deserializados y solo vuelve a leer el JSON si otro worker lo ha sustituido
+    """
+
+    # Cada cuántas escrituras se eliminan las conversaciones caducadas
+    PURGA_CADA = 50
+
+    def __init__(self, ruta, max_mensajes=MAX_MENSAJES, ttl=7 * 24 * 3600, max_caracteres=200000,
+                 max_bytes_contexto=8 * 1024 * 1024, max_contextos_memoria=32):
+        super().__init__(max_mensajes, ttl, max_caracteres)
+        self.ruta = ruta
+        self.max_bytes_contexto = max_bytes_contexto
+        self.max_contextos_memoria = max_contextos_memoria
+        self._contextos = OrderedDict()  # usuario -> (version, ContextoSBOM)
+        self._local = threading.local()
+        self._escrituras = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+
+        conexion = self._conexion()
+        conexion.execute("""
+            CREATE TABLE IF NOT EXISTS conversaciones (
+                usuario TEXT PRIMARY KEY,
+                actualizado REAL NOT NULL,
+                contexto TEXT,
+                contexto_version INTEGER
+            )
+        """)
+        conexion.execute("""
+            CREATE TABLE IF NOT EXISTS mensajes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                usuario TEXT NOT NULL,
+                texto TEXT NOT NULL
+            )
+        """)
+        conexion.execute("CREATE INDEX IF NOT EXISTS idx_mensajes_usuario ON mensajes(usuario, id)")
+        conexion.execute("CREATE INDEX IF NOT EXISTS idx_conversaciones_actualizado ON conversaciones(actualizado)")
+
+    def _conexion(self):
+        """Una conexión por hilo (sqlite3 no permite compartirlas entre hilos)"""
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            conexion.execute("PRAGMA busy_timeout=30000")
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexion = conexion
+        return conexion
+
+    def _contexto(self, conexion, usuario_id, version):
+        """ContextoSBOM de la versión indicada, deserializando el JSON solo si no está en memoria"""
+        if version is None:
+            return None
+        with self._lock:
+            guardado = self._contextos.get(usuario_id)
+            if guardado is not None and guardado[0] == version:
+                self._contextos.move_to_end(usuario_id)
+                return guardado[1]
+        fila = conexion.execute(
+            "SELECT contexto FROM conversaciones WHERE usuario = ? AND contexto_version = ?", (usuario_id, version)
+        ).fetchone()
+        if fila is None or fila[0] is None:
+            return None
+        contexto = ContextoSBOM.desde_dict(json.loads(fila[0]))
+        self._recordar_contexto(usuario_id, version, contexto)
+        return contexto
+
+    def _recordar_contexto(self, usuario_id, version, contexto):
+        with self._lock:
+            self._contextos[usuario_id] = (version, contexto)
+            self._contextos.move_to_end(usuario_id)
+            while len(self._contextos) > self.max_contextos_memoria:
+                self._contextos.popitem(last=False)
+
+    def obtener(self, usuario_id):
+        conexion = self._conexion()
+        ahora = time.time()
+        fila = conexion.execute(
+            "SELECT actualizado, contexto_version FROM conversaciones WHERE usuario = ?", (usuario_id,)
+        ).fetchone()
+        if fila is None:
+            return Conversacion(self.max_mensajes)
+        if fila[0] < ahora - self.ttl:
+            self._eliminar(conexion, usuario_id)
+            return Conversacion(self.max_mensajes)
+
+        conexion.execute("UPDATE conversaciones SET actualizado = ? WHERE usuario = ?", (ahora, usuario_id))
+        mensajes = [texto for (texto,) in conexion.execute(
+            "SELECT texto FROM mensajes WHERE usuario = ? ORDER BY id DESC LIMIT ?", (usuario_id, self.max_mensajes)
+        )]
+        mensajes.reverse()
+        return Conversacion(self.max_mensajes, mensajes, self._contexto(conexion, usuario_id, fila[1]), ahora)
+
+    def agregar_mensajes(self, usuario_id, *entradas):
+        conexion = self._conexion()
+        ahora = time.time()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            self._tocar(conexion, usuario_id, ahora)
+            conexion.executemany("INSERT INTO mensajes (usuario, texto) VALUES (?, ?)",
+                                 [(usuario_id, entrada) for entrada in entradas])
+            # Límite por número de mensajes y por caracteres: se borra desde el más antiguo que sobra
+            total = 0
+            for posicion, (id_mensaje, longitud) in enumerate(conexion.execute(
+                    "SELECT id, length(texto) FROM mensajes WHERE usuario = ? ORDER BY id DESC", (usuario_id,)
+            ).fetchall()):
+                total += longitud
+                if posicion >= self.max_mensajes or total > self.max_caracteres:
+                    conexion.execute("DELETE FROM mensajes WHERE usuario = ? AND id <= ?", (usuario_id, id_mensaje))
+                    break
+            conexion.execute("COMMIT")
+        except Exception:
+            conexion.execute("ROLLBACK")
+            raise
+        self._tras_escritura()
+        return self.obtener(usuario_id)
+
+    def guardar_contexto_sbom(self, usuario_id, contexto):
+        datos = contexto.a_dict()
+        serializado = json.dumps(datos, default=a_json)
+        if len(serializado) > self.max_bytes_contexto and datos['sbom_data'].get('componentes'):
+            # El chat solo usa resumen y vulnerabilidades: la lista de componentes es lo prescindible
+            print(f"⚠️ Contexto SBOM de {len(serializado)} bytes: se guarda sin la lista de componentes")
+            datos['sbom_data'] = {clave: valor for clave, valor in datos['sbom_data'].items() if clave != 'componentes'}
+            serializado = json.dumps(datos, default=a_json)
+
+        conexion = self._conexion()
+        version = time.time_ns()
+        self._tocar(conexion, usuario_id, time.time())
+        conexion.execute("UPDATE conversaciones SET contexto = ?, contexto_version = ? WHERE usuario = ?",
+                         (serializado, version, usuario_id))
+        # Este proceso ya tiene el objeto: no hace falta deserializar lo que acaba de escribir
+        self._recordar_contexto(usuario_id, version, contexto)
+        self._tras_escritura()
+        return self.obtener(usuario_id)
+
+    def _tocar(self, conexion, usuario_id, ahora):
+        conexion.execute("""
+            INSERT INTO conversaciones (usuario, actualizado) VALUES (?, ?)
+            ON CONFLICT(usuario) DO UPDATE SET actualizado = excluded.actualizado
+        """, (usuario_id, ahora))
+
+    def _eliminar(self, conexion, usuario_id):
+        conexion.execute("DELETE FROM mensajes WHERE usuario = ?", (usuario_id,))
+        conexion.execute("DELETE FROM conversaciones WHERE usuario = ?", (usuario_id,))
+        with self._lock:
+            self._contextos.pop(usuario_id, None)
+
+    def _tras_escritura(self):
+        with self._lock:
+            self._escrituras += 1
+            purgar = self._escrituras % self.PURGA_CADA == 0
+        if purgar:
+            self.purgar()
+
+    def purgar(self):
+        """Elimina las conversaciones caducadas y sus mensajes"""
+        conexion = self._conexion()
+        limite = time.time() - self.ttl
+        conexion.execute("""
+            DELETE FROM mensajes WHERE usuario IN (SELECT usuario FROM conversaciones WHERE actualizado < ?)
+        """, (limite,))
+        conexion.execute("DELETE FROM conversaciones WHERE actualizado < ?", (limite,))
+
+    def __len__(self):
+        return self._conexion().execute(
+            "SELECT COUNT(*) FROM conversaciones WHERE actualizado >= ?", (time.time() - self.ttl,)
+        ).fetchone()[0]
+
+    def total_mensajes(self):
+        return self._conexion().execute("SELECT COUNT(*) FROM mensajes").fetchone()[0]
@@ -0,0 +1,227 @@
+"""
+Espejo local de la base de datos de NVD.
+
+Carga los ficheros de feed JSON 2.0 de NVD (nvdcve-2.0-*.json[.gz]) en un SQLite indexado
+por producto CPE y aplica actualizaciones incrementales con ventanas lastModStartDate /
+lastModEndDate de la API. Permite responder consultas sin red (despliegues aislados).
+
+Uso:
+    python espejo_nvd.py cargar nvdcve-2.0-2023.json.gz nvdcve-2.0-2024.json.gz
+    python espejo_nvd.py sincronizar
+"""
+import asyncio
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+
+# La API no admite ventanas de modificación de más de 120 días
+MAX_DIAS_VENTANA = 120
+RESULTADOS_POR_PAGINA = 2000
+# 429 seguidos que se toleran por página antes de abandonar la sincronización, con una
+# espera exponencial (además de la pausa Retry-After del limitador) limitada a ESPERA_MAXIMA_429
+MAX_REINTENTOS_429 = 5
+ESPERA_MAXIMA_429 = 60
+FORMATO_FECHA_NVD = '%Y-%m-%dT%H:%M:%S.000'
+
+
+def productos_de_cve(cve_data):
+    """Extrae los pares (vendor, producto) de los criterios CPE de un CVE"""
+    productos = set()
+    for config in cve_data.get('configurations', []):
+        for node in config.get('nodes', []):
+            for cpe_match in node.get('cpeMatch', []):
+                partes = cpe_match.get('criteria', '').split(':')
+                if len(partes) > 4:
+                    productos.add((partes[3].lower(), partes[4].lower()))
+    return productos
+
+
+class EspejoNVD:
+    """Almacén local de CVEs indexado por producto CPE"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+
+        directorio = os.path.dirname(os.path.abspath(ruta))
+        os.makedirs(directorio, exist_ok=True)
+
+        conexion = self._conexion()
+        conexion.executescript("""
+            CREATE TABLE IF NOT EXISTS cves (
+                id TEXT PRIMARY KEY,
+                ultima_modificacion TEXT,
+                datos TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS cve_productos (
+                producto TEXT NOT NULL,
+                vendor TEXT NOT NULL,
+                cve_id TEXT NOT NULL,
+                PRIMARY KEY (producto, vendor, cve_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_cve_productos_cve ON cve_productos(cve_id);
+            CREATE TABLE IF NOT EXISTS meta (
+                clave TEXT PRIMARY KEY,
+                valor TEXT
+            );
+        """)
+
+    def _conexion(self):
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=30)
+            conexion.execute("PRAGMA busy_timeout=30000")
+            conexion.execute("PRAGMA journal_mode=WAL")
+            self._local.conexion = conexion
+        return conexion
+
+    def aplicar_cves(self, vulnerabilidades):
+        """Inserta o actualiza una lista de elementos {'cve': {...}} (formato feed/API 2.0)"""
+        conexion = self._conexion()
+        total = 0
+        with conexion:
+            for item in vulnerabilidades:
+                cve_data = item.get('cve', {})
+                cve_id = cve_data.get('id')
+                if not cve_id:
+                    continue
+                conexion.execute(
+                    "INSERT OR REPLACE INTO cves (id, ultima_modificacion, datos) VALUES (?, ?, ?)",
+                    (cve_id, cve_data.get('lastModified'), json.dumps(cve_data))
+                )
+                conexion.execute("DELETE FROM cve_productos WHERE cve_id = ?", (cve_id,))
+                conexion.executemany(
+                    "INSERT OR IGNORE INTO cve_productos (producto, vendor, cve_id) VALUES (?, ?, ?)",
+                    [(producto, vendor, cve_id) for vendor, producto in productos_de_cve(cve_data)]
+                )
+                total += 1
+        return total
+
+    def cargar_feed(self, ruta_feed):
+        """Carga un fichero de feed NVD JSON 2.0 (admite .gz)"""
+        abrir = gzip.open if ruta_feed.endswith('.gz') else open
+        with abrir(ruta_feed, 'rt', encoding='utf-8') as f:
+            feed = json.load(f)
+        total = self.aplicar_cves(feed.get('vulnerabilities', []))
+        marca = feed.get('timestamp')
+        if marca and marca > (self.obtener_meta('ultima_sincronizacion') or ''):
+            self.guardar_meta('ultima_sincronizacion', marca)
+        print(f"📥 Feed {os.path.basename(ruta_feed)} cargado: {total} CVEs")
+        return total
+
+    async def sincronizar(self, cliente, desde=None, hasta=None, max_reintentos=MAX_REINTENTOS_429, espera_429=1.0):
+        """
+        Descarga de la API los CVEs modificados entre `desde` y `hasta` (por defecto desde la
+        última sincronización hasta ahora) en ventanas de 120 días y los aplica al espejo.
+        `cliente` es cualquier objeto con `consultar(params)` como ClienteNVD
+        """
+        hasta = hasta or datetime.now(timezone.utc).replace(tzinfo=None)
+        if desde is None:
+            ultima = self.obtener_meta('ultima_sincronizacion')
+            if not ultima:
+                raise ValueError("El espejo está vacío: carga primero los feeds completos")
+            desde = datetime.fromisoformat(ultima[:19])
+
+        total = 0
+        inicio = desde
+        while inicio < hasta:
+            fin = min(inicio + timedelta(days=MAX_DIAS_VENTANA), hasta)
+            indice = 0
+            reintentos = 0
+            while True:
+                params = {
+                    'lastModStartDate': inicio.strftime(FORMATO_FECHA_NVD),
+                    'lastModEndDate': fin.strftime(FORMATO_FECHA_NVD),
+                    'startIndex': indice,
+                    'resultsPerPage': RESULTADOS_POR_PAGINA
+                }
+                status, datos, _ = await cliente.consultar(params)
+                if status == 429:
+                    # El limitador del cliente ya aplica la pausa de Retry-After
+                    if reintentos >= max_reintentos:
+                        raise RuntimeError(f"NVD sigue limitando la tasa (429) tras {max_reintentos} reintentos")
+                    await asyncio.sleep(min(espera_429 * 2 ** reintentos, ESPERA_MAXIMA_429))
+                    reintentos += 1
+                    continue
+                reintentos = 0
+                if status != 200:
+                    raise RuntimeError(f"Error en NVD API durante la sincronización: {status}")
+                pagina = datos.get('vulnerabilities', [])
+                total += self.aplicar_cves(pagina)
+                indice += len(pagina)
+                if not pagina or indice >= datos.get('totalResults', 0):
+                    break
+            self.guardar_meta('ultima_sincronizacion', fin.strftime(FORMATO_FECHA_NVD))
+            print(f"🔄 Ventana {inicio:%Y-%m-%d} → {fin:%Y-%m-%d} sincronizada")
+            inicio = fin
+
+        print(f"✅ Sincronización completada: {total} CVEs actualizados")
+        return total
+
+    def buscar_por_productos(self, productos, vendors=None):
+        """Devuelve los datos de los CVEs que afectan a alguno de los productos CPE indicados"""
+        productos = list(productos)
+        if not productos:
+            return []
+        marcas = ','.join('?' * len(productos))
+        consulta = f"SELECT DISTINCT cve_id FROM cve_productos WHERE producto IN ({marcas})"
+        parametros = productos
+        if vendors:
+            vendors = list(vendors)
+            consulta += f" AND vendor IN ({','.join('?' * len(vendors))})"
+            parametros = productos + vendors
+        conexion = self._conexion()
+        ids = [fila[0] for fila in conexion.execute(consulta, parametros)]
+        cves = []
+        for cve_id in ids:
+            fila = conexion.execute("SELECT datos FROM cves WHERE id = ?", (cve_id,)).fetchone()
+            if fila:
+                cves.append(json.loads(fila[0]))
+        return cves
+
+    def pares_vendor_producto(self):
+        """Pares (vendor, producto) presentes en el espejo, útiles para poblar el índice CPE"""
+        return self._conexion().execute("SELECT DISTINCT vendor, producto FROM cve_productos").fetchall()
+
+    def obtener_meta(self, clave):
+        fila = self._conexion().execute("SELECT valor FROM meta WHERE clave = ?", (clave,)).fetchone()
+        return fila[0] if fila else None
+
+    def guardar_meta(self, clave, valor):
+        conexion = self._conexion()
+        with conexion:
+            conexion.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES (?, ?)", (clave, valor))
+
+    def __len__(self):
+        return self._conexion().execute("SELECT COUNT(*) FROM cves").fetchone()[0]
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from cliente_nvd import ClienteNVD, NVD_API_BASE_URL
+
+    load_dotenv()
+    espejo = EspejoNVD(os.getenv("NVD_ESPEJO_DB", os.path.join("cache", "espejo_nvd.db")))
+
+    if len(sys.argv) > 2 and sys.argv[1] == 'cargar':
+        for ruta in sys.argv[2:]:
+            espejo.cargar_feed(ruta)
+    elif len(sys.argv) == 2 and sys.argv[1] == 'sincronizar':
+        cliente = ClienteNVD(NVD_API_BASE_URL, api_key=os.getenv("NVD_API_KEY"))
+
+        async def _sincronizar():
+            try:
+                await espejo.sincronizar(cliente)
+            finally:
+                await cliente.cerrar()
+
+        asyncio.run(_sincronizar())
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+    print(f"📊 CVEs en el espejo: {len(espejo)}")
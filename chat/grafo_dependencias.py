@@ -0,0 +1,170 @@
+from array import array
+from collections import deque
+
+SIN_PROFUNDIDAD = -1
+
+
+class GrafoDependencias:
+    """
+    Grafo de dependencias de un SBOM CycloneDX con identificadores enteros compactos.
+    Cada bom-ref se interna una sola vez como entero y las aristas se compilan en formato CSR
+    (desplazamientos + destinos en arrays de enteros), en sentido directo e inverso, la primera
+    vez que se consulta el grafo. La raíz es el componente de metadata; sus dependencias directas
+    son los componentes de primer nivel
+    """
+
+    def __init__(self, raiz=None):
+        self._indices = {}
+        self.referencias = []
+        self._origenes = array('i')
+        self._destinos = array('i')
+        self._raiz = None
+        self._csr = None
+        self._csr_inverso = None
+        self._profundidades = None
+        if raiz:
+            self.establecer_raiz(raiz)
+
+    @classmethod
+    def desde_cyclonedx(cls, dependencias, raiz=None):
+        """Construye el grafo a partir del array `dependencies` (ref/dependsOn) de CycloneDX"""
+        grafo = cls(raiz)
+        for dependencia in dependencias or []:
+            grafo.agregar_dependencia(dependencia.get('ref'), dependencia.get('dependsOn') or [])
+        return grafo
+
+    def nodo(self, referencia):
+        """Devuelve el entero asignado a un bom-ref, creándolo si no existía"""
+        indice = self._indices.get(referencia)
+        if indice is None:
+            indice = self._indices[referencia] = len(self.referencias)
+            self.referencias.append(referencia)
+        return indice
+
+    def indice(self, referencia):
+        """Entero de un bom-ref o None si no está en el grafo"""
+        return self._indices.get(referencia)
+
+    def establecer_raiz(self, referencia):
+        self._raiz = self.nodo(referencia)
+        self._profundidades = None
+
+    def agregar_dependencia(self, referencia, depende_de):
+        """Añade las aristas referencia -> cada elemento de depende_de"""
+        if not referencia:
+            return
+        origen = self.nodo(referencia)
+        for destino in depende_de:
+            if destino:
+                self._origenes.append(origen)
+                self._destinos.append(self.nodo(destino))
+        self._csr = self._csr_inverso = self._profundidades = None
+
+    def __len__(self):
+        return len(self.referencias)
+
+    @property
+    def num_aristas(self):
+        return len(self._destinos)
+
+    def _compilar(self, origenes, destinos):
+        """Ordena las aristas por origen (counting sort) y devuelve (desplazamientos, adyacentes)"""
+        desplazamientos = array('i', bytes(4 * (len(self.referencias) + 1)))
+        for origen in origenes:
+            desplazamientos[origen + 1] += 1
+        for i in range(len(self.referencias)):
+            desplazamientos[i + 1] += desplazamientos[i]
+        siguiente = array('i', desplazamientos[:-1])
+        adyacentes = array('i', bytes(4 * len(destinos)))
+        for origen, destino in zip(origenes, destinos):
+            adyacentes[siguiente[origen]] = destino
+            siguiente[origen] += 1
+        return desplazamientos, adyacentes
+
+    def sucesores(self, indice):
+        if self._csr is None:
+            self._csr = self._compilar(self._origenes, self._destinos)
+        desplazamientos, adyacentes = self._csr
+        return adyacentes[desplazamientos[indice]:desplazamientos[indice + 1]]
+
+    def predecesores(self, indice):
+        if self._csr_inverso is None:
+            self._csr_inverso = self._compilar(self._destinos, self._origenes)
+        desplazamientos, adyacentes = self._csr_inverso
+        return adyacentes[desplazamientos[indice]:desplazamientos[indice + 1]]
+
+    def directos(self):
+        """
+        Componentes de primer nivel: las dependencias de la raíz o, si la raíz no declara
+        ninguna, los nodos de los que no depende nadie
+        """
+        if self._raiz is not None and len(self.sucesores(self._raiz)):
+            return list(self.sucesores(self._raiz))
+        return [i for i in range(len(self.referencias)) if i != self._raiz and not len(self.predecesores(i))]
+
+    def profundidades(self):
+        """
+        Distancia mínima (BFS) desde la raíz de cada nodo: 1 para los de primer nivel y
+        SIN_PROFUNDIDAD para los que ningún componente de primer nivel alcanza
+        """
+        if self._profundidades is None:
+            profundidades = array('i', [SIN_PROFUNDIDAD]) * len(self.referencias)
+            cola = deque()
+            for indice in self.directos():
+                if profundidades[indice] == SIN_PROFUNDIDAD:
+                    profundidades[indice] = 1
+                    cola.append(indice)
+            while cola:
+                actual = cola.popleft()
+                for siguiente in self.sucesores(actual):
+                    if profundidades[siguiente] == SIN_PROFUNDIDAD and siguiente != self._raiz:
+                        profundidades[siguiente] = profundidades[actual] + 1
+                        cola.append(siguiente)
+            self._profundidades = profundidades
+        return self._profundidades
+
+    def profundidad(self, referencia):
+        """Profundidad de un bom-ref; None si no está en el grafo"""
+        indice = self._indices.get(referencia)
+        return None if indice is None else self.profundidades()[indice]
+
+    def alcanzable(self, referencia):
+        profundidad = self.profundidad(referencia)
+        return profundidad is not None and profundidad != SIN_PROFUNDIDAD
+
+    def introducido_por(self, referencia, maximo=None):
+        """
+        Componentes de primer nivel que arrastran (directa o transitivamente) el bom-ref indicado,
+        recorriendo el grafo inverso desde él
+        """
+        inicio = self._indices.get(referencia)
+        if inicio is None:
+            return []
+        directos = set(self.directos())
+        visitados = bytearray(len(self.referencias))
+        visitados[inicio] = 1
+        cola = deque([inicio])
+        encontrados = []
+        while cola:
+            actual = cola.popleft()
+            if actual in directos:
+                encontrados.append(self.referencias[actual])
+                if maximo and len(encontrados) >= maximo:
+                    break
+            for anterior in self.predecesores(actual):
+                if not visitados[anterior]:
+                    visitados[anterior] = 1
+                    cola.append(anterior)
+        return encontrados
+
+    def resumen(self):
+        profundidades = self.profundidades()
+        alcanzables = sum(1 for profundidad in profundidades if profundidad != SIN_PROFUNDIDAD)
+        return {
+            'nodos': len(self.referencias),
+            'aristas': self.num_aristas,
+            'componentes_directos': len(self.directos()),
+            'alcanzables': alcanzables,
+            'no_alcanzables': len(self.referencias) - alcanzables - (1 if self._raiz is not None else 0),
+            'profundidad_maxima': max(profundidades, default=0)
+        }
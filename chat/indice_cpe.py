@@ -0,0 +1,187 @@
+import gzip
+import json
+import os
+import re
+
+# 📦 PISTAS POR ECOSISTEMA PURL: target_sw usado en los CPE de NVD para cada gestor de paquetes
+ECOSISTEMAS_PURL = {
+    'npm': 'node.js',
+    'pypi': 'python',
+    'gem': 'ruby',
+    'cargo': 'rust',
+    'nuget': '.net',
+    'composer': 'php',
+    'hex': 'elixir',
+    'pub': 'dart',
+}
+
+# Segmentos de namespace (maven, golang...) que nunca son el vendor
+SEGMENTOS_IGNORADOS = {'org', 'com', 'net', 'io', 'dev', 'github', 'gitlab', 'bitbucket', 'golang', 'gopkg', 'in', 'x'}
+
+# Artefactos cuyo producto CPE en NVD es el del proyecto y no el del propio paquete
+# (log4j-core -> log4j). Solo alias conocidos: un prefijo del nombre no basta (jquery-ui no es jquery)
+ALIAS_PRODUCTOS_CPE = {
+    'log4j-core': 'log4j', 'log4j-api': 'log4j', 'log4j-1.2-api': 'log4j',
+    'spring-core': 'spring_framework', 'spring-beans': 'spring_framework',
+    'spring-context': 'spring_framework', 'spring-expression': 'spring_framework',
+    'spring-web': 'spring_framework', 'spring-webmvc': 'spring_framework',
+    'spring-webflux': 'spring_framework',
+    'tomcat-embed-core': 'tomcat', 'struts2-core': 'struts',
+    'netty-codec': 'netty', 'netty-codec-http': 'netty', 'netty-common': 'netty',
+    'netty-handler': 'netty', 'netty-transport': 'netty',
+    'jetty-server': 'jetty', 'jetty-http': 'jetty',
+}
+
+SEPARADORES = re.compile(r'[\s\-\._/]+')
+
+
+def tokenizar(nombre):
+    """Divide un nombre de producto en tokens (los separadores CPE más habituales son '_' y '-')"""
+    return [t for t in SEPARADORES.split(nombre.lower()) if t]
+
+
+def parsear_purl(purl):
+    """Devuelve (tipo, namespace, nombre, versión) de un purl, o None si no es válido"""
+    match = re.match(r'pkg:([^/]+)/(.+?)(?:@([^?#]*))?(?:[?#].*)?$', purl or '')
+    if not match:
+        return None
+    tipo, ruta, version = match.groups()
+    ruta = ruta.replace('%40', '@')
+    namespace, _, nombre = ruta.rpartition('/')
+    return tipo.lower(), namespace.lower(), nombre.lower(), version or ''
+
+
+class CandidatoCPE:
+    """Producto CPE candidato para un componente"""
+
+    __slots__ = ('vendor', 'producto', 'version', 'target_sw')
+
+    def __init__(self, vendor, producto, version='', target_sw=''):
+        self.vendor = vendor
+        self.producto = producto
+        self.version = version
+        self.target_sw = target_sw
+
+    @property
+    def cpe_name(self):
+        version = self.version or '*'
+        return f"cpe:2.3:a:{self.vendor}:{self.producto}:{version}:*:*:*:*:{self.target_sw or '*'}:*:*"
+
+    @property
+    def match_string(self):
+        """Cadena para virtualMatchString: cualquier versión del producto (los rangos se evalúan localmente)"""
+        return f"cpe:2.3:a:{self.vendor}:{self.producto}:*:*:*:*:*:{self.target_sw or '*'}:*:*"
+
+    def __repr__(self):
+        return f"CandidatoCPE({self.cpe_name})"
+
+
+class IndiceCPE:
+    """
+    Índice local del diccionario CPE de NVD.
+    Los productos se guardan en un trie por tokens ('spring_boot' -> spring → boot) cuyos nodos
+    terminales contienen los vendors, lo que permite tanto la búsqueda exacta como la del
+    prefijo más largo ('spring-boot-starter-web' -> spring_boot)
+    """
+
+    def __init__(self):
+        self._raiz = {}
+        self.total_productos = 0
+
+    def agregar(self, vendor, producto):
+        vendor = vendor.lower()
+        nodo = self._raiz
+        for token in tokenizar(producto):
+            nodo = nodo.setdefault(token, {})
+        vendors = nodo.setdefault(None, {})
+        if vendor not in vendors:
+            if not vendors:
+                self.total_productos += 1
+            # Se conserva la forma exacta del producto en el diccionario (p. ej. 'node.js')
+            vendors[vendor] = producto.lower()
+
+    def cargar_pares(self, pares):
+        for vendor, producto in pares:
+            self.agregar(vendor, producto)
+
+    def cargar_diccionario(self, ruta):
+        """
+        Carga un diccionario CPE: feed JSON 2.0 de productos (nvdcpe-2.0*.json[.gz]),
+        un directorio con varios feeds o un fichero de texto con líneas 'vendor:producto'
+        """
+        if os.path.isdir(ruta):
+            for nombre in sorted(os.listdir(ruta)):
+                self.cargar_diccionario(os.path.join(ruta, nombre))
+            return
+        abrir = gzip.open if ruta.endswith('.gz') else open
+        with abrir(ruta, 'rt', encoding='utf-8') as f:
+            if '.json' in ruta:
+                for item in json.load(f).get('products', []):
+                    cpe = item.get('cpe', {})
+                    if cpe.get('deprecated'):
+                        continue
+                    partes = cpe.get('cpeName', '').split(':')
+                    if len(partes) > 4 and partes[2] == 'a':
+                        self.agregar(partes[3], partes[4])
+            else:
+                for linea in f:
+                    vendor, _, producto = linea.strip().partition(':')
+                    if vendor and producto:
+                        self.agregar(vendor, producto)
+        print(f"📚 Diccionario CPE cargado desde {ruta}: {self.total_productos} productos")
+
+    def _buscar(self, tokens, prefijo=False):
+        """Vendors del producto exacto, o del prefijo más largo si prefijo=True"""
+        nodo = self._raiz
+        mejor = None
+        for token in tokens:
+            nodo = nodo.get(token)
+            if nodo is None:
+                break
+            if None in nodo:
+                mejor = nodo[None]
+        else:
+            if nodo is not None and None in nodo:
+                return nodo[None]
+        return mejor if prefijo else None
+
+    def resolver(self, componente, max_candidatos=3):
+        """Resuelve un componente del SBOM a productos CPE candidatos"""
+        nombre = componente.get('nombre', '')
+        version = componente.get('version', '')
+        target_sw = ''
+        pistas_vendor = set()
+
+        purl = parsear_purl(componente.get('purl', ''))
+        if purl:
+            tipo, namespace, nombre_purl, version_purl = purl
+            nombre = nombre_purl or nombre
+            version = version_purl or version
+            target_sw = ECOSISTEMAS_PURL.get(tipo, '')
+            for segmento in re.split(r'[/\.]', namespace.lstrip('@')):
+                if segmento and segmento not in SEGMENTOS_IGNORADOS:
+                    pistas_vendor.update({segmento, segmento.replace('-', '_')})
+
+        if version in ('No especificada', 'No especificado'):
+            version = ''
+
+        tokens = tokenizar(nombre)
+        if not tokens:
+            return []
+
+        vendors = self._buscar(tokens)
+        if vendors is None and pistas_vendor:
+            # El prefijo solo se acepta si el namespace del purl confirma el vendor
+            vendors = self._buscar(tokens, prefijo=True)
+            if vendors and not pistas_vendor & set(vendors):
+                vendors = None
+        if not vendors:
+            return []
+
+        # Preferir vendors confirmados por el purl o que coinciden con el producto (lodash:lodash)
+        preferidos = [v for v in vendors if v in pistas_vendor or v == vendors[v]]
+        ordenados = preferidos or list(vendors)
+        return [CandidatoCPE(v, vendors[v], version, target_sw) for v in ordenados[:max_candidatos]]
+
+    def __len__(self):
+        return self.total_productos
@@ -0,0 +1,115 @@
+import io
+import json
+
+TAMANO_BLOQUE = 64 * 1024
+
+# Arrays de primer nivel que se recorren elemento a elemento (CycloneDX y SPDX)
+CLAVES_INCREMENTALES = ('components', 'packages')
+
+_ESPACIOS = ' \t\n\r'
+# Caracteres con los que podría continuar un número cortado entre dos bloques
+_CONTINUACION_NUMERO = set('0123456789.eE+-')
+
+
+class LectorJSONIncremental:
+    """
+    Recorre un documento JSON cuyo valor raíz es un objeto sin cargarlo entero en memoria.
+    Los valores de primer nivel se decodifican completos, salvo los arrays de
+    CLAVES_INCREMENTALES, cuyos elementos se entregan de uno en uno. El buffer solo guarda
+    el fragmento pendiente de decodificar, así que la memoria depende del mayor elemento
+    y no del tamaño del documento
+    """
+
+    def __init__(self, flujo, claves_incrementales=CLAVES_INCREMENTALES, tamano_bloque=TAMANO_BLOQUE):
+        if isinstance(flujo, (bytes, bytearray)):
+            flujo = io.BytesIO(flujo)
+        if not isinstance(flujo, io.TextIOBase):
+            flujo = io.TextIOWrapper(flujo, encoding='utf-8-sig')
+        self._flujo = flujo
+        self._claves_incrementales = set(claves_incrementales)
+        self._tamano_bloque = tamano_bloque
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._fin = False
+        # Claves del objeto raíz en orden de aparición (incluidas las de arrays vacíos)
+        self.claves = []
+
+    def _leer_mas(self, tamano=None):
+        """Añade un bloque al buffer descartando lo ya consumido; False si no queda nada"""
+        if self._fin:
+            return False
+        bloque = self._flujo.read(tamano or self._tamano_bloque)
+        if not bloque:
+            self._fin = True
+            return False
+        self._buffer = self._buffer[self._pos:] + bloque
+        self._pos = 0
+        return True
+
+    def _siguiente_caracter(self):
+        """Salta espacios y devuelve el siguiente carácter sin consumirlo ('' al final)"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _ESPACIOS:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._leer_mas():
+                return ''
+
+    def _esperar(self, caracteres):
+        caracter = self._siguiente_caracter()
+        if caracter == '' or caracter not in caracteres:
+            raise ValueError(f"JSON no válido: se esperaba {' o '.join(repr(c) for c in caracteres)} "
+                             f"y se encontró {caracter!r}")
+        self._pos += 1
+        return caracter
+
+    def _decodificar_valor(self):
+        """Decodifica el siguiente valor completo, leyendo más bloques si está incompleto"""
+        self._siguiente_caracter()
+        while True:
+            try:
+                valor, fin = self._decoder.raw_decode(self._buffer, self._pos)
+                # Un número al final del buffer (o seguido de parte de otro) puede estar cortado
+                if self._fin or (fin < len(self._buffer) and self._buffer[fin] not in _CONTINUACION_NUMERO):
+                    self._pos = fin
+                    return valor
+            except json.JSONDecodeError:
+                if self._fin:
+                    raise
+            # Al menos tanto como lo pendiente: un elemento grande se completa en O(n) y no O(n²)
+            if not self._leer_mas(max(self._tamano_bloque, len(self._buffer) - self._pos)):
+                valor, self._pos = self._decoder.raw_decode(self._buffer, self._pos)
+                return valor
+
+    def __iter__(self):
+        """
+        Genera pares (clave, valor) del objeto raíz. Para las claves incrementales se genera
+        un par por cada elemento del array, en orden
+        """
+        self._esperar('{')
+        if self._siguiente_caracter() == '}':
+            self._pos += 1
+            return
+        while True:
+            clave = self._decodificar_valor()
+            if not isinstance(clave, str):
+                raise ValueError("JSON no válido: las claves deben ser cadenas")
+            self._esperar(':')
+            self.claves.append(clave)
+
+            if clave in self._claves_incrementales and self._siguiente_caracter() == '[':
+                self._pos += 1
+                if self._siguiente_caracter() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield clave, self._decodificar_valor()
+                        if self._esperar(',]') == ']':
+                            break
+            else:
+                yield clave, self._decodificar_valor()
+
+            if self._esperar(',}') == '}':
+                break
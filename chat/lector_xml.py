@@ -0,0 +1,80 @@
+import io
+import re
+import xml.etree.ElementTree as ET
+
+# http://cyclonedx.org/schema/bom/1.0 ... 1.6
+_ESPACIO_CYCLONEDX = re.compile(r'^https?://cyclonedx\.org/schema/bom/(\d+(?:\.\d+)*)$')
+
+
+def separar_etiqueta(etiqueta):
+    """'{espacio}nombre' -> ('espacio', 'nombre'); sin espacio de nombres -> ('', 'nombre')"""
+    if etiqueta[:1] == '{':
+        espacio, _, nombre = etiqueta[1:].partition('}')
+        return espacio, nombre
+    return '', etiqueta
+
+
+def detectar_formato_xml(etiqueta_raiz):
+    """
+    Detecta el formato a partir de la etiqueta raíz. Devuelve (formato, version_esquema, espacio)
+    con formato 'CycloneDX', 'SPDX' o None
+    """
+    espacio, nombre = separar_etiqueta(etiqueta_raiz)
+    coincidencia = _ESPACIO_CYCLONEDX.match(espacio)
+    if coincidencia:
+        return 'CycloneDX', coincidencia.group(1), espacio
+    if 'spdx' in etiqueta_raiz.lower():
+        return 'SPDX', None, espacio
+    if 'bom' in nombre.lower():
+        return 'CycloneDX', None, espacio
+    return None, None, espacio
+
+
+class LectorXMLIncremental:
+    """
+    Recorre un documento XML con iterparse en una sola pasada. Genera los elementos cuyo nombre
+    local está en `elementos` al cerrarse (completos, con sus hijos) y después los libera.
+    Todo lo demás se descarta en cuanto se cierra, así que la memoria depende del mayor elemento
+    generado y no del tamaño del documento. Tras el primer evento quedan disponibles la etiqueta
+    raíz y el formato detectado; al terminar, `etiquetas` contiene las etiquetas distintas vistas
+    """
+
+    def __init__(self, fuente, elementos):
+        if isinstance(fuente, (bytes, bytearray)):
+            fuente = io.BytesIO(fuente)
+        elif isinstance(fuente, str):
+            fuente = io.BytesIO(fuente.encode('utf-8'))
+        self._fuente = fuente
+        self._elementos = set(elementos)
+        self.raiz = None
+        self.formato = None
+        self.version_esquema = None
+        self.espacio = ''
+        self.etiquetas = set()
+
+    def __iter__(self):
+        """Genera (nombre_local, ruta, elemento) para cada elemento pedido; ruta son los nombres locales de sus ancestros"""
+        pila = []
+        # Elementos pedidos abiertos: mientras haya alguno, sus descendientes no se pueden soltar
+        abiertos = 0
+        for evento, elem in ET.iterparse(self._fuente, events=('start', 'end')):
+            if evento == 'start':
+                if self.raiz is None:
+                    self.raiz = elem.tag
+                    self.formato, self.version_esquema, self.espacio = detectar_formato_xml(elem.tag)
+                self.etiquetas.add(elem.tag)
+                nombre = separar_etiqueta(elem.tag)[1]
+                pila.append((nombre, elem))
+                if nombre in self._elementos:
+                    abiertos += 1
+                continue
+
+            nombre, _ = pila.pop()
+            if nombre in self._elementos:
+                yield nombre, tuple(ancestro for ancestro, _ in pila), elem
+                abiertos -= 1
+            if abiertos == 0 and pila:
+                # Un elemento pedido dentro de otro se conserva hasta que se cierre el de fuera
+                # El elemento recién cerrado es siempre el último hijo de su padre: quitarlo es O(1)
+                elem.clear()
+                del pila[-1][1][-1]
@@ -0,0 +1,323 @@
+import asyncio
+import hashlib
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ErrorLLM(Exception):
+    """El proveedor no ha respondido (error o timeout) tras agotar los reintentos"""
+
+
+class ProveedorLLM:
+    """
+    Backend de generación de texto. generar es asíncrona (endpoints async y pipeline SBOM);
+    generar_flujo es un generador síncrono de fragmentos para el endpoint SSE, que se
+    ejecuta en el hilo de la petición
+    """
+
+    nombre = 'base'
+
+    async def generar(self, prompt, timeout=None):
+        raise NotImplementedError
+
+    def generar_flujo(self, prompt, timeout=None):
+        raise NotImplementedError
+
+
+class ProveedorGemini(ProveedorLLM):
+    """
+    Google Gemini a través de google-generativeai. La versión fijada (0.3.2) no acepta
+    request_options: el timeout de generar lo aplica ClienteLLM con asyncio.wait_for, y el
+    del streaming (plazo máximo entre fragmentos) ClienteLLM.generar_flujo
+    """
+
+    nombre = 'gemini'
+
+    def __init__(self, api_key, modelo="gemini-2.0-flash"):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.modelo = modelo
+        self._modelo = genai.GenerativeModel(modelo)
+
+    async def generar(self, prompt, timeout=None):
+        respuesta = await self._modelo.generate_content_async(prompt)
+        return respuesta.text
+
+    def generar_flujo(self, prompt, timeout=None):
+        for chunk in self._modelo.generate_content(prompt, stream=True):
+            try:
+                texto = chunk.text
+            except ValueError:
+                continue  # fragmento sin texto (p. ej. bloqueado por seguridad)
+            if texto:
+                yield texto
+
+
+class ProveedorSimulado(ProveedorLLM):
+    """
+    Backend determinista sin red para pruebas de carga y CI: la respuesta depende solo del
+    prompt (hash, tamaño y CVEs que menciona) y tarda `latencia` segundos más `segundos_por_fragmento`
+    por cada fragmento del streaming
+    """
+
+    nombre = 'simulado'
+    _CVE = re.compile(r'CVE-\d{4}-\d{4,}')
+
+    def __init__(self, latencia=0.0, segundos_por_fragmento=0.0, palabras_por_fragmento=8):
+        self.latencia = latencia
+        self.segundos_por_fragmento = segundos_por_fragmento
+        self.palabras_por_fragmento = palabras_por_fragmento
+
+    def responder(self, prompt):
+        huella = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+        cves = list(dict.fromkeys(self._CVE.findall(prompt)))[:5]
+        texto = f"[simulado {huella}] Respuesta de prueba para un prompt de {len(prompt)} caracteres."
+        if cves:
+            texto += f" Vulnerabilidades mencionadas: {', '.join(cves)}."
+        return texto
+
+    async def generar(self, prompt, timeout=None):
+        if self.latencia:
+            await asyncio.sleep(self.latencia)
+        return self.responder(prompt)
+
+    def generar_flujo(self, prompt, timeout=None):
+        if self.latencia:
+            time.sleep(self.latencia)
+        palabras = self.responder(prompt).split(' ')
+        for i in range(0, len(palabras), self.palabras_por_fragmento):
+            if self.segundos_por_fragmento:
+                time.sleep(self.segundos_por_fragmento)
+            yield ('' if i == 0 else ' ') + ' '.join(palabras[i:i + self.palabras_por_fragmento])
+
+
+PROVEEDORES = {
+    ProveedorGemini.nombre: ProveedorGemini,
+    ProveedorSimulado.nombre: ProveedorSimulado,
+}
+
+
+def crear_proveedor(nombre, **opciones):
+    """Instancia el proveedor por nombre ('gemini', 'simulado')"""
+    clase = PROVEEDORES.get(nombre)
+    if clase is None:
+        raise ValueError(f"Proveedor LLM desconocido: {nombre} (disponibles: {', '.join(PROVEEDORES)})")
+    return clase(**opciones)
+
+
+class MetricasLLM:
+    """Contadores y latencias de las últimas `ventana` llamadas correctas (p50/p95 para /health)"""
+
+    def __init__(self, ventana=500):
+        self._latencias = deque(maxlen=ventana)
+        self._lock = threading.Lock()
+        self.llamadas = 0
+        self.errores = 0
+        self.timeouts = 0
+        self.reintentos = 0
+        self.coalescidas = 0
+
+    def registrar(self, segundos):
+        with self._lock:
+            self.llamadas += 1
+            self._latencias.append(segundos)
+
+    def fallo(self, timeout=False):
+        with self._lock:
+            if timeout:
+                self.timeouts += 1
+            else:
+                self.errores += 1
+
+    def reintento(self):
+        with self._lock:
+            self.reintentos += 1
+
+    def coalescida(self):
+        with self._lock:
+            self.coalescidas += 1
+
+    def resumen(self):
+        with self._lock:
+            latencias = sorted(self._latencias)
+            datos = {
+                'llamadas': self.llamadas,
+                'errores': self.errores,
+                'timeouts': self.timeouts,
+                'reintentos': self.reintentos,
+                'coalescidas': self.coalescidas
+            }
+        if latencias:
+            datos['latencia_p50_ms'] = round(latencias[len(latencias) // 2] * 1000, 1)
+            datos['latencia_p95_ms'] = round(latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))] * 1000, 1)
+        return datos
+
+
+class ClienteLLM:
+    """
+    Envoltorio de un ProveedorLLM con timeout por llamada, reintentos con backoff exponencial
+    y jitter, límite de llamadas simultáneas y métricas de latencia. El límite es uno solo para
+    todas las llamadas (un semáforo de hilos): el streaming lo toma en su hilo y generar lo
+    espera en un hilo auxiliar sin bloquear el event loop. En el streaming `timeout` es el plazo
+    máximo entre dos fragmentos.
+    Con coalescer=True las llamadas a generar con el mismo prompt que coinciden en el tiempo
+    comparten una única llamada al proveedor (single-flight) y reciben el mismo resultado o error
+    """
+
+    def __init__(self, proveedor, timeout=60, reintentos=2, max_concurrentes=8, espera_base=0.5, coalescer=True):
+        self.proveedor = proveedor
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.max_concurrentes = max_concurrentes
+        self.espera_base = espera_base
+        self.coalescer = coalescer
+        self._huecos = threading.BoundedSemaphore(max_concurrentes)
+        # Hilos en los que las llamadas async esperan hueco cuando el semáforo está lleno
+        self._esperas = ThreadPoolExecutor(thread_name_prefix='llm-espera')
+        # (id del event loop, sha256 del prompt) -> tarea en curso; los futures no cruzan event loops
+        self._en_curso = {}
+        self.metricas = MetricasLLM()
+
+    @property
+    def nombre(self):
+        return self.proveedor.nombre
+
+    def _espera(self, intento):
+        return self.espera_base * (2 ** intento) * random.uniform(0.5, 1.5)
+
+    def _sin_hueco(self):
+        self.metricas.fallo(timeout=True)
+        return ErrorLLM(f"{self.nombre}: sin hueco libre tras {self.timeout}s")
+
+    async def _adquirir(self):
+        """Toma un hueco del semáforo desde el event loop; ErrorLLM si no queda libre en `timeout`"""
+        if self._huecos.acquire(blocking=False):
+            return
+        espera = self._esperas.submit(self._huecos.acquire, True, self.timeout)
+        try:
+            adquirido = await asyncio.wrap_future(espera)
+        except asyncio.CancelledError:
+            # El hilo puede conseguir el hueco después de la cancelación: se devuelve al llegar
+            espera.add_done_callback(lambda f: not f.cancelled() and f.result() and self._huecos.release())
+            raise
+        if not adquirido:
+            raise self._sin_hueco()
+
+    async def generar(self, prompt):
+        """Texto completo de la respuesta; ErrorLLM si fallan todos los intentos"""
+        if not self.coalescer:
+            return await self._generar(prompt)
+        clave = (id(asyncio.get_running_loop()), hashlib.sha256(prompt.encode('utf-8')).hexdigest())
+        tarea = self._en_curso.get(clave)
+        if tarea is not None:
+            self.metricas.coalescida()
+        else:
+            tarea = asyncio.ensure_future(self._generar(prompt))
+            self._en_curso[clave] = tarea
+            tarea.add_done_callback(lambda t: self._fin_en_curso(clave, t))
+        # shield: si se cancela una de las peticiones que esperan, la llamada sigue para las demás
+        return await asyncio.shield(tarea)
+
+    def _fin_en_curso(self, clave, tarea):
+        if self._en_curso.get(clave) is tarea:
+            del self._en_curso[clave]
+        if not tarea.cancelled():
+            tarea.exception()  # recuperada aunque ya no quede nadie esperando (evita el aviso de asyncio)
+
+    async def _generar(self, prompt):
+        ultimo_error = None
+        for intento in range(self.reintentos + 1):
+            await self._adquirir()
+            inicio = time.monotonic()
+            try:
+                texto = await asyncio.wait_for(self.proveedor.generar(prompt, self.timeout), self.timeout)
+                self.metricas.registrar(time.monotonic() - inicio)
+                return texto
+            except asyncio.TimeoutError as e:
+                self.metricas.fallo(timeout=True)
+                ultimo_error = e
+            except Exception as e:
+                self.metricas.fallo()
+                ultimo_error = e
+            finally:
+                self._huecos.release()
+            if intento < self.reintentos:
+                self.metricas.reintento()
+                print(f"⚠️ Error con {self.nombre} ({type(ultimo_error).__name__}: {ultimo_error}); reintento {intento + 1}")
+                await asyncio.sleep(self._espera(intento))
+        raise ErrorLLM(f"{self.nombre}: {ultimo_error or 'timeout'}") from ultimo_error
+
+    def generar_flujo(self, prompt):
+        """
+        Generador síncrono de fragmentos. Solo se reintenta si el fallo llega antes del primer
+        fragmento (lo ya enviado al cliente no se puede retirar). Si el proveedor pasa más de
+        `timeout` segundos sin emitir un fragmento se corta con ErrorLLM
+        """
+        ultimo_error = None
+        for intento in range(self.reintentos + 1):
+            if not self._huecos.acquire(timeout=self.timeout):
+                raise self._sin_hueco()
+            inicio = time.monotonic()
+            emitidos = 0
+            try:
+                for fragmento in self._flujo_con_plazo(prompt):
+                    emitidos += 1
+                    yield fragmento
+                self.metricas.registrar(time.monotonic() - inicio)
+                return
+            except Exception as e:
+                self.metricas.fallo(timeout=isinstance(e, TimeoutError))
+                ultimo_error = e
+                if emitidos:
+                    raise ErrorLLM(f"{self.nombre}: {e}") from e
+            finally:
+                self._huecos.release()
+            if intento < self.reintentos:
+                self.metricas.reintento()
+                print(f"⚠️ Error con {self.nombre} ({type(ultimo_error).__name__}: {ultimo_error}); reintento {intento + 1}")
+                time.sleep(self._espera(intento))
+        raise ErrorLLM(f"{self.nombre}: {ultimo_error}") from ultimo_error
+
+    def _flujo_con_plazo(self, prompt):
+        """
+        Fragmentos del proveedor leídos en un hilo propio: TimeoutError si entre dos fragmentos
+        pasan más de `timeout` segundos. Un proveedor atascado deja solo ese hilo esperando;
+        el hueco del semáforo y el hilo de la petición quedan libres
+        """
+        cola = queue.Queue()
+        parar = threading.Event()
+
+        def leer():
+            try:
+                for fragmento in self.proveedor.generar_flujo(prompt, self.timeout):
+                    if parar.is_set():
+                        return
+                    cola.put((True, fragmento))
+                cola.put((False, None))
+            except Exception as e:
+                cola.put((False, e))
+
+        threading.Thread(target=leer, name='llm-flujo', daemon=True).start()
+        try:
+            while True:
+                try:
+                    es_fragmento, valor = cola.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"sin fragmentos en {self.timeout}s") from None
+                if not es_fragmento:
+                    if valor is not None:
+                        raise valor
+                    return
+                yield valor
+        finally:
+            parar.set()
+
+    def estadisticas(self):
+        datos = {'proveedor': self.nombre, 'max_concurrentes': self.max_concurrentes, 'en_curso': len(self._en_curso)}
+        datos.update(self.metricas.resumen())
+        return datos
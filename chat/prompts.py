@@ -0,0 +1,246 @@
+import math
+import re
+import unicodedata
+from indice_cpe import tokenizar
+
+# Gemini no expone un tokenizador local: ~4 caracteres por token es suficiente para repartir presupuesto
+CARACTERES_POR_TOKEN = 4
+
+# Peso de la coincidencia con la consulta frente a la prioridad propia del fragmento (ambas en 0..1):
+# lo que el usuario menciona explícitamente entra antes que lo más grave o lo más reciente
+PESO_CONSULTA = 2.0
+
+_PALABRA = re.compile(r'[a-z0-9][a-z0-9\-\._]*[a-z0-9]|[a-z0-9]')
+
+# Palabras vacías (es/en) que no aportan nada para medir la relevancia
+_VACIAS = {
+    'que', 'los', 'las', 'del', 'una', 'uno', 'por', 'para', 'con', 'sin', 'como', 'cual', 'cuales',
+    'son', 'hay', 'mas', 'este', 'esta', 'estos', 'estas', 'sobre', 'entre', 'puedes', 'dime', 'todo',
+    'todas', 'todos', 'the', 'and', 'for', 'with', 'what', 'which', 'are', 'this', 'that', 'from'
+}
+
+
+def estimar_tokens(texto):
+    """Tokens aproximados de un texto (redondeando hacia arriba)"""
+    return -(-len(texto) // CARACTERES_POR_TOKEN)
+
+
+def recortar_a_tokens(texto, max_tokens):
+    """Recorta un texto para que no pase de max_tokens, marcando el corte con '…'"""
+    max_caracteres = max_tokens * CARACTERES_POR_TOKEN
+    if len(texto) <= max_caracteres:
+        return texto
+    return texto[:max(0, max_caracteres - 1)].rstrip() + "…"
+
+
+def palabras_clave(texto):
+    """
+    Conjunto de términos de un texto para medir relevancia: minúsculas, sin tildes ni palabras
+    vacías. Los identificadores compuestos (CVE-2021-44228, log4j-core) se guardan enteros y
+    también por partes, para que 'log4j' coincida con 'log4j-core'
+    """
+    normalizado = unicodedata.normalize('NFKD', texto.lower())
+    normalizado = ''.join(c for c in normalizado if not unicodedata.combining(c))
+    terminos = set()
+    for palabra in _PALABRA.findall(normalizado):
+        partes = tokenizar(palabra)
+        if len(partes) > 1:
+            terminos.add(palabra)
+        terminos.update(p for p in partes if len(p) >= 3 or p.isdigit())
+    return terminos - _VACIAS
+
+
+def pesos_consulta(consulta, terminos_candidatos):
+    """
+    Peso IDF de cada término de la consulta entre los candidatos: un término que aparece en todos
+    (p. ej. 'cve' entre vulnerabilidades) no distingue nada y pesa ~0. Los que no aparecen en
+    ningún candidato se descartan
+    """
+    frecuencias = dict.fromkeys(consulta, 0)
+    for terminos in terminos_candidatos:
+        for termino in consulta & terminos:
+            frecuencias[termino] += 1
+    total = len(terminos_candidatos)
+    return {termino: math.log((total + 1) / (frecuencia + 0.5))
+            for termino, frecuencia in frecuencias.items() if frecuencia}
+
+
+def coincidencia(pesos, terminos):
+    """
+    Relevancia (0..1) de un candidato para la consulta: media entre su término más distintivo
+    (respecto al más distintivo de la consulta) y la fracción del peso total que cubre
+    """
+    cubiertos = [peso for termino, peso in pesos.items() if termino in terminos]
+    total = sum(pesos.values())
+    if not cubiertos or total <= 0:
+        return 0.0
+    return (max(cubiertos) / max(pesos.values()) + sum(cubiertos) / total) / 2
+
+
+class Fragmento:
+    """Trozo de prompt candidato con su coste estimado y su puntuación"""
+
+    __slots__ = ('texto', 'tokens', 'puntuacion', 'orden', 'clave', '_terminos')
+
+    def __init__(self, texto, tokens, puntuacion, orden, clave=None):
+        self.texto = texto
+        self.tokens = tokens
+        self.puntuacion = puntuacion
+        self.orden = orden
+        self.clave = clave
+        self._terminos = None
+
+    @property
+    def terminos(self):
+        """Términos del texto (se extraen una vez: un fragmento guardado no vuelve a tokenizarse)"""
+        if self._terminos is None:
+            self._terminos = frozenset(palabras_clave(self.texto))
+        return self._terminos
+
+
+class Seccion:
+    """
+    Grupo de fragmentos candidatos bajo una cabecera. La cabecera y el pie admiten {incluidos},
+    {total} y {omitidos}; el pie solo aparece si se ha omitido algo. La sección no se emite si no
+    entra ningún fragmento, salvo con siempre=True. Los fragmentos se emiten en el orden en que
+    se añadieron. La selección se guarda en cada construcción y no en la sección, así que una
+    sección ya preparada se puede reutilizar en varios prompts (ConstructorPrompt.agregar)
+    """
+
+    def __init__(self, cabecera=None, pie_omitidos=None, numeracion=None, separador="\n", total=None,
+                 siempre=False, fija=False):
+        self.cabecera = cabecera
+        self.pie_omitidos = pie_omitidos
+        self.numeracion = numeracion
+        self.separador = separador
+        self.total = total
+        self.siempre = siempre or fija
+        # Las secciones fijas no compiten por el presupuesto: entran enteras
+        self.fija = fija
+        self.fragmentos = []
+
+    @classmethod
+    def texto_fijo(cls, *lineas):
+        """Sección fija con un único texto"""
+        seccion = cls(fija=True)
+        seccion.agregar("\n".join(lineas))
+        return seccion
+
+    def _total(self):
+        return self.total if self.total is not None else len(self.fragmentos)
+
+    def _formatear(self, plantilla, incluidos):
+        total = self._total()
+        return plantilla.format(incluidos=incluidos, total=total, omitidos=max(0, total - incluidos))
+
+    def coste_fijo(self):
+        """Tokens de cabecera y pie (el pie se reserva aunque al final no haga falta)"""
+        coste = 0
+        if self.cabecera:
+            coste += estimar_tokens(self._formatear(self.cabecera, self._total())) + 1
+        if self.pie_omitidos:
+            coste += estimar_tokens(self._formatear(self.pie_omitidos, self._total())) + 1
+        return coste
+
+    def agregar(self, texto, prioridad=0.0, clave=None, max_tokens=None):
+        """
+        Añade un candidato. prioridad (0..1) es su importancia propia (severidad, recencia...);
+        clave agrupa variantes de lo mismo en distintas secciones (solo entra una)
+        """
+        if max_tokens:
+            texto = recortar_a_tokens(texto, max_tokens)
+        tokens = estimar_tokens(texto) + len(self.separador)
+        if self.numeracion:
+            tokens += estimar_tokens(self.numeracion.format(i=len(self.fragmentos) + 1))
+        self.fragmentos.append(Fragmento(texto, tokens, prioridad, len(self.fragmentos), clave))
+
+    def renderizar(self, incluidos):
+        if self.fija:
+            incluidos = self.fragmentos
+        if not incluidos and not self.siempre:
+            return None
+        elementos = sorted(incluidos, key=lambda fragmento: fragmento.orden)
+        textos = [fragmento.texto for fragmento in elementos]
+        if self.numeracion:
+            textos = [self.numeracion.format(i=i) + texto for i, texto in enumerate(textos, 1)]
+        lineas = []
+        if self.cabecera:
+            lineas.append(self._formatear(self.cabecera, len(elementos)))
+        if textos:
+            lineas.append(self.separador.join(textos))
+        if self.pie_omitidos and len(elementos) < self._total():
+            lineas.append(self._formatear(self.pie_omitidos, len(elementos)))
+        return "\n".join(lineas)
+
+
+class ConstructorPrompt:
+    """
+    Arma un prompt dentro de un presupuesto de tokens. El texto fijo (instrucciones, consulta,
+    resúmenes) se cuenta primero; el resto del presupuesto se llena de forma voraz con los
+    candidatos de todas las secciones ordenados por prioridad + coincidencia con la consulta.
+    Si un candidato no cabe se prueba el siguiente, así que los pequeños pueden aprovechar el hueco
+    """
+
+    def __init__(self, presupuesto_tokens, consulta=""):
+        self.presupuesto_tokens = presupuesto_tokens
+        self._consulta = palabras_clave(consulta)
+        self._secciones = []
+        self.tokens_estimados = 0
+        self.omitidos = 0
+
+    def fijo(self, *lineas):
+        """Texto que se incluye siempre, en su posición"""
+        return self.agregar(Seccion.texto_fijo(*lineas))
+
+    def seccion(self, cabecera=None, **opciones):
+        """Sección de candidatos en su posición (ver Seccion)"""
+        return self.agregar(Seccion(cabecera, **opciones))
+
+    def agregar(self, seccion):
+        """Añade una sección ya preparada (p. ej. guardada de un prompt anterior) en su posición"""
+        self._secciones.append(seccion)
+        return seccion
+
+    def construir(self):
+        restante = self.presupuesto_tokens
+        incluidos = {id(seccion): [] for seccion in self._secciones}
+        abiertas = set()
+        for seccion in self._secciones:
+            if seccion.fija:
+                restante -= sum(fragmento.tokens for fragmento in seccion.fragmentos)
+            if seccion.siempre:
+                restante -= seccion.coste_fijo()
+                abiertas.add(id(seccion))
+
+        fragmentos = [(posicion, seccion, fragmento) for posicion, seccion in enumerate(self._secciones)
+                      if not seccion.fija for fragmento in seccion.fragmentos]
+        pesos = pesos_consulta(self._consulta, [fragmento.terminos for _, _, fragmento in fragmentos]) if self._consulta else {}
+
+        candidatos = []
+        for posicion, seccion, fragmento in fragmentos:
+            puntuacion = fragmento.puntuacion
+            if pesos:
+                puntuacion += PESO_CONSULTA * coincidencia(pesos, fragmento.terminos)
+            candidatos.append((-puntuacion, posicion, fragmento.orden, seccion, fragmento))
+        # A igualdad de puntuación, primero las secciones y fragmentos que van antes
+        candidatos.sort(key=lambda candidato: candidato[:3])
+
+        claves = set()
+        for _, _, _, seccion, fragmento in candidatos:
+            if fragmento.clave is not None and fragmento.clave in claves:
+                continue
+            coste = fragmento.tokens
+            if id(seccion) not in abiertas:
+                coste += seccion.coste_fijo()
+            if coste > restante:
+                self.omitidos += 1
+                continue
+            restante -= coste
+            abiertas.add(id(seccion))
+            incluidos[id(seccion)].append(fragmento)
+            if fragmento.clave is not None:
+                claves.add(fragmento.clave)
+
+        self.tokens_estimados = self.presupuesto_tokens - restante
+        partes = [seccion.renderizar(incluidos[id(seccion)]) for seccion in self._secciones]
+        return "\n".join(parte for parte in partes if parte is not None)
@@ -0,0 +1,160 @@
+import sys
+from enum import IntEnum
+
+
+class Severidad(IntEnum):
+    """Severidad codificada como entero; el orden coincide con el de los filtros del proyecto"""
+    UNKNOWN = 0
+    LOW = 1
+    MEDIUM = 2
+    HIGH = 3
+    CRITICAL = 4
+
+
+def codificar_severidad(texto):
+    """'HIGH' -> Severidad.HIGH; los valores no reconocidos se conservan tal cual"""
+    return Severidad.__members__.get(texto, texto) if isinstance(texto, str) else texto
+
+
+# Marca de campo ausente (None es un valor válido)
+_SIN_VALOR = object()
+
+
+def internar(valor):
+    """Comparte una sola copia de las cadenas que se repiten entre componentes (tipos, licencias, versiones)"""
+    return sys.intern(valor) if type(valor) is str else valor
+
+
+class Registro:
+    """
+    Registro compacto con __slots__ que se comporta como el dict que sustituye (get, [], in,
+    keys/items), de modo que el código existente no cambia. Las claves fuera de los slots se
+    guardan en un dict auxiliar que solo se crea si hace falta. a_dict() recupera la forma
+    original y solo se usa en los bordes (respuestas JSON, cache)
+    """
+
+    __slots__ = ('_extra',)
+    CAMPOS = ()
+
+    def __init__(self, **campos):
+        self._extra = None
+        for clave, valor in campos.items():
+            self[clave] = valor
+
+    @classmethod
+    def desde_dict(cls, datos):
+        return cls(**datos)
+
+    def _leer(self, clave):
+        if clave in self.CAMPOS:
+            return getattr(self, clave, _SIN_VALOR)
+        return self._extra.get(clave, _SIN_VALOR) if self._extra else _SIN_VALOR
+
+    def _escribir(self, clave, valor):
+        if clave in self.CAMPOS:
+            setattr(self, clave, valor)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[clave] = valor
+
+    def get(self, clave, default=None):
+        valor = self._leer(clave)
+        return default if valor is _SIN_VALOR else valor
+
+    def __getitem__(self, clave):
+        valor = self._leer(clave)
+        if valor is _SIN_VALOR:
+            raise KeyError(clave)
+        return valor
+
+    def __setitem__(self, clave, valor):
+        self._escribir(clave, valor)
+
+    def __contains__(self, clave):
+        return self._leer(clave) is not _SIN_VALOR
+
+    def keys(self):
+        claves = [clave for clave in self.CAMPOS if self._leer(clave) is not _SIN_VALOR]
+        if self._extra:
+            claves.extend(self._extra)
+        return claves
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(clave, self._leer(clave)) for clave in self.keys()]
+
+    def a_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, otro):
+        if isinstance(otro, (Registro, dict)):
+            return self.a_dict() == (otro.a_dict() if isinstance(otro, Registro) else otro)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.a_dict()!r})"
+
+
+class Componente(Registro):
+    """
+    Componente de un SBOM. Cada formato rellena solo sus campos (CycloneDX: tipo/purl/bom_ref;
+    SPDX: spdx_id/download_location) y a_dict devuelve exactamente esos, en el orden de siempre
+    """
+
+    CAMPOS = ('nombre', 'version', 'tipo', 'purl', 'bom_ref', 'spdx_id', 'download_location', 'licencias')
+    __slots__ = CAMPOS
+
+    def _escribir(self, clave, valor):
+        if clave == 'licencias':
+            valor = [internar(licencia) for licencia in valor]
+        elif clave in ('version', 'tipo'):
+            valor = internar(valor)
+        Registro._escribir(self, clave, valor)
+
+
+class Vulnerabilidad(Registro):
+    """
+    Vulnerabilidad de NVD asociada a un componente. La severidad se guarda como Severidad y se
+    expone como 'HIGH'. El componente afectado se guarda como {'nombre': ..., 'version': ...}
+    (con las cadenas del componente internadas) y cada lectura devuelve ese mismo dict, así que
+    vuln['componente_afectado']['version'] = ... modifica la vulnerabilidad como con un dict
+    """
+
+    CAMPOS = ('cve_id', 'descripcion', 'severidad', 'score_cvss', 'vector_cvss', 'fecha_publicacion',
+              'referencias', 'productos_afectados', 'componente_afectado', 'cvss')
+    __slots__ = ('cve_id', 'descripcion', '_severidad', 'score_cvss', 'vector_cvss', 'fecha_publicacion',
+                 'referencias', 'productos_afectados', '_componente', 'cvss')
+
+    def _leer(self, clave):
+        if clave == 'severidad':
+            severidad = getattr(self, '_severidad', _SIN_VALOR)
+            return severidad.name if isinstance(severidad, Severidad) else severidad
+        if clave == 'componente_afectado':
+            return getattr(self, '_componente', _SIN_VALOR)
+        return Registro._leer(self, clave)
+
+    def _escribir(self, clave, valor):
+        if clave == 'severidad':
+            self._severidad = codificar_severidad(valor)
+        elif clave == 'componente_afectado':
+            self._componente = {'nombre': internar(valor.get('nombre', '')), 'version': internar(valor.get('version', ''))}
+        else:
+            Registro._escribir(self, clave, valor)
+
+    @property
+    def nivel_severidad(self):
+        """Nivel numérico (0 = UNKNOWN o no reconocida) sin pasar por la cadena"""
+        severidad = getattr(self, '_severidad', None)
+        return int(severidad) if isinstance(severidad, Severidad) else 0
+
+
+def a_json(objeto):
+    """Para json.dumps(default=...): convierte los registros a su forma dict al serializar"""
+    if isinstance(objeto, Registro):
+        return objeto.a_dict()
+    raise TypeError(f"Object of type {type(objeto).__name__} is not JSON serializable")
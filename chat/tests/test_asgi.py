@@ -0,0 +1,204 @@
+import asyncio
+import os
+import threading
+import time
+import unittest
+
+# ✅ SIN RED: backend LLM simulado antes de importar la app
+os.environ.setdefault('LLM_PROVEEDOR', 'simulado')
+
+from asgi import AplicacionASGI
+
+
+def scope_http(ruta, metodo='GET', cabeceras=(), query=b''):
+    return {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': metodo,
+            'scheme': 'http', 'path': ruta, 'raw_path': ruta.encode(), 'query_string': query,
+            'root_path': '', 'headers': list(cabeceras), 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
+
+
+class AplicacionLenta:
+    """WSGI que tarda `segundos` y anota cuántas peticiones atiende a la vez y en qué hilos"""
+
+    def __init__(self, segundos=0.1):
+        self.segundos = segundos
+        self.activas = 0
+        self.maximo = 0
+        self.hilos = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.activas += 1
+            self.maximo = max(self.maximo, self.activas)
+            self.hilos.add(threading.current_thread().name)
+        time.sleep(self.segundos)
+        with self._lock:
+            self.activas -= 1
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [environ['PATH_INFO'].encode()]
+
+
+class Eco:
+    """WSGI que devuelve método, query, cabecera X-Prueba y cuerpo recibidos"""
+
+    def __call__(self, environ, start_response):
+        cuerpo = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+        start_response('201 Created', [('Content-Type', 'text/plain'), ('X-Eco', 'si')])
+        return [f"{environ['REQUEST_METHOD']} {environ['QUERY_STRING']} {environ.get('HTTP_X_PRUEBA')} ".encode(), cuerpo]
+
+
+class Flujo:
+    """WSGI que emite fragmentos con una pausa entre ellos y anota si se cerró el iterable"""
+
+    def __init__(self, fragmentos=5, pausa=0.02):
+        self.fragmentos = fragmentos
+        self.pausa = pausa
+        self.emitidos = 0
+        self.cerrado = threading.Event()
+
+    def __call__(self, environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/event-stream')])
+        return self.generar()
+
+    def generar(self):
+        try:
+            for i in range(self.fragmentos):
+                self.emitidos += 1
+                yield f"data: {i}\n\n".encode()
+                time.sleep(self.pausa)
+        finally:
+            self.cerrado.set()
+
+
+async def pedir(aplicacion, ruta, cuerpo=(b'',), al_enviar=None, **opciones):
+    """Petición con el cuerpo en trozos; después de enviarlo, receive espera como un cliente conectado"""
+    mensajes = []
+    trozos = list(cuerpo)
+    desconexion = asyncio.Event()
+
+    async def receive():
+        if trozos:
+            trozo = trozos.pop(0)
+            return {'type': 'http.request', 'body': trozo, 'more_body': bool(trozos)}
+        await desconexion.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(mensaje):
+        mensajes.append(mensaje)
+        if al_enviar and al_enviar(mensajes):
+            desconexion.set()
+
+    await aplicacion(scope_http(ruta, **opciones), receive, send)
+    return mensajes
+
+
+def cuerpo_respuesta(mensajes):
+    return b''.join(m.get('body', b'') for m in mensajes if m['type'] == 'http.response.body')
+
+
+class TestAplicacionASGI(unittest.TestCase):
+    def test_respuesta(self):
+        aplicacion = AplicacionASGI(AplicacionLenta(0), max_hilos=2)
+        mensajes = asyncio.run(pedir(aplicacion, '/health'))
+        self.assertEqual(mensajes[0]['status'], 200)
+        self.assertEqual(cuerpo_respuesta(mensajes), b'/health')
+        self.assertFalse(mensajes[-1]['more_body'])
+
+    def test_post_con_cuerpo_en_trozos(self):
+        """Test: El cuerpo llega en varios mensajes http.request y la aplicación WSGI lo lee entero"""
+        aplicacion = AplicacionASGI(Eco(), max_hilos=1, cuerpo_en_memoria=4)
+        mensajes = asyncio.run(pedir(aplicacion, '/eco', cuerpo=(b'{"a":', b' 1}'), metodo='POST', query=b'x=1',
+                                     cabeceras=[(b'content-length', b'8'), (b'x-prueba', b'valor')]))
+        self.assertEqual(mensajes[0], {'type': 'http.response.start', 'status': 201,
+                                       'headers': [(b'content-type', b'text/plain'), (b'x-eco', b'si')]})
+        self.assertEqual(cuerpo_respuesta(mensajes), b'POST x=1 valor {"a": 1}')
+
+    def test_streaming_fragmento_a_fragmento(self):
+        """Test: Cada fragmento del iterable WSGI sale en su propio http.response.body"""
+        aplicacion = AplicacionASGI(Flujo(fragmentos=3, pausa=0), max_hilos=1)
+        mensajes = asyncio.run(pedir(aplicacion, '/stream'))
+        cuerpos = [m for m in mensajes if m['type'] == 'http.response.body']
+        self.assertEqual([m['body'] for m in cuerpos], [b'data: 0\n\n', b'data: 1\n\n', b'data: 2\n\n', b''])
+        self.assertEqual([m['more_body'] for m in cuerpos], [True, True, True, False])
+
+    def test_desconexion_corta_el_streaming(self):
+        """Test: Si el cliente se desconecta, el iterable se cierra y el hilo vuelve al pool"""
+        flujo = Flujo(fragmentos=100, pausa=0.01)
+        aplicacion = AplicacionASGI(flujo, max_hilos=1)
+        # El cliente se va tras recibir el primer fragmento
+        mensajes = asyncio.run(pedir(aplicacion, '/stream', al_enviar=lambda mensajes: len(mensajes) >= 2))
+        self.assertTrue(flujo.cerrado.is_set())
+        self.assertLess(flujo.emitidos, 100)
+        self.assertTrue(all(m.get('more_body', True) for m in mensajes))
+        # El único hilo del pool queda libre para la siguiente petición
+        siguiente = AplicacionLenta(0)
+        aplicacion.aplicacion_wsgi = siguiente
+        self.assertEqual(asyncio.run(pedir(aplicacion, '/health'))[0]['status'], 200)
+
+    def test_desconexion_antes_del_cuerpo(self):
+        """Test: Si el cliente se va mientras envía el cuerpo no se ejecuta la aplicación"""
+        wsgi = AplicacionLenta(0)
+        aplicacion = AplicacionASGI(wsgi, max_hilos=1)
+        mensajes = []
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(mensaje):
+            mensajes.append(mensaje)
+
+        asyncio.run(aplicacion(scope_http('/x', metodo='POST'), receive, send))
+        self.assertEqual((mensajes, wsgi.maximo), ([], 0))
+
+    def test_app_flask(self):
+        """Test: La aplicación del servicio responde a través del adaptador"""
+        import asgi
+        mensajes = asyncio.run(pedir(asgi.asgi_app, '/health'))
+        self.assertEqual(mensajes[0]['status'], 200)
+
+    def test_pool_acotado(self):
+        """Test: Nunca hay más peticiones en curso que hilos en el pool, y todas terminan"""
+        wsgi = AplicacionLenta(0.1)
+        aplicacion = AplicacionASGI(wsgi, max_hilos=2)
+
+        async def varias():
+            return await asyncio.gather(*(pedir(aplicacion, f'/p{i}') for i in range(6)))
+
+        inicio = time.monotonic()
+        respuestas = asyncio.run(varias())
+        self.assertEqual([r[0]['status'] for r in respuestas], [200] * 6)
+        self.assertEqual(wsgi.maximo, 2)
+        self.assertLessEqual(len(wsgi.hilos), 2)
+        self.assertTrue(all(nombre.startswith('asgi') for nombre in wsgi.hilos))
+        self.assertGreaterEqual(time.monotonic() - inicio, 0.3)
+
+    def test_peticiones_concurrentes(self):
+        """Test: Con hilos libres las peticiones se atienden en paralelo"""
+        wsgi = AplicacionLenta(0.2)
+        aplicacion = AplicacionASGI(wsgi, max_hilos=4)
+
+        async def varias():
+            return await asyncio.gather(*(pedir(aplicacion, f'/p{i}') for i in range(4)))
+
+        inicio = time.monotonic()
+        asyncio.run(varias())
+        self.assertLess(time.monotonic() - inicio, 0.6)
+        self.assertEqual(wsgi.maximo, 4)
+
+    def test_ciclo_de_vida(self):
+        aplicacion = AplicacionASGI(AplicacionLenta(0), max_hilos=1)
+        entrada = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        enviados = []
+
+        async def receive():
+            return entrada.pop(0)
+
+        async def send(mensaje):
+            enviados.append(mensaje['type'])
+
+        asyncio.run(aplicacion({'type': 'lifespan'}, receive, send))
+        self.assertEqual(enviados, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from cache_nvd import CacheMemoria, CacheNVD
+
+
+class TestCacheMemoria(unittest.TestCase):
+    def test_guardar_y_obtener(self):
+        """Test: Un valor guardado se recupera hasta que caduca"""
+        cache = CacheMemoria()
+        cache.guardar('a', [1, 2], time.time() + 60, 10)
+        self.assertEqual(cache.obtener('a'), [1, 2])
+        self.assertIsNone(cache.obtener('b'))
+
+    def test_caducidad(self):
+        """Test: Las entradas caducadas no se devuelven y se expulsan"""
+        cache = CacheMemoria()
+        cache.guardar('vieja', 1, time.time() - 1, 10)
+        self.assertIsNone(cache.obtener('vieja'))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_por_entradas(self):
+        """Test: Al superar max_entradas se expulsa la menos usada recientemente"""
+        cache = CacheMemoria(max_entradas=2)
+        expira = time.time() + 60
+        cache.guardar('a', 1, expira, 1)
+        cache.guardar('b', 2, expira, 1)
+        cache.obtener('a')
+        cache.guardar('c', 3, expira, 1)
+        self.assertEqual(cache.obtener('a'), 1)
+        self.assertIsNone(cache.obtener('b'))
+        self.assertEqual(cache.obtener('c'), 3)
+
+    def test_limite_de_bytes(self):
+        """Test: El límite de bytes expulsa entradas y rechaza las que no caben nunca"""
+        cache = CacheMemoria(max_bytes=100)
+        expira = time.time() + 60
+        cache.guardar('a', 'x', expira, 60)
+        cache.guardar('b', 'y', expira, 60)
+        self.assertIsNone(cache.obtener('a'))
+        self.assertEqual(cache.obtener('b'), 'y')
+        cache.guardar('enorme', 'z', expira, 500)
+        self.assertIsNone(cache.obtener('enorme'))
+
+    def test_reescritura_no_deja_caducidad_obsoleta(self):
+        """Test: Reescribir una clave con otra caducidad no la expulsa por la antigua"""
+        cache = CacheMemoria()
+        cache.guardar('a', 1, time.time() + 0.05, 1)
+        cache.guardar('a', 2, time.time() + 60, 1)
+        time.sleep(0.1)
+        cache.guardar('b', 3, time.time() + 60, 1)
+        self.assertEqual(cache.obtener('a'), 2)
+
+
+class TestCacheNVD(unittest.TestCase):
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.ruta = os.path.join(self.directorio, 'nvd_cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def test_persistencia_entre_instancias(self):
+        """Test: Lo guardado por un proceso lo lee otro que abre el mismo fichero"""
+        CacheNVD(self.ruta).guardar('log4j@2.14.1', [{'cve_id': 'CVE-2021-44228'}])
+        otra = CacheNVD(self.ruta)
+        self.assertEqual(otra.obtener('log4j@2.14.1'), [{'cve_id': 'CVE-2021-44228'}])
+        self.assertEqual(len(otra), 1)
+
+    def test_caducidad(self):
+        """Test: Las entradas caducadas no se devuelven"""
+        cache = CacheNVD(self.ruta, ttl=-1)
+        cache.guardar('a', [])
+        self.assertIsNone(CacheNVD(self.ruta).obtener('a'))
+
+    def test_lista_vacia_es_un_acierto(self):
+        """Test: "Sin vulnerabilidades" ([]) se distingue de "no está en cache" (None)"""
+        cache = CacheNVD(self.ruta)
+        cache.guardar('a', [])
+        self.assertEqual(CacheNVD(self.ruta).obtener('a'), [])
+
+    def test_lru_de_sqlite(self):
+        """Test: purgar expulsa las entradas menos usadas por encima de max_entradas"""
+        cache = CacheNVD(self.ruta, max_entradas=2)
+        for clave in ('a', 'b', 'c'):
+            cache.guardar(clave, clave)
+            time.sleep(0.01)
+        cache.purgar()
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(CacheNVD(self.ruta).obtener('a'))
+
+    def test_aciertos_en_memoria_actualizan_ultimo_acceso(self):
+        """Test: La clave más leída desde memoria no es la primera en salir del LRU de SQLite"""
+        cache = CacheNVD(self.ruta, max_entradas=2)
+        cache.guardar('caliente', 1)
+        time.sleep(0.01)
+        cache.guardar('b', 2)
+        time.sleep(0.01)
+        self.assertEqual(cache.obtener('caliente'), 1)  # acierto en memoria
+        cache.guardar('c', 3)
+        cache.purgar()
+        otra = CacheNVD(self.ruta)
+        self.assertEqual(otra.obtener('caliente'), 1)
+        self.assertIsNone(otra.obtener('b'))
+
+    def test_volcado_por_lotes(self):
+        """Test: Los accesos en memoria se vuelcan a SQLite al llenar el lote"""
+        cache = CacheNVD(self.ruta)
+        cache.ACCESOS_POR_LOTE = 2
+        cache.guardar('a', 1)
+        cache.guardar('b', 2)
+        antes = dict(cache._conexion().execute("SELECT clave, ultimo_acceso FROM cache_nvd"))
+        time.sleep(0.01)
+        cache.obtener('a')
+        self.assertEqual(len(cache._accesos), 1)
+        cache.obtener('b')
+        self.assertEqual(cache._accesos, {})
+        despues = dict(cache._conexion().execute("SELECT clave, ultimo_acceso FROM cache_nvd"))
+        self.assertGreater(despues['a'], antes['a'])
+        self.assertGreater(despues['b'], antes['b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import os
+import time
+import unittest
+from unittest import mock
+
+# ✅ SIN RED: backend LLM simulado antes de importar la app
+os.environ.setdefault('LLM_PROVEEDOR', 'simulado')
+
+import app
+from conversaciones import ContextoSBOM
+from cache_respuestas import CacheRespuestas, normalizar_pregunta, palabras_contenido, similitud, vector_ngramas
+
+
+class TestNormalizacion(unittest.TestCase):
+    def test_normalizar_pregunta(self):
+        """Test: Minúsculas, sin tildes ni puntuación y espacios colapsados"""
+        self.assertEqual(normalizar_pregunta("  ¿Cuáles son las vulnerabilidades CRÍTICAS?  "),
+                         "cuales son las vulnerabilidades criticas")
+        self.assertEqual(normalizar_pregunta("¿Afecta a log4j-core 2.14.1?"), "afecta a log4j-core 2.14.1")
+
+    def test_palabras_contenido(self):
+        """Test: Se quitan las palabras vacías pero no las negaciones"""
+        self.assertEqual(palabras_contenido("cuales son las vulnerabilidades criticas"),
+                         {'vulnerabilidades', 'criticas'})
+        self.assertIn('no', palabras_contenido("cuales no son criticas"))
+
+
+class TestCacheExacta(unittest.TestCase):
+    def test_acierto_exacto_con_pregunta_normalizada(self):
+        """Test: La misma pregunta con otra puntuación o tildes acierta en el nivel exacto"""
+        cache = CacheRespuestas()
+        cache.guardar("¿Cuáles son las críticas?", 'sbom', 'criterios', "Respuesta")
+        self.assertEqual(cache.obtener("cuales son las criticas", 'sbom', 'criterios'), ("Respuesta", 'exacta'))
+        self.assertEqual(cache.estadisticas()['aciertos_exactos'], 1)
+
+    def test_clave_depende_del_analisis_y_criterios(self):
+        """Test: Otro análisis u otros criterios no comparten respuesta"""
+        cache = CacheRespuestas()
+        cache.guardar("¿Cuáles son las críticas?", 'sbom', 'criterios', "Respuesta")
+        self.assertIsNone(cache.obtener("¿Cuáles son las críticas?", 'otro', 'criterios'))
+        self.assertIsNone(cache.obtener("¿Cuáles son las críticas?", 'sbom', 'otros'))
+        self.assertEqual(cache.estadisticas()['fallos'], 2)
+
+    def test_similitud_desactivada_por_defecto(self):
+        """Test: Sin umbral solo hay coincidencias exactas"""
+        cache = CacheRespuestas()
+        cache.guardar("¿Cuáles son las vulnerabilidades críticas?", 'sbom', 'criterios', "Respuesta")
+        self.assertIsNone(cache.obtener("vulnerabilidades criticas cuales son", 'sbom', 'criterios'))
+
+    def test_caducidad(self):
+        """Test: Las respuestas caducan con el TTL"""
+        cache = CacheRespuestas(ttl=0.05)
+        cache.guardar("pregunta", 'sbom', 'criterios', "Respuesta")
+        time.sleep(0.1)
+        self.assertIsNone(cache.obtener("pregunta", 'sbom', 'criterios'))
+
+
+class TestCacheSimilar(unittest.TestCase):
+    def setUp(self):
+        self.cache = CacheRespuestas(umbral_similitud=0.9)
+
+    def comprobar_fallo(self, guardada, nueva):
+        self.cache.guardar(guardada, 'sbom', 'criterios', "Respuesta a: " + guardada)
+        self.assertIsNone(self.cache.obtener(nueva, 'sbom', 'criterios'), f"{guardada!r} respondió a {nueva!r}")
+
+    def test_reformulacion_acierta(self):
+        """Test: Cambiar solo palabras vacías u orden reutiliza la respuesta"""
+        self.cache.guardar("¿Cuáles son las vulnerabilidades críticas?", 'sbom', 'criterios', "Respuesta")
+        self.assertEqual(self.cache.obtener("cuales son vulnerabilidades criticas", 'sbom', 'criterios'),
+                         ("Respuesta", 'similar'))
+        self.assertEqual(self.cache.estadisticas()['aciertos_similares'], 1)
+
+    def test_negacion(self):
+        """Test: 'no son críticas' no reutiliza la respuesta de 'críticas'"""
+        self.comprobar_fallo("¿Qué vulnerabilidades son críticas?", "¿Qué vulnerabilidades no son críticas?")
+
+    def test_severidad(self):
+        """Test: Severidad alta y baja son preguntas distintas"""
+        self.comprobar_fallo("¿Cuántas vulnerabilidades tienen severidad alta?",
+                             "¿Cuántas vulnerabilidades tienen severidad baja?")
+
+    def test_antonimos(self):
+        """Test: Fáciles y difíciles de solucionar son preguntas distintas"""
+        self.comprobar_fallo("¿Qué vulnerabilidades son fáciles de solucionar?",
+                             "¿Qué vulnerabilidades son difíciles de solucionar?")
+
+    def test_componentes_parecidos(self):
+        """Test: openssl y openssh son componentes distintos"""
+        self.comprobar_fallo("¿Qué vulnerabilidades del SBOM afectan a openssl y cómo se solucionan?",
+                             "¿Qué vulnerabilidades del SBOM afectan a openssh y cómo se solucionan?")
+
+    def test_identificadores(self):
+        """Test: Otro CVE u otra versión no reutiliza la respuesta"""
+        self.comprobar_fallo("¿Me afecta CVE-2021-44228?", "¿Me afecta CVE-2021-45046?")
+        self.comprobar_fallo("¿Es vulnerable lodash 4.17.20?", "¿Es vulnerable lodash 4.17.21?")
+
+    def test_n_gramas_no_bastan(self):
+        """Test: Pares como openssl/openssh superan el umbral de n-gramas: los separa la comprobación de palabras"""
+        a = vector_ngramas(normalizar_pregunta("¿Qué vulnerabilidades del SBOM afectan a openssl y cómo se solucionan?"))
+        b = vector_ngramas(normalizar_pregunta("¿Qué vulnerabilidades del SBOM afectan a openssh y cómo se solucionan?"))
+        self.assertGreaterEqual(similitud(a, b), 0.9)
+
+    def test_respuesta_caducada(self):
+        """Test: Si la respuesta caducó no se sirve por similitud"""
+        cache = CacheRespuestas(ttl=0.05, umbral_similitud=0.9)
+        cache.guardar("¿Cuáles son las vulnerabilidades críticas?", 'sbom', 'criterios', "Respuesta")
+        time.sleep(0.1)
+        self.assertIsNone(cache.obtener("cuales son vulnerabilidades criticas", 'sbom', 'criterios'))
+
+
+class TestContextoCacheChat(unittest.TestCase):
+    """La clave de la cache de respuestas del chat: proyecto activo y prompt sin conversación privada"""
+
+    def setUp(self):
+        sbom = {'formato': 'CycloneDX', 'resumen': {'total_componentes': 1}, 'vulnerabilidades_nvd': [
+            {'cve_id': 'CVE-2021-23337', 'severidad': 'HIGH', 'componente_afectado': {'nombre': 'lodash', 'version': '4.17.20'}}
+        ]}
+        # Dos usuarios con el mismo SBOM: la huella del análisis es la misma
+        for usuario in ('cache-ana', 'cache-luis'):
+            app.historial_conversaciones.guardar_contexto_sbom(usuario, ContextoSBOM('sbom.json', sbom))
+
+    def contexto_cache(self, usuario, proyecto_id, proyecto_nombre, proyecto_data=None):
+        async def consultar_proyecto_api(proyecto_id, cookies=None):
+            return 200, dict(proyecto_data or {}, nombre=proyecto_nombre)
+
+        with mock.patch.object(app, 'consultar_proyecto_api', consultar_proyecto_api):
+            _, es_pregunta_sbom, _, contexto_cache = app.bucle_async.ejecutar(app.preparar_mensaje_chat(
+                usuario, "¿Cuáles son las vulnerabilidades críticas del SBOM?", proyecto_id, proyecto_nombre))
+        self.assertTrue(es_pregunta_sbom)
+        return contexto_cache
+
+    def test_mismo_proyecto_comparte_clave(self):
+        """Test: Dos usuarios con el mismo análisis y proyecto comparten respuesta"""
+        self.assertEqual(self.contexto_cache('cache-ana', 1, 'Web'), self.contexto_cache('cache-luis', 1, 'Web'))
+        self.assertEqual(self.contexto_cache('cache-ana', None, None), self.contexto_cache('cache-luis', None, None))
+
+    def test_otro_proyecto_otra_clave(self):
+        """Test: Con otro proyecto, o sin proyecto, no se sirve la respuesta del proyecto de otro usuario"""
+        con_proyecto = self.contexto_cache('cache-ana', 1, 'Web')
+        self.assertNotEqual(con_proyecto, self.contexto_cache('cache-luis', 2, 'Interno'))
+        self.assertNotEqual(con_proyecto, self.contexto_cache('cache-luis', None, None))
+        self.assertNotEqual(con_proyecto, self.contexto_cache('cache-luis', 1, 'Web', {'max_vulnerabilidades': 3}))
+        self.assertEqual(con_proyecto[0], self.contexto_cache('cache-luis', 2, 'Interno')[0])
+
+    def test_historial_privado_fuera_del_prompt_cacheable(self):
+        """Test: Con historiales distintos, la respuesta compartible se genera sin la conversación de nadie"""
+        app.historial_conversaciones.agregar_mensajes('cache-ana', "Usuario: mi servidor interno es srv-ana-01")
+        app.historial_conversaciones.agregar_mensajes('cache-luis', "Usuario: trabajo en el proyecto secreto luis-x")
+        pregunta = "¿Cuáles son las vulnerabilidades críticas del SBOM?"
+
+        def preparar(usuario, cachear=True):
+            return app.bucle_async.ejecutar(app.preparar_mensaje_chat(usuario, pregunta, None, None, cachear=cachear))
+
+        prompt_ana, _, _, clave_ana = preparar('cache-ana')
+        prompt_luis, _, _, clave_luis = preparar('cache-luis')
+        self.assertEqual(clave_ana, clave_luis)
+        self.assertEqual(prompt_ana, prompt_luis)
+        self.assertNotIn("srv-ana-01", prompt_ana)
+        self.assertNotIn("luis-x", prompt_luis)
+
+        # Sin cache la respuesta es solo para este usuario: su conversación sí entra
+        prompt_privado, _, _, clave_privada = preparar('cache-ana', cachear=False)
+        self.assertIsNone(clave_privada)
+        self.assertIn("srv-ana-01", prompt_privado)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+# ✅ SIN RED: backend LLM simulado antes de importar la app
+os.environ.setdefault('LLM_PROVEEDOR', 'simulado')
+
+import app
+from llm import ClienteLLM, ProveedorLLM, ProveedorSimulado
+
+
+class ProveedorFragmentos(ProveedorLLM):
+    """Streaming con fragmentos fijos; con `fallo_tras` falla después de emitir ese número"""
+
+    nombre = 'fragmentos'
+
+    def __init__(self, fragmentos, fallo_tras=None):
+        self.fragmentos = fragmentos
+        self.fallo_tras = fallo_tras
+
+    def generar_flujo(self, prompt, timeout=None):
+        for numero, fragmento in enumerate(self.fragmentos):
+            if numero == self.fallo_tras:
+                raise RuntimeError("corte del proveedor")
+            yield fragmento
+
+
+def leer_eventos(respuesta):
+    """Separa el cuerpo SSE en (evento, datos JSON) comprobando el formato de cada bloque"""
+    cuerpo = respuesta.get_data(as_text=True)
+    assert cuerpo.endswith('\n\n'), cuerpo[-50:]
+    eventos = []
+    for bloque in cuerpo[:-2].split('\n\n'):
+        lineas = bloque.split('\n')
+        assert len(lineas) == 2, bloque
+        assert lineas[0].startswith('event: ') and lineas[1].startswith('data: '), bloque
+        eventos.append((lineas[0][len('event: '):], json.loads(lineas[1][len('data: '):])))
+    return eventos
+
+
+class TestChatStream(unittest.TestCase):
+    def cliente(self, usuario):
+        cliente = app.app.test_client()
+        cliente.set_cookie('username', usuario)
+        return cliente
+
+    def stream(self, usuario, mensaje="Hola, ¿qué tal?", **datos):
+        return self.cliente(usuario).post('/chat/mensajes/stream', json=dict(datos, message=mensaje, cache=False))
+
+    def usar_llm(self, proveedor):
+        parche = mock.patch.object(app, 'cliente_llm', ClienteLLM(proveedor, reintentos=0, espera_base=0.001))
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def test_formato_sse(self):
+        """Test: Eventos 'fragmento' seguidos de un único 'fin', con cabeceras para no almacenar en buffer"""
+        self.usar_llm(ProveedorSimulado(palabras_por_fragmento=2))
+        respuesta = self.stream('stream-ana')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.mimetype, 'text/event-stream')
+        self.assertEqual(respuesta.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(respuesta.headers['X-Accel-Buffering'], 'no')
+        eventos = leer_eventos(respuesta)
+        nombres = [evento for evento, _ in eventos]
+        self.assertGreater(len(nombres), 2)
+        self.assertEqual(nombres, ['fragmento'] * (len(nombres) - 1) + ['fin'])
+        texto = ''.join(datos['texto'] for _, datos in eventos[:-1])
+        self.assertEqual(eventos[-1][1]['message'], texto)
+        self.assertTrue(texto.startswith('[simulado'))
+
+    def test_fin_igual_que_mensajes(self):
+        """Test: El evento 'fin' tiene el mismo cuerpo que /chat/mensajes para la misma conversación"""
+        final = leer_eventos(self.stream('stream-luis'))[-1][1]
+        normal = self.cliente('stream-eva').post('/chat/mensajes', json={'message': "Hola, ¿qué tal?", 'cache': False})
+        self.assertEqual(final, normal.get_json())
+
+    def test_saltos_de_linea_en_un_solo_data(self):
+        """Test: Un fragmento con saltos de línea no rompe el evento (el JSON los escapa)"""
+        self.usar_llm(ProveedorFragmentos(["línea 1\n\nlínea 2", "\nfin"]))
+        eventos = leer_eventos(self.stream('stream-ana'))
+        self.assertEqual([datos['texto'] for _, datos in eventos[:-1]], ["línea 1\n\nlínea 2", "\nfin"])
+
+    def test_historial_al_terminar(self):
+        """Test: La pregunta y la respuesta completa se guardan en el historial al acabar el stream"""
+        self.usar_llm(ProveedorFragmentos(["uno", " dos"]))
+        leer_eventos(self.stream('stream-historial', "¿Cuántos?"))
+        self.assertEqual(list(app.historial_conversaciones.obtener('stream-historial').mensajes)[-2:],
+                         ["Usuario: ¿Cuántos?", "Bot: uno dos"])
+
+    def test_fallo_a_mitad(self):
+        """Test: Si el modelo falla tras emitir algo, el stream cierra con 'fin' y lo ya enviado"""
+        self.usar_llm(ProveedorFragmentos(["parcial", "resto"], fallo_tras=1))
+        eventos = leer_eventos(self.stream('stream-ana'))
+        self.assertEqual(eventos, [('fragmento', {'texto': 'parcial'}), ('fin', eventos[-1][1])])
+        self.assertEqual(eventos[-1][1]['message'], 'parcial')
+
+    def test_fallo_antes_de_empezar(self):
+        """Test: Si el modelo falla sin emitir nada se envía un mensaje de error como fragmento"""
+        self.usar_llm(ProveedorFragmentos(["nada"], fallo_tras=0))
+        eventos = leer_eventos(self.stream('stream-ana'))
+        self.assertEqual([evento for evento, _ in eventos], ['fragmento', 'fin'])
+        self.assertIn("error", eventos[0][1]['texto'])
+
+    def test_mensaje_vacio(self):
+        """Test: Sin mensaje responde 400 en JSON, no un stream"""
+        respuesta = self.cliente('stream-ana').post('/chat/mensajes/stream', json={'message': ''})
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(respuesta.get_json(), {"error": "Mensaje vacío"})
+
+
+if __name__ == '__main__':
+    unittest.main()
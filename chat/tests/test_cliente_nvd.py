@@ -0,0 +1,187 @@
+import asyncio
+import time
+import unittest
+from email.utils import formatdate
+
+from aiohttp import web
+
+from cliente_nvd import (ClienteNVD, LimitadorTasa, segundos_retry_after, NVD_PAUSA_POR_DEFECTO,
+                         NVD_PETICIONES_CON_CLAVE, NVD_PETICIONES_SIN_CLAVE)
+
+
+class TestLimitadorTasa(unittest.TestCase):
+    def test_cuota_segun_api_key(self):
+        """Test: Con API key la cuota es la de NVD con clave, sin ella la pública"""
+        for api_key, peticiones in ((None, NVD_PETICIONES_SIN_CLAVE), ('clave', NVD_PETICIONES_CON_CLAVE)):
+            limitador = LimitadorTasa.para_nvd(api_key)
+            self.assertLessEqual(limitador.capacidad + limitador.tasa * 30, peticiones)
+
+    def test_rafaga_inicial_sin_espera(self):
+        """Test: Las primeras `capacidad` peticiones no esperan"""
+        limitador = LimitadorTasa(50, 30)
+        esperas = [limitador._reservar() for _ in range(limitador.capacidad)]
+        self.assertEqual(esperas, [0.0] * limitador.capacidad)
+
+    def test_esperas_crecientes_al_agotar_tokens(self):
+        """Test: Sin tokens cada reserva espera 1/tasa más que la anterior"""
+        limitador = LimitadorTasa(50, 30)
+        for _ in range(limitador.capacidad):
+            limitador._reservar()
+        primera = limitador._reservar()
+        segunda = limitador._reservar()
+        self.assertAlmostEqual(primera, 1 / limitador.tasa, delta=0.05)
+        self.assertAlmostEqual(segunda - primera, 1 / limitador.tasa, delta=0.05)
+
+    def test_nunca_supera_la_cuota(self):
+        """Test: En cualquier ventana de 30 s no se conceden más peticiones que la cuota"""
+        limitador = LimitadorTasa(5, 30)
+        instantes = sorted(limitador._reservar() for _ in range(20))
+        for i, inicio in enumerate(instantes):
+            en_ventana = [t for t in instantes[i:] if t < inicio + 30]
+            self.assertLessEqual(len(en_ventana), 5)
+
+    def test_pausar_bloquea_todas_las_peticiones(self):
+        """Test: Tras pausar (Retry-After) ni los tokens acumulados evitan la espera"""
+        limitador = LimitadorTasa(50, 30)
+        limitador.pausar(2)
+        self.assertGreater(limitador._reservar(), 1.9)
+
+    def test_adquirir_asincrono(self):
+        """Test: adquirir espera lo reservado sin depender de un event loop concreto"""
+        limitador = LimitadorTasa(5, 30)
+        limitador.tasa = 20.0
+
+        async def dos_peticiones():
+            inicio = time.monotonic()
+            await limitador.adquirir()
+            await limitador.adquirir()
+            return time.monotonic() - inicio
+
+        self.assertGreaterEqual(asyncio.run(dos_peticiones()), 0.04)
+
+
+class TestRetryAfter(unittest.TestCase):
+    def test_segundos(self):
+        self.assertEqual(segundos_retry_after({'Retry-After': '12'}), 12.0)
+
+    def test_fecha_http(self):
+        segundos = segundos_retry_after({'Retry-After': formatdate(time.time() + 60, usegmt=True)})
+        self.assertAlmostEqual(segundos, 60, delta=2)
+
+    def test_ausente_o_invalida(self):
+        self.assertEqual(segundos_retry_after({}), NVD_PAUSA_POR_DEFECTO)
+        self.assertEqual(segundos_retry_after({'Retry-After': 'pronto'}), NVD_PAUSA_POR_DEFECTO)
+
+
+class ServidorNVD:
+    """API de NVD falsa en 127.0.0.1: anota las conexiones TCP (puerto del cliente) y las cabeceras"""
+
+    def __init__(self, estado=200, cabeceras=None):
+        self.estado = estado
+        self.cabeceras = cabeceras or {}
+        self.conexiones = set()
+        self.peticiones = []
+
+    async def responder(self, request):
+        self.conexiones.add(request.transport.get_extra_info('peername')[1])
+        self.peticiones.append((dict(request.query), request.headers.get('apiKey')))
+        if self.estado != 200:
+            return web.Response(status=self.estado, headers=self.cabeceras)
+        return web.json_response({'vulnerabilities': [{'cve': {'id': 'CVE-2021-23337'}}]})
+
+    async def iniciar(self):
+        aplicacion = web.Application()
+        aplicacion.router.add_get('/cves', self.responder)
+        self._runner = web.AppRunner(aplicacion)
+        await self._runner.setup()
+        sitio = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await sitio.start()
+        puerto = sitio._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{puerto}/cves"
+
+    async def parar(self):
+        await self._runner.cleanup()
+
+
+class TestClienteNVD(unittest.TestCase):
+    def escenario(self, prueba, servidor=None, **opciones):
+        """Ejecuta prueba(cliente) contra un ServidorNVD y cierra cliente y servidor al terminar"""
+        servidor = servidor or ServidorNVD()
+
+        async def ejecutar():
+            url = await servidor.iniciar()
+            cliente = ClienteNVD(url, limitador=LimitadorTasa(1000, 1), **opciones)
+            try:
+                return await prueba(cliente)
+            finally:
+                await cliente.cerrar()
+                await servidor.parar()
+
+        return servidor, asyncio.run(ejecutar())
+
+    def test_conexion_reutilizada(self):
+        """Test: Consultas seguidas comparten la sesión y una sola conexión TCP (keep-alive)"""
+        async def prueba(cliente):
+            sesiones = set()
+            for numero in range(5):
+                status, datos, _ = await cliente.consultar({'keywordSearch': f'p{numero}'})
+                sesiones.add(id(cliente.sesion()))
+                self.assertEqual((status, datos['vulnerabilities'][0]['cve']['id']), (200, 'CVE-2021-23337'))
+            return sesiones
+
+        servidor, sesiones = self.escenario(prueba)
+        self.assertEqual(len(sesiones), 1)
+        self.assertEqual(len(servidor.conexiones), 1)
+        self.assertEqual([query for query, _ in servidor.peticiones], [{'keywordSearch': f'p{n}'} for n in range(5)])
+
+    def test_limite_de_conexiones(self):
+        """Test: Las consultas simultáneas no abren más conexiones que limite_conexiones"""
+        async def prueba(cliente):
+            await asyncio.gather(*(cliente.consultar({'keywordSearch': str(n)}) for n in range(10)))
+
+        servidor, _ = self.escenario(prueba, limite_conexiones=2)
+        self.assertEqual(len(servidor.peticiones), 10)
+        self.assertLessEqual(len(servidor.conexiones), 2)
+
+    def test_api_key_en_cabecera(self):
+        """Test: La API key va en la cabecera apiKey de todas las peticiones"""
+        async def prueba(cliente):
+            await cliente.consultar({})
+
+        servidor, _ = self.escenario(prueba, api_key='secreta')
+        self.assertEqual(servidor.peticiones[0][1], 'secreta')
+
+    def test_429_pausa_el_limitador(self):
+        """Test: Un 429 con Retry-After pausa el limitador compartido"""
+        async def prueba(cliente):
+            status, datos, _ = await cliente.consultar({})
+            return status, datos, cliente.limitador._reservar()
+
+        _, (status, datos, espera) = self.escenario(prueba, ServidorNVD(429, {'Retry-After': '5'}))
+        self.assertEqual((status, datos), (429, None))
+        self.assertGreater(espera, 4)
+
+    def test_sesion_por_event_loop_y_cierre(self):
+        """Test: Otro event loop obtiene una sesión nueva; cerrar cierra la sesión activa"""
+        cliente = ClienteNVD('http://127.0.0.1:9/cves')
+
+        async def abrir():
+            return cliente.sesion()
+
+        bucles = [asyncio.new_event_loop(), asyncio.new_event_loop()]
+        try:
+            primera = bucles[0].run_until_complete(abrir())
+            self.assertIs(bucles[0].run_until_complete(abrir()), primera)
+            segunda = bucles[1].run_until_complete(abrir())
+            self.assertIsNot(primera, segunda)
+            bucles[1].run_until_complete(cliente.cerrar())
+            self.assertTrue(segunda.closed)
+            self.assertIsNone(cliente._sesion)
+            bucles[0].run_until_complete(primera.close())
+        finally:
+            for bucle in bucles:
+                bucle.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,260 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from conversaciones import AlmacenMemoria, AlmacenSQLite, ContextoSBOM, Conversacion
+
+
+def sbom_de_prueba(*cves):
+    return {
+        'formato': 'CycloneDX',
+        'resumen': {'total_componentes': 2},
+        'componentes': [{'nombre': 'lodash', 'version': '4.17.20'}, {'nombre': 'jquery', 'version': '3.4.1'}],
+        'vulnerabilidades_nvd': [
+            {'cve_id': cve, 'severidad': severidad, 'componente_afectado': {'nombre': 'lodash', 'version': '4.17.20'}}
+            for cve, severidad in cves
+        ]
+    }
+
+
+class TestContextoSBOM(unittest.TestCase):
+    def test_resumen_por_severidad(self):
+        """Test: El resumen cuenta las vulnerabilidades por severidad"""
+        contexto = ContextoSBOM('sbom.json', sbom_de_prueba(('CVE-1', 'HIGH'), ('CVE-2', 'HIGH'), ('CVE-3', 'LOW')))
+        self.assertEqual(contexto.resumen_vulnerabilidades['total'], 3)
+        self.assertEqual(contexto.resumen_vulnerabilidades['por_severidad'], {'HIGH': 2, 'LOW': 1})
+
+    def test_huella_depende_solo_del_resultado(self):
+        """Test: La huella no depende del fichero ni del orden, sí de las vulnerabilidades"""
+        a = ContextoSBOM('a.json', sbom_de_prueba(('CVE-1', 'HIGH'), ('CVE-2', 'LOW')), proyecto_id=1)
+        b = ContextoSBOM('b.json', sbom_de_prueba(('CVE-2', 'LOW'), ('CVE-1', 'HIGH')), proyecto_id=2)
+        c = ContextoSBOM('a.json', sbom_de_prueba(('CVE-1', 'HIGH')))
+        self.assertEqual(a.huella(), b.huella())
+        self.assertNotEqual(a.huella(), c.huella())
+
+    def test_secciones_prompt_se_regeneran_al_cambiar_huella(self):
+        """Test: generar() solo se llama la primera vez y cuando cambia la huella"""
+        contexto = ContextoSBOM('sbom.json', sbom_de_prueba(('CVE-1', 'HIGH')))
+        llamadas = []
+
+        def generar():
+            llamadas.append(1)
+            return ['seccion %d' % len(llamadas)]
+
+        self.assertEqual(contexto.secciones_prompt('h1', generar), ['seccion 1'])
+        self.assertEqual(contexto.secciones_prompt('h1', generar), ['seccion 1'])
+        self.assertEqual(contexto.secciones_prompt('h2', generar), ['seccion 2'])
+        self.assertEqual(len(llamadas), 2)
+
+    def test_ida_y_vuelta_dict(self):
+        """Test: a_dict/desde_dict conservan los datos del análisis"""
+        original = ContextoSBOM('sbom.json', sbom_de_prueba(('CVE-1', 'HIGH')), 7, 'Proyecto', {'umbral': 5})
+        copia = ContextoSBOM.desde_dict(original.a_dict())
+        self.assertEqual(copia.a_dict(), original.a_dict())
+        self.assertEqual(copia.huella(), original.huella())
+
+
+class TestConversacion(unittest.TestCase):
+    def test_buffer_circular(self):
+        """Test: Por encima de max_mensajes salen los más antiguos"""
+        conversacion = Conversacion(max_mensajes=3)
+        conversacion.agregar('1', '2')
+        conversacion.agregar('3', '4')
+        self.assertEqual(list(conversacion.mensajes), ['2', '3', '4'])
+        self.assertEqual(len(conversacion), 3)
+
+    def test_recortar_por_caracteres(self):
+        """Test: recortar descarta desde el principio hasta caber en el límite"""
+        conversacion = Conversacion()
+        conversacion.agregar('a' * 10, 'b' * 10, 'c' * 10)
+        conversacion.recortar(25)
+        self.assertEqual(list(conversacion.mensajes), ['b' * 10, 'c' * 10])
+
+
+class PruebasAlmacen:
+    """Comportamiento común de los almacenes de conversaciones"""
+
+    def crear(self, **opciones):
+        raise NotImplementedError
+
+    def test_conversacion_nueva_vacia(self):
+        """Test: Un usuario sin historial obtiene una conversación vacía"""
+        almacen = self.crear()
+        conversacion = almacen.obtener('ana')
+        self.assertEqual(len(conversacion), 0)
+        self.assertIsNone(conversacion.contexto_sbom)
+
+    def test_agregar_mensajes_por_usuario(self):
+        """Test: Los mensajes se guardan en orden y separados por usuario"""
+        almacen = self.crear()
+        almacen.agregar_mensajes('ana', 'Usuario: hola', 'Bot: hola')
+        almacen.agregar_mensajes('luis', 'Usuario: buenas')
+        almacen.agregar_mensajes('ana', 'Usuario: adiós')
+        self.assertEqual(list(almacen.obtener('ana').mensajes), ['Usuario: hola', 'Bot: hola', 'Usuario: adiós'])
+        self.assertEqual(list(almacen.obtener('luis').mensajes), ['Usuario: buenas'])
+        self.assertEqual(len(almacen), 2)
+        self.assertEqual(almacen.total_mensajes(), 4)
+
+    def test_limite_de_mensajes(self):
+        """Test: Se conservan solo los max_mensajes más recientes"""
+        almacen = self.crear(max_mensajes=3)
+        for numero in range(5):
+            almacen.agregar_mensajes('ana', 'mensaje %d' % numero)
+        self.assertEqual(list(almacen.obtener('ana').mensajes), ['mensaje 2', 'mensaje 3', 'mensaje 4'])
+
+    def test_limite_de_caracteres(self):
+        """Test: El historial se recorta desde el más antiguo al superar max_caracteres"""
+        almacen = self.crear(max_caracteres=25)
+        almacen.agregar_mensajes('ana', 'a' * 10, 'b' * 10)
+        almacen.agregar_mensajes('ana', 'c' * 10)
+        self.assertEqual(list(almacen.obtener('ana').mensajes), ['b' * 10, 'c' * 10])
+
+    def test_contexto_sbom(self):
+        """Test: El contexto SBOM se sustituye y se mantiene junto a los mensajes"""
+        almacen = self.crear()
+        almacen.agregar_mensajes('ana', 'Usuario: hola')
+        almacen.guardar_contexto_sbom('ana', ContextoSBOM('uno.json', sbom_de_prueba(('CVE-1', 'HIGH'))))
+        almacen.guardar_contexto_sbom('ana', ContextoSBOM('dos.json', sbom_de_prueba(('CVE-2', 'LOW')), proyecto_id=3))
+        conversacion = almacen.obtener('ana')
+        self.assertEqual(conversacion.contexto_sbom.filename, 'dos.json')
+        self.assertEqual(conversacion.contexto_sbom.proyecto_id, 3)
+        self.assertEqual(list(conversacion.mensajes), ['Usuario: hola'])
+        self.assertIsNone(almacen.obtener('luis').contexto_sbom)
+
+    def test_caducidad(self):
+        """Test: Una conversación sin actividad durante ttl caduca entera"""
+        almacen = self.crear(ttl=0.05)
+        almacen.agregar_mensajes('ana', 'Usuario: hola')
+        almacen.guardar_contexto_sbom('ana', ContextoSBOM('sbom.json', sbom_de_prueba(('CVE-1', 'HIGH'))))
+        time.sleep(0.1)
+        conversacion = almacen.obtener('ana')
+        self.assertEqual(len(conversacion), 0)
+        self.assertIsNone(conversacion.contexto_sbom)
+
+
+class TestAlmacenMemoria(PruebasAlmacen, unittest.TestCase):
+    def crear(self, **opciones):
+        return AlmacenMemoria(**opciones)
+
+    def test_max_usuarios_lru(self):
+        """Test: Por encima de max_usuarios se descarta la conversación menos reciente"""
+        almacen = self.crear(max_usuarios=2)
+        almacen.agregar_mensajes('ana', 'a')
+        almacen.agregar_mensajes('luis', 'b')
+        almacen.obtener('ana')
+        almacen.agregar_mensajes('eva', 'c')
+        self.assertEqual(len(almacen), 2)
+        self.assertEqual(len(almacen.obtener('ana')), 1)
+        self.assertEqual(len(almacen.obtener('luis')), 0)
+
+    def test_devuelve_copias(self):
+        """Test: Modificar la conversación devuelta no cambia la guardada"""
+        almacen = self.crear()
+        conversacion = almacen.agregar_mensajes('ana', 'Usuario: hola')
+        conversacion.agregar('Usuario: por fuera del almacén')
+        conversacion.guardar_contexto_sbom(ContextoSBOM('sbom.json', sbom_de_prueba(('CVE-1', 'HIGH'))))
+        guardada = almacen.obtener('ana')
+        self.assertEqual(list(guardada.mensajes), ['Usuario: hola'])
+        self.assertIsNone(guardada.contexto_sbom)
+
+    def test_escrituras_y_lecturas_concurrentes(self):
+        """Test: Varios hilos escribiendo y leyendo la misma conversación no pierden mensajes ni fallan"""
+        almacen = self.crear(max_mensajes=1000, max_caracteres=10 ** 6)
+        errores = []
+        # Cambios de hilo muy frecuentes para que las carreras aparezcan siempre
+        intervalo = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, intervalo)
+
+        def escribir(hilo):
+            for numero in range(100):
+                almacen.agregar_mensajes('ana', f'{hilo}-{numero}')
+                if numero % 10 == 0:
+                    almacen.guardar_contexto_sbom('ana', ContextoSBOM(f'{hilo}.json', sbom_de_prueba(('CVE-1', 'HIGH'))))
+
+        def leer():
+            try:
+                for _ in range(300):
+                    # Iterar la copia mientras otros hilos escriben (con el deque compartido fallaba)
+                    total = sum(len(entrada) for entrada in almacen.obtener('ana').mensajes)
+                    self.assertGreaterEqual(total, 0)
+            except Exception as e:
+                errores.append(e)
+
+        hilos = [threading.Thread(target=escribir, args=(i,)) for i in range(4)]
+        hilos += [threading.Thread(target=leer) for _ in range(4)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(errores, [])
+        mensajes = list(almacen.obtener('ana').mensajes)
+        self.assertEqual(len(mensajes), 400)
+        for hilo in range(4):
+            self.assertEqual([m for m in mensajes if m.startswith(f'{hilo}-')], [f'{hilo}-{n}' for n in range(100)])
+
+
+class TestAlmacenSQLite(PruebasAlmacen, unittest.TestCase):
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.ruta = os.path.join(self.directorio, 'conversaciones.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def crear(self, **opciones):
+        return AlmacenSQLite(self.ruta, **opciones)
+
+    def test_persistencia_entre_instancias(self):
+        """Test: Otra instancia sobre el mismo fichero ve mensajes y contexto"""
+        self.crear().agregar_mensajes('ana', 'Usuario: hola')
+        self.crear().guardar_contexto_sbom('ana', ContextoSBOM('sbom.json', sbom_de_prueba(('CVE-1', 'HIGH')), 5))
+        conversacion = self.crear().obtener('ana')
+        self.assertEqual(list(conversacion.mensajes), ['Usuario: hola'])
+        self.assertEqual(conversacion.contexto_sbom.proyecto_id, 5)
+        self.assertEqual(conversacion.contexto_sbom.resumen_vulnerabilidades['total'], 1)
+
+    def test_contexto_de_otro_worker(self):
+        """Test: Si otro worker sustituye el contexto se relee en lugar de usar el de memoria"""
+        almacen, otro = self.crear(), self.crear()
+        almacen.guardar_contexto_sbom('ana', ContextoSBOM('uno.json', sbom_de_prueba(('CVE-1', 'HIGH'))))
+        self.assertEqual(almacen.obtener('ana').contexto_sbom.filename, 'uno.json')
+        otro.guardar_contexto_sbom('ana', ContextoSBOM('dos.json', sbom_de_prueba(('CVE-2', 'LOW'))))
+        self.assertEqual(almacen.obtener('ana').contexto_sbom.filename, 'dos.json')
+
+    def test_contexto_deserializado_una_vez(self):
+        """Test: Las lecturas siguientes del mismo contexto no vuelven a parsear el JSON guardado"""
+        self.crear().guardar_contexto_sbom('ana', ContextoSBOM('sbom.json', sbom_de_prueba(('CVE-1', 'HIGH'))))
+        almacen = self.crear()
+        with mock.patch.object(ContextoSBOM, 'desde_dict', wraps=ContextoSBOM.desde_dict) as desde_dict:
+            primero = almacen.obtener('ana').contexto_sbom
+            almacen.agregar_mensajes('ana', 'Usuario: hola')
+            segundo = almacen.obtener('ana').contexto_sbom
+        self.assertIs(primero, segundo)
+        self.assertEqual(desde_dict.call_count, 1)
+
+    def test_contexto_grande_sin_componentes(self):
+        """Test: Un contexto que supera max_bytes_contexto se guarda sin la lista de componentes"""
+        self.crear(max_bytes_contexto=10).guardar_contexto_sbom(
+            'ana', ContextoSBOM('sbom.json', sbom_de_prueba(('CVE-1', 'HIGH'))))
+        contexto = self.crear().obtener('ana').contexto_sbom
+        self.assertNotIn('componentes', contexto.sbom_data)
+        self.assertEqual(len(contexto.sbom_data['vulnerabilidades_nvd']), 1)
+
+    def test_purgar(self):
+        """Test: purgar elimina las conversaciones caducadas y sus mensajes"""
+        almacen = self.crear(ttl=0.05)
+        almacen.agregar_mensajes('ana', 'a', 'b')
+        time.sleep(0.1)
+        almacen.purgar()
+        self.assertEqual(len(almacen), 0)
+        self.assertEqual(almacen.total_mensajes(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+# ✅ SIN RED: backend LLM simulado antes de importar la app
+os.environ.setdefault('LLM_PROVEEDOR', 'simulado')
+
+import app
+from espejo_nvd import EspejoNVD
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'nvd_pagina.json')
+
+CONTADORES = ('componentes_analizados', 'componentes_vulnerables', 'vulnerabilidades_encontradas',
+              'total_vulnerabilidades_brutas', 'vulnerabilidades_excluidas')
+
+
+def componente(nombre, version, tipo='npm'):
+    return {'nombre': nombre, 'version': version, 'purl': f'pkg:{tipo}/{nombre}@{version}'}
+
+
+class TestDeduplicacion(unittest.TestCase):
+    """Un paquete repetido se consulta una vez pero cuenta como si cada aparición se hubiera analizado"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        espejo = EspejoNVD(os.path.join(self.directorio, 'espejo.db'))
+        espejo.cargar_feed(FIXTURE)
+        parche = mock.patch.object(app, 'espejo_nvd', espejo)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def enriquecer(self, componentes, limite=2):
+        sbom = {'formato': 'CycloneDX', 'componentes': componentes}
+        return app.bucle_async.ejecutar(app.enriquecer_sbom_con_nvd(sbom, limite, 'MEDIUM'))
+
+    def veredicto(self, sbom, limite=2):
+        analisis = sbom['resumen']['nvd_analysis']
+        return app.verificar_limites_proyecto_avanzado(
+            1, analisis['vulnerabilidades_encontradas'], sbom['vulnerabilidades_nvd'], limite, 'MEDIUM')['excede_limite']
+
+    def test_totales_iguales_que_sin_deduplicar(self):
+        """Test: Con jquery tres veces los totales son la suma de analizar cada aparición por separado"""
+        componentes = [componente('jquery', '3.4.1'), componente('lodash', '4.17.20'),
+                       componente('jquery', '3.4.1'), componente('jquery', '3.4.1')]
+        deduplicado = self.enriquecer([dict(c) for c in componentes])
+        analisis = deduplicado['resumen']['nvd_analysis']
+        self.assertEqual(analisis['componentes_unicos'], 2)
+
+        # Referencia: cada aparición analizada como si fuera la única (sin deduplicación posible)
+        por_separado = [self.enriquecer([dict(c)])['resumen']['nvd_analysis'] for c in componentes]
+        for contador in CONTADORES:
+            self.assertEqual(analisis[contador], sum(parcial[contador] for parcial in por_separado), contador)
+        self.assertEqual(analisis['vulnerabilidades_encontradas'], 3)
+        self.assertEqual(analisis['componentes_vulnerables'], 3)
+
+    def test_cada_aparicion_tiene_su_vulnerabilidad(self):
+        """Test: Las vulnerabilidades repartidas son registros independientes de cada aparición"""
+        sbom = self.enriquecer([componente('jquery', '3.4.1'), componente('jquery', '3.4.1')])
+        vulnerabilidades = sbom['vulnerabilidades_nvd']
+        self.assertEqual([vuln['cve_id'] for vuln in vulnerabilidades], ['CVE-2020-11023'] * 2)
+        self.assertIsNot(vulnerabilidades[0], vulnerabilidades[1])
+        vulnerabilidades[1]['razon_exclusion'] = 'prueba'
+        self.assertNotIn('razon_exclusion', vulnerabilidades[0])
+
+    def test_veredicto_no_cambia(self):
+        """Test: El límite del proyecto se evalúa con todas las apariciones"""
+        repetido = self.enriquecer([componente('jquery', '3.4.1')] * 3)
+        unico = self.enriquecer([componente('jquery', '3.4.1')])
+        self.assertTrue(self.veredicto(repetido))
+        self.assertFalse(self.veredicto(unico))
+
+
+class ConsultaFalsa:
+    """Sustituye a buscar_vulnerabilidades_nvd: tarda `latencia` y anota la concurrencia alcanzada"""
+
+    def __init__(self, latencia=0.02, vulnerables=(), fallan=(), lentos=()):
+        self.latencia = latencia
+        self.vulnerables = set(vulnerables)
+        self.fallan = set(fallan)
+        self.lentos = set(lentos)
+        self.consultados = []
+        self.activas = 0
+        self.maximo = 0
+
+    async def __call__(self, componente):
+        nombre = componente['nombre']
+        self.consultados.append(nombre)
+        self.activas += 1
+        self.maximo = max(self.maximo, self.activas)
+        try:
+            await asyncio.sleep(10 if nombre in self.lentos else self.latencia)
+            if nombre in self.fallan:
+                raise RuntimeError(f"fallo en {nombre}")
+            if nombre in self.vulnerables:
+                return [app.Vulnerabilidad(cve_id=f'CVE-2000-{len(nombre):04d}', severidad='LOW',
+                                           componente_afectado={'nombre': nombre, 'version': componente['version']})]
+            return []
+        finally:
+            self.activas -= 1
+
+
+class PruebasConsultaFalsa(unittest.TestCase):
+    """Sin cache ni espejo: todas las consultas pasan por la ConsultaFalsa"""
+
+    def usar(self, consulta, en_cache=None):
+        def cache(componente):
+            return (en_cache or {}).get(componente['nombre'])
+
+        for nombre, valor in (('buscar_vulnerabilidades_nvd', consulta), ('obtener_vulnerabilidades_cache', cache)):
+            parche = mock.patch.object(app, nombre, valor)
+            parche.start()
+            self.addCleanup(parche.stop)
+        return consulta
+
+    def consultar(self, componentes, **opciones):
+        return app.bucle_async.ejecutar(app.consultar_componentes_nvd(componentes, **opciones))
+
+    def enriquecer(self, componentes, **opciones):
+        sbom = {'formato': 'CycloneDX', 'componentes': componentes}
+        return app.bucle_async.ejecutar(app.enriquecer_sbom_con_nvd(sbom, 10, 'MEDIUM', **opciones))
+
+
+class TestConsultaConcurrente(PruebasConsultaFalsa):
+    def test_concurrencia_acotada(self):
+        """Test: Nunca hay más consultas a NVD en curso que `concurrencia`"""
+        consulta = self.usar(ConsultaFalsa())
+        self.consultar([componente(f'p{i}', '1.0') for i in range(12)], concurrencia=3)
+        self.assertEqual(consulta.maximo, 3)
+        self.assertEqual(len(consulta.consultados), 12)
+
+    def test_consultas_en_paralelo(self):
+        """Test: Con concurrencia N el tiempo total es el de una tanda de N consultas, no la suma"""
+        self.usar(ConsultaFalsa(latencia=0.1))
+        inicio = time.monotonic()
+        self.consultar([componente(f'p{i}', '1.0') for i in range(8)], concurrencia=8)
+        self.assertLess(time.monotonic() - inicio, 0.5)
+
+    def test_resultados_en_el_orden_de_entrada(self):
+        """Test: Cada resultado queda en la posición de su componente: lista, excepción o cache"""
+        self.usar(ConsultaFalsa(vulnerables={'b'}, fallan={'c'}), en_cache={'a': ['de cache']})
+        resultados = self.consultar([componente('a', '1'), componente('b', '1'), componente('c', '1'),
+                                     componente('d', '1')], concurrencia=4)
+        self.assertEqual(resultados[0], ['de cache'])
+        self.assertEqual([vuln['cve_id'] for vuln in resultados[1]], ['CVE-2000-0001'])
+        self.assertIsInstance(resultados[2], RuntimeError)
+        self.assertEqual(resultados[3], [])
+
+    def test_aciertos_de_cache_sin_consulta(self):
+        """Test: Los componentes en cache no llegan a consultarse en NVD"""
+        consulta = self.usar(ConsultaFalsa(), en_cache={'a': []})
+        self.consultar([componente('a', '1'), componente('b', '1')])
+        self.assertEqual(consulta.consultados, ['b'])
+
+    def test_contadores_iguales_que_en_secuencial(self):
+        """Test: El resumen NVD no depende de la concurrencia"""
+        componentes = [componente(f'paquete-{i}', '1.0') for i in range(10)]
+        vulnerables = {'paquete-1', 'paquete-4', 'paquete-7'}
+        self.usar(ConsultaFalsa(latencia=0.001, vulnerables=vulnerables, fallan={'paquete-5'}))
+        secuencial = self.enriquecer([dict(c) for c in componentes], concurrencia=1)
+        paralelo = self.enriquecer([dict(c) for c in componentes], concurrencia=8)
+        self.assertEqual(secuencial['resumen']['nvd_analysis'], paralelo['resumen']['nvd_analysis'])
+        self.assertEqual(secuencial['vulnerabilidades_nvd'], paralelo['vulnerabilidades_nvd'])
+        self.assertEqual(paralelo['resumen']['nvd_analysis']['componentes_vulnerables'], 3)
+
+
+class TestPresupuesto(PruebasConsultaFalsa):
+    def test_corta_al_agotar_el_presupuesto(self):
+        """Test: Al agotar el presupuesto se devuelve lo consultado y el resto queda en None"""
+        self.usar(ConsultaFalsa(lentos={'lento'}))
+        inicio = time.monotonic()
+        resultados = self.consultar([componente('a', '1'), componente('lento', '1'), componente('b', '1')],
+                                    concurrencia=3, presupuesto=0.2)
+        self.assertLess(time.monotonic() - inicio, 1)
+        self.assertEqual(resultados, [[], None, []])
+
+    def test_prioridad_con_presupuesto_corto(self):
+        """Test: Primero se consultan los componentes con versión y purl, que son los evaluables"""
+        consulta = self.usar(ConsultaFalsa(latencia=0.05))
+        sin_version = [{'nombre': f'sin-version-{i}', 'version': ''} for i in range(3)]
+        con_purl = [componente(f'con-purl-{i}', '1.0.0') for i in range(3)]
+        self.consultar(sin_version + con_purl, concurrencia=1, presupuesto=0.12)
+        self.assertTrue(consulta.consultados)
+        self.assertTrue(all(nombre.startswith('con-purl') for nombre in consulta.consultados[:3]))
+
+    def test_progreso(self):
+        """Test: progreso recibe (procesados, total) hasta completar todos los componentes"""
+        self.usar(ConsultaFalsa(latencia=0.001), en_cache={'a': []})
+        avisos = []
+        self.consultar([componente(n, '1') for n in 'abcd'], concurrencia=2,
+                       progreso=lambda procesados, total: avisos.append((procesados, total)))
+        self.assertEqual(avisos[0], (1, 4))
+        self.assertEqual(avisos[-1], (4, 4))
+        self.assertEqual([procesados for procesados, _ in avisos], sorted(procesados for procesados, _ in avisos))
+
+    def test_componentes_omitidos_en_el_resumen(self):
+        """Test: El resumen indica cobertura y qué componentes (con todas sus apariciones) no se analizaron"""
+        self.usar(ConsultaFalsa(vulnerables={'a'}, lentos={'lento'}))
+        sbom = self.enriquecer([componente('a', '1'), componente('lento', '2'), componente('b', '1'),
+                                componente('lento', '2')], concurrencia=3, presupuesto=0.2)
+        analisis = sbom['resumen']['nvd_analysis']
+        self.assertTrue(analisis['presupuesto_agotado'])
+        self.assertEqual(analisis['componentes_omitidos'], ['lento@2', 'lento@2'])
+        self.assertEqual((analisis['componentes_analizados'], analisis['componentes_totales']), (2, 4))
+        self.assertEqual(analisis['cobertura_porcentaje'], 50.0)
+        self.assertEqual([vuln['cve_id'] for vuln in sbom['vulnerabilidades_nvd']], ['CVE-2000-0001'])
+
+    def test_sin_omitidos_con_presupuesto_suficiente(self):
+        """Test: Con tiempo suficiente se analizan todos los componentes (sin límite de 15)"""
+        self.usar(ConsultaFalsa(latencia=0.001))
+        sbom = self.enriquecer([componente(f'p{i}', '1') for i in range(40)], concurrencia=8, presupuesto=10)
+        analisis = sbom['resumen']['nvd_analysis']
+        self.assertFalse(analisis['presupuesto_agotado'])
+        self.assertEqual((analisis['componentes_analizados'], analisis['cobertura_porcentaje']), (40, 100.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
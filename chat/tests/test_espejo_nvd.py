@@ -0,0 +1,155 @@
+import asyncio
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+# ✅ SIN RED: backend LLM simulado antes de importar la app
+os.environ.setdefault('LLM_PROVEEDOR', 'simulado')
+
+import app
+from espejo_nvd import EspejoNVD, productos_de_cve
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'nvd_pagina.json')
+
+
+def cargar_pagina():
+    with open(FIXTURE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class ClienteFijo:
+    """Cliente NVD sin red: devuelve las respuestas (status, datos) indicadas, en orden"""
+
+    def __init__(self, respuestas):
+        self.respuestas = list(respuestas)
+        self.peticiones = []
+
+    async def consultar(self, params):
+        self.peticiones.append(dict(params))
+        status, datos = self.respuestas.pop(0)
+        return status, datos, {}
+
+
+class TestSincronizacion(unittest.TestCase):
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.espejo = EspejoNVD(os.path.join(self.directorio, 'espejo.db'))
+        self.espejo.guardar_meta('ultima_sincronizacion', '2024-05-01T00:00:00.000')
+        self.hasta = datetime(2024, 6, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def sincronizar(self, cliente, **opciones):
+        return asyncio.run(self.espejo.sincronizar(cliente, hasta=self.hasta, espera_429=0, **opciones))
+
+    def test_aplica_la_pagina(self):
+        """Test: Los CVEs de la página quedan en el espejo indexados por producto"""
+        cliente = ClienteFijo([(200, cargar_pagina())])
+        self.assertEqual(self.sincronizar(cliente), 3)
+        self.assertEqual(len(self.espejo), 3)
+        self.assertEqual(self.espejo.obtener_meta('ultima_sincronizacion'), '2024-06-01T00:00:00.000')
+        params = cliente.peticiones[0]
+        self.assertEqual(params['lastModStartDate'], '2024-05-01T00:00:00.000')
+        self.assertEqual(params['lastModEndDate'], '2024-06-01T00:00:00.000')
+        ids = [cve['id'] for cve in self.espejo.buscar_por_productos({'jquery_ui'})]
+        self.assertEqual(ids, ['CVE-2021-41184'])
+
+    def test_paginacion(self):
+        """Test: Se piden páginas hasta cubrir totalResults"""
+        pagina = cargar_pagina()
+        primera = dict(pagina, vulnerabilities=pagina['vulnerabilities'][:2])
+        segunda = dict(pagina, vulnerabilities=pagina['vulnerabilities'][2:], startIndex=2)
+        cliente = ClienteFijo([(200, primera), (200, segunda)])
+        self.assertEqual(self.sincronizar(cliente), 3)
+        self.assertEqual([p['startIndex'] for p in cliente.peticiones], [0, 2])
+
+    def test_actualizacion_sustituye_productos(self):
+        """Test: Un CVE modificado reemplaza sus productos anteriores"""
+        pagina = cargar_pagina()
+        self.espejo.aplicar_cves(pagina['vulnerabilities'])
+        modificado = copy.deepcopy(pagina['vulnerabilities'][0])
+        modificado['cve']['configurations'][0]['nodes'][0]['cpeMatch'][0]['criteria'] = \
+            'cpe:2.3:a:lodash:lodash_es:*:*:*:*:*:*:*:*'
+        cliente = ClienteFijo([(200, dict(pagina, vulnerabilities=[modificado], totalResults=1))])
+        self.sincronizar(cliente)
+        self.assertEqual(self.espejo.buscar_por_productos({'lodash'}), [])
+        self.assertEqual(len(self.espejo.buscar_por_productos({'lodash_es'})), 1)
+
+    def test_reintenta_429(self):
+        """Test: Un 429 se reintenta la misma página"""
+        cliente = ClienteFijo([(429, None), (429, None), (200, cargar_pagina())])
+        self.assertEqual(self.sincronizar(cliente), 3)
+        self.assertEqual(len(cliente.peticiones), 3)
+
+    def test_429_persistente_no_es_infinito(self):
+        """Test: Un 429 persistente agota los reintentos y falla sin avanzar la marca"""
+        cliente = ClienteFijo([(429, None)] * 10)
+        with self.assertRaises(RuntimeError):
+            self.sincronizar(cliente, max_reintentos=3)
+        self.assertEqual(len(cliente.peticiones), 4)
+        self.assertEqual(self.espejo.obtener_meta('ultima_sincronizacion'), '2024-05-01T00:00:00.000')
+
+    def test_error_http(self):
+        """Test: Un error de la API interrumpe la sincronización"""
+        with self.assertRaises(RuntimeError):
+            self.sincronizar(ClienteFijo([(503, None)]))
+
+    def test_espejo_vacio(self):
+        """Test: Sin carga previa no se puede sincronizar de forma incremental"""
+        vacio = EspejoNVD(os.path.join(self.directorio, 'vacio.db'))
+        with self.assertRaises(ValueError):
+            asyncio.run(vacio.sincronizar(ClienteFijo([])))
+
+    def test_productos_de_cve(self):
+        """Test: Se extraen los pares (vendor, producto) de los criterios CPE"""
+        cve_data = cargar_pagina()['vulnerabilities'][2]['cve']
+        self.assertEqual(productos_de_cve(cve_data), {('jqueryui', 'jquery_ui')})
+
+
+class TestBusquedaEspejo(unittest.TestCase):
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.espejo = EspejoNVD(os.path.join(self.directorio, 'espejo.db'))
+        self.espejo.aplicar_cves(cargar_pagina()['vulnerabilities'])
+        self.espejo_original = app.espejo_nvd
+        app.espejo_nvd = self.espejo
+
+    def tearDown(self):
+        app.espejo_nvd = self.espejo_original
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def cves(self, nombre, version, purl=''):
+        componente = {'nombre': nombre, 'version': version, 'purl': purl}
+        return sorted(vuln.cve_id for vuln in app.buscar_vulnerabilidades_espejo(componente))
+
+    def test_version_afectada(self):
+        self.assertEqual(self.cves('lodash', '4.17.20', 'pkg:npm/lodash@4.17.20'), ['CVE-2021-23337'])
+
+    def test_version_corregida(self):
+        self.assertEqual(self.cves('lodash', '4.17.21', 'pkg:npm/lodash@4.17.21'), [])
+
+    def test_no_mezcla_productos(self):
+        """Test: jquery no recibe los CVEs de jquery-ui ni al revés"""
+        self.assertEqual(self.cves('jquery', '3.4.1', 'pkg:npm/jquery@3.4.1'), ['CVE-2020-11023'])
+        self.assertEqual(self.cves('jquery-ui', '1.12.1', 'pkg:npm/jquery-ui@1.12.1'), ['CVE-2021-41184'])
+
+    def test_desde_el_event_loop(self):
+        """Test: buscar_vulnerabilidades_nvd consulta el espejo en un hilo del executor"""
+        componente = {'nombre': 'lodash', 'version': '4.17.20', 'purl': 'pkg:npm/lodash@4.17.20'}
+        vulnerabilidades = asyncio.run(app.buscar_vulnerabilidades_nvd(componente))
+        self.assertEqual([vuln.cve_id for vuln in vulnerabilidades], ['CVE-2021-23337'])
+
+    def test_consulta_de_varios_componentes(self):
+        """Test: La pasada previa resuelve todos los componentes desde el espejo"""
+        componentes = [{'nombre': 'lodash', 'version': '4.17.20'}, {'nombre': 'jquery', 'version': '3.6.0'}]
+        resultados = asyncio.run(app.consultar_componentes_nvd(componentes))
+        self.assertEqual([[vuln.cve_id for vuln in vulns] for vulns in resultados], [['CVE-2021-23337'], []])
+
+
+if __name__ == '__main__':
+    unittest.main()
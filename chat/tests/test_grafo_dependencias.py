@@ -0,0 +1,81 @@
+import unittest
+
+from grafo_dependencias import GrafoDependencias, SIN_PROFUNDIDAD
+
+
+def grafo_ejemplo():
+    """app -> a -> c -> d, app -> b -> c; 'suelto' no lo alcanza nadie"""
+    return GrafoDependencias.desde_cyclonedx([
+        {'ref': 'app', 'dependsOn': ['a', 'b']},
+        {'ref': 'a', 'dependsOn': ['c']},
+        {'ref': 'b', 'dependsOn': ['c']},
+        {'ref': 'c', 'dependsOn': ['d']},
+        {'ref': 'suelto', 'dependsOn': []},
+        {'ref': 'huerfano', 'dependsOn': ['d']},
+    ], raiz='app')
+
+
+class TestGrafoDependencias(unittest.TestCase):
+    def test_identificadores_compactos(self):
+        grafo = grafo_ejemplo()
+        self.assertEqual(grafo.referencias[:3], ['app', 'a', 'b'])
+        self.assertEqual(grafo.indice('c'), 3)
+        self.assertIsNone(grafo.indice('no-existe'))
+        self.assertEqual(len(grafo), 7)
+        self.assertEqual(grafo.num_aristas, 6)
+
+    def test_sucesores_y_predecesores(self):
+        grafo = grafo_ejemplo()
+        nombres = lambda indices: sorted(grafo.referencias[i] for i in indices)
+        self.assertEqual(nombres(grafo.sucesores(grafo.indice('app'))), ['a', 'b'])
+        self.assertEqual(nombres(grafo.predecesores(grafo.indice('c'))), ['a', 'b'])
+        self.assertEqual(nombres(grafo.predecesores(grafo.indice('d'))), ['c', 'huerfano'])
+        self.assertEqual(list(grafo.sucesores(grafo.indice('d'))), [])
+
+    def test_profundidades(self):
+        grafo = grafo_ejemplo()
+        self.assertEqual(grafo.profundidad('a'), 1)
+        self.assertEqual(grafo.profundidad('c'), 2)
+        self.assertEqual(grafo.profundidad('d'), 3)
+        self.assertEqual(grafo.profundidad('suelto'), SIN_PROFUNDIDAD)
+        self.assertIsNone(grafo.profundidad('no-existe'))
+        self.assertTrue(grafo.alcanzable('d'))
+        self.assertFalse(grafo.alcanzable('huerfano'))
+
+    def test_introducido_por(self):
+        grafo = grafo_ejemplo()
+        self.assertEqual(sorted(grafo.introducido_por('d')), ['a', 'b'])
+        self.assertEqual(len(grafo.introducido_por('d', maximo=1)), 1)
+        self.assertEqual(grafo.introducido_por('a'), ['a'])
+        self.assertEqual(grafo.introducido_por('no-existe'), [])
+
+    def test_sin_raiz_usa_nodos_sin_predecesores(self):
+        grafo = GrafoDependencias.desde_cyclonedx([{'ref': 'x', 'dependsOn': ['y']}, {'ref': 'y', 'dependsOn': ['z']}])
+        self.assertEqual([grafo.referencias[i] for i in grafo.directos()], ['x'])
+        self.assertEqual(grafo.profundidad('z'), 3)
+
+    def test_ciclos(self):
+        """Test: Un ciclo no hace que el recorrido se repita ni alcance la raíz"""
+        grafo = GrafoDependencias.desde_cyclonedx([
+            {'ref': 'app', 'dependsOn': ['a']},
+            {'ref': 'a', 'dependsOn': ['b']},
+            {'ref': 'b', 'dependsOn': ['a', 'app']},
+        ], raiz='app')
+        self.assertEqual(grafo.profundidad('b'), 2)
+        self.assertEqual(grafo.introducido_por('b'), ['a'])
+
+    def test_se_recompila_al_anadir_aristas(self):
+        grafo = grafo_ejemplo()
+        self.assertEqual(grafo.profundidad('suelto'), SIN_PROFUNDIDAD)
+        grafo.agregar_dependencia('b', ['suelto'])
+        self.assertEqual(grafo.profundidad('suelto'), 2)
+
+    def test_resumen(self):
+        self.assertEqual(grafo_ejemplo().resumen(), {
+            'nodos': 7, 'aristas': 6, 'componentes_directos': 2,
+            'alcanzables': 4, 'no_alcanzables': 2, 'profundidad_maxima': 3
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+# ✅ SIN RED: backend LLM simulado antes de importar la app
+os.environ.setdefault('LLM_PROVEEDOR', 'simulado')
+
+import app
+from conversaciones import MAX_MENSAJES, AlmacenMemoria, ContextoSBOM
+from espejo_nvd import EspejoNVD
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'nvd_pagina.json')
+
+
+def contexto_de_prueba():
+    return ContextoSBOM('sbom.json', {
+        'formato': 'CycloneDX', 'resumen': {'total_componentes': 1},
+        'vulnerabilidades_nvd': [{'cve_id': 'CVE-2020-11023', 'severidad': 'MEDIUM', 'score_cvss': 6.1,
+                                  'componente_afectado': {'nombre': 'jquery', 'version': '3.4.1'}}]
+    })
+
+
+class TestHistorialTipado(unittest.TestCase):
+    """El contexto SBOM va aparte de los mensajes, ya parseado, y cada turno de chat lo usa tal cual"""
+
+    def test_prompt_sin_parsear_json(self):
+        """Test: Formatear el historial con contexto SBOM no parsea ningún JSON"""
+        almacen = AlmacenMemoria()
+        almacen.guardar_contexto_sbom('ana', contexto_de_prueba())
+        conversacion = almacen.agregar_mensajes('ana', "Usuario: hola", "Bot: hola")
+        with mock.patch.object(app.json, 'loads', side_effect=AssertionError("json.loads en un turno de chat")):
+            prompt = app.formatear_historial_para_ai(conversacion, True, "¿Qué CVE tiene jquery?")
+        self.assertIn('CVE-2020-11023', prompt)
+        self.assertIn('Usuario: hola', prompt)
+
+    def test_mensajes_no_desplazan_el_contexto(self):
+        """Test: Llenar el buffer de mensajes no expulsa el análisis SBOM"""
+        almacen = AlmacenMemoria()
+        almacen.guardar_contexto_sbom('ana', contexto_de_prueba())
+        for numero in range(MAX_MENSAJES + 10):
+            conversacion = almacen.agregar_mensajes('ana', f"Usuario: pregunta {numero}")
+        self.assertEqual(len(conversacion.mensajes), MAX_MENSAJES)
+        self.assertEqual(conversacion.contexto_sbom.filename, 'sbom.json')
+        self.assertIn('CVE-2020-11023', app.formatear_historial_para_ai(conversacion, True, "vulnerabilidades"))
+
+    def test_subida_guarda_contexto_tipado(self):
+        """Test: Tras subir un SBOM el historial tiene un ContextoSBOM y ningún mensaje con el JSON del análisis"""
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, True)
+        espejo = EspejoNVD(os.path.join(directorio, 'espejo.db'))
+        espejo.cargar_feed(FIXTURE)
+        contenido = json.dumps({'bomFormat': 'CycloneDX', 'specVersion': '1.4', 'components': [
+            {'type': 'library', 'name': 'jquery', 'version': '3.4.1', 'purl': 'pkg:npm/jquery@3.4.1'}]}).encode('utf-8')
+        cliente = app.app.test_client()
+        cliente.set_cookie('username', 'historial-ana')
+        with mock.patch.object(app, 'espejo_nvd', espejo):
+            respuesta = cliente.post('/chat/upload-sbom', data={'file': (io.BytesIO(contenido), 'sbom.json')},
+                                     content_type='multipart/form-data')
+        self.assertEqual(respuesta.status_code, 200)
+
+        conversacion = app.historial_conversaciones.obtener('historial-ana')
+        self.assertIsInstance(conversacion.contexto_sbom, ContextoSBOM)
+        self.assertEqual(conversacion.contexto_sbom.filename, 'sbom.json')
+        self.assertEqual(conversacion.contexto_sbom.resumen_vulnerabilidades['total'], 1)
+        self.assertTrue(conversacion.mensajes)
+        self.assertFalse(any('CONTEXTO_SBOM' in entrada or 'vulnerabilidades_nvd' in entrada
+                             for entrada in conversacion.mensajes))
+
+
+if __name__ == '__main__':
+    unittest.main()
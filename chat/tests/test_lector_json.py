@@ -0,0 +1,149 @@
+import io
+import json
+import os
+import unittest
+
+# ✅ SIN RED: backend LLM simulado antes de importar la app
+os.environ.setdefault('LLM_PROVEEDOR', 'simulado')
+
+import app
+from lector_json import LectorJSONIncremental
+
+
+class FlujoContado(io.BytesIO):
+    """BytesIO que anota el mayor bloque pedido en cada read"""
+
+    def __init__(self, datos):
+        super().__init__(datos)
+        self.mayor_lectura = 0
+
+    def read(self, tamano=-1):
+        datos = super().read(tamano)
+        self.mayor_lectura = max(self.mayor_lectura, len(datos))
+        return datos
+
+    def read1(self, tamano=-1):
+        return self.read(tamano)
+
+
+def documento_cyclonedx(total=50):
+    return {
+        'bomFormat': 'CycloneDX',
+        'specVersion': '1.5',
+        'metadata': {'component': {'name': 'app', 'version': '1.0', 'bom-ref': 'app'}},
+        'components': [{'type': 'library', 'name': f'pkg{i}', 'version': f'1.{i}.0', 'bom-ref': f'r{i}',
+                        'purl': f'pkg:npm/pkg{i}@1.{i}.0', 'description': 'ñ' * 50}
+                       for i in range(total)],
+        'dependencies': [{'ref': 'app', 'dependsOn': ['r0', 'r1']}, {'ref': 'r0', 'dependsOn': ['r2']}],
+        'vulnerabilities': []
+    }
+
+
+class TestLectorJSONIncremental(unittest.TestCase):
+    def test_equivale_a_json_loads(self):
+        """Test: Los pares generados reconstruyen el documento original"""
+        documento = documento_cyclonedx()
+        lector = LectorJSONIncremental(json.dumps(documento).encode(), claves_incrementales=['components'],
+                                       tamano_bloque=7)
+        reconstruido = {}
+        for clave, valor in lector:
+            if clave == 'components':
+                reconstruido.setdefault(clave, []).append(valor)
+            else:
+                reconstruido[clave] = valor
+        self.assertEqual(reconstruido, documento)
+        self.assertEqual(lector.claves, list(documento))
+
+    def test_numeros_cortados_entre_bloques(self):
+        """Test: Un número partido entre dos bloques no se decodifica a medias"""
+        texto = json.dumps({'components': [123456789, 1.5e10, -0.25], 'total': 1234567}).encode()
+        for tamano in range(1, 12):
+            pares = list(LectorJSONIncremental(texto, tamano_bloque=tamano))
+            self.assertEqual(pares, [('components', 123456789), ('components', 1.5e10),
+                                     ('components', -0.25), ('total', 1234567)], f"bloque de {tamano}")
+
+    def test_arrays_vacios_y_objeto_vacio(self):
+        self.assertEqual(list(LectorJSONIncremental(b'{}')), [])
+        lector = LectorJSONIncremental(b'{"components": [], "bomFormat": "CycloneDX"}')
+        self.assertEqual(list(lector), [('bomFormat', 'CycloneDX')])
+        self.assertEqual(lector.claves, ['components', 'bomFormat'])
+
+    def test_bom_utf8_y_unicode(self):
+        texto = '﻿{"components": [{"name": "ñandú"}]}'.encode('utf-8')
+        self.assertEqual(list(LectorJSONIncremental(texto, tamano_bloque=3)), [('components', {'name': 'ñandú'})])
+
+    def test_json_no_valido(self):
+        for texto in (b'[1, 2]', b'{"a": 1', b'{"components": [1, 2}', b'{1: 2}'):
+            with self.assertRaises(ValueError, msg=texto):
+                list(LectorJSONIncremental(texto))
+
+    def test_lee_por_bloques(self):
+        """Test: Desde un fichero se lee por bloques, nunca el documento entero de una vez"""
+        datos = json.dumps(documento_cyclonedx(2000)).encode()
+        flujo = FlujoContado(datos)
+        total = sum(1 for clave, _ in LectorJSONIncremental(flujo, tamano_bloque=4096) if clave == 'components')
+        self.assertEqual(total, 2000)
+        self.assertLess(flujo.mayor_lectura, len(datos) // 10)
+
+
+class TestSBOMJSONIncremental(unittest.TestCase):
+    def setUp(self):
+        self.umbral = app.app.config['JSON_INCREMENTAL_BYTES']
+
+    def tearDown(self):
+        app.app.config['JSON_INCREMENTAL_BYTES'] = self.umbral
+
+    def procesar(self, contenido, filename, incremental):
+        app.app.config['JSON_INCREMENTAL_BYTES'] = 0 if incremental else 10 ** 12
+        tipo, documento = app.parsear_sbom(contenido, filename)
+        self.assertEqual(tipo, 'json_flujo' if incremental else 'json')
+        return app.procesar_documento_sbom(tipo, documento)
+
+    def test_incremental_equivale_al_completo(self):
+        """Test: Leído por bloques o entero, el resultado es el mismo"""
+        datos = json.dumps(documento_cyclonedx()).encode()
+        completo = self.procesar(datos, 'bom.json', incremental=False)
+        incremental = self.procesar(io.BytesIO(datos), 'bom.json', incremental=True)
+        for resultado in (completo, incremental):
+            resultado.pop('_grafo', None)
+        self.assertEqual(json.dumps(incremental, default=app.a_json), json.dumps(completo, default=app.a_json))
+
+    def test_componentes_anidados(self):
+        """Test: JSON y XML incluyen los componentes anidados, en el mismo orden"""
+        documento = documento_cyclonedx(2)
+        documento['components'][0]['components'] = [
+            {'name': 'hijo', 'version': '2.0', 'components': [{'name': 'nieto', 'version': '3.0'}]}]
+        datos = json.dumps(documento).encode()
+        xml = b'''<?xml version="1.0"?>
+<bom xmlns="http://cyclonedx.org/schema/bom/1.5" version="1">
+  <metadata><component type="application"><name>app</name></component></metadata>
+  <components>
+    <component type="library"><name>pkg0</name><version>1.0.0</version>
+      <components>
+        <component type="library"><name>hijo</name><version>2.0</version>
+          <components><component type="library"><name>nieto</name><version>3.0</version></component></components>
+        </component>
+      </components>
+    </component>
+    <component type="library"><name>pkg1</name><version>1.1.0</version></component>
+  </components>
+</bom>'''
+        esperados = ['nieto', 'hijo', 'pkg0', 'pkg1']
+        for incremental in (False, True):
+            resultado = self.procesar(datos, 'bom.json', incremental)
+            self.assertEqual([c['nombre'] for c in resultado['componentes']], esperados)
+        resultado = app.procesar_documento_sbom(*app.parsear_sbom(io.BytesIO(xml), 'bom.xml'))
+        self.assertEqual([c['nombre'] for c in resultado['componentes']], esperados)
+
+    def test_dependencias_y_cabecera(self):
+        datos = json.dumps(documento_cyclonedx()).encode()
+        cabecera, resultado = app.leer_sbom_json_incremental(io.BytesIO(datos))
+        self.assertEqual(cabecera['bomFormat'], 'CycloneDX')
+        self.assertIsNone(cabecera['components'])
+        self.assertEqual(resultado['componente_principal']['nombre'], 'app')
+        self.assertEqual(resultado['_grafo'].num_aristas, 3)
+        self.assertTrue(app.validar_documento_sbom('json_flujo', (cabecera, resultado))[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
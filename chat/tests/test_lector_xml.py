@@ -0,0 +1,97 @@
+import io
+import unittest
+
+from lector_xml import LectorXMLIncremental, detectar_formato_xml, separar_etiqueta
+
+CYCLONEDX = b'''<?xml version="1.0" encoding="UTF-8"?>
+<bom xmlns="http://cyclonedx.org/schema/bom/1.4" version="1">
+  <metadata>
+    <tools><tool><name>generador</name></tool></tools>
+    <component type="application" bom-ref="app"><name>app</name><version>1.0</version></component>
+  </metadata>
+  <components>
+    <component type="library" bom-ref="a"><name>a</name><version>1.0</version>
+      <components><component type="library" bom-ref="a1"><name>a1</name></component></components>
+    </component>
+    <component type="library" bom-ref="b"><name>b</name><version>2.0</version></component>
+  </components>
+  <dependencies>
+    <dependency ref="app"><dependency ref="a"/></dependency>
+    <dependency ref="a"><dependency ref="b"/></dependency>
+  </dependencies>
+</bom>'''
+
+SPDX = b'''<?xml version="1.0"?>
+<Document xmlns="http://spdx.org/rdf/terms">
+  <spdxVersion>SPDX-2.3</spdxVersion>
+  <Package><name>zlib</name><versionInfo>1.2.13</versionInfo></Package>
+  <Package><name>openssl</name><versionInfo>3.0.8</versionInfo></Package>
+</Document>'''
+
+
+class TestDeteccion(unittest.TestCase):
+    def test_separar_etiqueta(self):
+        self.assertEqual(separar_etiqueta('{http://x}bom'), ('http://x', 'bom'))
+        self.assertEqual(separar_etiqueta('bom'), ('', 'bom'))
+
+    def test_version_de_cyclonedx(self):
+        for version in ('1.0', '1.4', '1.6'):
+            formato, esquema, _ = detectar_formato_xml(f'{{http://cyclonedx.org/schema/bom/{version}}}bom')
+            self.assertEqual((formato, esquema), ('CycloneDX', version))
+
+    def test_otros_formatos(self):
+        self.assertEqual(detectar_formato_xml('{http://spdx.org/rdf/terms}Document')[0], 'SPDX')
+        self.assertEqual(detectar_formato_xml('bom')[0], 'CycloneDX')
+        self.assertIsNone(detectar_formato_xml('{http://ejemplo}raiz')[0])
+
+
+class TestLectorXMLIncremental(unittest.TestCase):
+    def test_componentes_y_rutas(self):
+        """Test: Los elementos pedidos llegan al cerrarse (anidados antes) con la ruta de sus ancestros"""
+        lector = LectorXMLIncremental(CYCLONEDX, elementos=('component',))
+        vistos = [(elem.get('bom-ref'), ruta) for _, ruta, elem in lector]
+        self.assertEqual(vistos, [
+            ('app', ('bom', 'metadata')),
+            ('a1', ('bom', 'components', 'component', 'components')),
+            ('a', ('bom', 'components')),
+            ('b', ('bom', 'components')),
+        ])
+        self.assertEqual(lector.formato, 'CycloneDX')
+        self.assertEqual(lector.version_esquema, '1.4')
+        self.assertEqual(lector.espacio, 'http://cyclonedx.org/schema/bom/1.4')
+
+    def test_anidado_conserva_sus_hijos(self):
+        """Test: Un elemento pedido que contiene otro llega completo"""
+        lector = LectorXMLIncremental(CYCLONEDX, elementos=('component',))
+        espacio = '{http://cyclonedx.org/schema/bom/1.4}'
+        for _, _, elem in lector:
+            if elem.get('bom-ref') == 'a':
+                self.assertEqual(elem.findtext(f'{espacio}name'), 'a')
+                self.assertEqual(len(elem.findall(f'{espacio}components/{espacio}component')), 1)
+
+    def test_libera_lo_ya_recorrido(self):
+        """Test: Cada elemento se genera completo y después se vacía, así el árbol no crece con el documento"""
+        componentes = b''.join(b'<component><name>p%d</name></component>' % i for i in range(500))
+        xml = b'<bom xmlns="http://cyclonedx.org/schema/bom/1.5"><components>' + componentes + b'</components></bom>'
+        generados = []
+        for _, _, elem in LectorXMLIncremental(io.BytesIO(xml), elementos=('component',)):
+            self.assertEqual(len(elem), 1)  # con su <name> mientras el consumidor lo usa
+            generados.append(elem)
+        self.assertEqual(len(generados), 500)
+        self.assertTrue(all(len(elem) == 0 for elem in generados))
+
+    def test_spdx_y_etiquetas(self):
+        lector = LectorXMLIncremental(SPDX, elementos=('Package',))
+        nombres = [elem.findtext('{http://spdx.org/rdf/terms}name') for _, _, elem in lector]
+        self.assertEqual(nombres, ['zlib', 'openssl'])
+        self.assertEqual(lector.formato, 'SPDX')
+        self.assertIn('{http://spdx.org/rdf/terms}spdxVersion', lector.etiquetas)
+
+    def test_texto_y_fichero(self):
+        """Test: Admite str, bytes y ficheros binarios"""
+        for fuente in (SPDX.decode(), SPDX, io.BytesIO(SPDX)):
+            self.assertEqual(len(list(LectorXMLIncremental(fuente, elementos=('Package',)))), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,361 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from llm import ClienteLLM, ErrorLLM, MetricasLLM, ProveedorGemini, ProveedorLLM, ProveedorSimulado, crear_proveedor
+
+
+class ProveedorFallos(ProveedorLLM):
+    """Falla las primeras `fallos` llamadas y después responde; cuenta llamadas y simultaneidad"""
+
+    nombre = 'fallos'
+
+    def __init__(self, fallos=0, latencia=0.0, fragmentos=('uno', ' dos'), fallo_tras_fragmento=False):
+        self.fallos = fallos
+        self.latencia = latencia
+        self.fragmentos = fragmentos
+        self.fallo_tras_fragmento = fallo_tras_fragmento
+        self.llamadas = 0
+        self.simultaneas = 0
+        self.max_simultaneas = 0
+
+    async def generar(self, prompt, timeout=None):
+        self.llamadas += 1
+        self.simultaneas += 1
+        self.max_simultaneas = max(self.max_simultaneas, self.simultaneas)
+        try:
+            if self.latencia:
+                await asyncio.sleep(self.latencia)
+            if self.llamadas <= self.fallos:
+                raise RuntimeError(f"fallo {self.llamadas}")
+            return f"respuesta a {prompt}"
+        finally:
+            self.simultaneas -= 1
+
+    def generar_flujo(self, prompt, timeout=None):
+        self.llamadas += 1
+        if self.llamadas <= self.fallos and not self.fallo_tras_fragmento:
+            raise RuntimeError(f"fallo {self.llamadas}")
+        for fragmento in self.fragmentos:
+            yield fragmento
+            if self.fallo_tras_fragmento:
+                raise RuntimeError("corte a mitad del streaming")
+
+
+class ProveedorContado(ProveedorLLM):
+    """Cuenta las llamadas simultáneas entre generar y generar_flujo (desde varios hilos)"""
+
+    nombre = 'contado'
+
+    def __init__(self, latencia=0.05):
+        self.latencia = latencia
+        self.simultaneas = 0
+        self.max_simultaneas = 0
+        self._lock = threading.Lock()
+
+    def _entrar(self):
+        with self._lock:
+            self.simultaneas += 1
+            self.max_simultaneas = max(self.max_simultaneas, self.simultaneas)
+
+    def _salir(self):
+        with self._lock:
+            self.simultaneas -= 1
+
+    async def generar(self, prompt, timeout=None):
+        self._entrar()
+        try:
+            await asyncio.sleep(self.latencia)
+            return prompt
+        finally:
+            self._salir()
+
+    def generar_flujo(self, prompt, timeout=None):
+        self._entrar()
+        try:
+            time.sleep(self.latencia)
+            yield prompt
+        finally:
+            self._salir()
+
+
+class ProveedorAtascado(ProveedorLLM):
+    """Streaming que emite `antes` fragmentos y se queda esperando hasta que se le suelte"""
+
+    nombre = 'atascado'
+
+    def __init__(self, antes=1):
+        self.antes = antes
+        self.soltar = threading.Event()
+        self.llamadas = 0
+
+    def generar_flujo(self, prompt, timeout=None):
+        self.llamadas += 1
+        for i in range(self.antes):
+            yield f"f{i}"
+        self.soltar.wait()
+        yield "tarde"
+
+
+class ModeloGemini032:
+    """Como GenerativeModel de google-generativeai 0.3.2: los argumentos desconocidos van a la petición"""
+
+    class Respuesta:
+        def __init__(self, text):
+            self.text = text
+
+    def _validar(self, opciones):
+        for campo in opciones:
+            raise ValueError(f"Unknown field for GenerateContentRequest: {campo}")
+
+    async def generate_content_async(self, contents, *, generation_config=None, safety_settings=None,
+                                     stream=False, **kwargs):
+        self._validar(kwargs)
+        return self.Respuesta(f"gemini: {contents}")
+
+    def generate_content(self, contents, *, generation_config=None, safety_settings=None, stream=False, **kwargs):
+        self._validar(kwargs)
+        return [self.Respuesta("gemini"), self.Respuesta(f": {contents}")]
+
+
+class TestProveedores(unittest.TestCase):
+    def test_simulado_determinista(self):
+        """Test: El proveedor simulado responde igual al mismo prompt y cita sus CVEs"""
+        proveedor = ProveedorSimulado()
+        prompt = "Analiza CVE-2021-44228 y CVE-2021-23337"
+        respuesta = asyncio.run(proveedor.generar(prompt))
+        self.assertEqual(respuesta, asyncio.run(proveedor.generar(prompt)))
+        self.assertNotEqual(respuesta, asyncio.run(proveedor.generar("otro prompt")))
+        self.assertIn("CVE-2021-44228, CVE-2021-23337", respuesta)
+
+    def test_simulado_flujo(self):
+        """Test: Los fragmentos del streaming reconstruyen la misma respuesta"""
+        proveedor = ProveedorSimulado(palabras_por_fragmento=3)
+        fragmentos = list(proveedor.generar_flujo("hola"))
+        self.assertGreater(len(fragmentos), 1)
+        self.assertEqual(''.join(fragmentos), proveedor.responder("hola"))
+
+    def test_crear_proveedor(self):
+        """Test: Se instancia por nombre; un nombre desconocido es un ValueError"""
+        proveedor = crear_proveedor('simulado', latencia=0.5)
+        self.assertIsInstance(proveedor, ProveedorSimulado)
+        self.assertEqual(proveedor.latencia, 0.5)
+        with self.assertRaises(ValueError):
+            crear_proveedor('desconocido')
+
+    def test_gemini_sin_request_options(self):
+        """Test: Las llamadas a Gemini son válidas para google-generativeai 0.3.2"""
+        proveedor = ProveedorGemini.__new__(ProveedorGemini)
+        proveedor._modelo = ModeloGemini032()
+        self.assertEqual(asyncio.run(proveedor.generar("hola", timeout=5)), "gemini: hola")
+        self.assertEqual(''.join(proveedor.generar_flujo("hola", timeout=5)), "gemini: hola")
+
+
+class TestClienteLLM(unittest.TestCase):
+    def test_reintentos(self):
+        """Test: Los fallos se reintentan con backoff y se cuentan en las métricas"""
+        proveedor = ProveedorFallos(fallos=2)
+        cliente = ClienteLLM(proveedor, reintentos=2, espera_base=0.001)
+        self.assertEqual(asyncio.run(cliente.generar("a")), "respuesta a a")
+        datos = cliente.estadisticas()
+        self.assertEqual((datos['llamadas'], datos['errores'], datos['reintentos']), (1, 2, 2))
+        self.assertIn('latencia_p50_ms', datos)
+
+    def test_reintentos_agotados(self):
+        """Test: Agotados los reintentos se lanza ErrorLLM con el último error como causa"""
+        cliente = ClienteLLM(ProveedorFallos(fallos=5), reintentos=1, espera_base=0.001)
+        with self.assertRaises(ErrorLLM) as contexto:
+            asyncio.run(cliente.generar("a"))
+        self.assertIsInstance(contexto.exception.__cause__, RuntimeError)
+        self.assertEqual(cliente.estadisticas()['errores'], 2)
+
+    def test_timeout(self):
+        """Test: Una llamada que supera el timeout se corta y cuenta como timeout"""
+        cliente = ClienteLLM(ProveedorSimulado(latencia=1), timeout=0.05, reintentos=1, espera_base=0.001)
+        with self.assertRaises(ErrorLLM):
+            asyncio.run(cliente.generar("a"))
+        datos = cliente.estadisticas()
+        self.assertEqual((datos['timeouts'], datos['llamadas']), (2, 0))
+
+    def test_limite_de_concurrencia(self):
+        """Test: No hay más de max_concurrentes llamadas simultáneas al proveedor"""
+        proveedor = ProveedorFallos(latencia=0.02)
+        cliente = ClienteLLM(proveedor, max_concurrentes=3, coalescer=False)
+
+        async def lanzar():
+            return await asyncio.gather(*(cliente.generar(f"p{i}") for i in range(10)))
+
+        self.assertEqual(len(asyncio.run(lanzar())), 10)
+        self.assertEqual(proveedor.max_simultaneas, 3)
+
+    def test_limite_por_event_loop(self):
+        """Test: El cliente sirve a varios event loops con el mismo semáforo"""
+        cliente = ClienteLLM(ProveedorSimulado(), max_concurrentes=1)
+        self.assertEqual(asyncio.run(cliente.generar("a")), asyncio.run(cliente.generar("a")))
+
+    def test_limite_unico_para_async_y_streaming(self):
+        """Test: generar y generar_flujo comparten max_concurrentes (no se suman los dos caminos)"""
+        proveedor = ProveedorContado(latencia=0.05)
+        cliente = ClienteLLM(proveedor, max_concurrentes=2, coalescer=False)
+        flujos = [threading.Thread(target=lambda i=i: list(cliente.generar_flujo(f"s{i}"))) for i in range(4)]
+
+        async def lanzar():
+            return await asyncio.gather(*(cliente.generar(f"a{i}") for i in range(4)))
+
+        for hilo in flujos:
+            hilo.start()
+        self.assertEqual(asyncio.run(lanzar()), [f"a{i}" for i in range(4)])
+        for hilo in flujos:
+            hilo.join()
+        self.assertEqual(proveedor.max_simultaneas, 2)
+        self.assertEqual(cliente.estadisticas()['llamadas'], 8)
+
+    def test_espera_de_hueco_con_timeout(self):
+        """Test: Sin hueco libre en `timeout` segundos generar falla como timeout"""
+        cliente = ClienteLLM(ProveedorContado(), timeout=0.05, max_concurrentes=1)
+        cliente._huecos.acquire()
+        with self.assertRaises(ErrorLLM):
+            asyncio.run(cliente.generar("a"))
+        self.assertEqual(cliente.estadisticas()['timeouts'], 1)
+
+    def test_cancelar_espera_de_hueco(self):
+        """Test: Cancelar una llamada que espera hueco no se queda con el hueco"""
+        cliente = ClienteLLM(ProveedorContado(latencia=0), timeout=5, max_concurrentes=1)
+        cliente._huecos.acquire()
+
+        async def escenario():
+            tarea = asyncio.ensure_future(cliente.generar("a"))
+            await asyncio.sleep(0.05)
+            tarea.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await tarea
+            cliente._huecos.release()
+            # El hilo que esperaba toma el hueco y lo devuelve: la siguiente llamada entra
+            return await asyncio.wait_for(cliente.generar("b"), 1)
+
+        self.assertEqual(asyncio.run(escenario()), "b")
+
+    def test_flujo_atascado_se_corta(self):
+        """Test: Un streaming sin fragmentos durante `timeout` segundos termina y libera su hueco"""
+        proveedor = ProveedorAtascado(antes=1)
+        cliente = ClienteLLM(proveedor, timeout=0.1, reintentos=2, max_concurrentes=1, espera_base=0.001)
+        recibidos = []
+        inicio = time.monotonic()
+        with self.assertRaises(ErrorLLM) as contexto:
+            for fragmento in cliente.generar_flujo("a"):
+                recibidos.append(fragmento)
+        self.assertLess(time.monotonic() - inicio, 1)
+        self.assertIsInstance(contexto.exception.__cause__, TimeoutError)
+        self.assertEqual((recibidos, proveedor.llamadas), (['f0'], 1))
+        self.assertEqual(cliente.estadisticas()['timeouts'], 1)
+        self.assertTrue(cliente._huecos.acquire(blocking=False))
+        proveedor.soltar.set()
+
+    def test_flujo_atascado_antes_del_primer_fragmento(self):
+        """Test: Si el proveedor no emite nada en `timeout` segundos se reintenta y después falla"""
+        proveedor = ProveedorAtascado(antes=0)
+        cliente = ClienteLLM(proveedor, timeout=0.05, reintentos=1, espera_base=0.001)
+        with self.assertRaises(ErrorLLM):
+            list(cliente.generar_flujo("a"))
+        self.assertEqual(proveedor.llamadas, 2)
+        self.assertEqual(cliente.estadisticas()['timeouts'], 2)
+        proveedor.soltar.set()
+
+    def test_flujo_reintenta_antes_del_primer_fragmento(self):
+        """Test: El streaming se reintenta si falla antes de emitir nada"""
+        cliente = ClienteLLM(ProveedorFallos(fallos=1), reintentos=1, espera_base=0.001)
+        self.assertEqual(list(cliente.generar_flujo("a")), ['uno', ' dos'])
+        self.assertEqual(cliente.estadisticas()['reintentos'], 1)
+
+    def test_flujo_no_reintenta_tras_emitir(self):
+        """Test: Un fallo a mitad del streaming no se reintenta (lo enviado no se retira)"""
+        proveedor = ProveedorFallos(fallo_tras_fragmento=True)
+        cliente = ClienteLLM(proveedor, reintentos=2, espera_base=0.001)
+        recibidos = []
+        with self.assertRaises(ErrorLLM):
+            for fragmento in cliente.generar_flujo("a"):
+                recibidos.append(fragmento)
+        self.assertEqual(recibidos, ['uno'])
+        self.assertEqual(proveedor.llamadas, 1)
+
+
+class TestCoalescencia(unittest.TestCase):
+    def lanzar(self, cliente, *prompts):
+        async def todas():
+            return await asyncio.gather(*(cliente.generar(prompt) for prompt in prompts), return_exceptions=True)
+        return asyncio.run(todas())
+
+    def test_prompts_iguales_comparten_llamada(self):
+        """Test: Las llamadas simultáneas con el mismo prompt hacen una sola llamada al proveedor"""
+        proveedor = ProveedorFallos(latencia=0.02)
+        cliente = ClienteLLM(proveedor)
+        self.assertEqual(self.lanzar(cliente, *["mismo"] * 5), ["respuesta a mismo"] * 5)
+        self.assertEqual(proveedor.llamadas, 1)
+        datos = cliente.estadisticas()
+        self.assertEqual((datos['coalescidas'], datos['en_curso']), (4, 0))
+
+    def test_prompts_distintos_no_se_agrupan(self):
+        """Test: Cada prompt distinto tiene su propia llamada"""
+        proveedor = ProveedorFallos(latencia=0.02)
+        cliente = ClienteLLM(proveedor)
+        self.assertEqual(self.lanzar(cliente, "a", "b", "a"), ["respuesta a a", "respuesta a b", "respuesta a a"])
+        self.assertEqual(proveedor.llamadas, 2)
+
+    def test_solo_llamadas_simultaneas(self):
+        """Test: Una llamada que empieza cuando la anterior ya terminó vuelve al proveedor"""
+        proveedor = ProveedorFallos()
+        cliente = ClienteLLM(proveedor)
+        self.lanzar(cliente, "a")
+        self.lanzar(cliente, "a")
+        self.assertEqual(proveedor.llamadas, 2)
+
+    def test_error_compartido(self):
+        """Test: Si la llamada compartida falla, todas las que esperan reciben el error"""
+        proveedor = ProveedorFallos(fallos=10, latencia=0.02)
+        cliente = ClienteLLM(proveedor, reintentos=0)
+        resultados = self.lanzar(cliente, *["mismo"] * 3)
+        self.assertTrue(all(isinstance(resultado, ErrorLLM) for resultado in resultados))
+        self.assertEqual(proveedor.llamadas, 1)
+        self.assertEqual(cliente.estadisticas()['en_curso'], 0)
+
+    def test_cancelar_una_espera(self):
+        """Test: Cancelar una de las peticiones no cancela la llamada para las demás"""
+        proveedor = ProveedorFallos(latencia=0.05)
+        cliente = ClienteLLM(proveedor)
+
+        async def escenario():
+            primera = asyncio.ensure_future(cliente.generar("mismo"))
+            segunda = asyncio.ensure_future(cliente.generar("mismo"))
+            await asyncio.sleep(0.01)
+            primera.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await primera
+            return await segunda
+
+        self.assertEqual(asyncio.run(escenario()), "respuesta a mismo")
+        self.assertEqual(proveedor.llamadas, 1)
+
+    def test_sin_coalescer(self):
+        """Test: Con coalescer=False cada llamada va al proveedor"""
+        proveedor = ProveedorFallos(latencia=0.02)
+        cliente = ClienteLLM(proveedor, coalescer=False)
+        self.assertEqual(self.lanzar(cliente, *["mismo"] * 4), ["respuesta a mismo"] * 4)
+        self.assertEqual(proveedor.llamadas, 4)
+        self.assertEqual(cliente.estadisticas()['coalescidas'], 0)
+
+
+class TestMetricasLLM(unittest.TestCase):
+    def test_percentiles(self):
+        """Test: p50 y p95 sobre la ventana de latencias"""
+        metricas = MetricasLLM(ventana=100)
+        for milisegundos in range(1, 101):
+            metricas.registrar(milisegundos / 1000)
+        datos = metricas.resumen()
+        self.assertEqual(datos['llamadas'], 100)
+        self.assertEqual(datos['latencia_p50_ms'], 51.0)
+        self.assertEqual(datos['latencia_p95_ms'], 96.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
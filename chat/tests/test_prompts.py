@@ -0,0 +1,144 @@
+import unittest
+
+from prompts import (ConstructorPrompt, Seccion, coincidencia, estimar_tokens, palabras_clave, pesos_consulta,
+                     recortar_a_tokens)
+
+
+class TestTokens(unittest.TestCase):
+    def test_estimar_tokens(self):
+        """Test: ~4 caracteres por token, redondeando hacia arriba"""
+        self.assertEqual(estimar_tokens(""), 0)
+        self.assertEqual(estimar_tokens("abcd"), 1)
+        self.assertEqual(estimar_tokens("abcde"), 2)
+
+    def test_recortar_a_tokens(self):
+        """Test: Los textos largos se recortan marcando el corte con '…'"""
+        self.assertEqual(recortar_a_tokens("corto", 10), "corto")
+        recortado = recortar_a_tokens("x" * 100, 5)
+        self.assertTrue(recortado.endswith("…"))
+        self.assertLessEqual(estimar_tokens(recortado), 5)
+
+
+class TestPalabrasClave(unittest.TestCase):
+    def test_normalizacion(self):
+        """Test: Minúsculas, sin tildes y sin palabras vacías"""
+        self.assertEqual(palabras_clave("¿Cuáles son las CRÍTICAS del proyecto?"), {'criticas', 'proyecto'})
+
+    def test_identificadores_compuestos(self):
+        """Test: Los identificadores se guardan enteros y por partes"""
+        terminos = palabras_clave("Actualizar log4j-core por CVE-2021-44228")
+        self.assertIn('log4j-core', terminos)
+        self.assertIn('log4j', terminos)
+        self.assertIn('core', terminos)
+        self.assertIn('cve-2021-44228', terminos)
+        self.assertIn('44228', terminos)
+
+
+class TestRelevancia(unittest.TestCase):
+    def test_pesos_idf(self):
+        """Test: Un término presente en todos los candidatos pesa menos que uno distintivo"""
+        candidatos = [{'cve', 'lodash'}, {'cve', 'jquery'}, {'cve', 'openssl'}]
+        pesos = pesos_consulta({'cve', 'lodash', 'inexistente'}, candidatos)
+        self.assertNotIn('inexistente', pesos)
+        self.assertLess(pesos['cve'], pesos['lodash'])
+
+    def test_coincidencia(self):
+        """Test: La coincidencia va de 0 (nada en común) a 1 (todos los términos)"""
+        pesos = {'lodash': 1.0, 'cve': 0.2}
+        self.assertEqual(coincidencia(pesos, {'jquery'}), 0.0)
+        self.assertAlmostEqual(coincidencia(pesos, {'lodash', 'cve'}), 1.0)
+        self.assertGreater(coincidencia(pesos, {'lodash'}), coincidencia(pesos, {'cve'}))
+        self.assertEqual(coincidencia({}, {'lodash'}), 0.0)
+
+
+class TestConstructorPrompt(unittest.TestCase):
+    def test_texto_fijo_siempre_entra(self):
+        """Test: El texto fijo se incluye entero aunque no quede presupuesto"""
+        constructor = ConstructorPrompt(1)
+        constructor.fijo("Eres un asistente de seguridad.", "Responde en español.")
+        self.assertEqual(constructor.construir(), "Eres un asistente de seguridad.\nResponde en español.")
+
+    def test_respeta_presupuesto(self):
+        """Test: Los candidatos que no caben se omiten y se cuentan"""
+        constructor = ConstructorPrompt(30)
+        seccion = constructor.seccion("Vulnerabilidades:")
+        for numero in range(10):
+            seccion.agregar("CVE-2021-%04d en el componente %d" % (numero, numero))
+        prompt = constructor.construir()
+        self.assertLessEqual(constructor.tokens_estimados, 30)
+        self.assertGreater(constructor.omitidos, 0)
+        self.assertTrue(prompt.startswith("Vulnerabilidades:"))
+
+    def test_prioridad(self):
+        """Test: Con presupuesto justo entra el candidato de mayor prioridad, en su orden original"""
+        constructor = ConstructorPrompt(15)
+        seccion = constructor.seccion()
+        seccion.agregar("baja " * 4, prioridad=0.1)
+        seccion.agregar("alta " * 4, prioridad=0.9)
+        seccion.agregar("media " * 4, prioridad=0.5)
+        prompt = constructor.construir()
+        self.assertIn("alta", prompt)
+        self.assertNotIn("baja", prompt)
+
+    def test_consulta_antes_que_prioridad(self):
+        """Test: Lo que menciona la consulta entra antes que lo más prioritario"""
+        constructor = ConstructorPrompt(12, consulta="¿Qué pasa con lodash?")
+        seccion = constructor.seccion()
+        seccion.agregar("CVE-2021-44228 en log4j-core", prioridad=1.0)
+        seccion.agregar("CVE-2021-23337 en lodash", prioridad=0.2)
+        prompt = constructor.construir()
+        self.assertIn("lodash", prompt)
+        self.assertNotIn("log4j", prompt)
+
+    def test_clave_solo_una_variante(self):
+        """Test: De los candidatos con la misma clave solo entra uno"""
+        constructor = ConstructorPrompt(1000)
+        resumen = constructor.seccion("Resumen:")
+        detalle = constructor.seccion("Detalle:")
+        resumen.agregar("CVE-1 (alta)", prioridad=0.5, clave='CVE-1')
+        detalle.agregar("CVE-1: descripción completa", prioridad=0.9, clave='CVE-1')
+        prompt = constructor.construir()
+        self.assertIn("descripción completa", prompt)
+        self.assertNotIn("Resumen:", prompt)
+
+    def test_cabecera_y_pie(self):
+        """Test: Cabecera y pie con contadores; el pie solo si se omitió algo"""
+        constructor = ConstructorPrompt(25)
+        seccion = constructor.seccion("Componentes ({incluidos} de {total}):", pie_omitidos="... y {omitidos} más",
+                                      numeracion="{i}. ")
+        for nombre in ('lodash', 'jquery', 'openssl', 'log4j', 'netty', 'jetty'):
+            seccion.agregar(nombre * 3)
+        prompt = constructor.construir()
+        lineas = prompt.split("\n")
+        self.assertRegex(lineas[0], r"^Componentes \(\d de 6\):$")
+        self.assertTrue(lineas[1].startswith("1. "))
+        self.assertRegex(lineas[-1], r"^\.\.\. y \d más$")
+
+        completo = ConstructorPrompt(1000)
+        seccion = completo.seccion("Componentes:", pie_omitidos="... y {omitidos} más")
+        seccion.agregar("lodash")
+        self.assertEqual(completo.construir(), "Componentes:\nlodash")
+
+    def test_seccion_vacia(self):
+        """Test: Una sección sin fragmentos incluidos no se emite salvo con siempre=True"""
+        constructor = ConstructorPrompt(100)
+        constructor.seccion("Vacía:")
+        constructor.seccion("Siempre:", siempre=True)
+        self.assertEqual(constructor.construir(), "Siempre:")
+
+    def test_seccion_reutilizable(self):
+        """Test: Una sección preparada puede usarse en varios prompts con presupuestos distintos"""
+        seccion = Seccion("Vulnerabilidades:")
+        for numero in range(5):
+            seccion.agregar("CVE-2021-%04d" % numero)
+        grande = ConstructorPrompt(1000)
+        grande.agregar(seccion)
+        pequeno = ConstructorPrompt(10)
+        pequeno.agregar(seccion)
+        self.assertEqual(grande.construir().count("CVE-"), 5)
+        self.assertLess(pequeno.construir().count("CVE-"), 5)
+        self.assertEqual(grande.construir().count("CVE-"), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
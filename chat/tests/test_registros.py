@@ -0,0 +1,89 @@
+import json
+import unittest
+
+from registros import Componente, Severidad, Vulnerabilidad, a_json, codificar_severidad
+
+
+def vulnerabilidad(**campos):
+    datos = {'cve_id': 'CVE-2021-23337', 'severidad': 'HIGH', 'score_cvss': 7.2,
+             'componente_afectado': {'nombre': 'lodash', 'version': '4.17.20'}}
+    datos.update(campos)
+    return Vulnerabilidad(**datos)
+
+
+class TestSeveridad(unittest.TestCase):
+    def test_codificar(self):
+        """Test: Las severidades conocidas pasan a Severidad; las desconocidas se conservan"""
+        self.assertIs(codificar_severidad('CRITICAL'), Severidad.CRITICAL)
+        self.assertEqual(codificar_severidad('N/A'), 'N/A')
+        self.assertIsNone(codificar_severidad(None))
+
+    def test_nivel_y_forma_de_texto(self):
+        """Test: La severidad se lee como texto y se compara por nivel numérico"""
+        vuln = vulnerabilidad()
+        self.assertEqual(vuln['severidad'], 'HIGH')
+        self.assertEqual(vuln.nivel_severidad, 3)
+        self.assertEqual(vulnerabilidad(severidad='N/A').nivel_severidad, 0)
+
+
+class TestComponenteAfectado(unittest.TestCase):
+    def test_modificar_en_sitio(self):
+        """Test: Cambiar una clave del componente afectado queda guardado en la vulnerabilidad"""
+        vuln = vulnerabilidad()
+        vuln['componente_afectado']['version'] = '4.17.21'
+        self.assertEqual(vuln['componente_afectado'], {'nombre': 'lodash', 'version': '4.17.21'})
+        self.assertEqual(vuln.a_dict()['componente_afectado']['version'], '4.17.21')
+
+    def test_misma_instancia_en_cada_lectura(self):
+        """Test: Cada lectura devuelve el mismo objeto, como un dict"""
+        vuln = vulnerabilidad()
+        self.assertIs(vuln['componente_afectado'], vuln.get('componente_afectado'))
+
+    def test_sustituir(self):
+        """Test: Asignar un componente nuevo lo normaliza a nombre y versión sin compartir el original"""
+        vuln = vulnerabilidad()
+        nuevo = {'nombre': 'jquery', 'version': '3.4.1', 'purl': 'pkg:npm/jquery@3.4.1'}
+        vuln['componente_afectado'] = nuevo
+        self.assertEqual(vuln['componente_afectado'], {'nombre': 'jquery', 'version': '3.4.1'})
+        nuevo['version'] = '3.5.0'
+        self.assertEqual(vuln['componente_afectado']['version'], '3.4.1')
+
+    def test_copias_independientes(self):
+        """Test: Una copia con desde_dict(a_dict()) no comparte el componente afectado"""
+        original = vulnerabilidad()
+        copia = Vulnerabilidad.desde_dict(original.a_dict())
+        copia['componente_afectado']['version'] = '0.0.1'
+        self.assertEqual(original['componente_afectado']['version'], '4.17.20')
+
+    def test_sin_componente(self):
+        """Test: Sin componente afectado la clave no existe"""
+        vuln = Vulnerabilidad(cve_id='CVE-1')
+        self.assertNotIn('componente_afectado', vuln)
+        self.assertEqual(vuln.get('componente_afectado', {}), {})
+
+
+class TestRegistro(unittest.TestCase):
+    def test_se_comporta_como_dict(self):
+        """Test: get, [], in, keys e igualdad con el dict que sustituye"""
+        vuln = vulnerabilidad(razon_exclusion='severidad')
+        self.assertEqual(vuln.get('descripcion', 'sin'), 'sin')
+        self.assertIn('razon_exclusion', vuln)
+        self.assertEqual(vuln.keys(), ['cve_id', 'severidad', 'score_cvss', 'componente_afectado', 'razon_exclusion'])
+        self.assertEqual(vuln, vuln.a_dict())
+        with self.assertRaises(KeyError):
+            vuln['descripcion']
+
+    def test_json(self):
+        """Test: a_json serializa los registros con su forma dict"""
+        texto = json.dumps({'vulnerabilidades': [vulnerabilidad()]}, default=a_json)
+        self.assertEqual(json.loads(texto)['vulnerabilidades'][0]['componente_afectado'],
+                         {'nombre': 'lodash', 'version': '4.17.20'})
+
+    def test_componente_solo_sus_campos(self):
+        """Test: Un componente devuelve solo los campos que se le asignaron, en el orden de CAMPOS"""
+        componente = Componente(version='1.0', nombre='a', licencias=['MIT'])
+        self.assertEqual(list(componente.a_dict()), ['nombre', 'version', 'licencias'])
+
+
+if __name__ == '__main__':
+    unittest.main()
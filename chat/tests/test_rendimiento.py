@@ -0,0 +1,117 @@
+"""
+Pruebas de rendimiento sin red de /chat/upload-sbom y /chat/mensajes: LLM simulado y espejo NVD
+construido con el fixture. Miden peticiones por segundo y latencias y comprueban que todas las
+peticiones terminan bien; la medida acompaña al mensaje de cualquier fallo.
+
+Solo se ejecutan con CHAT_BENCH=1 (python -m unittest tests.test_rendimiento).
+CHAT_BENCH_PETICIONES y CHAT_BENCH_CONCURRENCIA ajustan la carga (por defecto 40 y 8).
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+# ✅ SIN RED: backend LLM simulado antes de importar la app
+os.environ.setdefault('LLM_PROVEEDOR', 'simulado')
+
+import app
+from espejo_nvd import EspejoNVD
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'nvd_pagina.json')
+
+PETICIONES = int(os.getenv("CHAT_BENCH_PETICIONES", "40"))
+CONCURRENCIA = int(os.getenv("CHAT_BENCH_CONCURRENCIA", "8"))
+
+
+def sbom_cyclonedx(componentes=50):
+    """SBOM CycloneDX con componentes afectados por el fixture y relleno sin vulnerabilidades"""
+    lista = [
+        {'type': 'library', 'name': 'lodash', 'version': '4.17.20', 'purl': 'pkg:npm/lodash@4.17.20'},
+        {'type': 'library', 'name': 'jquery', 'version': '3.4.1', 'purl': 'pkg:npm/jquery@3.4.1'},
+        {'type': 'library', 'name': 'jquery-ui', 'version': '1.12.1', 'purl': 'pkg:npm/jquery-ui@1.12.1'},
+    ]
+    lista += [{'type': 'library', 'name': f'paquete-{i}', 'version': f'1.0.{i}', 'purl': f'pkg:npm/paquete-{i}@1.0.{i}'}
+              for i in range(componentes - len(lista))]
+    return json.dumps({'bomFormat': 'CycloneDX', 'specVersion': '1.4', 'components': lista}).encode('utf-8')
+
+
+def medir(nombre, peticion):
+    """Lanza PETICIONES peticiones con CONCURRENCIA hilos; devuelve las respuestas y el resumen de la medida"""
+    def cronometrar(i):
+        inicio = time.perf_counter()
+        respuesta = peticion(i)
+        return respuesta, time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCIA) as pool:
+        resultados = list(pool.map(cronometrar, range(PETICIONES)))
+    total = time.perf_counter() - inicio
+    latencias = sorted(segundos for _, segundos in resultados)
+    p50 = latencias[len(latencias) // 2] * 1000
+    p95 = latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))] * 1000
+    resumen = (f"📊 {nombre}: {PETICIONES} peticiones ({CONCURRENCIA} simultáneas) en {total:.2f}s "
+               f"= {PETICIONES / total:.1f} req/s, p50 {p50:.0f} ms, p95 {p95:.0f} ms")
+    return [respuesta for respuesta, _ in resultados], resumen
+
+
+@unittest.skipUnless(os.getenv("CHAT_BENCH") == "1", "pruebas de rendimiento: activar con CHAT_BENCH=1")
+class TestRendimientoChat(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        if app.LLM_PROVEEDOR != 'simulado':
+            raise unittest.SkipTest("las pruebas de rendimiento necesitan LLM_PROVEEDOR=simulado")
+        cls.directorio = tempfile.mkdtemp()
+        espejo = EspejoNVD(os.path.join(cls.directorio, 'espejo.db'))
+        espejo.cargar_feed(FIXTURE)
+        cls.parche = mock.patch.object(app, 'espejo_nvd', espejo)
+        cls.parche.start()
+        cls.sbom = sbom_cyclonedx()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.parche.stop()
+        shutil.rmtree(cls.directorio, ignore_errors=True)
+
+    def cliente(self, usuario):
+        cliente = app.app.test_client()
+        cliente.set_cookie('username', usuario)
+        return cliente
+
+    def subir(self, cliente):
+        return cliente.post('/chat/upload-sbom', data={'file': (io.BytesIO(self.sbom), 'bench.bom.json')},
+                            content_type='multipart/form-data')
+
+    def test_upload_sbom(self):
+        """Test: Rendimiento de /chat/upload-sbom con el LLM simulado y el espejo NVD"""
+        respuestas, resumen = medir('/chat/upload-sbom', lambda i: self.subir(self.cliente(f'bench-subida-{i}')))
+        for respuesta in respuestas:
+            self.assertEqual(respuesta.status_code, 200, f"{resumen}\n{respuesta.get_data(as_text=True)[:300]}")
+        datos = respuestas[0].get_json()
+        self.assertEqual(datos['sbom_info']['componentes'], 50)
+        cves = {vuln['cve_id'] for vuln in app.historial_conversaciones.obtener('bench-subida-0')
+                .contexto_sbom.sbom_data['vulnerabilidades_nvd']}
+        self.assertIn('CVE-2020-11023', cves)
+
+    def test_mensajes(self):
+        """Test: Rendimiento de /chat/mensajes sobre un SBOM analizado, sin cache de respuestas"""
+        usuarios = [f'bench-chat-{i}' for i in range(CONCURRENCIA)]
+        for usuario in usuarios:
+            self.assertEqual(self.subir(self.cliente(usuario)).status_code, 200)
+
+        def preguntar(i):
+            return self.cliente(usuarios[i % len(usuarios)]).post('/chat/mensajes', json={
+                'message': f"¿Qué vulnerabilidades críticas tiene el SBOM? ({i})", 'cache': False})
+
+        respuestas, resumen = medir('/chat/mensajes', preguntar)
+        for respuesta in respuestas:
+            self.assertEqual(respuesta.status_code, 200, f"{resumen}\n{respuesta.get_data(as_text=True)[:300]}")
+            self.assertIn('[simulado', respuesta.get_json()['message'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import unittest
+from unittest import mock
+
+# ✅ SIN RED: backend LLM simulado antes de importar la app
+os.environ.setdefault('LLM_PROVEEDOR', 'simulado')
+
+import app
+from conversaciones import ContextoSBOM, Conversacion
+
+CRITERIOS = {'peso_severidad': 70, 'peso_solucionabilidad': 30}
+
+
+def contexto_de_prueba(criterios=CRITERIOS):
+    return ContextoSBOM('sbom.json', {
+        'formato': 'CycloneDX', 'resumen': {'total_componentes': 2},
+        'vulnerabilidades_nvd': [
+            {'cve_id': 'CVE-2020-11023', 'severidad': 'MEDIUM', 'score_cvss': 6.1,
+             'componente_afectado': {'nombre': 'jquery', 'version': '3.4.1'}},
+            {'cve_id': 'CVE-2021-23337', 'severidad': 'HIGH', 'score_cvss': 7.2,
+             'componente_afectado': {'nombre': 'lodash', 'version': '4.17.20'}},
+        ]
+    }, proyecto_id=1, proyecto_nombre='Web', criterios_solucionabilidad=criterios)
+
+
+class TestSeccionesPromptSBOM(unittest.TestCase):
+    """Las secciones del análisis se generan una vez y solo se regeneran si cambian los criterios"""
+
+    def setUp(self):
+        self.conversacion = Conversacion(contexto_sbom=contexto_de_prueba())
+        self.conversacion.agregar("Usuario: hola")
+        parche = mock.patch.object(app, 'generar_secciones_prompt_sbom', wraps=app.generar_secciones_prompt_sbom)
+        self.generar = parche.start()
+        self.addCleanup(parche.stop)
+
+    def turno(self, pregunta="¿Qué vulnerabilidades tiene el SBOM?", criterios=None):
+        return app.formatear_historial_para_ai(self.conversacion, True, pregunta, criterios_proyecto=criterios)
+
+    def test_una_generacion_por_analisis(self):
+        """Test: Varios turnos, con preguntas distintas o generales, generan las secciones una sola vez"""
+        primero = self.turno()
+        self.turno("¿Y lodash?")
+        app.formatear_historial_para_ai(self.conversacion, False, "gracias")
+        self.assertEqual(self.generar.call_count, 1)
+        self.assertIn('CVE-2021-23337', primero)
+        self.assertIn('Severidad 70% / Solucionabilidad 30%', primero)
+
+    def test_mismos_criterios_no_regeneran(self):
+        """Test: Los criterios actuales iguales a los del análisis (en otro orden) reutilizan las secciones"""
+        self.turno()
+        self.turno(criterios={'peso_solucionabilidad': 30, 'peso_severidad': 70})
+        self.assertEqual(self.generar.call_count, 1)
+
+    def test_criterios_nuevos_regeneran(self):
+        """Test: Si cambian los criterios del proyecto las secciones se regeneran con ellos, y después se reutilizan"""
+        self.turno()
+        nuevos = {'peso_severidad': 40, 'peso_solucionabilidad': 60}
+        prompt = self.turno(criterios=nuevos)
+        self.assertEqual(self.generar.call_count, 2)
+        self.assertEqual(self.generar.call_args.args[1], nuevos)
+        self.assertIn('Severidad 40% / Solucionabilidad 60%', prompt)
+        self.assertNotIn('Severidad 70% / Solucionabilidad 30%', prompt)
+        self.turno(criterios=nuevos)
+        self.assertEqual(self.generar.call_count, 2)
+
+    def test_cada_analisis_sus_secciones(self):
+        """Test: Un análisis nuevo (otro ContextoSBOM) genera las suyas"""
+        self.turno()
+        self.conversacion.guardar_contexto_sbom(contexto_de_prueba())
+        self.turno()
+        self.assertEqual(self.generar.call_count, 2)
+
+    def test_no_se_persisten(self):
+        """Test: Las secciones guardadas no forman parte del contexto serializado"""
+        self.turno()
+        self.assertNotIn('_secciones_prompt', self.conversacion.contexto_sbom.a_dict())
+        copia = ContextoSBOM.desde_dict(self.conversacion.contexto_sbom.a_dict())
+        app.formatear_historial_para_ai(Conversacion(contexto_sbom=copia), True, "vulnerabilidades")
+        self.assertEqual(self.generar.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
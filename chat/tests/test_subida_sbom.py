@@ -0,0 +1,140 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+# ✅ SIN RED: backend LLM simulado antes de importar la app
+os.environ.setdefault('LLM_PROVEEDOR', 'simulado')
+
+import app
+from espejo_nvd import EspejoNVD
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'nvd_pagina.json')
+
+
+def sbom_cyclonedx(componentes=3):
+    lista = [{'type': 'library', 'name': 'jquery', 'version': '3.4.1', 'purl': 'pkg:npm/jquery@3.4.1'}]
+    lista += [{'type': 'library', 'name': f'paquete-{i}', 'version': '1.0.0', 'purl': f'pkg:npm/paquete-{i}@1.0.0'}
+              for i in range(componentes - 1)]
+    return json.dumps({'bomFormat': 'CycloneDX', 'specVersion': '1.4', 'components': lista}).encode('utf-8')
+
+
+class FlujoContado(io.BytesIO):
+    """Stream de subida que anota cada lectura (tamaño pedido)"""
+
+    def __init__(self, datos):
+        super().__init__(datos)
+        self.lecturas = []
+
+    def read(self, tamano=-1):
+        self.lecturas.append(tamano)
+        return super().read(tamano)
+
+
+class TestParsearSBOM(unittest.TestCase):
+    def test_tipos_por_extension(self):
+        """Test: Cada formato se parsea según su extensión en el tipo de documento esperado"""
+        cyclonedx_xml = (b'<bom xmlns="http://cyclonedx.org/schema/bom/1.4"><components>'
+                         b'<component type="library"><name>jquery</name><version>3.4.1</version></component>'
+                         b'</components></bom>')
+        casos = [
+            ('sbom.json', sbom_cyclonedx(), 'json'),
+            ('sbom.yaml', b'bomFormat: CycloneDX\ncomponents: []\n', 'yaml'),
+            ('sbom.xml', cyclonedx_xml, 'xml'),
+            ('sbom.txt', b'PackageName: jquery\n', 'texto'),
+        ]
+        for nombre, contenido, tipo in casos:
+            with self.subTest(nombre=nombre):
+                self.assertEqual(app.parsear_sbom(io.BytesIO(contenido), nombre)[0], tipo)
+
+    def test_json_grande_por_bloques(self):
+        """Test: Un JSON por encima del umbral se recorre por bloques sin leer el stream entero"""
+        contenido = sbom_cyclonedx(400)
+        flujo = FlujoContado(contenido)
+        with mock.patch.dict(app.app.config, {'JSON_INCREMENTAL_BYTES': 1024}):
+            tipo, documento = app.parsear_sbom(flujo, 'grande.json')
+        self.assertEqual(tipo, 'json_flujo')
+        self.assertEqual(len(documento[1]['componentes']), 400)
+        self.assertNotIn(-1, flujo.lecturas)
+        self.assertNotIn(None, flujo.lecturas)
+        self.assertTrue(all(tamano < len(contenido) for tamano in flujo.lecturas))
+
+    def test_validar_y_procesar_el_mismo_arbol(self):
+        """Test: Validación y extracción usan el documento parseado, sin volver a leer el contenido"""
+        flujo = FlujoContado(sbom_cyclonedx())
+        tipo, documento = app.parsear_sbom(flujo, 'sbom.json')
+        lecturas = len(flujo.lecturas)
+        self.assertTrue(app.validar_documento_sbom(tipo, documento)[0])
+        self.assertEqual(len(app.procesar_documento_sbom(tipo, documento)['componentes']), 3)
+        self.assertEqual(len(flujo.lecturas), lecturas)
+
+
+class TestSubidaUnaPasada(unittest.TestCase):
+    """/chat/upload-sbom parsea la subida una vez y no escribe ficheros salvo que se pida"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        espejo = EspejoNVD(os.path.join(self.directorio, 'espejo.db'))
+        espejo.cargar_feed(FIXTURE)
+        self.subidas = os.path.join(self.directorio, 'subidas')
+        os.makedirs(self.subidas)
+        for parche in (mock.patch.object(app, 'espejo_nvd', espejo),
+                       mock.patch.dict(app.app.config, {'UPLOAD_FOLDER': self.subidas})):
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def subir(self, contenido=None, nombre='sbom.json'):
+        cliente = app.app.test_client()
+        cliente.set_cookie('username', 'subida-ana')
+        return cliente.post('/chat/upload-sbom', data={'file': (io.BytesIO(contenido or sbom_cyclonedx()), nombre)},
+                            content_type='multipart/form-data')
+
+    def test_un_solo_parseo(self):
+        """Test: La subida se parsea una vez y validación y procesamiento reciben ese mismo documento"""
+        contenido = sbom_cyclonedx()
+        parsear = mock.Mock(wraps=app.parsear_sbom)
+        validar = mock.Mock(wraps=app.validar_documento_sbom)
+        procesar = mock.Mock(wraps=app.procesar_documento_sbom)
+        with mock.patch.object(app, 'parsear_sbom', parsear), \
+                mock.patch.object(app, 'validar_documento_sbom', validar), \
+                mock.patch.object(app, 'procesar_documento_sbom', procesar), \
+                mock.patch.object(app.json, 'loads', wraps=json.loads) as loads:
+            respuesta = self.subir(contenido)
+        self.assertEqual(respuesta.status_code, 200, respuesta.get_data(as_text=True)[:300])
+        self.assertEqual(parsear.call_count, 1)
+        # json.loads también lo usa el espejo NVD: solo cuentan las llamadas con el documento subido
+        self.assertEqual(sum(1 for llamada in loads.call_args_list if llamada.args[:1] == (contenido,)), 1)
+        self.assertIs(validar.call_args.args[1], procesar.call_args.args[1])
+        self.assertEqual(respuesta.get_json()['sbom_info']['componentes'], 3)
+
+    def test_sin_ficheros_temporales(self):
+        """Test: Sin GUARDAR_SUBIDAS no se escribe nada en la carpeta de subidas"""
+        with mock.patch.dict(app.app.config, {'GUARDAR_SUBIDAS': False}):
+            self.assertEqual(self.subir().status_code, 200)
+        self.assertEqual(os.listdir(self.subidas), [])
+
+    def test_copia_si_se_pide(self):
+        """Test: Con GUARDAR_SUBIDAS se guarda una copia idéntica y el análisis sigue funcionando"""
+        contenido = sbom_cyclonedx()
+        with mock.patch.dict(app.app.config, {'GUARDAR_SUBIDAS': True}):
+            self.assertEqual(self.subir(contenido).status_code, 200)
+        copias = os.listdir(self.subidas)
+        self.assertEqual(len(copias), 1)
+        with open(os.path.join(self.subidas, copias[0]), 'rb') as copia:
+            self.assertEqual(copia.read(), contenido)
+
+    def test_contenido_no_valido(self):
+        """Test: Un documento que no es un SBOM se rechaza con 400 tras el único parseo"""
+        respuesta = self.subir(b'{"hola": "mundo"}')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn("Archivo no válido", respuesta.get_json()['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+# ✅ SIN RED: backend LLM simulado antes de importar la app
+os.environ.setdefault('LLM_PROVEEDOR', 'simulado')
+
+import app
+from espejo_nvd import EspejoNVD
+from trabajos import COMPLETADO, EN_CURSO, ERROR, PENDIENTE, GestorTrabajos
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'nvd_pagina.json')
+
+
+def esperar(trabajo, timeout=10):
+    limite = time.monotonic() + timeout
+    while not trabajo.terminado and time.monotonic() < limite:
+        trabajo.esperar_cambio(trabajo.version, timeout=0.1)
+    return trabajo
+
+
+class TestGestorTrabajos(unittest.TestCase):
+    def test_etapas_progreso_y_resultado(self):
+        """Test: El trabajo pasa por sus etapas y termina con el resultado de la función"""
+        gestor = GestorTrabajos(max_workers=1)
+        continuar = threading.Event()
+
+        def funcion(trabajo, valor):
+            trabajo.iniciar_etapa('uno')
+            trabajo.actualizar_progreso(1, 2)
+            continuar.wait(5)
+            return {'valor': valor}, 200
+
+        trabajo = gestor.crear('ana', funcion, 7, etapas=['uno'])
+        self.assertIn(trabajo.estado, (PENDIENTE, EN_CURSO))
+        # Mientras la función espera se ve la etapa y el progreso, sin resultado
+        while trabajo.progreso['procesados'] != 1:
+            trabajo.esperar_cambio(trabajo.version, timeout=0.1)
+        datos = trabajo.a_dict()
+        self.assertEqual((datos['estado'], datos['etapa'], datos['progreso']), (EN_CURSO, 'uno', {'procesados': 1, 'total': 2}))
+        self.assertNotIn('resultado', datos)
+        continuar.set()
+        datos = esperar(trabajo).a_dict()
+        self.assertEqual((datos['estado'], datos['status_http'], datos['resultado']), (COMPLETADO, 200, {'valor': 7}))
+
+    def test_errores(self):
+        """Test: Un status >= 400 o una excepción dejan el trabajo en error con su mensaje"""
+        gestor = GestorTrabajos()
+        rechazado = esperar(gestor.crear('ana', lambda trabajo: ({'error': 'SBOM inválido'}, 400)))
+        self.assertEqual((rechazado.estado, rechazado.error, rechazado.status_http), (ERROR, 'SBOM inválido', 400))
+
+        def falla(trabajo):
+            raise RuntimeError("se rompió")
+
+        roto = esperar(gestor.crear('ana', falla))
+        self.assertEqual((roto.estado, roto.error, roto.status_http), (ERROR, 'se rompió', 500))
+
+    def test_solo_su_usuario(self):
+        """Test: Un trabajo solo lo ve el usuario que lo creó"""
+        gestor = GestorTrabajos()
+        trabajo = gestor.crear('ana', lambda trabajo: ({}, 200))
+        self.assertIs(gestor.obtener(trabajo.id, 'ana'), trabajo)
+        self.assertIsNone(gestor.obtener(trabajo.id, 'luis'))
+        self.assertIsNone(gestor.obtener('no-existe', 'ana'))
+
+    def test_limpiar_terminados(self):
+        """Test: Los trabajos terminados se eliminan pasado el ttl"""
+        gestor = GestorTrabajos(ttl=0.05)
+        esperar(gestor.crear('ana', lambda trabajo: ({}, 200)))
+        time.sleep(0.1)
+        gestor.limpiar()
+        self.assertEqual(len(gestor), 0)
+
+
+class TestEndpointsTrabajos(unittest.TestCase):
+    """POST /chat/trabajos/sbom, GET /chat/trabajos/<id> y /chat/trabajos/<id>/eventos con el espejo NVD del fixture"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        espejo = EspejoNVD(os.path.join(self.directorio, 'espejo.db'))
+        espejo.cargar_feed(FIXTURE)
+        parche = mock.patch.object(app, 'espejo_nvd', espejo)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def cliente(self, usuario):
+        cliente = app.app.test_client()
+        cliente.set_cookie('username', usuario)
+        return cliente
+
+    def crear(self, cliente, contenido=None, nombre='sbom.json'):
+        contenido = contenido or json.dumps({'bomFormat': 'CycloneDX', 'specVersion': '1.4', 'components': [
+            {'type': 'library', 'name': 'jquery', 'version': '3.4.1', 'purl': 'pkg:npm/jquery@3.4.1'}
+        ]}).encode('utf-8')
+        return cliente.post('/chat/trabajos/sbom', data={'file': (io.BytesIO(contenido), nombre)},
+                            content_type='multipart/form-data')
+
+    def consultar_hasta_terminar(self, cliente, url, timeout=10):
+        limite = time.monotonic() + timeout
+        while True:
+            datos = cliente.get(url).get_json()
+            if datos['estado'] in (COMPLETADO, ERROR) or time.monotonic() > limite:
+                return datos
+            time.sleep(0.02)
+
+    def test_crear_y_consultar(self):
+        """Test: La subida responde 202 con el id y el estado termina con el análisis completo"""
+        cliente = self.cliente('trabajo-ana')
+        respuesta = self.crear(cliente)
+        self.assertEqual(respuesta.status_code, 202)
+        datos = respuesta.get_json()
+        self.assertEqual(respuesta.headers['Location'], datos['estado_url'])
+        self.assertEqual(datos['estado_url'], f"/chat/trabajos/{datos['trabajo_id']}")
+
+        estado = self.consultar_hasta_terminar(cliente, datos['estado_url'])
+        self.assertEqual(estado['estado'], COMPLETADO, estado.get('error'))
+        self.assertEqual(estado['etapas'], app.ETAPAS_ANALISIS_SBOM)
+        self.assertEqual(estado['status_http'], 200)
+        self.assertEqual(estado['resultado']['sbom_info']['componentes'], 1)
+        # El análisis queda como contexto del chat del usuario
+        contexto = app.historial_conversaciones.obtener('trabajo-ana').contexto_sbom
+        self.assertEqual([v['cve_id'] for v in contexto.sbom_data['vulnerabilidades_nvd']], ['CVE-2020-11023'])
+
+    def test_otro_usuario_no_lo_ve(self):
+        """Test: Otro usuario recibe 404 en el estado y en los eventos"""
+        datos = self.crear(self.cliente('trabajo-ana')).get_json()
+        otro = self.cliente('trabajo-luis')
+        self.assertEqual(otro.get(datos['estado_url']).status_code, 404)
+        self.assertEqual(otro.get(datos['eventos_url']).status_code, 404)
+        self.consultar_hasta_terminar(self.cliente('trabajo-ana'), datos['estado_url'])
+
+    def test_archivo_no_valido(self):
+        """Test: Sin archivo o con una extensión no permitida no se crea trabajo"""
+        cliente = self.cliente('trabajo-ana')
+        self.assertEqual(cliente.post('/chat/trabajos/sbom', data={}, content_type='multipart/form-data').status_code, 400)
+        self.assertEqual(self.crear(cliente, b'MZ', 'programa.exe').status_code, 400)
+
+    def test_contenido_invalido_termina_en_error(self):
+        """Test: Un SBOM que no se puede analizar deja el trabajo en error con el status de la validación"""
+        cliente = self.cliente('trabajo-ana')
+        datos = self.crear(cliente, b'{"no": "es un sbom"}').get_json()
+        estado = self.consultar_hasta_terminar(cliente, datos['estado_url'])
+        self.assertEqual(estado['estado'], ERROR)
+        self.assertGreaterEqual(estado['status_http'], 400)
+        self.assertTrue(estado['error'])
+
+    def test_eventos(self):
+        """Test: El stream de eventos termina con un evento 'resultado' con el estado final"""
+        cliente = self.cliente('trabajo-ana')
+        datos = self.crear(cliente).get_json()
+        respuesta = cliente.get(datos['eventos_url'])
+        self.assertEqual(respuesta.mimetype, 'text/event-stream')
+        eventos = [bloque for bloque in respuesta.get_data(as_text=True).split('\n\n') if bloque.startswith('event:')]
+        nombres = [bloque.split('\n')[0][len('event: '):] for bloque in eventos]
+        self.assertEqual(nombres[-1], 'resultado')
+        self.assertTrue(all(nombre == 'progreso' for nombre in nombres[:-1]))
+        final = json.loads(eventos[-1].split('\n', 1)[1][len('data: '):])
+        self.assertEqual(final['estado'], COMPLETADO)
+
+
+if __name__ == '__main__':
+    unittest.main()
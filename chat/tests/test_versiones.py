@@ -0,0 +1,133 @@
+import os
+import unittest
+
+# ✅ SIN RED: backend LLM simulado antes de importar la app
+os.environ.setdefault('LLM_PROVEEDOR', 'simulado')
+
+import app
+from versiones import (comparar_versiones, esquema_para_purl, version_valida,
+                       PredicadoCVE, RangoCPE)
+
+
+def cve_con_rango(producto, vendor=None, **rango):
+    cpe_match = {'vulnerable': True, 'criteria': f"cpe:2.3:a:{vendor or producto}:{producto}:*:*:*:*:*:*:*:*"}
+    cpe_match.update(rango)
+    # El id debe variar: app.predicados_cve cachea por (id, lastModified)
+    return {'id': f"CVE-TEST-{producto}-{sorted(rango.items())}", 'lastModified': '2024-01-01T00:00:00.000',
+            'configurations': [{'nodes': [{'operator': 'OR', 'cpeMatch': [cpe_match]}]}]}
+
+
+class TestComparacionVersiones(unittest.TestCase):
+    def assertOrden(self, esquema, *versiones):
+        """Cada versión es estrictamente menor que la siguiente"""
+        for menor, mayor in zip(versiones, versiones[1:]):
+            self.assertEqual(comparar_versiones(menor, mayor, esquema), -1, f"{menor} < {mayor} ({esquema})")
+            self.assertEqual(comparar_versiones(mayor, menor, esquema), 1, f"{mayor} > {menor} ({esquema})")
+
+    def assertIguales(self, esquema, *versiones):
+        for otra in versiones[1:]:
+            self.assertEqual(comparar_versiones(versiones[0], otra, esquema), 0, f"{versiones[0]} == {otra} ({esquema})")
+
+    def test_semver(self):
+        self.assertOrden('semver', '1.0.0-alpha', '1.0.0-alpha.1', '1.0.0-alpha.beta', '1.0.0-beta',
+                         '1.0.0-beta.2', '1.0.0-beta.11', '1.0.0-rc.1', '1.0.0', '1.0.1', '1.9.0', '1.10.0', '2.0.0')
+        self.assertIguales('semver', '1.2.3', 'v1.2.3', '1.2.3+build.5')
+
+    def test_semver_ceros_finales(self):
+        """Test: 1.2.3 == 1.2.3.0 (y no menor)"""
+        self.assertIguales('semver', '1.2.3', '1.2.3.0', '1.2.3.0.0')
+        self.assertIguales('semver', '1.2', '1.2.0')
+        self.assertOrden('semver', '1.2.3', '1.2.3.1', '1.2.4')
+
+    def test_pep440(self):
+        self.assertOrden('pep440', '1.0.dev1', '1.0a1', '1.0a2', '1.0b1', '1.0rc1', '1.0', '1.0.post1',
+                         '1.0.1', '1.1', '2!0.5')
+        self.assertIguales('pep440', '1.0', '1.0.0', 'v1.0', '1.0.0.0')
+        self.assertIguales('pep440', '1.0rc1', '1.0-rc.1', '1.0c1')
+
+    def test_maven(self):
+        self.assertOrden('maven', '1.0-alpha-1', '1.0-beta-1', '1.0-M1', '1.0-RC1', '1.0-SNAPSHOT',
+                         '1.0', '1.0-sp1', '1.0.1', '1.1')
+        self.assertIguales('maven', '1', '1.0', '1.0.0', '1.0-ga', '1.0.Final', '1.0-RELEASE')
+        self.assertOrden('maven', '2.14.1', '2.15.0', '2.17.1')
+
+    def test_debian(self):
+        self.assertOrden('debian', '1.0~rc1', '1.0', '1.0-1', '1.0-2', '1.0.1', '1:0.9')
+        self.assertOrden('debian', '1.1.1f-1ubuntu2', '1.1.1f-1ubuntu2.16', '1.1.1n-0+deb11u4')
+        self.assertIguales('debian', '0:1.0-1', '1.0-1')
+
+    def test_esquema_para_purl(self):
+        self.assertEqual(esquema_para_purl('pkg:pypi/django@4.2'), 'pep440')
+        self.assertEqual(esquema_para_purl('pkg:maven/org.apache.logging.log4j/log4j-core@2.14.1'), 'maven')
+        self.assertEqual(esquema_para_purl('pkg:deb/debian/openssl@1.1.1n-0+deb11u4'), 'debian')
+        self.assertEqual(esquema_para_purl('pkg:npm/lodash@4.17.20'), 'semver')
+        self.assertEqual(esquema_para_purl(''), 'semver')
+
+    def test_version_valida(self):
+        self.assertTrue(version_valida('1.0'))
+        for version in ('', '*', '-', 'No especificada', 'latest'):
+            self.assertFalse(version_valida(version))
+
+
+class TestPredicados(unittest.TestCase):
+    def test_rango_excluyente_e_incluyente(self):
+        rango = RangoCPE({'criteria': 'cpe:2.3:a:apache:log4j:*:*:*:*:*:*:*:*',
+                          'versionStartIncluding': '2.0', 'versionEndExcluding': '2.15.0'})
+        self.assertTrue(rango.contiene('2.0', 'maven'))
+        self.assertTrue(rango.contiene('2.14.1', 'maven'))
+        self.assertFalse(rango.contiene('2.15.0', 'maven'))
+        self.assertFalse(rango.contiene('1.2.17', 'maven'))
+
+    def test_version_exacta(self):
+        rango = RangoCPE({'criteria': 'cpe:2.3:a:openssl:openssl:1.0.1f:*:*:*:*:*:*:*'})
+        self.assertTrue(rango.contiene('1.0.1f', 'semver'))
+        self.assertFalse(rango.contiene('1.0.1g', 'semver'))
+
+    def test_evaluar(self):
+        predicado = PredicadoCVE(cve_con_rango('lodash', versionEndExcluding='4.17.21'))
+        self.assertTrue(predicado.evaluar({'lodash'}, '4.17.20'))
+        self.assertFalse(predicado.evaluar({'lodash'}, '4.17.21'))
+        self.assertIsNone(predicado.evaluar({'underscore'}, '1.0'))
+        self.assertIsNone(predicado.evaluar({'lodash'}, '4.17.20', vendors={'otro'}))
+        self.assertTrue(predicado.evaluar({'lodash'}, 'No especificada'))
+
+    def test_ignora_no_vulnerables_y_negados(self):
+        cve_data = cve_con_rango('app')
+        cve_data['configurations'][0]['nodes'][0]['cpeMatch'].append(
+            {'vulnerable': False, 'criteria': 'cpe:2.3:o:linux:linux_kernel:*:*:*:*:*:*:*:*'})
+        cve_data['configurations'][0]['nodes'].append(
+            {'negate': True, 'cpeMatch': [{'vulnerable': True, 'criteria': 'cpe:2.3:a:otro:otro:*:*:*:*:*:*:*:*'}]})
+        self.assertEqual(set(PredicadoCVE(cve_data).rangos), {'app'})
+
+
+class TestRelevancia(unittest.TestCase):
+    def relevante(self, cve_data, nombre, version, purl=''):
+        return app.es_vulnerabilidad_relevante(cve_data, {'nombre': nombre, 'version': version, 'purl': purl})
+
+    def test_no_usa_rangos_de_otro_producto(self):
+        """Test: jquery-ui no se evalúa con los rangos de jquery (ni positivo ni negativo)"""
+        cve_jquery = cve_con_rango('jquery', versionEndExcluding='3.5.0')
+        self.assertFalse(self.relevante(cve_jquery, 'jquery-ui', '1.12.1', 'pkg:npm/jquery-ui@1.12.1'))
+        self.assertTrue(self.relevante(cve_jquery, 'jquery', '1.12.4', 'pkg:npm/jquery@1.12.4'))
+
+    def test_alias_conocido(self):
+        """Test: log4j-core usa los rangos del producto CPE log4j"""
+        cve_log4j = cve_con_rango('log4j', vendor='apache', versionStartIncluding='2.0', versionEndExcluding='2.15.0')
+        purl = 'pkg:maven/org.apache.logging.log4j/log4j-core@{}'
+        self.assertTrue(self.relevante(cve_log4j, 'log4j-core', '2.14.1', purl.format('2.14.1')))
+        self.assertFalse(self.relevante(cve_log4j, 'log4j-core', '2.17.1', purl.format('2.17.1')))
+
+    def test_esquema_del_ecosistema(self):
+        """Test: La versión del purl se compara con el esquema de su ecosistema"""
+        cve_django = cve_con_rango('django', vendor='djangoproject', versionEndExcluding='4.2')
+        self.assertTrue(self.relevante(cve_django, 'django', '4.2rc1', 'pkg:pypi/django@4.2rc1'))
+        self.assertFalse(self.relevante(cve_django, 'django', '4.2.post1', 'pkg:pypi/django@4.2.post1'))
+
+    def test_sin_configuraciones_usa_descripcion(self):
+        cve_data = {'id': 'CVE-0000-0002', 'descriptions': [{'lang': 'en', 'value': 'A flaw in minimist allows...'}]}
+        self.assertTrue(self.relevante(cve_data, 'minimist', '1.2.5'))
+        self.assertFalse(self.relevante(cve_data, 'lodash', '4.17.20'))
+
+
+if __name__ == '__main__':
+    unittest.main()
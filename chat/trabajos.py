@@ -0,0 +1,133 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Estados de un trabajo
+PENDIENTE = 'pendiente'
+EN_CURSO = 'en_curso'
+COMPLETADO = 'completado'
+ERROR = 'error'
+
+ESTADOS_FINALES = (COMPLETADO, ERROR)
+
+
+class Trabajo:
+    """Análisis en segundo plano con su etapa actual, progreso y resultado"""
+
+    def __init__(self, usuario_id, etapas=()):
+        self.id = uuid.uuid4().hex
+        self.usuario_id = usuario_id
+        self.etapas = list(etapas)
+        self.estado = PENDIENTE
+        self.etapa = None
+        self.progreso = {'procesados': 0, 'total': 0}
+        self.resultado = None
+        self.status_http = None
+        self.error = None
+        self.creado = time.time()
+        self.actualizado = self.creado
+        # Cada cambio incrementa la versión y despierta a quien espere (streaming de eventos)
+        self.version = 0
+        self._condicion = threading.Condition()
+
+    def _actualizar(self, **cambios):
+        with self._condicion:
+            for campo, valor in cambios.items():
+                setattr(self, campo, valor)
+            self.actualizado = time.time()
+            self.version += 1
+            self._condicion.notify_all()
+
+    def iniciar_etapa(self, etapa):
+        print(f"⏩ Trabajo {self.id[:8]}: etapa {etapa}")
+        self._actualizar(etapa=etapa, progreso={'procesados': 0, 'total': 0})
+
+    def actualizar_progreso(self, procesados, total):
+        self._actualizar(progreso={'procesados': procesados, 'total': total})
+
+    def esperar_cambio(self, version, timeout=15):
+        """Bloquea hasta que la versión supere `version` o venza el timeout; devuelve la versión actual"""
+        with self._condicion:
+            self._condicion.wait_for(lambda: self.version > version or self.estado in ESTADOS_FINALES, timeout)
+            return self.version
+
+    @property
+    def terminado(self):
+        return self.estado in ESTADOS_FINALES
+
+    def a_dict(self, incluir_resultado=True):
+        with self._condicion:
+            datos = {
+                'id': self.id,
+                'estado': self.estado,
+                'etapa': self.etapa,
+                'etapas': self.etapas,
+                'progreso': dict(self.progreso),
+                'creado': self.creado,
+                'actualizado': self.actualizado
+            }
+            if self.error:
+                datos['error'] = self.error
+            if incluir_resultado and self.terminado:
+                datos['status_http'] = self.status_http
+                datos['resultado'] = self.resultado
+            return datos
+
+
+class GestorTrabajos:
+    """
+    Ejecuta trabajos en un pool de hilos propio, de modo que las peticiones HTTP que los
+    crean responden enseguida. Los trabajos terminados se conservan `ttl` segundos para
+    poder consultar su resultado y después se eliminan
+    """
+
+    def __init__(self, max_workers=2, ttl=3600):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='trabajo')
+        self._trabajos = {}
+        self._lock = threading.Lock()
+
+    def crear(self, usuario_id, funcion, *args, etapas=(), **kwargs):
+        """
+        Encola `funcion(trabajo, *args, **kwargs)`, que debe devolver (resultado, status_http).
+        Devuelve el Trabajo recién creado
+        """
+        self.limpiar()
+        trabajo = Trabajo(usuario_id, etapas)
+        with self._lock:
+            self._trabajos[trabajo.id] = trabajo
+        self._executor.submit(self._ejecutar, trabajo, funcion, args, kwargs)
+        return trabajo
+
+    def _ejecutar(self, trabajo, funcion, args, kwargs):
+        trabajo._actualizar(estado=EN_CURSO)
+        try:
+            resultado, status_http = funcion(trabajo, *args, **kwargs)
+            estado = COMPLETADO if status_http < 400 else ERROR
+            error = resultado.get('error') if isinstance(resultado, dict) and estado == ERROR else None
+            trabajo._actualizar(estado=estado, resultado=resultado, status_http=status_http, error=error)
+        except Exception as e:
+            traceback.print_exc()
+            trabajo._actualizar(estado=ERROR, status_http=500, error=str(e))
+
+    def obtener(self, trabajo_id, usuario_id=None):
+        """Devuelve el trabajo si existe y pertenece al usuario indicado"""
+        with self._lock:
+            trabajo = self._trabajos.get(trabajo_id)
+        if trabajo is None or (usuario_id is not None and trabajo.usuario_id != usuario_id):
+            return None
+        return trabajo
+
+    def limpiar(self):
+        """Elimina los trabajos terminados hace más de `ttl` segundos"""
+        limite = time.time() - self.ttl
+        with self._lock:
+            caducados = [tid for tid, t in self._trabajos.items() if t.terminado and t.actualizado < limite]
+            for trabajo_id in caducados:
+                del self._trabajos[trabajo_id]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._trabajos)
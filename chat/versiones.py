@@ -0,0 +1,304 @@
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+# 🔢 ESQUEMA DE VERSIONES SEGÚN EL TIPO DE PURL
+ESQUEMAS_PURL = {
+    'pypi': 'pep440',
+    'maven': 'maven',
+    'deb': 'debian',
+    'npm': 'semver',
+    'cargo': 'semver',
+    'gem': 'semver',
+    'golang': 'semver',
+    'nuget': 'semver',
+    'composer': 'semver',
+}
+
+
+# --- SemVer (y versiones genéricas con puntos) -------------------------------------------------
+
+def _clave_semver(version):
+    version = version.strip().lstrip('vV').split('+', 1)[0]
+    principal, _, prerelease = version.partition('-')
+    numeros = []
+    for parte in principal.split('.'):
+        match = re.match(r'(\d+)(.*)', parte)
+        if match:
+            numeros.append((int(match.group(1)), match.group(2)))
+        else:
+            numeros.append((-1, parte))
+    # Los ceros finales no cuentan (1.2 == 1.2.0 == 1.2.0.0)
+    while len(numeros) > 1 and numeros[-1] == (0, ''):
+        numeros.pop()
+    # Una versión sin prerelease es mayor que cualquiera de sus prereleases
+    if not prerelease:
+        pre = ((1,),)
+    else:
+        # Identificadores numéricos < alfanuméricos (regla 11 de SemVer)
+        pre = tuple((0, int(p), '') if p.isdigit() else (1, 0, p) for p in prerelease.split('.'))
+        pre = ((0,),) + pre
+    return tuple(numeros), pre
+
+
+# --- PEP 440 ------------------------------------------------------------------------------------
+
+_PEP440 = re.compile(r"""
+    ^v?(?:(?P<epoch>\d+)!)?
+    (?P<release>\d+(?:\.\d+)*)
+    (?:[-_\.]?(?P<pre_l>a|b|c|rc|alpha|beta|pre|preview)[-_\.]?(?P<pre_n>\d*))?
+    (?:(?:-(?P<post_n1>\d+))|(?:[-_\.]?(?P<post_l>post|rev|r)[-_\.]?(?P<post_n2>\d*)))?
+    (?:[-_\.]?dev[-_\.]?(?P<dev_n>\d*))?
+    (?:\+(?P<local>[a-z0-9]+(?:[-_\.][a-z0-9]+)*))?$
+""", re.VERBOSE | re.IGNORECASE)
+
+_PRE_PEP440 = {'a': 0, 'alpha': 0, 'b': 1, 'beta': 1, 'c': 2, 'rc': 2, 'pre': 2, 'preview': 2}
+
+
+def _clave_pep440(version):
+    match = _PEP440.match(version.strip().lower())
+    if not match:
+        return _clave_semver(version)
+    release = [int(p) for p in match.group('release').split('.')]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+    infinito = float('inf')
+    if match.group('pre_l'):
+        pre = (_PRE_PEP440[match.group('pre_l')], int(match.group('pre_n') or 0))
+    elif match.group('dev_n') is not None and not (match.group('post_n1') or match.group('post_l')):
+        pre = (-infinito, 0)  # 1.0.dev1 < 1.0a1
+    else:
+        pre = (infinito, 0)
+    if match.group('post_n1') or match.group('post_l'):
+        post = (int(match.group('post_n1') or match.group('post_n2') or 0),)
+    else:
+        post = (-infinito,)
+    dev = (int(match.group('dev_n') or 0),) if match.group('dev_n') is not None else (infinito,)
+    return int(match.group('epoch') or 0), tuple(release), pre, post, dev
+
+
+# --- Maven (ComparableVersion simplificado) --------------------------------------------------------
+
+_CALIFICADORES_MAVEN = {'alpha': 0, 'a': 0, 'beta': 1, 'b': 1, 'milestone': 2, 'm': 2,
+                        'rc': 3, 'cr': 3, 'snapshot': 4, '': 5, 'ga': 5, 'final': 5,
+                        'release': 5, 'sp': 6}
+
+
+def _clave_maven(version):
+    tokens = re.findall(r'\d+|[a-z]+', version.strip().lower())
+    numeros = []
+    while tokens and tokens[0].isdigit():
+        numeros.append(int(tokens.pop(0)))
+    resto = []
+    for token in tokens:
+        if token.isdigit():
+            resto.append((1, int(token), ''))
+        else:
+            orden = _CALIFICADORES_MAVEN.get(token)
+            # Calificadores desconocidos van después de los conocidos y se ordenan alfabéticamente
+            resto.append((0, orden, '') if orden is not None else (0, 7, token))
+    # Los calificadores de release al final no cuentan (1.0 == 1.0-ga == 1.0.Final)
+    while resto and resto[-1] == (0, 5, ''):
+        resto.pop()
+    return numeros, resto
+
+
+def _comparar_maven(a, b):
+    numeros_a, resto_a = _clave_maven(a)
+    numeros_b, resto_b = _clave_maven(b)
+    # Los ceros finales no cuentan (1 == 1.0 == 1.0.0)
+    longitud = max(len(numeros_a), len(numeros_b))
+    numeros_a += [0] * (longitud - len(numeros_a))
+    numeros_b += [0] * (longitud - len(numeros_b))
+    if numeros_a != numeros_b:
+        return -1 if numeros_a < numeros_b else 1
+    for i in range(max(len(resto_a), len(resto_b))):
+        # Un elemento ausente equivale a release: mayor que un calificador de prerelease
+        x = resto_a[i] if i < len(resto_a) else (0, 5, '')
+        y = resto_b[i] if i < len(resto_b) else (0, 5, '')
+        if x != y:
+            return -1 if x < y else 1
+    return 0
+
+
+# --- Debian (algoritmo de dpkg) -----------------------------------------------------------------
+
+def _orden_caracter_debian(c):
+    if c == '~':
+        return -1
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+
+def _comparar_fragmento_debian(a, b):
+    """verrevcmp de dpkg: alterna partes no numéricas y numéricas"""
+    i = j = 0
+    while i < len(a) or j < len(b):
+        diferencia = 0
+        while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+            ca = _orden_caracter_debian(a[i]) if i < len(a) and not a[i].isdigit() else 0
+            cb = _orden_caracter_debian(b[j]) if j < len(b) and not b[j].isdigit() else 0
+            if ca != cb:
+                return -1 if ca < cb else 1
+            i += 1
+            j += 1
+        while i < len(a) and a[i] == '0':
+            i += 1
+        while j < len(b) and b[j] == '0':
+            j += 1
+        while i < len(a) and a[i].isdigit() and j < len(b) and b[j].isdigit():
+            if not diferencia:
+                diferencia = ord(a[i]) - ord(b[j])
+            i += 1
+            j += 1
+        if i < len(a) and a[i].isdigit():
+            return 1
+        if j < len(b) and b[j].isdigit():
+            return -1
+        if diferencia:
+            return -1 if diferencia < 0 else 1
+    return 0
+
+
+def _partes_debian(version):
+    version = version.strip()
+    epoch, _, resto = version.partition(':') if ':' in version else ('0', '', version)
+    upstream, _, revision = resto.rpartition('-') if '-' in resto else (resto, '', '0')
+    return int(epoch or 0) if epoch.isdigit() else 0, upstream, revision
+
+
+def _comparar_debian(a, b):
+    ea, ua, ra = _partes_debian(a)
+    eb, ub, rb = _partes_debian(b)
+    if ea != eb:
+        return -1 if ea < eb else 1
+    return _comparar_fragmento_debian(ua, ub) or _comparar_fragmento_debian(ra, rb)
+
+
+# --- API pública --------------------------------------------------------------------------------
+
+def _comparar_por_clave(funcion_clave):
+    def comparar(a, b):
+        ka, kb = funcion_clave(a), funcion_clave(b)
+        return (ka > kb) - (ka < kb)
+    return comparar
+
+
+_COMPARADORES = {
+    'semver': _comparar_por_clave(_clave_semver),
+    'pep440': _comparar_por_clave(_clave_pep440),
+    'maven': _comparar_maven,
+    'debian': _comparar_debian,
+}
+
+
+def esquema_para_purl(purl):
+    """Esquema de versiones según el tipo de purl (semver por defecto)"""
+    match = re.match(r'pkg:([^/]+)/', purl or '')
+    return ESQUEMAS_PURL.get(match.group(1).lower(), 'semver') if match else 'semver'
+
+
+@lru_cache(maxsize=65536)
+def comparar_versiones(a, b, esquema='semver'):
+    """Devuelve -1, 0 o 1 según a < b, a == b o a > b en el esquema indicado"""
+    try:
+        return _COMPARADORES.get(esquema, _COMPARADORES['semver'])(a, b)
+    except (ValueError, TypeError):
+        return (a > b) - (a < b)
+
+
+def version_valida(version):
+    return bool(version) and version not in ('*', '-', 'No especificada', 'No especificado') and any(c.isdigit() for c in version)
+
+
+# --- Predicados de aplicabilidad sobre configuraciones cpeMatch de NVD ------------------------------
+
+class RangoCPE:
+    """Un cpeMatch vulnerable de NVD: producto más versión exacta o rango de versiones"""
+
+    __slots__ = ('vendor', 'producto', 'exacta', 'desde', 'desde_incluida', 'hasta', 'hasta_incluida')
+
+    def __init__(self, cpe_match):
+        partes = cpe_match.get('criteria', '').lower().split(':')
+        self.vendor = partes[3] if len(partes) > 4 else ''
+        self.producto = partes[4] if len(partes) > 4 else ''
+        version = partes[5] if len(partes) > 5 else '*'
+        self.exacta = version if version not in ('*', '-', '') else None
+        self.desde = cpe_match.get('versionStartIncluding') or cpe_match.get('versionStartExcluding')
+        self.desde_incluida = 'versionStartIncluding' in cpe_match
+        self.hasta = cpe_match.get('versionEndIncluding') or cpe_match.get('versionEndExcluding')
+        self.hasta_incluida = 'versionEndIncluding' in cpe_match
+
+    def contiene(self, version, esquema):
+        if self.exacta is not None:
+            return comparar_versiones(version, self.exacta, esquema) == 0
+        if self.desde:
+            c = comparar_versiones(version, self.desde, esquema)
+            if c < 0 or (c == 0 and not self.desde_incluida):
+                return False
+        if self.hasta:
+            c = comparar_versiones(version, self.hasta, esquema)
+            if c > 0 or (c == 0 and not self.hasta_incluida):
+                return False
+        return True
+
+
+class PredicadoCVE:
+    """
+    Aplicabilidad precompilada de un CVE: rangos vulnerables agrupados por producto CPE.
+    Los nodos con negate o los cpeMatch no vulnerables (plataformas en nodos AND) se ignoran,
+    ya que solo interesa saber si la versión del componente cae en algún rango afectado
+    """
+
+    __slots__ = ('rangos',)
+
+    def __init__(self, cve_data):
+        self.rangos = {}
+        for config in cve_data.get('configurations', []):
+            for node in config.get('nodes', []):
+                if node.get('negate'):
+                    continue
+                for cpe_match in node.get('cpeMatch', []):
+                    if not cpe_match.get('vulnerable', True):
+                        continue
+                    rango = RangoCPE(cpe_match)
+                    if rango.producto:
+                        self.rangos.setdefault(rango.producto, []).append(rango)
+
+    def evaluar(self, productos, version, esquema='semver', vendors=None):
+        """
+        True si algún rango de los productos afecta a la versión, False si ninguno la afecta
+        y None si el CVE no tiene rangos para esos productos (no se puede decidir)
+        """
+        rangos = [r for p in productos for r in self.rangos.get(p, [])
+                  if not vendors or r.vendor in vendors]
+        if not rangos:
+            return None
+        if not version_valida(version):
+            return True  # sin versión conocida no se puede descartar
+        return any(rango.contiene(version, esquema) for rango in rangos)
+
+
+class CachePredicados:
+    """Cache LRU de predicados compilados, indexada por (id del CVE, lastModified)"""
+
+    def __init__(self, max_entradas=20000):
+        self.max_entradas = max_entradas
+        self._predicados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, cve_data):
+        clave = (cve_data.get('id'), cve_data.get('lastModified'))
+        with self._lock:
+            predicado = self._predicados.get(clave)
+            if predicado is not None:
+                self._predicados.move_to_end(clave)
+                return predicado
+        predicado = PredicadoCVE(cve_data)
+        with self._lock:
+            self._predicados[clave] = predicado
+            if len(self._predicados) > self.max_entradas:
+                self._predicados.popitem(last=False)
+        return predicado
@@ -422,35 +422,9 @@ function agregarMensajeAlChat(mensaje, tipo) {
         minute: '2-digit' 
     });
     
-    let mensajeProcesado = mensaje;
-    
-    if (tipo === 'bot') {
-        try {
-            if (typeof marked !== 'undefined') {
-                marked.setOptions({
-                    breaks: true,
-                    gfm: true,
-                    sanitize: false,
-                    smartypants: true
-                });
-                mensajeProcesado = marked.parse(mensaje);
-            } else {
-                mensajeProcesado = procesarMarkdownBasico(mensaje);
-            }
-            
-            if (typeof DOMPurify !== 'undefined') {
-                mensajeProcesado = DOMPurify.sanitize(mensajeProcesado, {
-                    ALLOWED_TAGS: ['strong', 'em', 'code', 'pre', 'br', 'p', 'ul', 'ol', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote'],
-                    ALLOWED_ATTR: []
-                });
-            }
-        } catch (error) {
-            console.warn("Error procesando markdown:", error);
-            mensajeProcesado = mensaje.replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/\n/g, '<br>');
-        }
-    } else {
-        mensajeProcesado = mensaje.replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/\n/g, '<br>');
-    }
+    const mensajeProcesado = tipo === 'bot'
+        ? renderizarMensajeBot(mensaje)
+        : mensaje.replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/\n/g, '<br>');
     
     messageGroup.innerHTML = `
         <div class="message-avatar ${tipo}">
@@ -466,6 +440,37 @@ function agregarMensajeAlChat(mensaje, tipo) {
     
     chatMensajes.appendChild(messageGroup);
     scrollToBottom();
+    
+    return messageGroup;
+}
+
+// ✅ CONVERTIR EL MARKDOWN DE LA IA EN HTML SANEADO
+function renderizarMensajeBot(mensaje) {
+    let mensajeProcesado = mensaje;
+    try {
+        if (typeof marked !== 'undefined') {
+            marked.setOptions({
+                breaks: true,
+                gfm: true,
+                sanitize: false,
+                smartypants: true
+            });
+            mensajeProcesado = marked.parse(mensaje);
+        } else {
+            mensajeProcesado = procesarMarkdownBasico(mensaje);
+        }
+        
+        if (typeof DOMPurify !== 'undefined') {
+            mensajeProcesado = DOMPurify.sanitize(mensajeProcesado, {
+                ALLOWED_TAGS: ['strong', 'em', 'code', 'pre', 'br', 'p', 'ul', 'ol', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote'],
+                ALLOWED_ATTR: []
+            });
+        }
+    } catch (error) {
+        console.warn("Error procesando markdown:", error);
+        mensajeProcesado = mensaje.replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/\n/g, '<br>');
+    }
+    return mensajeProcesado;
 }
 
 export function inicializarChat() {
@@ -612,7 +617,8 @@ async function enviarMensajeAlServidor(messageText) {
     try {
         console.log("🚀 Enviando mensaje para proyecto:", proyectoActualChat.nombre);
         
-        const response = await fetchWithCredentials(`${API_BASE_URL_CHAT}/chat/mensajes`, {
+        // ✅ RESPUESTA EN STREAMING: EL TEXTO SE MUESTRA SEGÚN LO GENERA LA IA
+        const response = await fetchWithCredentials(`${API_BASE_URL_CHAT}/chat/mensajes/stream`, {
             method: 'POST',
             body: JSON.stringify({ 
                 message: messageText,
@@ -632,16 +638,8 @@ async function enviarMensajeAlServidor(messageText) {
             throw new Error(errorData.error || `Error ${response.status}`);
         }
 
-        const data = await response.json();
+        const data = await leerRespuestaEnStreaming(response);
         console.log("✅ Respuesta recibida:", data);
-
-        // ✅ OCULTAR INDICADOR ANTES DE MOSTRAR RESPUESTA
-        ocultarIndicadorEscribiendo();
-        
-        // Pequeña pausa para suavizar la transición
-        setTimeout(() => {
-            agregarMensajeAlChat(data.message, 'bot');
-        }, 100);
         
     } catch (error) {
         console.error("❌ Error en el chat:", error);
@@ -658,6 +656,52 @@ async function enviarMensajeAlServidor(messageText) {
     }
 }
 
+// ✅ LEER LOS EVENTOS SSE DE /chat/mensajes/stream E IR PINTANDO LA RESPUESTA
+async function leerRespuestaEnStreaming(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let texto = '';
+    let burbuja = null;
+    let datosFinales = null;
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        const eventos = buffer.split('\n\n');
+        buffer = eventos.pop();
+        
+        for (const evento of eventos) {
+            const tipo = (evento.match(/^event: (.*)$/m) || [])[1];
+            const datos = (evento.match(/^data: (.*)$/m) || [])[1];
+            if (!datos) continue;
+            const contenido = JSON.parse(datos);
+            
+            if (tipo === 'fragmento') {
+                texto += contenido.texto;
+                if (!burbuja) {
+                    // ✅ EL PRIMER FRAGMENTO SUSTITUYE AL INDICADOR DE ESCRITURA
+                    ocultarIndicadorEscribiendo();
+                    burbuja = agregarMensajeAlChat(texto, 'bot').querySelector('.message-bubble');
+                } else {
+                    burbuja.innerHTML = renderizarMensajeBot(texto);
+                    scrollToBottom();
+                }
+            } else if (tipo === 'fin') {
+                datosFinales = contenido;
+            }
+        }
+    }
+    
+    if (!burbuja) {
+        ocultarIndicadorEscribiendo();
+        agregarMensajeAlChat(datosFinales ? datosFinales.message : texto, 'bot');
+    }
+    return datosFinales || { message: texto };
+}
+
 // ✅ MODIFICAR LA FUNCIÓN DE MANEJO DE SBOM
 async function manejarArchivoSBOM(event) {
     const file = event.target.files[0];
@@ -694,7 +738,8 @@ async function manejarArchivoSBOM(event) {
         formData.append('max_severidad', proyectoActualChat.max_severidad || 'MEDIUM');
         formData.append('mensaje', `Analiza este archivo SBOM del proyecto ${proyectoActualChat.nombre}`);
         
-        const response = await fetch(`${API_BASE_URL_CHAT}/chat/upload-sbom`, {
+        // ✅ EL ANÁLISIS SE ENCOLA COMO TRABAJO Y SE CONSULTA SU ESTADO HASTA QUE TERMINA
+        const response = await fetch(`${API_BASE_URL_CHAT}/chat/trabajos/sbom`, {
             method: 'POST',
             credentials: 'include',
             body: formData
@@ -705,7 +750,8 @@ async function manejarArchivoSBOM(event) {
             throw new Error(errorData.error || `Error ${response.status}`);
         }
         
-        const data = await response.json();
+        const trabajo = await response.json();
+        const data = await esperarTrabajoSBOM(trabajo.trabajo_id);
         console.log("✅ Archivo SBOM procesado:", data);
         
         // ✅ OCULTAR INDICADOR DE PROCESAMIENTO
@@ -745,6 +791,43 @@ async function manejarArchivoSBOM(event) {
     }
 }
 
+// ✅ TEXTOS DE LAS ETAPAS DEL ANÁLISIS EN SEGUNDO PLANO
+const ETAPAS_SBOM = {
+    criterios: '🎯 Obteniendo criterios del proyecto',
+    validacion: '📁 Leyendo archivo',
+    procesamiento: '📋 Extrayendo componentes',
+    nvd: '🔍 Consultando NVD',
+    solucionabilidad: '🎯 Aplicando criterios',
+    limites: '📊 Verificando límites',
+    ia: '🧠 Generando análisis'
+};
+
+// ✅ CONSULTAR EL ESTADO DE UN TRABAJO DE SBOM HASTA QUE TERMINE
+async function esperarTrabajoSBOM(trabajoId, intervalo = 1500) {
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, intervalo));
+        
+        const response = await fetchWithCredentials(`${API_BASE_URL_CHAT}/chat/trabajos/${trabajoId}`);
+        const estado = await response.json();
+        if (!response.ok) {
+            throw new Error(estado.error || `Error ${response.status}`);
+        }
+        
+        const texto = document.querySelector('#typing-indicator .typing-text');
+        if (texto && estado.etapa) {
+            const { procesados, total } = estado.progreso || {};
+            texto.textContent = (ETAPAS_SBOM[estado.etapa] || estado.etapa) + (total ? ` (${procesados}/${total})` : '...');
+        }
+        
+        if (estado.estado === 'completado') {
+            return estado.resultado;
+        }
+        if (estado.estado === 'error') {
+            throw new Error(estado.error || (estado.resultado && estado.resultado.error) || 'Error procesando el SBOM');
+        }
+    }
+}
+
 // ✅ INDICADOR ESPECIAL PARA PROCESAMIENTO DE SBOM
 function mostrarIndicadorProcesandoSBOM() {
     const indicadorId = 'typing-indicator';